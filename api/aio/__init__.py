@@ -0,0 +1,89 @@
+import functools
+import json
+import time
+from starlette.responses import JSONResponse
+from api.metrics import add_serialization_time, start_async_request, finish_async_request
+from api.sessions import (
+    RESPONDERS_ONLY, TOKEN_PARAM, InvalidSession, authenticate, is_responder, request_token, role_session,
+    session_error
+)
+
+class TimedJSONResponse(JSONResponse):
+    """JSON response encoded like Flask's jsonify, timed for metrics"""
+    
+    def render(self, content):
+        start = time.perf_counter()
+        try:
+            return json.dumps(content, sort_keys=True, separators=(',', ':')).encode('utf-8')
+        finally:
+            add_serialization_time(time.perf_counter() - start)
+
+def jsonify(payload, status_code=200):
+    """Build a JSON response for an async handler"""
+    return TimedJSONResponse(payload, status_code=status_code)
+
+def require_session(handler):
+    """Async counterpart of api.sessions.require_session
+
+    The verified Session is in ``request.state.session``.
+    """
+    @functools.wraps(handler)
+    async def wrapped(request):
+        token = request_token(request.headers.get('authorization'), request.query_params.get(TOKEN_PARAM))
+        try:
+            request.state.session = authenticate(token, request.path_params['user_id'])
+        except InvalidSession as e:
+            payload, status, headers = session_error(e)
+            return TimedJSONResponse(payload, status_code=status, headers=headers)
+        return await handler(request)
+    return wrapped
+
+def require_role(allowed, error):
+    """Async counterpart of api.sessions.require_role
+
+    The verified Session is in ``request.state.session``.
+    """
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapped(request):
+            try:
+                request.state.session = role_session(request.headers.get('authorization'), allowed, error)
+            except InvalidSession as e:
+                payload, status, headers = session_error(e)
+                return TimedJSONResponse(payload, status_code=status, headers=headers)
+            return await handler(request)
+        return wrapped
+    return decorator
+
+require_responder = require_role(is_responder, RESPONDERS_ONLY)
+
+class MetricsMiddleware:
+    """Record request metrics for the async routes
+
+    ``endpoints`` maps each handler to its route label. Requests that fall
+    through to the Flask app are left to Flask's own metrics hooks.
+    """
+    
+    def __init__(self, app, endpoints):
+        self.app = app
+        self.endpoints = endpoints
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        
+        status = 500
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+        
+        token = start_async_request()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            endpoint = self.endpoints.get(scope.get('endpoint'))
+            finish_async_request(token, endpoint, scope['method'], status)
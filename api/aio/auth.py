@@ -0,0 +1,172 @@
+import asyncio
+from datetime import datetime
+from starlette.routing import Route
+from api.aio import jsonify, require_session
+from api.aio.users import get_user
+from api.auth import (
+    MAX_USER_ID_ATTEMPTS, registration_error, new_user, hash_password, password_matches, password_setup_error
+)
+from api.storage import EmailAlreadyRegistered, UserIdCollision
+from api.storage.aio import get_async_storage
+from api.users import invalidate_user
+from api.writebehind import user_writes
+from api.sessions import issue_token, revocations
+from config import Config
+
+async def register(request):
+    """Handle user registration"""
+    try:
+        # Get request data
+        data = await request.json()
+        
+        # Validate required fields
+        error = registration_error(data)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }, 400)
+        
+        # Get storage backend
+        storage = get_async_storage()
+        
+        # Claim the email and a fresh user ID in one transaction, retrying
+        # with a new ID if the generated one is already taken
+        for attempt in range(MAX_USER_ID_ATTEMPTS):
+            # Hashing the password takes a while: off the event loop
+            user_data = await asyncio.to_thread(new_user, data)
+            user_id = user_data['user_id']
+            
+            try:
+                await storage.create_user(user_data)
+                break
+            except UserIdCollision:
+                continue
+            except EmailAlreadyRegistered:
+                return jsonify({
+                    'success': False,
+                    'error': 'User with this email already exists'
+                }, 409)
+        else:
+            return jsonify({
+                'success': False,
+                'error': 'Registration failed: could not allocate a unique user ID'
+            }, 503)
+        
+        invalidate_user(user_id)
+        
+        return jsonify({
+            'success': True,
+            'message': 'User registered successfully',
+            'user_id': user_id,
+            'token': issue_token(user_id),
+            'expires_in': Config.SESSION_TOKEN_TTL,
+            'data': {
+                'username': user_data['username'],
+                'email': user_data['email'],
+                'mobile_number': user_data['mobile_number']
+            }
+        }, 201)
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Registration failed: {str(e)}'
+        }, 500)
+
+async def login(request):
+    """Handle user login"""
+    try:
+        data = await request.json()
+        
+        if not data.get('user_id') or not isinstance(data.get('password'), str):
+            return jsonify({
+                'success': False,
+                'error': 'User ID and password are required'
+            }, 400)
+        
+        # Get storage backend
+        storage = get_async_storage()
+        
+        # Get user data
+        user_data = await get_user(data['user_id'], storage=storage)
+        
+        password_hash = user_data.get('password_hash') if user_data else None
+        if user_data is not None and not password_hash:
+            # A cached profile may predate a password set since
+            user_data = await storage.get_user(data['user_id'])
+            password_hash = user_data.get('password_hash') if user_data else None
+        
+        # Hashing runs off the event loop
+        if user_data is not None and not password_hash:
+            # An account from before passwords: this login sets its first one
+            error = password_setup_error(data, user_data)
+            if error:
+                return jsonify({
+                    'success': False,
+                    'error': error,
+                    'password_setup_required': True
+                }, 403)
+            password_hash = await asyncio.to_thread(hash_password, data['password'])
+            await storage.update_user(data['user_id'], {'password_hash': password_hash})
+            invalidate_user(data['user_id'])
+        elif not await asyncio.to_thread(password_matches, data['password'], password_hash):
+            # The same answer for an unknown user as for a wrong password
+            return jsonify({
+                'success': False,
+                'error': 'Invalid user ID or password'
+            }, 401)
+        
+        # Record the login in the background; the buffer merges repeated
+        # logins and writes them in batches
+        user_writes.defer(data['user_id'], {
+            'last_login': datetime.utcnow().isoformat()
+        })
+        
+        return jsonify({
+            'success': True,
+            'message': 'Login successful',
+            'user_id': user_data['user_id'],
+            'token': issue_token(user_data['user_id'], user_data.get('family_version', 0)),
+            'expires_in': Config.SESSION_TOKEN_TTL,
+            'data': {
+                'username': user_data['username'],
+                'email': user_data['email'],
+                'mobile_number': user_data['mobile_number'],
+                'family_members': user_data.get('family_members', [])
+            }
+        }, 200)
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Login failed: {str(e)}'
+        }, 500)
+
+@require_session
+async def logout(request):
+    """Revoke every session token issued to the user"""
+    try:
+        user_id = request.path_params['user_id']
+        revoked_at = datetime.utcnow().isoformat()
+        await get_async_storage().revoke_sessions(user_id, revoked_at)
+        revocations.record(user_id, revoked_at)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Logged out on all devices',
+            'user_id': user_id,
+            'revoked_at': revoked_at
+        }, 200)
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Logout failed: {str(e)}'
+        }, 500)
+
+routes = [
+    Route('/register', register, methods=['POST']),
+    Route('/login', login, methods=['POST']),
+    Route('/@{user_id}/logout', logout, methods=['POST'])
+]
@@ -0,0 +1,239 @@
+import asyncio
+from datetime import datetime
+from starlette.routing import Route
+from api.aio import jsonify, require_session
+from api.aio.users import get_user, get_users, load_users
+from api.storage.aio import get_async_storage
+from api.family import incoming_member
+from api.users import invalidate_user
+from api.sessions import issue_token
+
+@require_session
+async def add_family_member(request):
+    """Add a family member to user's family list"""
+    user_id = request.path_params['user_id']
+    try:
+        data = await request.json()
+        
+        if 'family_member_id' not in data or not data['family_member_id']:
+            return jsonify({
+                'success': False,
+                'error': 'Family member ID is required'
+            }, 400)
+        
+        family_member_id = data['family_member_id']
+        
+        # Get storage backend
+        storage = get_async_storage()
+        
+        # Check that both users exist in one batched read
+        users = await load_users([user_id, family_member_id], storage=storage)
+        user_data = users.get(user_id)
+        
+        if user_data is None:
+            return jsonify({
+                'success': False,
+                'error': 'User not found'
+            }, 404)
+        
+        family_member_data = users.get(family_member_id)
+        
+        if family_member_data is None:
+            return jsonify({
+                'success': False,
+                'error': 'Family member not found'
+            }, 404)
+        
+        # Get current family list
+        family_members = user_data.get('family_members', [])
+        
+        # Check if family member is already added
+        if family_member_id in family_members:
+            return jsonify({
+                'success': False,
+                'error': 'Family member already added'
+            }, 409)
+        
+        # Link atomically, together with the optional reverse link
+        reciprocal = bool(data.get('reciprocal'))
+        family_version = await storage.add_family_member(
+            user_id, family_member_id,
+            reciprocal=reciprocal,
+            updated_at=datetime.utcnow().isoformat()
+        )
+        
+        invalidate_user(user_id)
+        if reciprocal:
+            invalidate_user(family_member_id)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Family member added successfully',
+            'user_id': user_id,
+            'family_member': {
+                'user_id': family_member_id,
+                'username': family_member_data['username'],
+                'email': family_member_data['email'],
+                'mobile_number': family_member_data['mobile_number']
+            },
+            'total_family_members': len(family_members) + 1,
+            'reciprocal': reciprocal,
+            'token': issue_token(user_id, family_version)
+        }, 200)
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to add family member: {str(e)}'
+        }, 500)
+
+@require_session
+async def get_family_members(request):
+    """Get all family members for a user"""
+    user_id = request.path_params['user_id']
+    try:
+        # Get storage backend
+        storage = get_async_storage()
+        
+        # Get user data, re-read if the token has seen a newer family list
+        user_data = await get_user(user_id, storage=storage, family_version=request.state.session.family_version)
+        
+        if user_data is None:
+            return jsonify({
+                'success': False,
+                'error': 'User not found'
+            }, 404)
+        
+        # Get family member details in a single batched read
+        family_members = []
+        for member_data in await get_users(user_data.get('family_members', []), storage=storage):
+            family_members.append({
+                'user_id': member_data['user_id'],
+                'username': member_data['username'],
+                'email': member_data['email'],
+                'mobile_number': member_data['mobile_number'],
+                'is_active': member_data.get('is_active', True)
+            })
+        
+        return jsonify({
+            'success': True,
+            'user_id': user_id,
+            'family_members': family_members,
+            'total_count': len(family_members)
+        }, 200)
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to get family members: {str(e)}'
+        }, 500)
+
+@require_session
+async def get_incoming_family(request):
+    """Get the users who list this user as a family member"""
+    user_id = request.path_params['user_id']
+    try:
+        # Get storage backend
+        storage = get_async_storage()
+        
+        # Check the user and read the reverse family index at the same time
+        user_data, listed_by_ids = await asyncio.gather(
+            get_user(user_id, storage=storage, family_version=request.state.session.family_version),
+            storage.get_listed_by(user_id)
+        )
+        
+        if user_data is None:
+            return jsonify({
+                'success': False,
+                'error': 'User not found'
+            }, 404)
+        
+        family_members = set(user_data.get('family_members', []))
+        listed_by = [
+            incoming_member(member_data, family_members)
+            for member_data in await get_users(listed_by_ids, storage=storage)
+        ]
+        
+        return jsonify({
+            'success': True,
+            'user_id': user_id,
+            'listed_by': listed_by,
+            'total_count': len(listed_by)
+        }, 200)
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to get incoming family members: {str(e)}'
+        }, 500)
+
+@require_session
+async def remove_family_member(request):
+    """Remove a family member from user's family list"""
+    user_id = request.path_params['user_id']
+    try:
+        data = await request.json()
+        
+        if 'family_member_id' not in data or not data['family_member_id']:
+            return jsonify({
+                'success': False,
+                'error': 'Family member ID is required'
+            }, 400)
+        
+        family_member_id = data['family_member_id']
+        
+        # Get storage backend
+        storage = get_async_storage()
+        
+        # Get current user data
+        user_data = (await load_users([user_id], storage=storage)).get(user_id)
+        
+        if user_data is None:
+            return jsonify({
+                'success': False,
+                'error': 'User not found'
+            }, 404)
+        
+        family_members = user_data.get('family_members', [])
+        
+        # Check if family member exists in the list
+        if family_member_id not in family_members:
+            return jsonify({
+                'success': False,
+                'error': 'Family member not found in your family list'
+            }, 404)
+        
+        # Unlink atomically, together with the optional reverse link
+        reciprocal = bool(data.get('reciprocal'))
+        family_version = await storage.remove_family_member(
+            user_id, family_member_id,
+            reciprocal=reciprocal,
+            updated_at=datetime.utcnow().isoformat()
+        )
+        
+        invalidate_user(user_id)
+        if reciprocal:
+            invalidate_user(family_member_id)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Family member removed successfully',
+            'user_id': user_id,
+            'removed_member_id': family_member_id,
+            'total_family_members': len(family_members) - 1,
+            'reciprocal': reciprocal,
+            'token': issue_token(user_id, family_version)
+        }, 200)
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to remove family member: {str(e)}'
+        }, 500)
+
+routes = [
+    Route('/@{user_id}/add_family', add_family_member, methods=['POST']),
+    Route('/@{user_id}/family', get_family_members, methods=['GET']),
+    Route('/@{user_id}/family/incoming', get_incoming_family, methods=['GET']),
+    Route('/@{user_id}/remove_family', remove_family_member, methods=['POST'])
+]
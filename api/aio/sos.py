@@ -0,0 +1,480 @@
+import asyncio
+from datetime import datetime
+from starlette.responses import Response
+from starlette.routing import Route
+from api.aio import jsonify, require_responder, require_session
+from api.aio.users import get_user, get_users
+from api.users import cached_user
+from api.events import alert_hub
+from api.notifications import dispatcher
+from api.coalesce import coalescer, IdempotencyConflict
+from api.dashboard import active_alerts, parse_feed_args
+from api.pages import etag_matches
+from api.geo import parse_geo, public_geo, covering_cells
+from api.journal import journal
+from api.breaker import BackendUnavailable, backend_breaker
+from api.sos import (
+    HISTORY_FIELDS, NEARBY_FIELDS, FAMILY_ALERT_FIELDS, contact_details, build_alert,
+    parse_history_args, history_page, family_alerts_page, archive_tier_needed, merge_tiers,
+    alert_update, coalesced_alert, coalesced_response, with_caller, claim_error, unavailable_error,
+    unverified_user, pending_alert,
+    parse_nearby_args, nearby_page, location_error,
+    parse_expand, expand_fields, expand_ids, fill_details
+)
+from api.storage.aio import get_async_storage
+
+async def journaled(operation, storage, *args):
+    """Make an alert write through the journal, off the event loop, or through storage with it off"""
+    if journal.enabled:
+        return await asyncio.to_thread(getattr(journal, operation), *args)
+    return await getattr(storage, operation)(*args)
+
+async def get_alert(storage, alert_id):
+    """Get an alert from the journal if it has not reached storage yet, else from storage"""
+    alert = journal.pending_alert(alert_id)
+    if alert is not None:
+        return alert
+    return await storage.get_alert(alert_id)
+
+async def expand_alerts(alerts, sos_alerts, expand, storage=None):
+    """Fill in contact details on a response page with one batched profile read"""
+    if not expand:
+        return alerts
+    records = dict(sos_alerts)
+    profiles = await get_users(expand_ids(alerts, records, expand), storage=storage)
+    return fill_details(alerts, records, expand, profiles)
+
+def unavailable_response(error, action):
+    """503 response for a request that could not reach storage in time"""
+    payload, status, headers = unavailable_error(error, action)
+    response = jsonify(payload, status)
+    response.headers.update(headers)
+    return response
+
+async def create_alert(storage, user_id, user_data, data, geo=None):
+    """Store a new alert, queue its notifications and return the response payload"""
+    if journal.enabled:
+        return await create_journaled_alert(storage, user_id, user_data, data, geo)
+    
+    # Store the alert while the members' profiles are read; it refers to
+    # the members by ID, so it does not wait for their details. Delivery
+    # status is filled in by the dispatcher as each notification is
+    # attempted, so the stored alert starts without pending markers.
+    sos_alert = build_alert(user_id, user_data, [], data, geo)
+    sos_alert['delivery'] = {}
+    member_profiles, alert_id = await asyncio.gather(
+        get_users(user_data.get('family_members', []), storage=storage),
+        storage.create_alert(sos_alert)
+    )
+    family_members = [
+        contact_details(member_data['user_id'], member_data)
+        for member_data in member_profiles
+    ]
+    
+    notifications_queued = dispatcher.dispatch(alert_id, sos_alert, family_members)
+    alert_hub.publish('sos_triggered', alert_id, sos_alert)
+    
+    return {
+        'success': True,
+        'message': 'SOS alert triggered successfully',
+        'alert_id': alert_id,
+        'user_id': user_id,
+        'triggered_at': sos_alert['triggered_at'],
+        'family_members_notified': len(family_members),
+        'family_members': family_members,
+        'notifications_queued': notifications_queued,
+        'details_pending': False,
+        'coalesced': False,
+        'status': 'active'
+    }
+
+async def create_journaled_alert(storage, user_id, user_data, data, geo=None):
+    """Journal a new alert, queue its notifications and return the response payload"""
+    # Journaling is a local fsync, so the alert is written with its pending
+    # deliveries once the members' profiles are read, instead of alongside
+    # the read. With storage down, the journal notifies them once it can
+    # read them
+    family_members = []
+    if not user_data.get('details_pending'):
+        try:
+            family_members = [
+                contact_details(member_data['user_id'], member_data)
+                for member_data in await get_users(user_data.get('family_members', []), storage=storage)
+            ]
+        except BackendUnavailable:
+            user_data = dict(user_data, details_pending=True)
+    if user_data.get('details_pending'):
+        sos_alert = pending_alert(user_id, user_data, data, geo)
+    else:
+        sos_alert = build_alert(user_id, user_data, family_members, data, geo)
+    alert_id = await asyncio.to_thread(journal.create_alert, sos_alert)
+    
+    notifications_queued = dispatcher.dispatch(alert_id, sos_alert, family_members)
+    alert_hub.publish('sos_triggered', alert_id, sos_alert)
+    
+    return {
+        'success': True,
+        'message': 'SOS alert triggered successfully',
+        'alert_id': alert_id,
+        'user_id': user_id,
+        'triggered_at': sos_alert['triggered_at'],
+        'family_members_notified': len(family_members),
+        'family_members': family_members,
+        'notifications_queued': notifications_queued,
+        'details_pending': bool(sos_alert.get('details_pending')),
+        'coalesced': False,
+        'status': 'active'
+    }
+
+@require_session
+async def trigger_sos(request):
+    """Trigger SOS alert for user and notify family members"""
+    user_id = request.path_params['user_id']
+    try:
+        data = await request.json() or {}
+        
+        # Structured position, if the client sent coordinates
+        try:
+            geo = parse_geo(data)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }, 400)
+        
+        # Get storage backend. Reads wait at most BACKEND_TIMEOUT, and fail
+        # at once while the backend is down, instead of holding the alert
+        storage = backend_breaker.guard(get_async_storage())
+        
+        # Get user data, re-read if the token has seen a newer family list.
+        # With storage down the alert is journaled all the same
+        try:
+            user_data = await get_user(user_id, storage=storage, family_version=request.state.session.family_version)
+        except BackendUnavailable:
+            if not journal.enabled:
+                raise
+            user_data = unverified_user(user_id)
+        
+        if user_data is None:
+            return jsonify({
+                'success': False,
+                'error': 'User not found'
+            }, 404)
+        
+        # A retry with the same Idempotency-Key gets the first response, and
+        # repeated presses join the user's active alert instead of creating
+        # and notifying again
+        try:
+            claim = await coalescer.claim_async(user_id, request.headers.get('Idempotency-Key'))
+        except (ValueError, IdempotencyConflict) as e:
+            payload, status = claim_error(e)
+            return jsonify(payload, status)
+        
+        if claim.replay is not None:
+            response = jsonify(claim.replay, 200)
+            response.headers['Idempotent-Replayed'] = 'true'
+            return response
+        
+        try:
+            if claim.coalesced:
+                update = alert_update(data, geo)
+                await journaled('append_alert_update', storage, claim.alert_id, update)
+                alert_hub.publish('sos_updated', claim.alert_id, coalesced_alert(user_id, user_data, claim, update))
+                payload = coalesced_response(user_id, claim, update)
+            else:
+                payload = await create_alert(storage, user_id, user_data, data, geo)
+        except Exception:
+            await asyncio.to_thread(coalescer.abandon, claim)
+            raise
+        
+        await asyncio.to_thread(coalescer.complete, claim, payload)
+        return jsonify(payload, 200)
+    
+    except BackendUnavailable as e:
+        return unavailable_response(e, 'SOS alert failed')
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'SOS alert failed: {str(e)}'
+        }, 500)
+
+@require_session
+async def get_sos_history(request):
+    """Get SOS alert history for a user"""
+    user_id = request.path_params['user_id']
+    try:
+        # Parse pagination, filter and expand parameters
+        try:
+            limit, status, start_after = parse_history_args(request.query_params)
+            expand = parse_expand(request.query_params)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }, 400)
+        
+        # Get storage backend
+        storage = get_async_storage()
+        
+        # The session token vouches for the user, so only the page is read
+        sos_alerts = await storage.list_alerts(
+            user_id,
+            fields=expand_fields(HISTORY_FIELDS, expand),
+            status=status,
+            limit=limit + 1,
+            start_after=start_after
+        )
+        
+        # Resolved alerts older than the archive cutoff are in monthly rollups
+        if archive_tier_needed(sos_alerts, limit, status):
+            archived = await storage.list_archived_alerts(
+                user_id, status=status, limit=limit + 1, start_after=start_after
+            )
+            sos_alerts = merge_tiers(sos_alerts, archived, limit)
+        
+        alerts, next_cursor = history_page(sos_alerts, limit)
+        await expand_alerts(alerts, sos_alerts, expand, storage=storage)
+        
+        return jsonify({
+            'success': True,
+            'user_id': user_id,
+            'alerts': alerts,
+            'total_alerts': len(alerts),
+            'next_cursor': next_cursor
+        }, 200)
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to get SOS history: {str(e)}'
+        }, 500)
+
+@require_session
+async def get_family_sos_alerts(request):
+    """Get recent SOS alerts from users who list this user as family"""
+    user_id = request.path_params['user_id']
+    try:
+        # Parse pagination, filter and expand parameters
+        try:
+            limit, status, start_after = parse_history_args(request.query_params)
+            expand = parse_expand(request.query_params)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }, 400)
+        
+        # Get storage backend
+        storage = get_async_storage()
+        
+        # One indexed query on the alerts' notified members, newest first
+        sos_alerts = await storage.list_member_alerts(
+            user_id,
+            fields=expand_fields(FAMILY_ALERT_FIELDS, expand),
+            status=status,
+            limit=limit + 1,
+            start_after=start_after
+        )
+        
+        alerts, next_cursor = family_alerts_page(sos_alerts, limit)
+        await expand_alerts(alerts, sos_alerts, expand, storage=storage)
+        
+        return jsonify({
+            'success': True,
+            'user_id': user_id,
+            'alerts': alerts,
+            'total_alerts': len(alerts),
+            'next_cursor': next_cursor
+        }, 200)
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to get family SOS alerts: {str(e)}'
+        }, 500)
+
+@require_responder
+async def nearby_sos_alerts(request):
+    """Get active SOS alerts within a radius or bounding box, for responders"""
+    try:
+        # Parse the search area
+        try:
+            bbox, center, radius, limit = parse_nearby_args(request.query_params)
+            cells = covering_cells(bbox)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }, 400)
+        
+        # Read only the active alerts indexed under the cells covering the
+        # area, then drop the ones outside it
+        candidates = await get_async_storage().list_alerts_in_cells(cells, status='active', fields=NEARBY_FIELDS)
+        alerts = nearby_page(candidates, bbox, center, radius, limit)
+        
+        return jsonify({
+            'success': True,
+            'alerts': alerts,
+            'total_alerts': len(alerts)
+        }, 200)
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to search nearby SOS alerts: {str(e)}'
+        }, 500)
+
+@require_responder
+async def active_sos_alerts(request):
+    """Get the responder dashboard feed of open alerts, oldest first"""
+    try:
+        try:
+            status, limit = parse_feed_args(request.query_params)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }, 400)
+        
+        # Served from the in-process mirror of active_alerts, never from storage
+        etag, body = active_alerts.feed(status, limit)
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type='application/json', headers=headers)
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to get active SOS alerts: {str(e)}'
+        }, 500)
+
+@require_session
+async def update_sos_location(request):
+    """Report a new position for an active SOS alert"""
+    user_id = request.path_params['user_id']
+    alert_id = request.path_params['alert_id']
+    try:
+        data = await request.json() or {}
+        
+        # Validate the reported position
+        try:
+            geo = parse_geo(data)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }, 400)
+        error = location_error(data, geo)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }, 400)
+        
+        # Get storage backend, guarded like the trigger path
+        storage = backend_breaker.guard(get_async_storage())
+        
+        # Get the SOS alert, from the journal if it has not reached storage yet
+        alert_data = await get_alert(storage, alert_id)
+        
+        if alert_data is None:
+            return jsonify({
+                'success': False,
+                'error': 'SOS alert not found'
+            }, 404)
+        
+        # Check if the alert belongs to the user
+        if alert_data['user_id'] != user_id:
+            return jsonify({
+                'success': False,
+                'error': 'Unauthorized access to SOS alert'
+            }, 403)
+        
+        if alert_data['status'] != 'active':
+            return jsonify({
+                'success': False,
+                'error': 'SOS alert is already resolved'
+            }, 409)
+        
+        # Append the update and move the alert in the nearby index
+        update = alert_update(data, geo)
+        await journaled('append_alert_update', storage, alert_id, update)
+        alert_data.update({key: value for key, value in update.items() if key != 'triggered_at'})
+        alert_hub.publish('sos_updated', alert_id, with_caller(alert_data, cached_user(user_id)))
+        
+        return jsonify({
+            'success': True,
+            'alert_id': alert_id,
+            'updated_at': update['triggered_at'],
+            'location': alert_data['location'],
+            'geo': public_geo(alert_data.get('geo'))
+        }, 200)
+    
+    except BackendUnavailable as e:
+        return unavailable_response(e, 'Failed to update SOS location')
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to update SOS location: {str(e)}'
+        }, 500)
+
+@require_session
+async def resolve_sos_alert(request):
+    """Resolve an SOS alert"""
+    user_id = request.path_params['user_id']
+    alert_id = request.path_params['alert_id']
+    try:
+        # Get storage backend, guarded like the trigger path
+        storage = backend_breaker.guard(get_async_storage())
+        
+        # Get the SOS alert, from the journal if it has not reached storage yet
+        alert_data = await get_alert(storage, alert_id)
+        
+        if alert_data is None:
+            return jsonify({
+                'success': False,
+                'error': 'SOS alert not found'
+            }, 404)
+        
+        # Check if the alert belongs to the user
+        if alert_data['user_id'] != user_id:
+            return jsonify({
+                'success': False,
+                'error': 'Unauthorized access to SOS alert'
+            }, 403)
+        
+        # Close the coalescing window so the next press raises a new alert
+        await asyncio.to_thread(coalescer.end, user_id, alert_id)
+        
+        # Update alert status and its dashboard entry
+        resolved_at = datetime.utcnow().isoformat()
+        alert_data.update({'status': 'resolved', 'resolved_at': resolved_at})
+        await journaled('resolve_alert', storage, alert_id, alert_data)
+        alert_hub.publish('sos_resolved', alert_id, with_caller(alert_data, cached_user(user_id)))
+        
+        return jsonify({
+            'success': True,
+            'message': 'SOS alert resolved successfully',
+            'alert_id': alert_id,
+            'resolved_at': resolved_at
+        }, 200)
+    
+    except BackendUnavailable as e:
+        return unavailable_response(e, 'Failed to resolve SOS alert')
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to resolve SOS alert: {str(e)}'
+        }, 500)
+
+# The SSE stream stays on the Flask app, which the ASGI app falls back to
+routes = [
+    Route('/@{user_id}/sos', trigger_sos, methods=['POST']),
+    Route('/@{user_id}/sos/history', get_sos_history, methods=['GET']),
+    Route('/@{user_id}/sos/family', get_family_sos_alerts, methods=['GET']),
+    Route('/sos/nearby', nearby_sos_alerts, methods=['GET']),
+    Route('/sos/active', active_sos_alerts, methods=['GET']),
+    Route('/@{user_id}/sos/{alert_id}/location', update_sos_location, methods=['POST']),
+    Route('/@{user_id}/sos/{alert_id}/resolve', resolve_sos_alert, methods=['POST'])
+]
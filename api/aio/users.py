@@ -0,0 +1,38 @@
+from api.storage.aio import get_async_storage
+from api.users import USER_FIELDS, profile_cache, cached_members, cache_members
+
+# Async versions of api.users; they share the same per-worker caches
+
+async def get_user(user_id, storage=None, family_version=0):
+    """Get a user document as a dict, or None if the user does not exist"""
+    user_data = profile_cache.get(user_id)
+    if user_data is not None and user_data.get('family_version', 0) >= family_version:
+        return user_data
+    
+    storage = storage or get_async_storage()
+    user_data = await storage.get_user(user_id)
+    if user_data is None:
+        return None
+    
+    profile_cache.set(user_id, user_data)
+    return user_data
+
+async def load_users(user_ids, storage=None):
+    """Read full user documents in one round trip, bypassing the cache"""
+    storage = storage or get_async_storage()
+    users = await storage.get_users(user_ids)
+    for user_id, user_data in users.items():
+        profile_cache.set(user_id, user_data)
+    return users
+
+async def get_users(user_ids, fields=USER_FIELDS, storage=None):
+    """Get several user profiles in one multi-document read, in request order"""
+    if not user_ids:
+        return []
+    
+    found, missing_ids = cached_members(user_ids, fields)
+    if missing_ids:
+        storage = storage or get_async_storage()
+        cache_members(found, await storage.get_users(missing_ids, fields=fields), fields)
+    
+    return [found[user_id] for user_id in user_ids if user_id in found]
@@ -0,0 +1,215 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from api.background import PerProcess
+from api.metrics import latency_summary
+from api.storage import get_storage
+from config import Config
+
+logger = logging.getLogger('sangam.archive')
+
+def archive_cutoff(max_age=None):
+    """The resolved_at before which alerts belong in the archive tier"""
+    max_age = Config.ALERT_ARCHIVE_AGE if max_age is None else max_age
+    return (datetime.utcnow() - timedelta(seconds=max_age)).isoformat()
+
+class ArchiveTier:
+    """Whether the archive tier holds any alerts yet, so history reads can skip it until it does
+
+    Until a check finds the archive empty it counts as in use, and once
+    rollups exist it stays in use, so a history page never misses archived
+    alerts except for the first ones another process archives: those are
+    picked up by the next check, at most ``interval`` seconds later.
+    Checks run on a background thread and in_use() never waits for one.
+    """
+    
+    def __init__(self, interval=None, storage=None):
+        self.interval = interval or Config.ALERT_ARCHIVE_INTERVAL
+        self._storage = storage
+        self._lock = threading.Lock()
+        self._in_use = None
+        self._checked_at = None
+        # PID of the process running a check; a forked child runs its own
+        self._checking = None
+    
+    @property
+    def storage(self):
+        return self._storage or get_storage()
+    
+    def in_use(self):
+        """Whether history reads should query the archive tier"""
+        if self._in_use:
+            return True
+        with self._lock:
+            stale = self._checked_at is None or time.monotonic() - self._checked_at >= self.interval
+            if stale and self._checking != os.getpid():
+                self._checking = os.getpid()
+                threading.Thread(target=self.refresh, name='archive-tier-check', daemon=True).start()
+        return self._in_use is not False
+    
+    def refresh(self):
+        """Check storage for archived alerts now"""
+        try:
+            in_use = self.storage.has_archived_alerts()
+        except Exception as e:
+            logger.warning('Could not check the alert archive: %s', e)
+            in_use = self._in_use
+        with self._lock:
+            self._in_use = self._in_use or in_use
+            self._checked_at = time.monotonic()
+            self._checking = None
+        return self._in_use
+    
+    def mark_in_use(self):
+        self._in_use = True
+
+class AlertArchiver:
+    """Move alerts resolved more than ``max_age`` seconds ago out of sos_alerts into monthly rollups
+
+    Each batch lists the ``batch_size`` alerts resolved longest ago and
+    archives them with one commit (Storage.archive_alerts), so sos_alerts
+    and every query over it only hold open and recently resolved alerts. A
+    run stops after ``max_batches`` batches to keep each pass bounded, and
+    the thread starts one every ``interval`` seconds. Archived alerts leave
+    sos_alerts, so a run resumes where the last one stopped; a batch cut
+    short before its commit is listed again, and archiving it twice stores
+    it once.
+
+    History reads combine both tiers (see api.sos). Only processes
+    configured to archive call start(), and the thread does not survive a
+    fork.
+    """
+    
+    def __init__(self, max_age=None, batch_size=None, interval=None, max_batches=None, storage=None):
+        self.max_age = Config.ALERT_ARCHIVE_AGE if max_age is None else max_age
+        self.batch_size = batch_size or Config.ALERT_ARCHIVE_BATCH_SIZE
+        self.interval = interval or Config.ALERT_ARCHIVE_INTERVAL
+        self.max_batches = Config.ALERT_ARCHIVE_MAX_BATCHES if max_batches is None else max_batches
+        self._storage = storage
+        
+        self._lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._process = PerProcess(self._lock)
+        
+        self.archived = 0
+        self.batches = 0
+        self.runs = 0
+        self.failed_runs = 0
+        self.last_run = None
+        self._latencies = deque(maxlen=1000)
+    
+    @property
+    def storage(self):
+        return self._storage or get_storage()
+    
+    def run_once(self, max_batches=None, on_batch=None):
+        """Archive alerts past the cutoff in up to ``max_batches`` batches (0 for all) and return counters
+
+        ``on_batch(counts)`` is called after each batch commits.
+        """
+        max_batches = self.max_batches if max_batches is None else max_batches
+        storage = self.storage
+        cutoff = archive_cutoff(self.max_age)
+        counts = {'alerts': 0, 'batches': 0, 'seconds': 0.0, 'alerts_per_second': 0.0}
+        started = time.perf_counter()
+        
+        with self._run_lock:
+            while not max_batches or counts['batches'] < max_batches:
+                if self._stopped.is_set():
+                    break
+                batch_started = time.perf_counter()
+                alerts = storage.list_resolved_alerts(cutoff, self.batch_size)
+                if not alerts:
+                    break
+                storage.archive_alerts(alerts)
+                archive_tier.mark_in_use()
+                
+                with self._lock:
+                    self._latencies.append(time.perf_counter() - batch_started)
+                    self.archived += len(alerts)
+                    self.batches += 1
+                counts['alerts'] += len(alerts)
+                counts['batches'] += 1
+                counts['seconds'] = time.perf_counter() - started
+                counts['alerts_per_second'] = counts['alerts'] / counts['seconds']
+                if on_batch:
+                    on_batch(counts)
+                if len(alerts) < self.batch_size:
+                    break
+        
+        counts['seconds'] = time.perf_counter() - started
+        counts['alerts_per_second'] = counts['alerts'] / counts['seconds'] if counts['seconds'] else 0.0
+        with self._lock:
+            self.runs += 1
+            self.last_run = dict(counts, finished_at=datetime.utcnow().isoformat())
+        return counts
+    
+    def start(self):
+        """Start archiving every ``interval`` seconds in this process"""
+        self._ensure_started()
+        return self
+    
+    def _ensure_started(self):
+        self._process.start(self._start_thread)
+    
+    def _start_thread(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='alert-archiver', daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                counts = self.run_once()
+                if counts['alerts']:
+                    logger.info('Archived %d resolved alerts in %d batches (%.0f alerts/s)',
+                                counts['alerts'], counts['batches'], counts['alerts_per_second'])
+            except Exception:
+                with self._lock:
+                    self.failed_runs += 1
+                logger.exception('Alert archiving error')
+            self._wake.wait(self.interval)
+            self._wake.clear()
+    
+    def shutdown(self, timeout=5):
+        """Stop the archiver thread after its current batch"""
+        if not self._process.started:
+            return
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._process.stopped()
+    
+    def stats(self):
+        """Get archived alert and batch counters, the last run's throughput and batch latency percentiles"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                'running': self._process.started,
+                'archived': self.archived,
+                'batches': self.batches,
+                'runs': self.runs,
+                'failed_runs': self.failed_runs,
+                'last_run': self.last_run,
+                'max_age_seconds': self.max_age,
+                'batch_size': self.batch_size,
+                'max_batches': self.max_batches,
+                'interval_seconds': self.interval
+            }
+        
+        stats['batch_latency_seconds'] = latency_summary(latencies)
+        return stats
+
+# This process's view of the archive tier, shared by the history handlers
+archive_tier = ArchiveTier()
+
+# Archiver for this process; started by warm_up when ALERT_ARCHIVE_ENABLED
+archiver = AlertArchiver()
+atexit.register(archiver.shutdown)
@@ -1,18 +1,115 @@
 from flask import Blueprint, request, jsonify
-import firebase_admin
-from firebase_admin import firestore
+import hashlib
+import hmac
+import secrets
 import string
 import random
 from datetime import datetime
+from api.storage import get_storage, normalize_email, EmailAlreadyRegistered, UserIdCollision
+from api.storage.base import normalize_zone, zone_fields
+from api.users import get_user, invalidate_user
+from api.writebehind import user_writes
+from api.sessions import issue_token, require_session, revoke_sessions
+from config import Config
 
 auth_bp = Blueprint('auth', __name__)
 
+# How many fresh IDs to try before giving up on a registration
+MAX_USER_ID_ATTEMPTS = 5
+
 def generate_user_id():
     """Generate a unique user ID with prefix and random alphanumeric string"""
     prefix = "SANGAM"
     random_string = ''.join(random.choices(string.ascii_uppercase + string.digits, k=8))
     return f"{prefix}_{random_string}"
 
+def hash_password(password):
+    """Salted PBKDF2-SHA256 hash of a password, as ``pbkdf2_sha256$rounds$salt$hash``"""
+    iterations = Config.PASSWORD_HASH_ITERATIONS
+    salt = secrets.token_hex(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('utf-8'), iterations)
+    return f'pbkdf2_sha256${iterations}${salt}${digest.hex()}'
+
+def password_matches(password, password_hash):
+    """Whether a password matches a stored hash; never for a user without one
+
+    Hashes the password even without a stored hash, so a login takes as
+    long for an unknown user ID as for a wrong password.
+    """
+    try:
+        algorithm, iterations, salt, expected = (password_hash or '').split('$')
+        iterations = int(iterations)
+    except ValueError:
+        algorithm, iterations, salt, expected = 'pbkdf2_sha256', Config.PASSWORD_HASH_ITERATIONS, '', ''
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt.encode('utf-8'), iterations)
+    return algorithm == 'pbkdf2_sha256' and bool(expected) and hmac.compare_digest(digest.hex(), expected)
+
+def mobile_digits(mobile_number):
+    """A mobile number's digits, to compare numbers written differently"""
+    return ''.join(char for char in str(mobile_number or '') if char.isdigit())
+
+def password_setup_error(data, user_data):
+    """Get the client error for a login setting an account's first password, or None if it may
+
+    Accounts registered before logins checked a password have none. Their
+    first login sets it, proving the account with its registered email and
+    mobile number.
+    """
+    if not Config.PASSWORD_SETUP_ON_LOGIN:
+        return 'No password is set for this account; ask the helpdesk to set one'
+    if (not data.get('email') or not data.get('mobile_number')
+            or normalize_email(data['email']) != normalize_email(user_data.get('email') or '')
+            or mobile_digits(data['mobile_number']) != mobile_digits(user_data.get('mobile_number'))):
+        return ('No password is set for this account yet: log in with your registered email '
+                'and mobile number to choose one')
+    if len(data['password']) < Config.PASSWORD_MIN_LENGTH:
+        return f'Password must be at least {Config.PASSWORD_MIN_LENGTH} characters'
+    return None
+
+def registration_error(data, password_required=True):
+    """Get the client error for a registration body, or None if it is valid
+
+    Without ``password_required`` a missing password is allowed; the user
+    cannot log in until one is set with scripts.set_password.
+    """
+    for field in ('username', 'email', 'mobile_number'):
+        if field not in data or not data[field]:
+            return f'Missing required field: {field}'
+    if password_required and not data.get('password'):
+        return 'Missing required field: password'
+    if 'password' in data and (not isinstance(data['password'], str)
+                               or len(data['password']) < Config.PASSWORD_MIN_LENGTH):
+        return f'Password must be at least {Config.PASSWORD_MIN_LENGTH} characters'
+    if data.get('zone'):
+        try:
+            normalize_zone(data['zone'])
+        except ValueError as e:
+            return str(e)
+    return None
+
+def new_user(data):
+    """Build a new user document with a freshly generated user ID
+
+    A ``zone`` puts the user in that zone's broadcast audience. The
+    password is only kept as its hash.
+    """
+    user_data = {
+        'user_id': generate_user_id(),
+        'username': data['username'],
+        'email': data['email'],
+        'mobile_number': data['mobile_number'],
+        'family_members': [],  # Initialize empty family list
+        'family_version': 0,
+        'created_at': datetime.utcnow().isoformat(),
+        'last_login': None,
+        'is_active': True
+    }
+    if data.get('password'):
+        user_data['password_hash'] = hash_password(data['password'])
+    if data.get('zone'):
+        user_data.update(zone_fields(user_data['user_id'], normalize_zone(data['zone'])))
+    return user_data
+
 @auth_bp.route('/register', methods=['POST'])
 def register():
     """Handle user registration"""
@@ -21,56 +118,54 @@ def register():
         data = request.get_json()
         
         # Validate required fields
-        required_fields = ['username', 'email', 'mobile_number']
-        for field in required_fields:
-            if field not in data or not data[field]:
-                return jsonify({
-                    'success': False,
-                    'error': f'Missing required field: {field}'
-                }), 400
-        
-        # Initialize Firestore client
-        db = firestore.client()
-        
-        # Check if user already exists with this email
-        users_ref = db.collection('users')
-        existing_user = users_ref.where('email', '==', data['email']).get()
-        
-        if existing_user:
+        error = registration_error(data)
+        if error:
             return jsonify({
                 'success': False,
-                'error': 'User with this email already exists'
-            }), 409
+                'error': error
+            }), 400
         
-        # Generate unique user ID
-        user_id = generate_user_id()
+        # Get storage backend
+        storage = get_storage()
         
-        # Prepare user data
-        user_data = {
-            'user_id': user_id,
-            'username': data['username'],
-            'email': data['email'],
-            'mobile_number': data['mobile_number'],
-            'family_members': [],  # Initialize empty family list
-            'created_at': datetime.utcnow().isoformat(),
-            'last_login': None,
-            'is_active': True
-        }
+        # Claim the email and a fresh user ID in one transaction, retrying
+        # with a new ID if the generated one is already taken
+        for attempt in range(MAX_USER_ID_ATTEMPTS):
+            # Prepare user data
+            user_data = new_user(data)
+            user_id = user_data['user_id']
+            
+            try:
+                storage.create_user(user_data)
+                break
+            except UserIdCollision:
+                continue
+            except EmailAlreadyRegistered:
+                return jsonify({
+                    'success': False,
+                    'error': 'User with this email already exists'
+                }), 409
+        else:
+            return jsonify({
+                'success': False,
+                'error': 'Registration failed: could not allocate a unique user ID'
+            }), 503
         
-        # Store user in Firestore
-        users_ref.document(user_id).set(user_data)
+        invalidate_user(user_id)
         
         return jsonify({
             'success': True,
             'message': 'User registered successfully',
             'user_id': user_id,
+            'token': issue_token(user_id),
+            'expires_in': Config.SESSION_TOKEN_TTL,
             'data': {
                 'username': user_data['username'],
                 'email': user_data['email'],
                 'mobile_number': user_data['mobile_number']
             }
         }), 201
-        
+    
     except Exception as e:
         return jsonify({
             'success': False,
@@ -83,29 +178,45 @@ def login():
     try:
         data = request.get_json()
         
-        if 'user_id' not in data or not data['user_id']:
+        if not data.get('user_id') or not isinstance(data.get('password'), str):
             return jsonify({
                 'success': False,
-                'error': 'User ID is required'
+                'error': 'User ID and password are required'
             }), 400
         
-        # Initialize Firestore client
-        db = firestore.client()
+        # Get storage backend
+        storage = get_storage()
         
         # Get user data
-        user_ref = db.collection('users').document(data['user_id'])
-        user_doc = user_ref.get()
+        user_data = get_user(data['user_id'], storage=storage)
         
-        if not user_doc.exists:
+        password_hash = user_data.get('password_hash') if user_data else None
+        if user_data is not None and not password_hash:
+            # A cached profile may predate a password set since
+            user_data = storage.get_user(data['user_id'])
+            password_hash = user_data.get('password_hash') if user_data else None
+        
+        if user_data is not None and not password_hash:
+            # An account from before passwords: this login sets its first one
+            error = password_setup_error(data, user_data)
+            if error:
+                return jsonify({
+                    'success': False,
+                    'error': error,
+                    'password_setup_required': True
+                }), 403
+            storage.update_user(data['user_id'], {'password_hash': hash_password(data['password'])})
+            invalidate_user(data['user_id'])
+        elif not password_matches(data['password'], password_hash):
+            # The same answer for an unknown user as for a wrong password
             return jsonify({
                 'success': False,
-                'error': 'User not found'
-            }), 404
-        
-        user_data = user_doc.to_dict()
+                'error': 'Invalid user ID or password'
+            }), 401
         
-        # Update last login
-        user_ref.update({
+        # Record the login in the background; the buffer merges repeated
+        # logins and writes them in batches
+        user_writes.defer(data['user_id'], {
             'last_login': datetime.utcnow().isoformat()
         })
         
@@ -113,6 +224,9 @@ def login():
             'success': True,
             'message': 'Login successful',
             'user_id': user_data['user_id'],
+            # Later calls send this instead of being looked up by user ID
+            'token': issue_token(user_data['user_id'], user_data.get('family_version', 0)),
+            'expires_in': Config.SESSION_TOKEN_TTL,
             'data': {
                 'username': user_data['username'],
                 'email': user_data['email'],
@@ -120,9 +234,30 @@ def login():
                 'family_members': user_data.get('family_members', [])
             }
         }), 200
-        
+    
     except Exception as e:
         return jsonify({
             'success': False,
             'error': f'Login failed: {str(e)}'
         }), 500
+
+
+@auth_bp.route('/@<user_id>/logout', methods=['POST'])
+@require_session
+def logout(user_id):
+    """Revoke every session token issued to the user"""
+    try:
+        revoked_at = revoke_sessions(user_id)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Logged out on all devices',
+            'user_id': user_id,
+            'revoked_at': revoked_at
+        }), 200
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Logout failed: {str(e)}'
+        }), 500
@@ -0,0 +1,34 @@
+import os
+import threading
+
+class PerProcess:
+    """Starts a background worker once in each process
+
+    Threads do not survive fork(): a worker forked from a preloaded app
+    inherits its parent's state but none of its threads, so start() runs
+    setup again in every process that calls it.
+    """
+    
+    def __init__(self, lock=None):
+        self.pid = None
+        self._lock = lock or threading.Lock()
+    
+    @property
+    def started(self):
+        """Whether start() has run setup in this process"""
+        return self.pid == os.getpid()
+    
+    def start(self, setup):
+        """Run setup() under the lock unless this process already has; return whether it ran"""
+        if self.started:
+            return False
+        with self._lock:
+            if self.started:
+                return False
+            setup()
+            self.pid = os.getpid()
+        return True
+    
+    def stopped(self):
+        """Forget the start, so the next start() runs setup again"""
+        self.pid = None
@@ -0,0 +1,192 @@
+import asyncio
+import contextvars
+import inspect
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from google.api_core.exceptions import NotFound
+from api.background import PerProcess
+from config import Config
+
+logger = logging.getLogger('sangam.breaker')
+
+# Errors storage raises for a document it does not have: the backend
+# answered, so they do not count as failed calls
+NOT_FOUND_ERRORS = (KeyError, NotFound)
+
+class BackendUnavailable(Exception):
+    """A storage call was not made or did not finish in time"""
+
+class CircuitOpen(BackendUnavailable):
+    """The breaker is open: recent calls failed, so this one was not made"""
+
+class BackendTimeout(BackendUnavailable):
+    """A storage call took longer than the breaker's call timeout"""
+
+class CircuitBreaker:
+    """Fail storage calls fast while the backend is failing or slow
+
+    Every call waits at most ``call_timeout`` seconds. After
+    ``failure_threshold`` consecutive failures or timeouts the breaker
+    opens and calls raise CircuitOpen at once, without touching the
+    backend. After ``reset_timeout`` seconds it lets one trial call
+    through (half-open): success closes it, failure opens it again.
+
+    A sync call that times out keeps running on the breaker's thread pool;
+    only the caller stops waiting for it. Errors in ``answered_errors``
+    reach the caller but count as successful calls: the backend answered.
+    """
+    
+    def __init__(self, name='storage', failure_threshold=None, reset_timeout=None, call_timeout=None,
+                 max_workers=None, answered_errors=NOT_FOUND_ERRORS):
+        self.name = name
+        self.answered_errors = answered_errors
+        self.failure_threshold = failure_threshold or Config.BREAKER_FAILURE_THRESHOLD
+        self.reset_timeout = Config.BREAKER_RESET_SECONDS if reset_timeout is None else reset_timeout
+        self.call_timeout = call_timeout or Config.BACKEND_TIMEOUT
+        self._max_workers = max_workers or 16
+        self._executor = None
+        self._lock = threading.Lock()
+        self._process = PerProcess(self._lock)
+        
+        self.state = 'closed'
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        
+        self.calls = 0
+        self.successes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.opened = 0
+    
+    def _before_call(self):
+        """Raise CircuitOpen unless a call may go through now"""
+        with self._lock:
+            if self.state == 'open':
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    self.rejected += 1
+                    raise CircuitOpen(f'{self.name} backend unavailable, retry shortly')
+                self.state = 'half_open'
+                self._trial = False
+            if self.state == 'half_open':
+                if self._trial:
+                    self.rejected += 1
+                    raise CircuitOpen(f'{self.name} backend unavailable, retry shortly')
+                self._trial = True
+            self.calls += 1
+    
+    def _on_success(self):
+        with self._lock:
+            self.successes += 1
+            self._failures = 0
+            if self.state != 'closed':
+                logger.info('%s circuit closed', self.name)
+            self.state = 'closed'
+            self._trial = False
+    
+    def _on_failure(self, timed_out):
+        with self._lock:
+            self.failures += 1
+            self.timeouts += timed_out
+            self._failures += 1
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.opened += 1
+                    logger.warning('%s circuit opened after %d failed calls', self.name, self._failures)
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+                self._trial = False
+    
+    def _pool(self):
+        self._process.start(self._new_pool)
+        return self._executor
+    
+    def _new_pool(self):
+        # A forked child does not inherit the parent's pool threads
+        self._executor = ThreadPoolExecutor(self._max_workers, thread_name_prefix=f'{self.name}-breaker')
+    
+    def call(self, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) on the breaker's pool and wait at most call_timeout for it"""
+        self._before_call()
+        # Carry the request's context over so metrics count the call
+        context = contextvars.copy_context()
+        future = self._pool().submit(context.run, fn, *args, **kwargs)
+        try:
+            result = future.result(self.call_timeout)
+        except FutureTimeout:
+            self._on_failure(True)
+            raise BackendTimeout(f'{self.name} backend did not answer within {self.call_timeout}s')
+        except self.answered_errors:
+            self._on_success()
+            raise
+        except Exception:
+            self._on_failure(False)
+            raise
+        self._on_success()
+        return result
+    
+    async def call_async(self, awaitable):
+        """Await a storage coroutine for at most call_timeout"""
+        try:
+            self._before_call()
+        except CircuitOpen:
+            awaitable.close()
+            raise
+        try:
+            result = await asyncio.wait_for(awaitable, self.call_timeout)
+        except asyncio.TimeoutError:
+            self._on_failure(True)
+            raise BackendTimeout(f'{self.name} backend did not answer within {self.call_timeout}s')
+        except self.answered_errors:
+            self._on_success()
+            raise
+        except Exception:
+            self._on_failure(False)
+            raise
+        self._on_success()
+        return result
+    
+    def guard(self, storage):
+        """Wrap a Storage or AsyncStorage so every call goes through this breaker"""
+        return GuardedStorage(storage, self)
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'calls': self.calls,
+                'successes': self.successes,
+                'failures': self.failures,
+                'timeouts': self.timeouts,
+                'rejected': self.rejected,
+                'opened': self.opened,
+                'call_timeout_seconds': self.call_timeout,
+                'reset_timeout_seconds': self.reset_timeout
+            }
+
+class GuardedStorage:
+    """Storage proxy whose methods go through a CircuitBreaker"""
+    
+    def __init__(self, storage, breaker):
+        self._storage = storage
+        self._breaker = breaker
+        self.name = storage.name
+    
+    def __getattr__(self, operation):
+        method = getattr(self._storage, operation)
+        breaker = self._breaker
+        if inspect.iscoroutinefunction(method):
+            async def call_async(*args, **kwargs):
+                return await breaker.call_async(method(*args, **kwargs))
+            return call_async
+        if callable(method):
+            def call(*args, **kwargs):
+                return breaker.call(method, *args, **kwargs)
+            return call
+        return method
+
+# Breaker for this worker's storage backend
+backend_breaker = CircuitBreaker()
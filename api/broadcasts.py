@@ -0,0 +1,241 @@
+from flask import Blueprint, request, jsonify, g
+from datetime import datetime, timedelta
+from api.storage import get_storage
+from api.storage.base import new_alert_id, normalize_zone, zone_fields, broadcast_shards
+from api.users import invalidate_user
+from api.sessions import require_role, require_session
+from api.sos import encode_cursor, decode_cursor
+from api.fanout import fanout
+from config import Config
+
+broadcasts_bp = Blueprint('broadcasts', __name__)
+
+# Kinds of broadcast authorities send, shown to recipients as they are
+BROADCAST_CATEGORIES = ('crowd_crush', 'lost_child', 'ghat_closure', 'general')
+MESSAGE_MAX_LENGTH = 500
+
+# Inbox page sizes
+INBOX_DEFAULT_LIMIT = 20
+INBOX_MAX_LIMIT = 100
+
+# Reject a request without a valid session token of a user in Config.BROADCAST_AUTHORITIES
+require_authority = require_role(lambda user_id: user_id in Config.BROADCAST_AUTHORITIES,
+                                 'Only mela authorities can send broadcasts')
+
+def broadcast_error(data):
+    """Get the client error for a broadcast body, or None if it is valid"""
+    for field in ('zone', 'message'):
+        if not data.get(field):
+            return f'Missing required field: {field}'
+    try:
+        normalize_zone(data['zone'])
+    except ValueError as e:
+        return str(e)
+    if data.get('category', 'general') not in BROADCAST_CATEGORIES:
+        return f"category must be one of {', '.join(BROADCAST_CATEGORIES)}"
+    if not isinstance(data['message'], str) or len(data['message']) > MESSAGE_MAX_LENGTH:
+        return f'message must be text of at most {MESSAGE_MAX_LENGTH} characters'
+    return None
+
+def new_broadcast(data, created_by, now=None):
+    """Build a broadcast record from a validated request body"""
+    now = now or datetime.utcnow()
+    return {
+        'zone': normalize_zone(data['zone']),
+        'category': data.get('category', 'general'),
+        'message': data['message'],
+        'created_by': created_by,
+        'created_at': now.isoformat(),
+        'expires_at': (now + timedelta(seconds=Config.BROADCAST_INBOX_RETENTION)).isoformat(),
+        'shards': Config.BROADCAST_SHARDS
+    }
+
+def broadcast_progress(broadcast_id, broadcast, shards):
+    """Delivery progress of a broadcast summed over its shards"""
+    done = [shard for shard in shards if shard['status'] == 'done']
+    started = [shard['started_at'] for shard in shards if shard.get('started_at')]
+    if len(done) == len(shards):
+        status = 'sent'
+    elif started:
+        status = 'sending'
+    else:
+        status = 'queued'
+    
+    delivered = sum(shard['delivered'] for shard in shards)
+    started_at = min(started) if started else None
+    finished_at = max(shard['finished_at'] for shard in done) if status == 'sent' and done else None
+    elapsed = None
+    if started_at:
+        end = datetime.fromisoformat(finished_at) if finished_at else datetime.utcnow()
+        elapsed = (end - datetime.fromisoformat(started_at)).total_seconds()
+    
+    return dict(broadcast, **{
+        'broadcast_id': broadcast_id,
+        'status': status,
+        'delivered': delivered,
+        'shards_done': len(done),
+        'started_at': started_at,
+        'finished_at': finished_at,
+        'recipients_per_second': delivered / elapsed if elapsed else None,
+        'shard_progress': [{
+            'shard': shard['shard'],
+            'status': shard['status'],
+            'delivered': shard['delivered'],
+            'owner': shard.get('owner'),
+            'updated_at': shard.get('updated_at')
+        } for shard in shards]
+    })
+
+def parse_inbox_args(args):
+    """Parse limit and start_after, raising ValueError with the client error"""
+    try:
+        limit = int(args.get('limit', INBOX_DEFAULT_LIMIT))
+    except ValueError:
+        limit = 0
+    
+    if not 1 <= limit <= INBOX_MAX_LIMIT:
+        raise ValueError(f'limit must be between 1 and {INBOX_MAX_LIMIT}')
+    
+    start_after = args.get('start_after')
+    try:
+        start_after = decode_cursor(start_after) if start_after else None
+    except ValueError:
+        raise ValueError('Invalid start_after cursor')
+    
+    return limit, start_after
+
+@broadcasts_bp.route('/broadcasts', methods=['POST'])
+@require_authority
+def send_broadcast():
+    """Broadcast an alert to everyone registered in a zone"""
+    try:
+        data = request.get_json() or {}
+        
+        # Validate the broadcast
+        error = broadcast_error(data)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+        
+        # Store it with its shards; fan-out workers pick the shards up
+        broadcast_id = new_alert_id()
+        broadcast = new_broadcast(data, g.session.user_id)
+        created = datetime.fromisoformat(broadcast['created_at']).timestamp()
+        shards = broadcast_shards(broadcast_id, broadcast, broadcast['shards'], created)
+        get_storage().create_broadcast(broadcast_id, broadcast, shards)
+        fanout.wake()
+        
+        return jsonify({
+            'success': True,
+            'message': 'Broadcast queued',
+            'broadcast_id': broadcast_id,
+            'zone': broadcast['zone'],
+            'shards': len(shards),
+            'status': 'queued'
+        }), 202
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to send broadcast: {str(e)}'
+        }), 500
+
+@broadcasts_bp.route('/broadcasts/<broadcast_id>', methods=['GET'])
+@require_authority
+def get_broadcast(broadcast_id):
+    """Get a broadcast's delivery progress"""
+    try:
+        found = get_storage().get_broadcast(broadcast_id)
+        
+        if found is None:
+            return jsonify({
+                'success': False,
+                'error': 'Broadcast not found'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'broadcast': broadcast_progress(broadcast_id, *found)
+        }), 200
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to get broadcast: {str(e)}'
+        }), 500
+
+@broadcasts_bp.route('/@<user_id>/inbox', methods=['GET'])
+@require_session
+def get_inbox(user_id):
+    """Get the broadcasts sent to the user's zone, newest first"""
+    try:
+        try:
+            limit, start_after = parse_inbox_args(request.args)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        # One extra entry tells whether there is a next page
+        since = (datetime.utcnow() - timedelta(seconds=Config.BROADCAST_INBOX_RETENTION)).isoformat()
+        entries = get_storage().list_inbox(user_id, since, limit=limit + 1, start_after=start_after)
+        
+        next_cursor = None
+        if len(entries) > limit:
+            entries = entries[:limit]
+            next_cursor = encode_cursor(entries[-1]['created_at'])
+        
+        return jsonify({
+            'success': True,
+            'user_id': user_id,
+            'broadcasts': entries,
+            'next_cursor': next_cursor
+        }), 200
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to get inbox: {str(e)}'
+        }), 500
+
+@broadcasts_bp.route('/@<user_id>/zone', methods=['POST'])
+@require_session
+def set_zone(user_id):
+    """Move the user into a zone's broadcast audience, or out of any with zone null"""
+    try:
+        data = request.get_json() or {}
+        
+        if 'zone' not in data:
+            return jsonify({
+                'success': False,
+                'error': 'Missing required field: zone'
+            }), 400
+        
+        zone = None
+        if data['zone']:
+            try:
+                zone = normalize_zone(data['zone'])
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 400
+        
+        # The token shows the user exists; the update moves them in the zone index
+        get_storage().update_user(user_id, zone_fields(user_id, zone))
+        invalidate_user(user_id)
+        
+        return jsonify({
+            'success': True,
+            'user_id': user_id,
+            'zone': zone
+        }), 200
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to set zone: {str(e)}'
+        }), 500
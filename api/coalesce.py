@@ -0,0 +1,431 @@
+import asyncio
+import json
+import threading
+import time
+import uuid
+from config import Config
+
+# Longest Idempotency-Key header accepted
+MAX_KEY_LENGTH = 255
+
+class IdempotencyConflict(Exception):
+    """Another request with the same Idempotency-Key is still being handled"""
+
+class CoalescingStore:
+    """Shared state behind SOS idempotency keys and coalescing windows
+
+    Every method is atomic across the processes sharing the store. Claims
+    hand out a token; only the token's holder can complete or release the
+    claim, and a claim left pending for ``claim_timeout`` seconds (its
+    request died) can be taken over. Times are wall-clock seconds so that
+    processes agree on them.
+    """
+    
+    def claim_key(self, user_id, key, now, ttl, claim_timeout):
+        """Claim an idempotency key
+
+        Returns ('new', token), ('replay', response) for a key whose request
+        finished within ``ttl`` seconds, or ('pending', None).
+        """
+        raise NotImplementedError
+    
+    def save_key(self, user_id, key, token, response):
+        """Store the response to replay for a claimed key"""
+        raise NotImplementedError
+    
+    def release_key(self, user_id, key, token):
+        """Drop a claimed key so a retry runs the request again"""
+        raise NotImplementedError
+    
+    def claim_window(self, user_id, now, window, claim_timeout):
+        """Join or open the user's coalescing window
+
+        Returns ('existing', (alert_id, triggered_at)) if the user's last
+        trigger was less than ``window`` seconds ago, ('pending', None) while
+        another request is creating the user's alert, or ('new', token).
+        Joining an existing window extends it.
+        """
+        raise NotImplementedError
+    
+    def set_window_alert(self, user_id, token, alert_id, triggered_at, now):
+        """Attach the created alert to a window opened with claim_window()"""
+        raise NotImplementedError
+    
+    def release_window(self, user_id, token):
+        """Drop a window whose alert was never created"""
+        raise NotImplementedError
+    
+    def end_window(self, user_id, alert_id):
+        """Close the window of a resolved alert"""
+        raise NotImplementedError
+
+class MemoryCoalescingStore(CoalescingStore):
+    """Coalescing state in this process only, for single-worker deployments"""
+    
+    # Seconds between sweeps of expired keys and windows
+    SWEEP_INTERVAL = 60
+    
+    def __init__(self):
+        self._keys = {}
+        self._windows = {}
+        self._lock = threading.Lock()
+        self._next_sweep = {}
+    
+    def _sweep(self, entries, field, cutoff, now):
+        """Drop entries whose ``field`` is older than cutoff, at most once per interval"""
+        if now < self._next_sweep.get(field, 0):
+            return
+        self._next_sweep[field] = now + self.SWEEP_INTERVAL
+        for entry_key in [k for k, v in entries.items() if v[field] < cutoff]:
+            del entries[entry_key]
+    
+    def claim_key(self, user_id, key, now, ttl, claim_timeout):
+        with self._lock:
+            entry = self._keys.get((user_id, key))
+            if entry is not None and entry['response'] is not None and now - entry['created_at'] < ttl:
+                return 'replay', json.loads(entry['response'])
+            if entry is not None and entry['response'] is None and now - entry['created_at'] < claim_timeout:
+                return 'pending', None
+            
+            self._sweep(self._keys, 'created_at', now - ttl, now)
+            token = uuid.uuid4().hex
+            self._keys[(user_id, key)] = {'token': token, 'response': None, 'created_at': now}
+            return 'new', token
+    
+    def save_key(self, user_id, key, token, response):
+        with self._lock:
+            entry = self._keys.get((user_id, key))
+            if entry is not None and entry['token'] == token:
+                # Stored serialized so a replay cannot share objects with the original
+                entry['response'] = json.dumps(response)
+    
+    def release_key(self, user_id, key, token):
+        with self._lock:
+            entry = self._keys.get((user_id, key))
+            if entry is not None and entry['token'] == token:
+                del self._keys[(user_id, key)]
+    
+    def claim_window(self, user_id, now, window, claim_timeout):
+        with self._lock:
+            entry = self._windows.get(user_id)
+            if entry is not None and entry['alert_id'] is not None and now - entry['last_seen'] < window:
+                entry['last_seen'] = now
+                return 'existing', (entry['alert_id'], entry['triggered_at'])
+            if entry is not None and entry['alert_id'] is None and now - entry['claimed_at'] < claim_timeout:
+                return 'pending', None
+            
+            self._sweep(self._windows, 'last_seen', now - max(window, claim_timeout), now)
+            token = uuid.uuid4().hex
+            self._windows[user_id] = {
+                'token': token, 'alert_id': None, 'triggered_at': None,
+                'claimed_at': now, 'last_seen': now
+            }
+            return 'new', token
+    
+    def set_window_alert(self, user_id, token, alert_id, triggered_at, now):
+        with self._lock:
+            entry = self._windows.get(user_id)
+            if entry is not None and entry['token'] == token:
+                entry.update(token=None, alert_id=alert_id, triggered_at=triggered_at, last_seen=now)
+    
+    def release_window(self, user_id, token):
+        with self._lock:
+            entry = self._windows.get(user_id)
+            if entry is not None and entry['token'] == token:
+                del self._windows[user_id]
+    
+    def end_window(self, user_id, alert_id):
+        with self._lock:
+            entry = self._windows.get(user_id)
+            if entry is not None and entry['alert_id'] == alert_id:
+                del self._windows[user_id]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    token TEXT,
+    response TEXT,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (user_id, key)
+);
+CREATE INDEX IF NOT EXISTS idempotency_keys_by_created ON idempotency_keys (created_at);
+
+CREATE TABLE IF NOT EXISTS sos_windows (
+    user_id TEXT PRIMARY KEY,
+    token TEXT,
+    alert_id TEXT,
+    triggered_at TEXT,
+    claimed_at REAL NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sos_windows_by_last_seen ON sos_windows (last_seen);
+"""
+
+class SQLiteCoalescingStore(CoalescingStore):
+    """Coalescing state in a SQLite file shared by every worker on the host
+
+    Each claim is one BEGIN IMMEDIATE transaction, so concurrent workers
+    see each other's claims.
+    """
+    
+    def __init__(self, path, pool_size=8, timeout=5.0):
+        from api.storage.sqlite_backend import ConnectionPool
+        self.path = path
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+        self._pool = ConnectionPool(path, pool_size, timeout, on_connect=self._ensure_schema)
+    
+    def _ensure_schema(self, conn):
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if not self._schema_ready:
+                conn.executescript(SCHEMA)
+                self._schema_ready = True
+    
+    def _execute(self, sql, params):
+        with self._pool.connection() as conn:
+            conn.execute(sql, params)
+    
+    def _claim(self, claim):
+        """Run claim(conn) in a write transaction"""
+        with self._pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = claim(conn)
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+        return result
+    
+    def claim_key(self, user_id, key, now, ttl, claim_timeout):
+        def claim(conn):
+            row = conn.execute(
+                "SELECT response, created_at FROM idempotency_keys WHERE user_id = ? AND key = ?",
+                (user_id, key)
+            ).fetchone()
+            if row is not None and row['response'] is not None and now - row['created_at'] < ttl:
+                return 'replay', json.loads(row['response'])
+            if row is not None and row['response'] is None and now - row['created_at'] < claim_timeout:
+                return 'pending', None
+            
+            conn.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (now - ttl,))
+            token = uuid.uuid4().hex
+            conn.execute(
+                "INSERT OR REPLACE INTO idempotency_keys (user_id, key, token, response, created_at) "
+                "VALUES (?, ?, ?, NULL, ?)",
+                (user_id, key, token, now)
+            )
+            return 'new', token
+        return self._claim(claim)
+    
+    def save_key(self, user_id, key, token, response):
+        self._execute(
+            "UPDATE idempotency_keys SET response = ?, token = NULL WHERE user_id = ? AND key = ? AND token = ?",
+            (json.dumps(response), user_id, key, token)
+        )
+    
+    def release_key(self, user_id, key, token):
+        self._execute(
+            "DELETE FROM idempotency_keys WHERE user_id = ? AND key = ? AND token = ?",
+            (user_id, key, token)
+        )
+    
+    def claim_window(self, user_id, now, window, claim_timeout):
+        def claim(conn):
+            row = conn.execute(
+                "SELECT alert_id, triggered_at, claimed_at, last_seen FROM sos_windows WHERE user_id = ?",
+                (user_id,)
+            ).fetchone()
+            if row is not None and row['alert_id'] is not None and now - row['last_seen'] < window:
+                conn.execute("UPDATE sos_windows SET last_seen = ? WHERE user_id = ?", (now, user_id))
+                return 'existing', (row['alert_id'], row['triggered_at'])
+            if row is not None and row['alert_id'] is None and now - row['claimed_at'] < claim_timeout:
+                return 'pending', None
+            
+            conn.execute("DELETE FROM sos_windows WHERE last_seen < ?", (now - max(window, claim_timeout),))
+            token = uuid.uuid4().hex
+            conn.execute(
+                "INSERT OR REPLACE INTO sos_windows (user_id, token, alert_id, triggered_at, claimed_at, last_seen) "
+                "VALUES (?, ?, NULL, NULL, ?, ?)",
+                (user_id, token, now, now)
+            )
+            return 'new', token
+        return self._claim(claim)
+    
+    def set_window_alert(self, user_id, token, alert_id, triggered_at, now):
+        self._execute(
+            "UPDATE sos_windows SET token = NULL, alert_id = ?, triggered_at = ?, last_seen = ? "
+            "WHERE user_id = ? AND token = ?",
+            (alert_id, triggered_at, now, user_id, token)
+        )
+    
+    def release_window(self, user_id, token):
+        self._execute("DELETE FROM sos_windows WHERE user_id = ? AND token = ?", (user_id, token))
+    
+    def end_window(self, user_id, alert_id):
+        self._execute("DELETE FROM sos_windows WHERE user_id = ? AND alert_id = ?", (user_id, alert_id))
+
+class Claim:
+    """What one SOS request should do, as decided by SOSCoalescer.claim()
+
+    ``replay`` holds the stored response of an earlier request with the
+    same Idempotency-Key. Otherwise ``alert_id`` is set when the request
+    joins the user's active alert, and the request creates a new alert
+    when it is None.
+    """
+    
+    def __init__(self, user_id, key=None):
+        self.user_id = user_id
+        self.key = key
+        self.key_token = None
+        self.window_token = None
+        self.alert_id = None
+        self.triggered_at = None
+        self.replay = None
+    
+    @property
+    def coalesced(self):
+        return self.alert_id is not None
+
+class SOSCoalescer:
+    """Idempotency keys and per-user coalescing windows for SOS triggers
+
+    A retried request with the same Idempotency-Key gets the first
+    response back. A trigger within ``window`` seconds of the user's last
+    one joins the alert that trigger created instead of creating another;
+    each trigger extends the window, and resolving the alert closes it.
+    A request that cannot get an answer within ``wait`` seconds creates
+    its own alert, so an alert is never dropped.
+    """
+    
+    def __init__(self, store=None, window=None, key_ttl=None, claim_timeout=None, wait=None,
+                 poll_interval=0.05, clock=time.time):
+        self.store = store or create_store()
+        self.window = Config.SOS_COALESCE_WINDOW if window is None else window
+        self.key_ttl = Config.SOS_IDEMPOTENCY_TTL if key_ttl is None else key_ttl
+        self.claim_timeout = Config.SOS_CLAIM_TIMEOUT if claim_timeout is None else claim_timeout
+        self.wait = Config.SOS_COALESCE_WAIT if wait is None else wait
+        self.poll_interval = poll_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.created = 0
+        self.coalesced = 0
+        self.replayed = 0
+        self.conflicts = 0
+    
+    def _new_claim(self, user_id, key):
+        if key is not None and not 0 < len(key) <= MAX_KEY_LENGTH:
+            raise ValueError(f'Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters')
+        return Claim(user_id, key)
+    
+    def _advance(self, claim):
+        """Take the next claim step; return what it waits on ('key', 'window') or None when done"""
+        if claim.key is not None and claim.key_token is None:
+            state, value = self.store.claim_key(
+                claim.user_id, claim.key, self._clock(), self.key_ttl, self.claim_timeout
+            )
+            if state == 'pending':
+                return 'key'
+            if state == 'replay':
+                claim.replay = value
+                return None
+            claim.key_token = value
+        
+        if self.window > 0:
+            state, value = self.store.claim_window(claim.user_id, self._clock(), self.window, self.claim_timeout)
+            if state == 'pending':
+                return 'window'
+            if state == 'existing':
+                claim.alert_id, claim.triggered_at = value
+            else:
+                claim.window_token = value
+        return None
+    
+    def _finish(self, claim, waiting_on):
+        with self._lock:
+            if waiting_on == 'key':
+                self.conflicts += 1
+                raise IdempotencyConflict()
+            if claim.replay is not None:
+                self.replayed += 1
+            elif claim.coalesced:
+                self.coalesced += 1
+            else:
+                self.created += 1
+        return claim
+    
+    def claim(self, user_id, key=None):
+        """Decide whether a trigger replays, joins the active alert or creates one
+
+        Raises ValueError for a malformed key and IdempotencyConflict while
+        another request holds the same key.
+        """
+        claim = self._new_claim(user_id, key)
+        deadline = time.monotonic() + self.wait
+        while True:
+            waiting_on = self._advance(claim)
+            if waiting_on is None or time.monotonic() >= deadline:
+                return self._finish(claim, waiting_on)
+            time.sleep(self.poll_interval)
+    
+    async def claim_async(self, user_id, key=None):
+        """claim() for the event loop: store calls run in a thread and waits do not block"""
+        claim = self._new_claim(user_id, key)
+        deadline = time.monotonic() + self.wait
+        while True:
+            waiting_on = await asyncio.to_thread(self._advance, claim)
+            if waiting_on is None or time.monotonic() >= deadline:
+                return self._finish(claim, waiting_on)
+            await asyncio.sleep(self.poll_interval)
+    
+    def complete(self, claim, response):
+        """Record a handled trigger: open its window and store its response for replays"""
+        if claim.window_token is not None:
+            self.store.set_window_alert(
+                claim.user_id, claim.window_token, response['alert_id'], response['triggered_at'], self._clock()
+            )
+        if claim.key_token is not None:
+            self.store.save_key(claim.user_id, claim.key, claim.key_token, response)
+    
+    def abandon(self, claim):
+        """Release a failed trigger's claims so a retry starts over"""
+        if claim.coalesced:
+            # The window's alert could not be updated; let the retry raise a new one
+            self.store.end_window(claim.user_id, claim.alert_id)
+        if claim.window_token is not None:
+            self.store.release_window(claim.user_id, claim.window_token)
+        if claim.key_token is not None:
+            self.store.release_key(claim.user_id, claim.key, claim.key_token)
+    
+    def end(self, user_id, alert_id):
+        """Close the user's window when its alert is resolved"""
+        self.store.end_window(user_id, alert_id)
+    
+    def stats(self):
+        """Get created/coalesced/replayed trigger counters"""
+        with self._lock:
+            triggers = self.created + self.coalesced + self.replayed
+            return {
+                'store': type(self.store).__name__,
+                'window_seconds': self.window,
+                'created': self.created,
+                'coalesced': self.coalesced,
+                'replayed': self.replayed,
+                'conflicts': self.conflicts,
+                'coalesced_ratio': (self.coalesced + self.replayed) / triggers if triggers else 0.0
+            }
+
+def create_store(backend=None):
+    """Build the coalescing store named by Config.SOS_COALESCE_STORE"""
+    backend = backend or Config.SOS_COALESCE_STORE
+    if backend == 'memory':
+        return MemoryCoalescingStore()
+    if backend == 'sqlite':
+        return SQLiteCoalescingStore(Config.SOS_COALESCE_PATH, Config.SQLITE_POOL_SIZE, Config.SQLITE_TIMEOUT)
+    raise ValueError(f'Unknown SOS coalescing store: {backend}')
+
+# Shared coalescer for this worker process; the store is what workers share
+coalescer = SOSCoalescer()
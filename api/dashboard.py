@@ -0,0 +1,168 @@
+import json
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta
+from config import Config
+from api.storage import get_storage
+
+FEED_STATUSES = ('active', 'resolved', 'all')
+FEED_DEFAULT_LIMIT = 200
+FEED_MAX_LIMIT = 1000
+
+def parse_feed_args(args):
+    """Parse status and limit, raising ValueError with the client error"""
+    status = args.get('status', 'active')
+    if status not in FEED_STATUSES:
+        raise ValueError('status must be active, resolved or all')
+    
+    try:
+        limit = int(args.get('limit', FEED_DEFAULT_LIMIT))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= FEED_MAX_LIMIT:
+        raise ValueError(f'limit must be between 1 and {FEED_MAX_LIMIT}')
+    return status, limit
+
+class ActiveAlertsMirror:
+    """In-process copy of the active_alerts collection for the responder dashboard
+
+    Storage pushes every change to the collection through
+    watch_active_alerts, so a dashboard refresh is served from memory
+    without querying storage. Each change bumps ``version``; rendered feeds
+    are cached per version and their ETag is the version, so an unchanged
+    refresh is a 304. Resolved alerts are dropped once they are older than
+    ``retention`` seconds, even before storage expires them.
+    """
+    
+    def __init__(self, retention=None, storage=None):
+        self.retention = Config.ACTIVE_ALERTS_RETENTION if retention is None else retention
+        self._storage = storage
+        # Reentrant: a watch may deliver its first snapshot before returning
+        self._lock = threading.RLock()
+        self._pid = None
+        self._listeners = []
+        self._reset()
+    
+    def _reset(self):
+        self._watch = None
+        self._entries = {}
+        self._feeds = {}
+        self._oldest_resolved = None
+        # Part of every ETag, so tags from another process or start never match
+        self._epoch = uuid.uuid4().hex[:8]
+        self.version = 0
+        self.synced = False
+        self.updated_at = None
+        self.changes = 0
+        self.resets = 0
+    
+    def start(self):
+        """Subscribe to active_alerts; a no-op if this process already has"""
+        with self._lock:
+            if self._pid == os.getpid() and self._watch is not None:
+                return self
+            # Watch threads do not survive a fork, so a child starts over
+            self._reset()
+            self._pid = os.getpid()
+            storage = self._storage or get_storage()
+            self._watch = storage.watch_active_alerts(self._apply)
+        return self
+    
+    def add_listener(self, listener):
+        """Also pass every change the watch delivers to listener(changes, reset)"""
+        if listener not in self._listeners:
+            self._listeners.append(listener)
+    
+    def stop(self):
+        with self._lock:
+            watch, self._watch = self._watch, None
+        if watch is not None:
+            watch.unsubscribe()
+    
+    def _apply(self, changes, reset):
+        for listener in self._listeners:
+            listener(changes, reset)
+        
+        with self._lock:
+            entries = {} if reset else dict(self._entries)
+            for alert_id, entry in changes:
+                if entry is None:
+                    entries.pop(alert_id, None)
+                else:
+                    # Who was notified is for the alert streams, not the dashboard
+                    entries[alert_id] = dict(
+                        {key: value for key, value in entry.items() if key != 'family_notified'},
+                        alert_id=alert_id
+                    )
+            
+            self.synced = True
+            self.resets += bool(reset)
+            self.changes += len(changes)
+            # A reload that found nothing new keeps the version, and the ETag
+            if entries == self._entries:
+                return
+            self._set_entries(entries)
+    
+    def _set_entries(self, entries):
+        self._entries = entries
+        self._feeds = {}
+        self.version += 1
+        self.updated_at = datetime.utcnow().isoformat()
+        resolved = [entry['resolved_at'] for entry in entries.values()
+                    if entry.get('status') == 'resolved' and entry.get('resolved_at')]
+        self._oldest_resolved = min(resolved) if resolved else None
+    
+    def _prune(self):
+        """Drop resolved entries past retention; called with the lock held"""
+        cutoff = (datetime.utcnow() - timedelta(seconds=self.retention)).isoformat()
+        if self._oldest_resolved is None or self._oldest_resolved >= cutoff:
+            return
+        self._set_entries({
+            alert_id: entry for alert_id, entry in self._entries.items()
+            if entry.get('status') != 'resolved' or (entry.get('resolved_at') or '') >= cutoff
+        })
+    
+    def feed(self, status='active', limit=FEED_DEFAULT_LIMIT):
+        """Return (etag, JSON body) of the dashboard feed, oldest open alert first"""
+        self.start()
+        with self._lock:
+            self._prune()
+            key = (status, limit)
+            cached = self._feeds.get(key)
+            if cached is None:
+                cached = self._feeds[key] = (f'"{self._epoch}-{self.version}"', self._render(status, limit))
+            return cached
+    
+    def _render(self, status, limit):
+        counts = {'active': 0, 'resolved': 0}
+        alerts = []
+        for entry in self._entries.values():
+            entry_status = entry.get('status')
+            if entry_status in counts:
+                counts[entry_status] += 1
+            if status == 'all' or entry_status == status:
+                alerts.append(entry)
+        alerts.sort(key=lambda entry: entry.get('triggered_at') or '')
+        
+        return json.dumps({
+            'success': True,
+            'synced': self.synced,
+            'updated_at': self.updated_at,
+            'counts': counts,
+            'alerts': alerts[:limit],
+            'total_alerts': len(alerts)
+        }).encode('utf-8')
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'synced': self.synced,
+                'version': self.version,
+                'entries': len(self._entries),
+                'changes': self.changes,
+                'resets': self.resets,
+                'updated_at': self.updated_at
+            }
+
+active_alerts = ActiveAlertsMirror()
@@ -0,0 +1,181 @@
+import itertools
+import json
+import queue
+import threading
+import time
+from collections import deque
+from config import Config
+from api.geo import public_geo
+
+def alert_state(alert):
+    """What a stream shows of an alert, to tell a new change from one already published"""
+    return (alert.get('status'), alert.get('location'), public_geo(alert.get('geo')))
+
+class Subscription:
+    """One SSE connection's view of the hub"""
+    
+    def __init__(self, user_id, queue_size):
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.overflowed = False
+    
+    def offer(self, event):
+        """Queue an event; a full queue marks the subscriber for disconnect"""
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+    
+    def wants(self, event):
+        """Whether the event is for this connection's user"""
+        return self.user_id in event['recipients']
+
+class AlertHub:
+    """Per-process pub/sub for SOS alert events
+
+    ``trigger_sos`` and ``resolve_sos_alert`` publish here and each SSE
+    connection receives the events of the alerts sent to its user: their
+    own and those whose ``family_notified`` lists them, the same people
+    who are notified by SMS and email. Recent events are
+    kept in a ring buffer so reconnecting clients can resume from their
+    ``Last-Event-ID``.
+
+    Subscribers and the buffer live in one worker process. Alerts raised
+    in other workers and on other hosts arrive through ``apply_changes``,
+    fed by the active_alerts watch, once they reach storage.
+    """
+    
+    def __init__(self, history_size=None, max_connections=None, queue_size=100):
+        self.max_connections = max_connections or Config.SSE_MAX_CONNECTIONS
+        self.queue_size = queue_size
+        self._history = deque(maxlen=history_size or Config.SSE_HISTORY_SIZE)
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        # Start from wall-clock milliseconds so IDs keep increasing across restarts
+        self._ids = itertools.count(int(time.time() * 1000))
+        # alert_state of every alert published, and the alerts in the watch's last reload
+        self._seen = {}
+        self._listed = set()
+        self._synced = False
+        self.published = 0
+        self.mirrored = 0
+        self.rejected = 0
+    
+    def publish(self, event_type, alert_id, alert):
+        """Send an alert event to its owner and the family members it notified"""
+        with self._lock:
+            event = {
+                'id': next(self._ids),
+                'event': event_type,
+                'recipients': frozenset([alert['user_id'], *(alert.get('family_notified') or [])]),
+                'data': {
+                    'alert_id': alert_id,
+                    'user_id': alert['user_id'],
+                    'username': alert.get('user_details', {}).get('username'),
+                    'status': alert.get('status'),
+                    'location': alert.get('location'),
+                    'geo': public_geo(alert.get('geo')),
+                    'message': alert.get('message'),
+                    'triggered_at': alert.get('triggered_at'),
+                    'resolved_at': alert.get('resolved_at')
+                }
+            }
+            self._history.append(event)
+            self._seen[alert_id] = alert_state(alert)
+            self.published += 1
+            subscribers = [sub for sub in self._subscribers if sub.wants(event)]
+        
+        for subscription in subscribers:
+            subscription.offer(event)
+        return event
+    
+    def apply_changes(self, changes, reset):
+        """Publish alerts changed by other workers, from (alert_id, active_alerts entry) pairs
+
+        An entry in the state this hub last published is skipped, so alerts
+        raised in this worker are not sent twice. The first snapshot only
+        records what is already there.
+        """
+        events = []
+        with self._lock:
+            initial, self._synced = not self._synced, True
+            present = {alert_id for alert_id, entry in changes if entry is not None}
+            gone = self._listed - present if reset else {alert_id for alert_id, entry in changes if entry is None}
+            for alert_id in gone:
+                self._seen.pop(alert_id, None)
+            self._listed = present if reset else (self._listed - gone) | present
+            
+            for alert_id, entry in changes:
+                if entry is None:
+                    continue
+                state = alert_state(entry)
+                known = self._seen.get(alert_id)
+                if known == state:
+                    continue
+                self._seen[alert_id] = state
+                if initial:
+                    continue
+                if entry.get('status') == 'resolved':
+                    event_type = 'sos_resolved'
+                else:
+                    event_type = 'sos_triggered' if known is None else 'sos_updated'
+                events.append((event_type, alert_id, entry))
+        
+        for event_type, alert_id, entry in events:
+            self.publish(event_type, alert_id, entry)
+        with self._lock:
+            self.mirrored += len(events)
+    
+    def subscribe(self, user_id, last_event_id=None):
+        """Register a subscriber, or return None if the worker is at its connection cap
+
+        Buffered events newer than ``last_event_id`` are replayed first.
+        """
+        subscription = Subscription(user_id, self.queue_size)
+        with self._lock:
+            if len(self._subscribers) >= self.max_connections:
+                self.rejected += 1
+                return None
+            self._subscribers.add(subscription)
+            if last_event_id is not None:
+                for event in self._history:
+                    if event['id'] > last_event_id and subscription.wants(event):
+                        subscription.offer(event)
+        return subscription
+    
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'connections': len(self._subscribers),
+                'max_connections': self.max_connections,
+                'buffered_events': len(self._history),
+                'published': self.published,
+                'mirrored': self.mirrored,
+                'rejected': self.rejected
+            }
+
+def format_event(event):
+    """Encode an event in the text/event-stream wire format"""
+    return f"id: {event['id']}\nevent: {event['event']}\ndata: {json.dumps(event['data'])}\n\n"
+
+def stream_events(hub, subscription, heartbeat=None):
+    """Yield SSE frames for a subscription, with heartbeats while idle"""
+    heartbeat = heartbeat or Config.SSE_HEARTBEAT_SECONDS
+    try:
+        yield f"retry: {Config.SSE_RETRY_MS}\n\n"
+        while not subscription.overflowed:
+            try:
+                event = subscription.queue.get(timeout=heartbeat)
+            except queue.Empty:
+                yield ": heartbeat\n\n"
+                continue
+            yield format_event(event)
+    finally:
+        hub.unsubscribe(subscription)
+
+# Shared hub for this worker process
+alert_hub = AlertHub()
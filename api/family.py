@@ -1,11 +1,24 @@
-from flask import Blueprint, request, jsonify
-import firebase_admin
-from firebase_admin import firestore
+from flask import Blueprint, request, jsonify, g
 from datetime import datetime
+from api.storage import get_storage
+from api.users import get_user, get_users, load_users, invalidate_user
+from api.sessions import issue_token, require_session
 
 family_bp = Blueprint('family', __name__)
 
+def incoming_member(member_data, family_members):
+    """A user who lists the caller, and whether the caller lists them back"""
+    return {
+        'user_id': member_data['user_id'],
+        'username': member_data['username'],
+        'email': member_data['email'],
+        'mobile_number': member_data['mobile_number'],
+        'is_active': member_data.get('is_active', True),
+        'reciprocal': member_data['user_id'] in family_members
+    }
+
 @family_bp.route('/@<user_id>/add_family', methods=['POST'])
+@require_session
 def add_family_member(user_id):
     """Add a family member to user's family list"""
     try:
@@ -19,31 +32,28 @@ def add_family_member(user_id):
         
         family_member_id = data['family_member_id']
         
-        # Initialize Firestore client
-        db = firestore.client()
+        # Get storage backend
+        storage = get_storage()
         
-        # Check if user exists
-        user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
+        # Check that both users exist in one batched read
+        users = load_users([user_id, family_member_id], storage=storage)
+        user_data = users.get(user_id)
         
-        if not user_doc.exists:
+        if user_data is None:
             return jsonify({
                 'success': False,
                 'error': 'User not found'
             }), 404
         
-        # Check if family member exists
-        family_member_ref = db.collection('users').document(family_member_id)
-        family_member_doc = family_member_ref.get()
+        family_member_data = users.get(family_member_id)
         
-        if not family_member_doc.exists:
+        if family_member_data is None:
             return jsonify({
                 'success': False,
                 'error': 'Family member not found'
             }), 404
         
-        # Get current user data
-        user_data = user_doc.to_dict()
+        # Get current family list
         family_members = user_data.get('family_members', [])
         
         # Check if family member is already added
@@ -53,17 +63,18 @@ def add_family_member(user_id):
                 'error': 'Family member already added'
             }), 409
         
-        # Add family member to the list
-        family_members.append(family_member_id)
-        
-        # Update user document
-        user_ref.update({
-            'family_members': family_members,
-            'updated_at': datetime.utcnow().isoformat()
-        })
+        # Link atomically; concurrent adds merge instead of overwriting each
+        # other, and the optional reverse link is written in the same commit
+        reciprocal = bool(data.get('reciprocal'))
+        family_version = storage.add_family_member(
+            user_id, family_member_id,
+            reciprocal=reciprocal,
+            updated_at=datetime.utcnow().isoformat()
+        )
         
-        # Get family member details for response
-        family_member_data = family_member_doc.to_dict()
+        invalidate_user(user_id)
+        if reciprocal:
+            invalidate_user(family_member_id)
         
         return jsonify({
             'success': True,
@@ -75,7 +86,10 @@ def add_family_member(user_id):
                 'email': family_member_data['email'],
                 'mobile_number': family_member_data['mobile_number']
             },
-            'total_family_members': len(family_members)
+            'total_family_members': len(family_members) + 1,
+            'reciprocal': reciprocal,
+            # Carries the new family_version to every worker's cache check
+            'token': issue_token(user_id, family_version)
         }), 200
         
     except Exception as e:
@@ -85,40 +99,34 @@ def add_family_member(user_id):
         }), 500
 
 @family_bp.route('/@<user_id>/family', methods=['GET'])
+@require_session
 def get_family_members(user_id):
     """Get all family members for a user"""
     try:
-        # Initialize Firestore client
-        db = firestore.client()
+        # Get storage backend
+        storage = get_storage()
         
-        # Get user data
-        user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
+        # Get user data, re-read if the token has seen a newer family list
+        user_data = get_user(user_id, storage=storage, family_version=g.session.family_version)
         
-        if not user_doc.exists:
+        if user_data is None:
             return jsonify({
                 'success': False,
                 'error': 'User not found'
             }), 404
         
-        user_data = user_doc.to_dict()
         family_member_ids = user_data.get('family_members', [])
         
-        # Get family member details
+        # Get family member details in a single batched read
         family_members = []
-        for member_id in family_member_ids:
-            member_ref = db.collection('users').document(member_id)
-            member_doc = member_ref.get()
-            
-            if member_doc.exists:
-                member_data = member_doc.to_dict()
-                family_members.append({
-                    'user_id': member_id,
-                    'username': member_data['username'],
-                    'email': member_data['email'],
-                    'mobile_number': member_data['mobile_number'],
-                    'is_active': member_data.get('is_active', True)
-                })
+        for member_data in get_users(family_member_ids, storage=storage):
+            family_members.append({
+                'user_id': member_data['user_id'],
+                'username': member_data['username'],
+                'email': member_data['email'],
+                'mobile_number': member_data['mobile_number'],
+                'is_active': member_data.get('is_active', True)
+            })
         
         return jsonify({
             'success': True,
@@ -133,7 +141,46 @@ def get_family_members(user_id):
             'error': f'Failed to get family members: {str(e)}'
         }), 500
 
+@family_bp.route('/@<user_id>/family/incoming', methods=['GET'])
+@require_session
+def get_incoming_family(user_id):
+    """Get the users who list this user as a family member"""
+    try:
+        # Get storage backend
+        storage = get_storage()
+        
+        # Get user data, re-read if the token has seen a newer family list
+        user_data = get_user(user_id, storage=storage, family_version=g.session.family_version)
+        
+        if user_data is None:
+            return jsonify({
+                'success': False,
+                'error': 'User not found'
+            }), 404
+        
+        # One read of the reverse family index, then the profiles in a
+        # single batched read
+        family_members = set(user_data.get('family_members', []))
+        listed_by = [
+            incoming_member(member_data, family_members)
+            for member_data in get_users(storage.get_listed_by(user_id), storage=storage)
+        ]
+        
+        return jsonify({
+            'success': True,
+            'user_id': user_id,
+            'listed_by': listed_by,
+            'total_count': len(listed_by)
+        }), 200
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to get incoming family members: {str(e)}'
+        }), 500
+
 @family_bp.route('/@<user_id>/remove_family', methods=['POST'])
+@require_session
 def remove_family_member(user_id):
     """Remove a family member from user's family list"""
     try:
@@ -147,20 +194,18 @@ def remove_family_member(user_id):
         
         family_member_id = data['family_member_id']
         
-        # Initialize Firestore client
-        db = firestore.client()
+        # Get storage backend
+        storage = get_storage()
         
-        # Get user data
-        user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
+        # Get current user data
+        user_data = load_users([user_id], storage=storage).get(user_id)
         
-        if not user_doc.exists:
+        if user_data is None:
             return jsonify({
                 'success': False,
                 'error': 'User not found'
             }), 404
         
-        user_data = user_doc.to_dict()
         family_members = user_data.get('family_members', [])
         
         # Check if family member exists in the list
@@ -170,21 +215,26 @@ def remove_family_member(user_id):
                 'error': 'Family member not found in your family list'
             }), 404
         
-        # Remove family member from the list
-        family_members.remove(family_member_id)
+        # Unlink atomically, together with the optional reverse link
+        reciprocal = bool(data.get('reciprocal'))
+        family_version = storage.remove_family_member(
+            user_id, family_member_id,
+            reciprocal=reciprocal,
+            updated_at=datetime.utcnow().isoformat()
+        )
         
-        # Update user document
-        user_ref.update({
-            'family_members': family_members,
-            'updated_at': datetime.utcnow().isoformat()
-        })
+        invalidate_user(user_id)
+        if reciprocal:
+            invalidate_user(family_member_id)
         
         return jsonify({
             'success': True,
             'message': 'Family member removed successfully',
             'user_id': user_id,
             'removed_member_id': family_member_id,
-            'total_family_members': len(family_members)
+            'total_family_members': len(family_members) - 1,
+            'reciprocal': reciprocal,
+            'token': issue_token(user_id, family_version)
         }), 200
         
     except Exception as e:
@@ -0,0 +1,281 @@
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from api.background import PerProcess
+from api.breaker import backend_breaker
+from api.metrics import latency_summary
+from api.notifications import dispatcher
+from api.storage import get_storage
+from config import Config
+
+logger = logging.getLogger('sangam.fanout')
+
+# Inbox entries per commit: a Firestore batch holds 500 writes, one of them the shard's progress
+MAX_BATCH_ENTRIES = 499
+
+# Seconds a paused worker waits before checking the SOS path again
+YIELD_WAIT = 0.05
+
+class RateLimiter:
+    """Token bucket allowing ``rate`` units a second, in bursts of up to ``burst``
+
+    A rate of 0 or less does not limit.
+    """
+    
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def delay(self, count):
+        """Take ``count`` units and return the seconds to wait before using them"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= count
+            return max(0.0, -self._tokens / self.rate)
+
+class BroadcastFanout:
+    """Deliver zone broadcasts to their recipients' inboxes, one leased shard at a time
+
+    A broadcast is split into shards, each covering a range of the zone's
+    slots (see api.storage.base.ZONE_SLOTS). Every process running the
+    fan-out thread claims the open shard whose lease ran out longest ago, so
+    a broadcast's shards spread over all workers, and a shard whose worker
+    died is claimed again once its lease runs out. A shard is read
+    ``batch_size`` users at a time in (zone_slot, user_id) order, and each
+    batch's inbox entries commit with the shard's cursor and a renewed
+    lease, so the next owner resumes after the last batch written.
+
+    The thread writes at most ``rate`` inbox entries a second and pauses
+    while more than ``yield_depth`` SOS notifications wait in the
+    dispatcher or the SOS path's circuit breaker is not closed, so a
+    broadcast never takes capacity an SOS alert needs. A worker paused past
+    its lease may see its shard claimed by another: batches only commit
+    while their worker holds the lease, so its next batch is dropped and
+    the new owner resumes after the last one committed.
+    """
+    
+    def __init__(self, rate=None, batch_size=None, lease_seconds=None, interval=None, yield_depth=None,
+                 storage=None):
+        self.rate = Config.BROADCAST_RATE if rate is None else rate
+        self.batch_size = min(batch_size or Config.BROADCAST_BATCH_SIZE, MAX_BATCH_ENTRIES)
+        self.lease_seconds = lease_seconds or Config.BROADCAST_LEASE_SECONDS
+        self.interval = interval or Config.BROADCAST_POLL_INTERVAL
+        self.yield_depth = Config.BROADCAST_YIELD_QUEUE_DEPTH if yield_depth is None else yield_depth
+        self._storage = storage
+        self._limiter = RateLimiter(self.rate)
+        
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._process = PerProcess(self._lock)
+        # (pid, owner ID) of the process holding this worker's leases
+        self._owner = None
+        
+        self.shards_claimed = 0
+        self.shards_done = 0
+        self.leases_lost = 0
+        self.delivered = 0
+        self.batches = 0
+        self.failed_runs = 0
+        self.paused_seconds = 0.0
+        self.throttled_seconds = 0.0
+        self.current = None
+        self._latencies = deque(maxlen=1000)
+    
+    @property
+    def storage(self):
+        return self._storage or get_storage()
+    
+    @property
+    def owner(self):
+        """The ID this worker's leases are held under, new in every process"""
+        if self._owner is None or self._owner[0] != os.getpid():
+            self._owner = (os.getpid(), f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}')
+        return self._owner[1]
+    
+    def run_once(self, max_shards=0):
+        """Claim and deliver open shards until none is left or ``max_shards`` are done (0 for all)
+
+        Returns the shards claimed and inbox entries written.
+        """
+        counts = {'shards': 0, 'delivered': 0}
+        while not max_shards or counts['shards'] < max_shards:
+            if self._stopped.is_set():
+                break
+            now = time.time()
+            shard = self.storage.claim_broadcast_shard(self.owner, now + self.lease_seconds, now)
+            if shard is None:
+                break
+            with self._lock:
+                self.shards_claimed += 1
+            counts['shards'] += 1
+            counts['delivered'] += self.deliver_shard(shard)
+        return counts
+    
+    def deliver_shard(self, shard):
+        """Write a claimed shard's remaining inbox entries and return how many were written"""
+        storage = self.storage
+        broadcast_id, number = shard['broadcast_id'], shard['shard']
+        cursor = tuple(shard['cursor']) if shard['cursor'] else None
+        delivered, batches = shard['delivered'], shard['batches']
+        with self._lock:
+            self.current = {'broadcast_id': broadcast_id, 'shard': number, 'delivered': delivered}
+        
+        try:
+            while True:
+                self._yield_to_sos()
+                if self._stopped.is_set():
+                    self._release(broadcast_id, number)
+                    return delivered - shard['delivered']
+                
+                started = time.perf_counter()
+                users = storage.list_zone_users(shard['zone'], shard['slots'], self.batch_size, cursor)
+                wait = self._limiter.delay(len(users))
+                if wait:
+                    self._stopped.wait(wait)
+                
+                done = len(users) < self.batch_size
+                next_cursor = users[-1] if users else cursor
+                updated_at = datetime.utcnow().isoformat()
+                progress = {
+                    'cursor': list(next_cursor) if next_cursor else None,
+                    'delivered': delivered + len(users),
+                    'batches': batches + 1,
+                    'lease_until': time.time() + self.lease_seconds,
+                    'updated_at': updated_at
+                }
+                if done:
+                    progress.update(status='done', owner=None, finished_at=updated_at)
+                if not storage.deliver_broadcast_batch(
+                    broadcast_id, number, self.owner, [(user_id, shard['entry']) for _, user_id in users], progress
+                ):
+                    # Claimed by another worker after the lease ran out; it
+                    # resumes after the last batch committed here
+                    logger.warning('Lost the lease on broadcast shard %s/%s', broadcast_id, number)
+                    with self._lock:
+                        self.leases_lost += 1
+                    return delivered - shard['delivered']
+                cursor = next_cursor
+                delivered += len(users)
+                batches += 1
+                
+                with self._lock:
+                    self._latencies.append(time.perf_counter() - started - wait)
+                    self.throttled_seconds += wait
+                    self.delivered += len(users)
+                    self.batches += 1
+                    self.current['delivered'] = delivered
+                    if done:
+                        self.shards_done += 1
+                if done:
+                    return delivered - shard['delivered']
+        except Exception:
+            # Let the next run retry the batch rather than wait out the lease
+            self._release(broadcast_id, number)
+            raise
+        finally:
+            with self._lock:
+                self.current = None
+    
+    def _release(self, broadcast_id, number):
+        """Hand a shard back now rather than when its lease runs out"""
+        try:
+            self.storage.deliver_broadcast_batch(broadcast_id, number, self.owner, [], {
+                'owner': None,
+                'lease_until': time.time()
+            })
+        except Exception as e:
+            logger.warning('Could not release broadcast shard %s/%s: %s', broadcast_id, number, e)
+    
+    def _yield_to_sos(self):
+        """Wait while SOS notifications are backed up or the SOS path's breaker is not closed"""
+        paused = None
+        while not self._stopped.is_set() and (
+            dispatcher.backlog() > self.yield_depth or backend_breaker.state != 'closed'
+        ):
+            paused = paused or time.monotonic()
+            self._stopped.wait(YIELD_WAIT)
+        if paused:
+            with self._lock:
+                self.paused_seconds += time.monotonic() - paused
+    
+    def wake(self):
+        """Look for shards now instead of at the next poll"""
+        self._wake.set()
+    
+    def start(self):
+        """Start delivering broadcast shards in this process"""
+        self._ensure_started()
+        return self
+    
+    def _ensure_started(self):
+        self._process.start(self._start_thread)
+    
+    def _start_thread(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='broadcast-fanout', daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                counts = self.run_once()
+                if counts['shards']:
+                    logger.info('Delivered %d broadcast shards, %d inbox entries',
+                                counts['shards'], counts['delivered'])
+            except Exception:
+                with self._lock:
+                    self.failed_runs += 1
+                logger.exception('Broadcast fan-out error')
+            self._wake.wait(self.interval)
+            self._wake.clear()
+    
+    def shutdown(self, timeout=5):
+        """Stop the fan-out thread, handing its shard back after the current batch"""
+        if not self._process.started:
+            return
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._process.stopped()
+    
+    def stats(self):
+        """Get shard and delivery counters, time paused for SOS traffic or throttled, and batch latency percentiles"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                'running': self._process.started,
+                'shards_claimed': self.shards_claimed,
+                'shards_done': self.shards_done,
+                'leases_lost': self.leases_lost,
+                'delivered': self.delivered,
+                'batches': self.batches,
+                'failed_runs': self.failed_runs,
+                'paused_for_sos_seconds': self.paused_seconds,
+                'throttled_seconds': self.throttled_seconds,
+                'current_shard': dict(self.current) if self.current else None,
+                'rate_per_second': self.rate,
+                'batch_size': self.batch_size,
+                'lease_seconds': self.lease_seconds
+            }
+        
+        stats['batch_latency_seconds'] = latency_summary(latencies)
+        return stats
+
+# Fan-out worker for this process; started by warm_up when BROADCAST_FANOUT_ENABLED
+fanout = BroadcastFanout()
+atexit.register(fanout.shutdown)
@@ -0,0 +1,135 @@
+import math
+
+# Geohash alphabet (base 32 without a, i, l, o)
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Precision of the geohash stored on each alert (about 5 m cells)
+GEOHASH_PRECISION = 9
+
+# Prefix lengths each alert is indexed under, from about 156 km down to 150 m
+# cells. A nearby search uses the finest length that covers its area in at
+# most MAX_SEARCH_CELLS cells (Firestore's array-contains-any limit).
+INDEX_PRECISIONS = (3, 4, 5, 6, 7)
+MAX_SEARCH_CELLS = 30
+
+EARTH_RADIUS_M = 6371008.8
+METERS_PER_DEGREE_LAT = 111320.0
+
+def encode(lat, lon, precision=GEOHASH_PRECISION):
+    """Geohash of a point"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        value, bounds = (lon, lon_range) if even else (lat, lat_range)
+        mid = (bounds[0] + bounds[1]) / 2
+        bits <<= 1
+        if value >= mid:
+            bits |= 1
+            bounds[0] = mid
+        else:
+            bounds[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(chars)
+
+def cell_size(precision):
+    """(height, width) in degrees of a geohash cell"""
+    bits = 5 * precision
+    return 180.0 / 2 ** (bits // 2), 360.0 / 2 ** ((bits + 1) // 2)
+
+def distance_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+def radius_bbox(lat, lon, radius_m):
+    """(south, west, north, east) box around a circle"""
+    dlat = radius_m / METERS_PER_DEGREE_LAT
+    dlon = radius_m / (METERS_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 1e-6))
+    return max(lat - dlat, -90.0), max(lon - dlon, -180.0), min(lat + dlat, 90.0), min(lon + dlon, 180.0)
+
+def _steps(low, high, step):
+    values = []
+    value = low
+    while value < high:
+        values.append(value)
+        value += step
+    values.append(high)
+    return values
+
+def covering_cells(bbox):
+    """Geohash prefixes, all of one INDEX_PRECISIONS length, that cover a box
+
+    Raises ValueError if even the coarsest length needs more than
+    MAX_SEARCH_CELLS cells.
+    """
+    south, west, north, east = bbox
+    for precision in reversed(INDEX_PRECISIONS):
+        height, width = cell_size(precision)
+        rows = math.floor(north / height) - math.floor(south / height) + 1
+        columns = math.floor(east / width) - math.floor(west / width) + 1
+        if rows * columns > MAX_SEARCH_CELLS:
+            continue
+        # One point per row and column of cells, plus the far edges
+        return sorted({
+            encode(lat, lon, precision)
+            for lat in _steps(south, north, height)
+            for lon in _steps(west, east, width)
+        })
+    raise ValueError('Search area is too large')
+
+def in_bbox(lat, lon, bbox):
+    south, west, north, east = bbox
+    return south <= lat <= north and west <= lon <= east
+
+def _coordinate(data, field, low, high):
+    try:
+        value = float(data[field])
+    except (TypeError, ValueError):
+        raise ValueError(f'{field} must be a number')
+    if not low <= value <= high:
+        raise ValueError(f'{field} must be between {low} and {high}')
+    return value
+
+def parse_geo(data):
+    """Structured position from ``lat``, ``lon`` and optional ``accuracy`` (metres)
+
+    Returns None when the request has no coordinates and raises ValueError
+    with the client error when they are invalid. The position carries its
+    geohash and the prefixes it is indexed under.
+    """
+    if data.get('lat') is None and data.get('lon') is None:
+        return None
+    if data.get('lat') is None or data.get('lon') is None:
+        raise ValueError('lat and lon must be sent together')
+    
+    lat = _coordinate(data, 'lat', -90.0, 90.0)
+    lon = _coordinate(data, 'lon', -180.0, 180.0)
+    geo = {'lat': lat, 'lon': lon}
+    if data.get('accuracy') is not None:
+        geo['accuracy'] = _coordinate(data, 'accuracy', 0.0, 1e7)
+    
+    geohash = encode(lat, lon)
+    geo['geohash'] = geohash
+    geo['cells'] = [geohash[:precision] for precision in INDEX_PRECISIONS]
+    return geo
+
+def public_geo(geo):
+    """An alert's position as shown to clients, without the index prefixes"""
+    if not geo:
+        return None
+    return {key: value for key, value in geo.items() if key != 'cells'}
+
+def location_label(geo):
+    """Readable location for an alert sent with coordinates but no place name"""
+    return f"{geo['lat']:.5f},{geo['lon']:.5f}"
@@ -0,0 +1,512 @@
+import atexit
+import copy
+import fcntl
+import glob
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from api.background import PerProcess
+from api.breaker import NOT_FOUND_ERRORS, backend_breaker
+from api.metrics import latency_summary
+from api.storage import get_storage
+from api.storage.base import new_alert_id
+from config import Config
+
+logger = logging.getLogger('sangam.journal')
+
+# Alert writes the journal records, each applied as storage.<op>(alert_id, *args)
+OPERATIONS = ('create_alert', 'append_alert_update', 'set_delivery_status', 'resolve_alert')
+
+# Errors storage raises for a write to an alert it does not have; the
+# breaker does not count them, so waiting for such an alert never opens it
+MISSING_ALERT_ERRORS = NOT_FOUND_ERRORS
+
+class AlertJournal:
+    """Write-ahead journal that acknowledges SOS writes before storage has them
+
+    Each write is appended to this worker's journal file in ``directory``
+    and fsynced, and the request returns. A replicator thread applies the
+    journaled writes to storage, each alert's in order: new alerts go in
+    create_alerts batches, carrying the delivery statuses recorded while
+    they waited, every call goes through the backend circuit breaker, and a
+    failed batch is retried with exponential backoff. Ack
+    lines record which writes storage has, and the file is truncated once
+    it has all of them.
+
+    Alert IDs are chosen when the alert is journaled, and every operation
+    is idempotent, so replaying a write storage already has is harmless.
+    That is what happens at startup: journals left by workers that died
+    (their file lock is free) are adopted and replayed.
+
+    Until an alert's writes reach storage, get_alert serves it from memory.
+    With ``enabled`` off every method writes straight to storage, the
+    ``storage`` passed in if any.
+
+    An alert journaled with ``details_pending`` was raised while storage
+    was down. Before it is sent, ``backfill(alert_id, alert)`` is called
+    through the breaker to fill it in with fill_pending_alert; failing, it
+    is retried with the batch.
+    """
+    
+    # Seconds the writes to an alert storage does not have are retried
+    # before they are dropped
+    MISSING_ALERT_GRACE = 300
+    
+    def __init__(self, directory=None, enabled=None, max_batch=None, retry_min=None, retry_max=None,
+                 storage=None, breaker=None):
+        self.directory = directory or Config.SOS_JOURNAL_DIR
+        self.enabled = Config.SOS_JOURNAL_ENABLED if enabled is None else enabled
+        self.max_batch = max_batch or Config.SOS_JOURNAL_MAX_BATCH
+        self.retry_min = retry_min or Config.SOS_JOURNAL_RETRY_MIN
+        self.retry_max = retry_max or Config.SOS_JOURNAL_RETRY_MAX
+        self._storage = storage
+        self.breaker = breaker or backend_breaker
+        self.backfill = None
+        
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._apply_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._fd = None
+        self._process = PerProcess(self._lock)
+        self._reset()
+    
+    def _reset(self):
+        self.path = None
+        self._thread = None
+        # Journaled records not yet in storage by seq, oldest first
+        self._pending = {}
+        # Pending create_alert records by alert ID
+        self._creates = {}
+        self._pending_by_alert = Counter()
+        # Alerts created through the journal that still have pending writes
+        self._views = {}
+        self._seq = 0
+        self._written = 0
+        self._synced = 0
+        self._failures = 0
+        self._retry_at = 0
+        # Alert IDs whose writes wait for the alert to reach storage, and until when
+        self._blocked = {}
+        self.retry_delay = 0
+        
+        self.appended = 0
+        self.replicated = 0
+        self.dropped = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.fsyncs = 0
+        self.adopted = 0
+        self._append_latencies = deque(maxlen=1000)
+        self._lag = deque(maxlen=1000)
+    
+    @property
+    def storage(self):
+        return self._storage or get_storage()
+    
+    def start(self):
+        """Open this worker's journal, adopt orphaned ones and start replicating"""
+        self._ensure_started()
+        return self
+    
+    def _ensure_started(self):
+        if not self._process.start(self._open):
+            return
+        self._adopt_orphans()
+        self._thread = threading.Thread(target=self._run, name='sos-journal', daemon=True)
+        self._thread.start()
+    
+    def _open(self):
+        # A forked child shares the parent's file and lock; it opens its own
+        if self._fd is not None:
+            os.close(self._fd)
+        self._reset()
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f'journal-{os.getpid()}-{uuid.uuid4().hex[:8]}.log')
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._stopped.clear()
+    
+    def _adopt_orphans(self):
+        """Take over the pending writes of journals whose worker has exited"""
+        for path in sorted(glob.glob(os.path.join(self.directory, 'journal-*.log'))):
+            if path == self.path:
+                continue
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except FileNotFoundError:
+                continue
+            try:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Its worker is alive
+                    continue
+                if os.fstat(fd).st_nlink == 0:
+                    # Adopted by another worker while we waited to open it
+                    continue
+                with os.fdopen(os.dup(fd), 'r', encoding='utf-8') as journal_file:
+                    records = read_pending(journal_file)
+                if records:
+                    self._append([(record['op'], record['alert_id'], record['args']) for record in records])
+                    self.adopted += len(records)
+                    logger.info('Adopted %d journaled SOS writes from %s', len(records), path)
+                os.unlink(path)
+            finally:
+                os.close(fd)
+    
+    def _append(self, entries):
+        """Journal (op, alert_id, args) entries and return once they are on disk"""
+        started = time.perf_counter()
+        with self._lock:
+            lines = []
+            for op, alert_id, args in entries:
+                self._seq += 1
+                record = {'seq': self._seq, 'op': op, 'alert_id': alert_id, 'args': args}
+                line = json.dumps(record, separators=(',', ':'))
+                lines.append(line)
+                # Track a decoded copy, so callers changing their dicts later cannot alter it
+                self._track(json.loads(line))
+            os.write(self._fd, ('\n'.join(lines) + '\n').encode('utf-8'))
+            self._written = seq = self._seq
+            self.appended += len(entries)
+        
+        # Group commit: one fsync covers every record written before it
+        with self._sync_lock:
+            if self._synced < seq:
+                written = self._written
+                os.fsync(self._fd)
+                self._synced = written
+                self.fsyncs += 1
+        
+        with self._lock:
+            self._append_latencies.append(time.perf_counter() - started)
+        self._wake.set()
+    
+    def _track(self, record):
+        """Queue a record for replication and apply it to its alert's view; called with the lock held"""
+        record['journaled_at'] = time.monotonic()
+        self._pending[record['seq']] = record
+        alert_id = record['alert_id']
+        self._pending_by_alert[alert_id] += 1
+        args = record['args']
+        
+        if record['op'] == 'create_alert':
+            self._creates[alert_id] = record
+            self._views[alert_id] = copy.deepcopy(args[0])
+            return
+        if record['op'] == 'set_delivery_status' and alert_id in self._creates:
+            # Held for the alert's create, which writes it when it is sent
+            self._creates[alert_id].setdefault('deliveries', []).append(record)
+            record['held'] = True
+        view = self._views.get(alert_id)
+        if view is None:
+            return
+        if record['op'] == 'append_alert_update':
+            update = args[0]
+            view.setdefault('location_updates', []).append(update)
+            view['last_triggered_at'] = update['triggered_at']
+            for field in ('location', 'geo'):
+                if field in update:
+                    view[field] = update[field]
+        elif record['op'] == 'set_delivery_status':
+            member_id, channel, delivery = args
+            view.setdefault('delivery', {}).setdefault(member_id, {})[channel] = delivery
+        elif record['op'] == 'resolve_alert':
+            view.update(status=args[0]['status'], resolved_at=args[0]['resolved_at'])
+    
+    def create_alert(self, alert, storage=None):
+        """Journal a new alert and return its ID"""
+        if not self.enabled:
+            return (storage or self.storage).create_alert(alert)
+        self._ensure_started()
+        alert_id = new_alert_id()
+        self._append([('create_alert', alert_id, [alert])])
+        return alert_id
+    
+    def append_alert_update(self, alert_id, update, storage=None):
+        if not self.enabled:
+            return (storage or self.storage).append_alert_update(alert_id, update)
+        self._ensure_started()
+        self._append([('append_alert_update', alert_id, [update])])
+    
+    def resolve_alert(self, alert_id, alert, storage=None):
+        if not self.enabled:
+            return (storage or self.storage).resolve_alert(alert_id, alert)
+        self._ensure_started()
+        self._append([('resolve_alert', alert_id, [alert])])
+    
+    def set_delivery_status(self, alert_id, member_id, channel, delivery, storage=None):
+        """Record a delivery; journaled only while the alert has writes pending"""
+        if self.enabled and self.is_pending(alert_id):
+            self._append([('set_delivery_status', alert_id, [member_id, channel, delivery])])
+            return
+        (storage or self.storage).set_delivery_status(alert_id, member_id, channel, delivery)
+    
+    def is_pending(self, alert_id):
+        """Whether writes to the alert are journaled but not yet in storage"""
+        return alert_id in self._pending_by_alert
+    
+    def pending_alert(self, alert_id):
+        """The alert as journaled, if it was created here and storage does not have all of it yet"""
+        with self._lock:
+            view = self._views.get(alert_id)
+            return copy.deepcopy(view) if view is not None else None
+    
+    def fill_pending_alert(self, alert_id, fields):
+        """Add fields to a journaled alert not yet sent to storage and clear its ``details_pending``"""
+        with self._lock:
+            record = self._creates.get(alert_id)
+            if record is not None:
+                record['args'][0].update(copy.deepcopy(fields))
+                record['args'][0].pop('details_pending', None)
+            view = self._views.get(alert_id)
+            if view is not None:
+                view.update(copy.deepcopy(fields))
+                view.pop('details_pending', None)
+    
+    def get_alert(self, alert_id, storage=None):
+        """Get an alert from the journal if it is pending, else from storage"""
+        alert = self.pending_alert(alert_id)
+        if alert is not None:
+            return alert
+        return (storage or self.storage).get_alert(alert_id)
+    
+    def _run(self):
+        while True:
+            self._wake.wait(self._wait_seconds())
+            if self._stopped.is_set():
+                return
+            self._wake.clear()
+            try:
+                self.replicate()
+            except Exception:
+                logger.exception('SOS journal replication error')
+    
+    def _wait_seconds(self):
+        """Seconds until the replicator has something to try, or None to wait for a write"""
+        with self._lock:
+            if not self._pending:
+                return None
+            now = time.monotonic()
+            retries = [at for at in [self._retry_at, *self._blocked.values()] if at > now]
+            return min(retries) - now if retries else 0
+    
+    def _next_batch(self):
+        """The oldest records that can be applied together; called with the lock held
+
+        Pending new alerts go in one batch. Records of an alert that is
+        waiting to appear in storage are skipped, keeping each alert's
+        writes in order without holding up the others.
+        """
+        now = time.monotonic()
+        eligible = (
+            record for record in self._pending.values()
+            if not record.get('held') and self._blocked.get(record['alert_id'], 0) <= now
+        )
+        first = next(eligible, None)
+        if first is None or first['op'] != 'create_alert':
+            return [first] if first else []
+        batch = [first]
+        for record in eligible:
+            if len(batch) >= self.max_batch:
+                break
+            if record['op'] == 'create_alert':
+                batch.append(record)
+        for create in batch:
+            # Write the deliveries recorded so far with the alert
+            for record in create.get('deliveries', []):
+                if not record.get('folded'):
+                    member_id, channel, delivery = record['args']
+                    create['args'][0].setdefault('delivery', {}).setdefault(member_id, {})[channel] = delivery
+                    record['folded'] = True
+        return batch
+    
+    def replicate(self, force=False):
+        """Apply pending records to storage until none are left or storage fails
+
+        Unless ``force`` is set, does nothing while backing off after a
+        failure. Returns whether the journal is drained.
+        """
+        with self._apply_lock:
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        return True
+                    if not force and self._retry_at > time.monotonic():
+                        return False
+                    batch = self._next_batch()
+                if not batch:
+                    return False
+                
+                try:
+                    self._apply(batch)
+                except MISSING_ALERT_ERRORS as e:
+                    self._missing(batch[0], e)
+                    continue
+                except Exception as e:
+                    self._backoff(batch, e)
+                    return False
+                self._done(batch)
+    
+    def _apply(self, batch):
+        op = batch[0]['op']
+        if op == 'create_alert':
+            for record in batch:
+                if self.backfill and record['args'][0].get('details_pending'):
+                    self.breaker.call(self.backfill, record['alert_id'], copy.deepcopy(record['args'][0]))
+            self.breaker.call(self.storage.create_alerts, {
+                record['alert_id']: record['args'][0] for record in batch
+            })
+        else:
+            self.breaker.call(getattr(self.storage, op), batch[0]['alert_id'], *batch[0]['args'])
+    
+    def _retry_delay(self, failures):
+        delay = min(self.retry_max, self.retry_min * 2 ** (failures - 1))
+        return delay * random.uniform(0.5, 1)
+    
+    def _backoff(self, batch, error):
+        with self._lock:
+            self.failed_batches += 1
+            self._failures += 1
+            self.retry_delay = self._retry_delay(self._failures)
+            self._retry_at = time.monotonic() + self.retry_delay
+        logger.warning('Failed to replicate %d journaled SOS writes, retrying in %.1fs: %s',
+                       len(batch), self.retry_delay, error)
+    
+    def _missing(self, record, error):
+        """Hold back the writes to an alert storage does not have yet
+
+        The alert may still be in another worker's journal. Its writes are
+        retried with backoff and dropped after MISSING_ALERT_GRACE seconds.
+        """
+        alert_id = record['alert_id']
+        now = time.monotonic()
+        if now - record['journaled_at'] > self.MISSING_ALERT_GRACE:
+            logger.error('Dropped journaled %s for missing alert %s: %s', record['op'], alert_id, error)
+            self._done([record], dropped=True)
+            return
+        with self._lock:
+            record['attempts'] = record.get('attempts', 0) + 1
+            self._blocked[alert_id] = now + self._retry_delay(record['attempts'])
+    
+    def _done(self, batch, dropped=False):
+        now = time.monotonic()
+        with self._lock:
+            done = []
+            for record in batch:
+                done.append(record)
+                for delivery in record.get('deliveries', []):
+                    if delivery.get('folded'):
+                        done.append(delivery)
+                    else:
+                        # Recorded while the create was being sent: write it on its own
+                        delivery['held'] = False
+            batch = done
+            for record in batch:
+                del self._pending[record['seq']]
+                alert_id = record['alert_id']
+                if record['op'] == 'create_alert':
+                    self._creates.pop(alert_id, None)
+                self._blocked.pop(alert_id, None)
+                self._pending_by_alert[alert_id] -= 1
+                if self._pending_by_alert[alert_id] <= 0:
+                    del self._pending_by_alert[alert_id]
+                    self._views.pop(alert_id, None)
+                self._lag.append(now - record['journaled_at'])
+            if dropped:
+                self.dropped += len(batch)
+            else:
+                self.replicated += len(batch)
+                self.batches += 1
+                self._failures = 0
+                self.retry_delay = 0
+                self._retry_at = 0
+            
+            if self._pending:
+                # Not fsynced: a lost ack only means replaying idempotent writes
+                acked = [record['seq'] for record in batch]
+                os.write(self._fd, json.dumps({'acked': acked}, separators=(',', ':')).encode('utf-8') + b'\n')
+            else:
+                # Drained: nothing in the file is needed any more
+                os.ftruncate(self._fd, 0)
+    
+    def flush(self):
+        """Try to replicate everything journaled now, even while backing off
+
+        Returns whether the journal is drained.
+        """
+        if not self._process.started:
+            return True
+        return self.replicate(force=True)
+    
+    def shutdown(self, timeout=5):
+        """Stop replicating after one last attempt; what is left is replayed on the next start"""
+        if not self._process.started:
+            return 0
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self.replicate(force=True)
+        with self._lock:
+            left = len(self._pending)
+            if not left:
+                os.unlink(self.path)
+            # Closing releases the lock, so a live worker can adopt what is left
+            os.close(self._fd)
+            self._fd = None
+            self._process.stopped()
+        return left
+    
+    def stats(self):
+        """Get journal depth, replication counters and append and lag percentiles"""
+        with self._lock:
+            appends = sorted(self._append_latencies)
+            lag = sorted(self._lag)
+            stats = {
+                'enabled': self.enabled,
+                'pending': len(self._pending),
+                'pending_alerts': len(self._pending_by_alert),
+                'waiting_alerts': len(self._blocked),
+                'appended': self.appended,
+                'replicated': self.replicated,
+                'dropped': self.dropped,
+                'adopted': self.adopted,
+                'batches': self.batches,
+                'failed_batches': self.failed_batches,
+                'fsyncs': self.fsyncs,
+                'retry_delay_seconds': self.retry_delay
+            }
+        
+        stats['append_latency_seconds'] = latency_summary(appends)
+        stats['replication_lag_seconds'] = latency_summary(lag)
+        stats['breaker'] = self.breaker.stats()
+        return stats
+
+def read_pending(journal_file):
+    """Records in a journal file that were never acked, in order
+
+    A line cut short by a crash during the write is skipped.
+    """
+    records = []
+    acked = set()
+    for line in journal_file:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if 'acked' in record:
+            acked.update(record['acked'])
+        elif record.get('op') in OPERATIONS:
+            records.append(record)
+    return [record for record in records if record['seq'] not in acked]
+
+# SOS write-ahead journal for this worker process
+journal = AlertJournal()
+atexit.register(journal.shutdown)
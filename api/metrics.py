@@ -0,0 +1,255 @@
+import os
+import time
+from contextvars import ContextVar
+from flask import g, request, has_request_context
+from flask.json.provider import DefaultJSONProvider
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+)
+from prometheus_client import multiprocess
+
+# Multi-worker gunicorn: set PROMETHEUS_MULTIPROC_DIR to a shared, empty
+# directory so every worker's samples are merged at scrape time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CALL_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+REQUEST_LATENCY = Histogram(
+    'sangam_request_duration_seconds', 'HTTP request latency',
+    ['endpoint', 'method', 'status'], buckets=LATENCY_BUCKETS
+)
+REQUEST_BACKEND_SECONDS = Histogram(
+    'sangam_request_backend_seconds', 'Time a request spent waiting on the storage backend',
+    ['endpoint'], buckets=LATENCY_BUCKETS
+)
+REQUEST_SERIALIZATION_SECONDS = Histogram(
+    'sangam_request_serialization_seconds', 'Time a request spent serializing JSON',
+    ['endpoint'], buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+)
+REQUEST_BACKEND_CALLS = Histogram(
+    'sangam_request_backend_calls', 'Storage backend calls made by one request',
+    ['endpoint', 'kind'], buckets=CALL_COUNT_BUCKETS
+)
+BACKEND_CALLS = Counter(
+    'sangam_backend_calls_total', 'Storage backend calls',
+    ['backend', 'operation', 'kind']
+)
+BACKEND_LATENCY = Histogram(
+    'sangam_backend_call_duration_seconds', 'Storage backend call latency',
+    ['backend', 'operation'], buckets=LATENCY_BUCKETS
+)
+STARTUP_SECONDS = Gauge(
+    'sangam_startup_phase_seconds', 'Worker startup time per phase (slowest worker)',
+    ['phase'], multiprocess_mode='max'
+)
+
+# Storage operations by the kind of backend work they do
+BACKEND_OPERATIONS = {
+    'get_user': 'read',
+    'get_users': 'read',
+    'get_listed_by': 'read',
+    'get_alert': 'read',
+    'find_emails': 'read',
+    'list_alerts': 'query',
+    'list_alerts_in_cells': 'query',
+    'list_active_alerts': 'query',
+    'list_member_alerts': 'query',
+    'list_revocations': 'query',
+    'scan_users': 'query',
+    'scan_alerts': 'query',
+    'list_resolved_alerts': 'query',
+    'list_archived_alerts': 'query',
+    'has_archived_alerts': 'query',
+    'list_zone_users': 'query',
+    'get_broadcast': 'query',
+    'list_inbox': 'query',
+    'list_pending_deliveries': 'query',
+    'create_user': 'write',
+    'create_users': 'write',
+    'update_user': 'write',
+    'update_users': 'write',
+    'add_family_member': 'write',
+    'remove_family_member': 'write',
+    'revoke_sessions': 'write',
+    'create_alert': 'write',
+    'create_alerts': 'write',
+    'import_alerts': 'write',
+    'update_alert': 'write',
+    'append_alert_update': 'write',
+    'resolve_alert': 'write',
+    'set_delivery_status': 'write',
+    'claim_delivery': 'write',
+    'archive_alerts': 'write',
+    'create_broadcast': 'write',
+    'claim_broadcast_shard': 'write',
+    'deliver_broadcast_batch': 'write'
+}
+BACKEND_KINDS = ('read', 'write', 'query')
+
+# Per-request counters for the ASGI app, which has no flask.g
+_async_request = ContextVar('sangam_async_request', default=None)
+
+def _record_backend_call(backend, operation, kind, elapsed):
+    BACKEND_CALLS.labels(backend, operation, kind).inc()
+    BACKEND_LATENCY.labels(backend, operation).observe(elapsed)
+    if has_request_context() and 'metrics_calls' in g:
+        g.metrics_calls[kind] += 1
+        g.metrics_backend_seconds += elapsed
+        return
+    state = _async_request.get()
+    if state is not None:
+        state['calls'][kind] += 1
+        state['backend_seconds'] += elapsed
+
+def _instrumented(operation, kind):
+    def call(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return getattr(self._storage, operation)(*args, **kwargs)
+        finally:
+            _record_backend_call(self.name, operation, kind, time.perf_counter() - start)
+    call.__name__ = operation
+    return call
+
+class InstrumentedStorage:
+    """Storage wrapper that counts and times every backend call
+
+    Operations missing from BACKEND_OPERATIONS pass through untimed.
+    """
+    
+    def __init__(self, storage):
+        self._storage = storage
+        self.name = storage.name
+    
+    def __getattr__(self, name):
+        return getattr(self._storage, name)
+
+for _operation, _kind in BACKEND_OPERATIONS.items():
+    setattr(InstrumentedStorage, _operation, _instrumented(_operation, _kind))
+
+def _instrumented_async(operation, kind):
+    async def call(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await getattr(self._storage, operation)(*args, **kwargs)
+        finally:
+            _record_backend_call(self.name, operation, kind, time.perf_counter() - start)
+    call.__name__ = operation
+    return call
+
+class InstrumentedAsyncStorage(InstrumentedStorage):
+    """AsyncStorage wrapper that counts and times every backend call"""
+
+for _operation, _kind in BACKEND_OPERATIONS.items():
+    setattr(InstrumentedAsyncStorage, _operation, _instrumented_async(_operation, _kind))
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """JSON provider that records serialization time for the current request"""
+    
+    def dumps(self, obj, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            if has_request_context() and 'metrics_calls' in g:
+                g.metrics_serialization_seconds += time.perf_counter() - start
+
+def _endpoint_label():
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+def _start_request():
+    g.metrics_start = time.perf_counter()
+    g.metrics_calls = dict.fromkeys(BACKEND_KINDS, 0)
+    g.metrics_backend_seconds = 0.0
+    g.metrics_serialization_seconds = 0.0
+
+def _finish_request(response):
+    if 'metrics_start' not in g:
+        return response
+    endpoint = _endpoint_label()
+    REQUEST_LATENCY.labels(endpoint, request.method, response.status_code).observe(
+        time.perf_counter() - g.metrics_start
+    )
+    REQUEST_BACKEND_SECONDS.labels(endpoint).observe(g.metrics_backend_seconds)
+    REQUEST_SERIALIZATION_SECONDS.labels(endpoint).observe(g.metrics_serialization_seconds)
+    for kind, count in g.metrics_calls.items():
+        REQUEST_BACKEND_CALLS.labels(endpoint, kind).observe(count)
+    return response
+
+def init_metrics(app):
+    """Install request timing hooks and the timed JSON provider on an app"""
+    app.json = TimedJSONProvider(app)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+def instrument_storage(storage):
+    """Wrap a storage backend so its calls are counted and timed"""
+    if isinstance(storage, InstrumentedStorage):
+        return storage
+    return InstrumentedStorage(storage)
+
+def instrument_async_storage(storage):
+    """Wrap an async storage backend so its calls are counted and timed"""
+    if isinstance(storage, InstrumentedAsyncStorage):
+        return storage
+    return InstrumentedAsyncStorage(storage)
+
+def start_async_request():
+    """Start timing an ASGI request; pass the returned token to finish_async_request"""
+    state = {
+        'start': time.perf_counter(),
+        'calls': dict.fromkeys(BACKEND_KINDS, 0),
+        'backend_seconds': 0.0,
+        'serialization_seconds': 0.0
+    }
+    return _async_request.set(state)
+
+def add_serialization_time(elapsed):
+    """Add JSON encoding time to the current ASGI request"""
+    state = _async_request.get()
+    if state is not None:
+        state['serialization_seconds'] += elapsed
+
+def finish_async_request(token, endpoint, method, status):
+    """Record an ASGI request's metrics under a Flask-style route label"""
+    state = _async_request.get()
+    _async_request.reset(token)
+    if endpoint is None:
+        return
+    REQUEST_LATENCY.labels(endpoint, method, status).observe(time.perf_counter() - state['start'])
+    REQUEST_BACKEND_SECONDS.labels(endpoint).observe(state['backend_seconds'])
+    REQUEST_SERIALIZATION_SECONDS.labels(endpoint).observe(state['serialization_seconds'])
+    for kind, count in state['calls'].items():
+        REQUEST_BACKEND_CALLS.labels(endpoint, kind).observe(count)
+
+def latency_summary(latencies):
+    """p50, p95, p99 and max of sorted latencies, all None when there are none"""
+    def percentile(p):
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+    
+    return {
+        'p50': percentile(0.50),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'max': latencies[-1] if latencies else None
+    }
+
+def record_startup(timings):
+    """Publish per-phase startup times"""
+    for phase, seconds in timings.items():
+        STARTUP_SECONDS.labels(phase).set(seconds)
+
+def render_metrics():
+    """Render all metrics in the Prometheus text format
+
+    Returns a (body, content_type) pair. In multiprocess mode the samples
+    of every worker are merged.
+    """
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,374 @@
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timedelta
+from api.background import PerProcess
+from api.journal import journal
+from api.metrics import latency_summary
+from config import Config
+
+logger = logging.getLogger('sangam.notifications')
+
+# Member and caller fields a recovered job carries, as the SOS path stores them
+CONTACT_FIELDS = ('user_id', 'username', 'email', 'mobile_number')
+
+class NotificationChannel:
+    """Base class for a notification channel (SMS, email, push, ...)
+
+    Subclasses override ``send`` and raise on failure; the dispatcher retries
+    failed sends with exponential backoff.
+    """
+    
+    name = None
+    contact_field = None
+    
+    def __init__(self, name=None, max_concurrency=None):
+        self.name = name or self.name
+        self.max_concurrency = max_concurrency or Config.NOTIFY_CHANNEL_CONCURRENCY
+    
+    def address(self, member):
+        """Get the member's address on this channel, or None to skip it"""
+        if self.contact_field is None:
+            return member.get('user_id')
+        return member.get(self.contact_field)
+    
+    def send(self, address, member, alert):
+        raise NotImplementedError
+
+class LoggingChannel(NotificationChannel):
+    """Local stand-in that logs the notification instead of sending it"""
+    
+    def __init__(self, name, contact_field=None, max_concurrency=None):
+        super().__init__(name, max_concurrency)
+        self.contact_field = contact_field
+    
+    def send(self, address, member, alert):
+        user = alert['user_details']
+        logger.info(
+            "[%s] SOS from %s (%s) to %s <%s>: %s @ %s",
+            self.name, user['username'], user['user_id'],
+            member.get('username', member['user_id']), address,
+            alert.get('message'), alert.get('location')
+        )
+
+def default_channels():
+    """Logging stand-ins for the channels named in Config.NOTIFY_CHANNELS"""
+    contact_fields = {'sms': 'mobile_number', 'email': 'email', 'push': None}
+    return [
+        LoggingChannel(name, contact_fields.get(name))
+        for name in Config.NOTIFY_CHANNELS
+    ]
+
+class NotificationJob:
+    """One notification to one family member on one channel"""
+    
+    def __init__(self, alert_id, alert, member, channel):
+        self.alert_id = alert_id
+        self.alert = alert
+        self.member = member
+        self.channel = channel
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+
+class NotificationDispatcher:
+    """Background fan-out of SOS notifications
+
+    Jobs run on a bounded pool of worker threads. Each channel has its own
+    concurrency limit so one slow provider cannot occupy every worker, and
+    failed sends are retried with exponential backoff. Delivery status is
+    written back onto the alert under ``delivery.<member_id>.<channel>``.
+
+    Threads start lazily on first use, so each forked gunicorn worker gets
+    its own pool.
+
+    Jobs live only in this process. A delivery still ``pending`` in storage
+    ``recover_after`` seconds after it was queued is taken to be lost with
+    the worker that queued it: one thread per worker looks for such
+    deliveries every ``recover_interval`` seconds, claims each in storage so
+    only one worker re-sends it, and queues it again. Resolved alerts are
+    not recovered.
+    """
+    
+    def __init__(self, channels=None, workers=None, max_attempts=None,
+                 backoff_base=None, backoff_max=None, recover_after=None, recover_interval=None):
+        self.channels = {}
+        for channel in channels if channels is not None else default_channels():
+            self.register_channel(channel)
+        self.workers = workers or Config.NOTIFY_WORKERS
+        self.max_attempts = max_attempts or Config.NOTIFY_MAX_ATTEMPTS
+        self.backoff_base = backoff_base if backoff_base is not None else Config.NOTIFY_BACKOFF_BASE
+        self.backoff_max = backoff_max if backoff_max is not None else Config.NOTIFY_BACKOFF_MAX
+        self.recover_after = recover_after if recover_after is not None else Config.NOTIFY_RECOVERY_AFTER
+        self.recover_interval = recover_interval if recover_interval is not None else Config.NOTIFY_RECOVERY_INTERVAL
+        
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._retry_ready = threading.Condition(self._lock)
+        self._stop_ready = threading.Condition(self._lock)
+        self._retries = []
+        self._sequence = itertools.count()
+        self._in_flight = defaultdict(int)
+        self._waiting = defaultdict(deque)
+        # (alert_id, member_id, channel) of every job queued here and not finished
+        self._queued = set()
+        self._threads = []
+        self._process = PerProcess(self._lock)
+        self._stopping = False
+        
+        self._counters = defaultdict(int)
+        self._latencies = deque(maxlen=1000)
+    
+    def register_channel(self, channel):
+        """Add or replace a channel by name"""
+        self.channels[channel.name] = channel
+    
+    def dispatch(self, alert_id, alert, members):
+        """Queue one job per member per channel and return the job count"""
+        jobs = [
+            NotificationJob(alert_id, alert, member, channel)
+            for member in members for channel in self.channels.values()
+        ]
+        self._enqueue(jobs)
+        return len(jobs)
+    
+    def initial_status(self, members):
+        """Pending delivery status to store on a new alert"""
+        queued_at = datetime.utcnow().isoformat()
+        return {
+            member['user_id']: {
+                name: {'status': 'pending', 'attempts': 0, 'queued_at': queued_at} for name in self.channels
+            }
+            for member in members
+        }
+    
+    def recover(self, storage=None):
+        """Queue again the deliveries left pending by a worker that stopped and return the job count"""
+        storage = storage or journal.storage
+        now = datetime.utcnow()
+        cutoff = (now - timedelta(seconds=self.recover_after)).isoformat()
+        jobs = []
+        for alert_id, alert in storage.list_pending_deliveries():
+            # Statuses this worker journaled have not reached storage yet
+            if journal.is_pending(alert_id):
+                continue
+            with self._lock:
+                lost = [
+                    (member_id, name, delivery)
+                    for member_id, channels in alert.get('delivery', {}).items()
+                    for name, delivery in channels.items()
+                    if delivery.get('status') == 'pending' and name in self.channels
+                    and (alert_id, member_id, name) not in self._queued
+                    and (delivery.get('recovered_at') or delivery.get('queued_at') or alert['triggered_at']) < cutoff
+                ]
+            if not lost:
+                continue
+            
+            users = storage.get_users([alert['user_id']] + [member_id for member_id, _, _ in lost])
+            alert = dict(alert, user_details=contact(alert['user_id'], users.get(alert['user_id'])))
+            for member_id, name, delivery in lost:
+                # Another worker may be recovering the same delivery
+                if not storage.claim_delivery(alert_id, member_id, name, delivery,
+                                              dict(delivery, recovered_at=now.isoformat())):
+                    continue
+                jobs.append(NotificationJob(alert_id, alert, contact(member_id, users.get(member_id)),
+                                            self.channels[name]))
+        
+        if jobs:
+            logger.warning('Recovered %d pending notifications', len(jobs))
+            self._enqueue(jobs)
+            with self._lock:
+                self._counters['recovered'] += len(jobs)
+        return len(jobs)
+    
+    def stats(self):
+        """Get queue depth, delivery counters and latency percentiles"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = dict(self._counters)
+            stats.update({
+                'queue_depth': self._queue.qsize(),
+                'retry_depth': len(self._retries),
+                'waiting_for_channel': sum(len(jobs) for jobs in self._waiting.values()),
+                'in_flight': dict(self._in_flight),
+                'workers': self.workers,
+                'channels': list(self.channels)
+            })
+        
+        stats['delivery_latency_seconds'] = latency_summary(latencies)
+        return stats
+    
+    def backlog(self):
+        """Jobs queued, parked at a channel's concurrency limit or waiting to be retried"""
+        with self._lock:
+            return self._queue.qsize() + len(self._retries) + sum(len(jobs) for jobs in self._waiting.values())
+    
+    def wait_idle(self, timeout=None):
+        """Block until every queued job has finished; used by benchmarks"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                idle = (self._queue.unfinished_tasks == 0 and not self._retries
+                        and not any(self._waiting.values()))
+            if idle:
+                return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+    
+    def shutdown(self, timeout=5):
+        """Stop the worker threads after draining the queue"""
+        self.wait_idle(timeout)
+        with self._lock:
+            self._stopping = True
+            self._retry_ready.notify_all()
+            self._stop_ready.notify_all()
+        for _ in range(self.workers):
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        self._process.stopped()
+        self._stopping = False
+    
+    def start(self):
+        """Start the worker threads now instead of on the first dispatch"""
+        self._ensure_started()
+    
+    def _ensure_started(self):
+        self._process.start(self._start_threads)
+    
+    def _start_threads(self):
+        self._threads = [
+            threading.Thread(target=self._work, name=f'sos-notify-{i}', daemon=True)
+            for i in range(self.workers)
+        ]
+        self._threads.append(threading.Thread(target=self._schedule_retries, name='sos-notify-retry', daemon=True))
+        if self.recover_after and self.recover_interval:
+            self._threads.append(threading.Thread(target=self._recover_lost, name='sos-notify-recover', daemon=True))
+        for thread in self._threads:
+            thread.start()
+    
+    def _enqueue(self, jobs):
+        self._ensure_started()
+        with self._lock:
+            for job in jobs:
+                self._queued.add((job.alert_id, job.member['user_id'], job.channel.name))
+            self._counters['queued'] += len(jobs)
+        for job in jobs:
+            self._queue.put(job)
+    
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                self._run(job)
+            except Exception:
+                logger.exception('Notification worker error')
+            finally:
+                self._queue.task_done()
+    
+    def _run(self, job):
+        channel = job.channel
+        
+        # Park the job if the channel is at its concurrency limit
+        with self._lock:
+            if self._in_flight[channel.name] >= channel.max_concurrency:
+                self._waiting[channel.name].append(job)
+                return
+            self._in_flight[channel.name] += 1
+        
+        try:
+            self._deliver(job)
+        finally:
+            with self._lock:
+                self._in_flight[channel.name] -= 1
+                if self._waiting[channel.name]:
+                    self._queue.put(self._waiting[channel.name].popleft())
+    
+    def _deliver(self, job):
+        address = job.channel.address(job.member)
+        if not address:
+            self._record(job, 'skipped')
+            return
+        
+        job.attempts += 1
+        try:
+            job.channel.send(address, job.member, job.alert)
+        except Exception as e:
+            if job.attempts >= self.max_attempts:
+                logger.error('Giving up on %s to %s for alert %s: %s',
+                             job.channel.name, job.member['user_id'], job.alert_id, e)
+                self._record(job, 'failed', str(e))
+            else:
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (job.attempts - 1))
+                with self._lock:
+                    self._counters['retried'] += 1
+                    heapq.heappush(self._retries, (time.monotonic() + delay, next(self._sequence), job))
+                    self._retry_ready.notify()
+            return
+        
+        self._record(job, 'sent')
+    
+    def _schedule_retries(self):
+        with self._lock:
+            while not self._stopping:
+                if not self._retries:
+                    self._retry_ready.wait()
+                    continue
+                ready_at = self._retries[0][0]
+                now = time.monotonic()
+                if ready_at > now:
+                    self._retry_ready.wait(ready_at - now)
+                    continue
+                _, _, job = heapq.heappop(self._retries)
+                self._queue.put(job)
+    
+    def _recover_lost(self):
+        while True:
+            try:
+                self.recover()
+            except Exception:
+                logger.exception('Notification recovery error')
+            with self._lock:
+                if not self._stopping:
+                    self._stop_ready.wait(self.recover_interval)
+                if self._stopping:
+                    return
+    
+    def _record(self, job, status, error=None):
+        latency = time.monotonic() - job.enqueued_at
+        with self._lock:
+            self._queued.discard((job.alert_id, job.member['user_id'], job.channel.name))
+            self._counters[status] += 1
+            if status == 'sent':
+                self._latencies.append(latency)
+        
+        delivery = {
+            'status': status,
+            'attempts': job.attempts,
+            'updated_at': datetime.utcnow().isoformat()
+        }
+        if error:
+            delivery['error'] = error
+        
+        try:
+            # Journaled while the alert itself is still in the journal. Written
+            # with unguarded storage: delivery writes are not on the request
+            # path and do not count towards the SOS path's circuit breaker
+            journal.set_delivery_status(job.alert_id, job.member['user_id'], job.channel.name, delivery)
+        except Exception as e:
+            logger.error('Failed to record delivery status for alert %s: %s', job.alert_id, e)
+
+def contact(user_id, user_data):
+    """A recovered job's contact details for a user, or only their ID if they are gone"""
+    user_data = user_data or {}
+    return dict({field: user_data.get(field) for field in CONTACT_FIELDS}, user_id=user_id)
+
+# Shared dispatcher for this worker process
+dispatcher = NotificationDispatcher()
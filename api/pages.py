@@ -0,0 +1,205 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+from flask import Response, request, render_template, send_from_directory, abort
+from config import Config
+
+try:
+    import brotli
+except ImportError:  # Optional: without it pages are offered as gzip only
+    brotli = None
+
+# Content encodings we precompute, in order of preference
+ENCODINGS = ('br', 'gzip')
+
+# Only text-like files shrink; images and fonts are already compressed
+COMPRESSIBLE_TYPES = ('text/', 'application/javascript', 'application/json', 'image/svg+xml')
+MIN_COMPRESS_SIZE = 512
+
+# Cache-Control for responses a browser must revalidate (pages, unversioned assets)
+REVALIDATE = 'no-cache'
+
+def compress(body, encoding):
+    """Compress a body at the highest level; this runs once per asset"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=11)
+    return gzip.compress(body, compresslevel=9, mtime=0)
+
+def parse_accept_encoding(header):
+    """Parse an Accept-Encoding header into {coding: q}"""
+    accepted = {}
+    for item in (header or '').split(','):
+        coding, _, params = item.strip().partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+    return accepted
+
+def negotiate(header, available):
+    """Pick the best available encoding the client accepts, else identity"""
+    accepted = parse_accept_encoding(header)
+    best, best_q = 'identity', 0.0
+    for encoding in ENCODINGS:
+        if encoding not in available:
+            continue
+        q = accepted.get(encoding, accepted.get('*', 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+class CompressedAsset:
+    """A response body with precomputed encodings and a strong ETag for each"""
+    
+    def __init__(self, body, mimetype):
+        self.mimetype = mimetype
+        digest = hashlib.sha256(body).hexdigest()
+        self.fingerprint = digest[:12]
+        self.variants = {'identity': body}
+        
+        if len(body) >= MIN_COMPRESS_SIZE and mimetype.startswith(COMPRESSIBLE_TYPES):
+            for encoding in ENCODINGS:
+                if encoding == 'br' and brotli is None:
+                    continue
+                compressed = compress(body, encoding)
+                if len(compressed) < len(body):
+                    self.variants[encoding] = compressed
+        
+        # Each encoding is a different byte sequence, so each gets its own strong ETag
+        self.etags = {
+            encoding: f'"{digest[:32]}"' if encoding == 'identity' else f'"{digest[:32]}-{encoding}"'
+            for encoding in self.variants
+        }
+    
+    def response(self, cache_control):
+        """Serve the variant the client accepts, or 304 if it already has it"""
+        encoding = negotiate(request.headers.get('Accept-Encoding'), self.variants)
+        headers = {
+            'ETag': self.etags[encoding],
+            'Cache-Control': cache_control,
+            'Vary': 'Accept-Encoding'
+        }
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        
+        if etag_matches(request.headers.get('If-None-Match'), self.etags[encoding]):
+            return Response(status=304, headers=headers)
+        return Response(self.variants[encoding], mimetype=self.mimetype, headers=headers)
+
+class StaticAssets:
+    """Fingerprinted, precompressed files from the static directory
+
+    Files are hashed at startup. Files up to ``max_file_size`` are also kept
+    in memory with their compressed variants. URLs from url() carry the
+    fingerprint as ``?v=``, and such requests are cached for
+    ``max_age`` seconds.
+    """
+    
+    def __init__(self, directory, max_age=None, max_file_size=None):
+        self.directory = directory
+        self.max_age = Config.STATIC_MAX_AGE if max_age is None else max_age
+        self.max_file_size = Config.STATIC_CACHE_MAX_FILE_SIZE if max_file_size is None else max_file_size
+        self.fingerprints = {}
+        self.assets = {}
+    
+    def scan(self):
+        """Hash, and where small enough load and compress, every static file"""
+        if not os.path.isdir(self.directory):
+            return self
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, self.directory).replace(os.sep, '/')
+                if os.path.getsize(path) <= self.max_file_size:
+                    with open(path, 'rb') as f:
+                        asset = CompressedAsset(f.read(), _guess_type(filename))
+                    self.assets[filename] = asset
+                    self.fingerprints[filename] = asset.fingerprint
+                else:
+                    self.fingerprints[filename] = _file_fingerprint(path)
+        return self
+    
+    def url(self, filename):
+        """URL for a static file, versioned with its content fingerprint"""
+        fingerprint = self.fingerprints.get(filename)
+        if fingerprint is None:
+            return f'/static/{filename}'
+        return f'/static/{filename}?v={fingerprint}'
+    
+    def response(self, filename):
+        """Serve a static file with caching headers and negotiated compression"""
+        fingerprint = self.fingerprints.get(filename)
+        if fingerprint is not None and request.args.get('v') == fingerprint:
+            cache_control = f'public, max-age={self.max_age}, immutable'
+        else:
+            cache_control = REVALIDATE
+        
+        asset = self.assets.get(filename)
+        if asset is None:
+            # Large or newly added file: stream it from disk with Werkzeug's ETag handling
+            response = send_from_directory(self.directory, filename, conditional=True, etag=True)
+            response.headers['Cache-Control'] = cache_control
+            return response
+        return asset.response(cache_control)
+
+class PageCache:
+    """Pages rendered once at startup and served precompressed"""
+    
+    def __init__(self, app):
+        self.app = app
+        self.pages = {}
+    
+    def render(self, templates):
+        """Render and compress each template"""
+        with self.app.test_request_context():
+            for template in templates:
+                body = render_template(template).encode('utf-8')
+                self.pages[template] = CompressedAsset(body, 'text/html')
+        return self
+    
+    def response(self, template):
+        """Serve a cached page; in debug mode re-render so template edits show up"""
+        if self.app.debug:
+            return render_template(template)
+        page = self.pages.get(template)
+        if page is None:
+            abort(404)
+        return page.response(REVALIDATE)
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    # Proxies may weaken ETags; If-None-Match uses the weak comparison
+    return etag in {tag.strip().removeprefix('W/') for tag in if_none_match.split(',')}
+
+def _guess_type(filename):
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+def _file_fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+def init_pages(app, templates):
+    """Fingerprint static files and prerender ``templates`` for an app
+
+    Templates can link assets with ``{{ static_url('path') }}``.
+    """
+    static_assets = StaticAssets(os.path.join(app.root_path, 'static')).scan()
+    app.jinja_env.globals['static_url'] = static_assets.url
+    page_cache = PageCache(app).render(templates)
+    app.extensions['static_assets'] = static_assets
+    app.extensions['page_cache'] = page_cache
+    return page_cache, static_assets
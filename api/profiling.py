@@ -0,0 +1,339 @@
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from flask import g, request
+from config import Config
+
+logger = logging.getLogger('sangam.profiling')
+
+# Request header asking for a profile of that request: "<expires>.<signature>"
+PROFILE_HEADER = 'X-Profile'
+
+# Response header naming the file the request's profile is written to
+PROFILE_FILE_HEADER = 'X-Profile-File'
+
+# Bytes of the HMAC-SHA256 kept in a profile header's signature
+SIGNATURE_SIZE = 16
+
+# Frames above Flask's dispatch (server loop, WSGI middleware) are the same in every profile
+ROOT_FUNCTION = 'full_dispatch_request'
+
+# Frames from these modules count as time waiting on the storage backend
+BACKEND_MODULES = ('api.storage.',)
+
+FORMATS = {'speedscope': '.speedscope.json', 'collapsed': '.folded'}
+
+def _sign(payload):
+    # A key derived for profile headers only, so a session token signature is never a valid one
+    key = hashlib.sha256(b'sangam-profile-header:' + Config.SECRET_KEY.encode('utf-8')).digest()
+    return hmac.new(key, payload, hashlib.sha256).hexdigest()[:SIGNATURE_SIZE * 2]
+
+def sign_profile_header(ttl=300, now=None):
+    """Sign an X-Profile header value, accepted for ``ttl`` seconds"""
+    expires = str(int((time.time() if now is None else now) + ttl))
+    return f'{expires}.{_sign(expires.encode("ascii"))}'
+
+def verify_profile_header(value, now=None):
+    """Whether an X-Profile header value carries a valid, unexpired signature"""
+    expires, _, signature = value.partition('.')
+    if not expires.isdigit() or int(expires) < (time.time() if now is None else now):
+        return False
+    return hmac.compare_digest(signature, _sign(expires.encode('ascii')))
+
+def frame_key(frame):
+    """(name, file, first line) of the function a frame runs"""
+    code = frame.f_code
+    module = frame.f_globals.get('__name__', '?')
+    return f'{module}.{code.co_qualname}', code.co_filename, code.co_firstlineno
+
+def stack_of(frame):
+    """The frame's call stack, outermost first, cut at Flask's request dispatch"""
+    stack = []
+    while frame is not None:
+        stack.append(frame_key(frame))
+        if frame.f_code.co_name == ROOT_FUNCTION:
+            break
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+class RequestProfile:
+    """Wall-clock stack samples of one thread, taken by a sampler thread every ``interval`` seconds
+
+    The request thread's stack is sampled whether it runs Python code or
+    waits on a socket, a lock or a sleep, so time blocked on a Firestore
+    call shows up under the storage call that made it, which a CPU profiler
+    would miss. Each sample is weighted by the time since the previous one.
+    Sampling stops after ``max_seconds``, for streamed responses.
+    """
+    
+    def __init__(self, thread_id, interval, max_seconds):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = datetime.utcnow()
+        self.elapsed = None
+        self._started = time.perf_counter()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        last = self._started
+        deadline = self._started + self.max_seconds
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is not None:
+                self.stacks[stack_of(frame)] += now - last
+                self.samples += 1
+            del frame
+            last = now
+            if now >= deadline:
+                break
+    
+    def stop(self):
+        """Stop sampling and return self"""
+        self._stopped.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self._started
+        return self
+    
+    def backend_seconds(self):
+        """Sampled time spent inside storage backend calls"""
+        return sum(
+            seconds for stack, seconds in self.stacks.items()
+            if any(name.startswith(BACKEND_MODULES) for name, _, _ in stack)
+        )
+    
+    def speedscope(self, name):
+        """The profile as a speedscope sampled profile (https://www.speedscope.app)"""
+        frames, index = [], {}
+        samples, weights = [], []
+        for stack, seconds in self.stacks.items():
+            sample = []
+            for key in stack:
+                if key not in index:
+                    index[key] = len(frames)
+                    frames.append({'name': key[0], 'file': key[1], 'line': key[2]})
+                sample.append(index[key])
+            samples.append(sample)
+            weights.append(seconds)
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'exporter': 'sangam',
+            'name': name,
+            'activeProfileIndex': 0,
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights
+            }]
+        }
+    
+    def collapsed(self):
+        """The profile as collapsed stacks for flamegraph.pl, weighted in microseconds"""
+        totals = Counter()
+        for stack, seconds in self.stacks.items():
+            totals[';'.join(name for name, _, _ in stack)] += seconds
+        return ''.join(
+            f'{stack} {round(seconds * 1e6)}\n'
+            for stack, seconds in sorted(totals.items()) if round(seconds * 1e6)
+        )
+
+class Profiler:
+    """Profile requests that carry a signed X-Profile header, or a ``sample_rate`` share of all requests
+
+    One request per process is profiled at a time; others asking while it
+    runs are served unprofiled and counted as busy. Profiles are written to
+    ``directory`` off the request thread, and only the newest ``max_files``
+    are kept. Nothing here runs unless init_profiling() installed the hooks.
+    """
+    
+    def __init__(self, directory=None, max_files=None, sample_rate=None, interval=None,
+                 max_seconds=None, output_format=None):
+        self.directory = directory or Config.PROFILE_DIR
+        self.max_files = Config.PROFILE_MAX_FILES if max_files is None else max_files
+        self.sample_rate = Config.PROFILE_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.interval = interval or Config.PROFILE_INTERVAL
+        self.max_seconds = max_seconds or Config.PROFILE_MAX_SECONDS
+        self.output_format = output_format or Config.PROFILE_FORMAT
+        if self.output_format not in FORMATS:
+            raise ValueError(f'Unknown profile format {self.output_format!r}, expected one of {sorted(FORMATS)}')
+        
+        self._lock = threading.Lock()
+        self._active = threading.Lock()
+        
+        self.requested_by_header = 0
+        self.sampled = 0
+        self.rejected = 0
+        self.busy = 0
+        self.written = 0
+        self.failed_writes = 0
+        self.pruned = 0
+        self._recent = deque(maxlen=20)
+    
+    def wanted(self):
+        """Whether the current request asks to be profiled"""
+        header = request.headers.get(PROFILE_HEADER)
+        if header is not None:
+            if verify_profile_header(header):
+                with self._lock:
+                    self.requested_by_header += 1
+                return True
+            with self._lock:
+                self.rejected += 1
+            return False
+        if self.sample_rate and random.random() < self.sample_rate:
+            with self._lock:
+                self.sampled += 1
+            return True
+        return False
+    
+    def start(self):
+        """Start profiling the current request, unless another one is being profiled"""
+        if not self._active.acquire(blocking=False):
+            with self._lock:
+                self.busy += 1
+            return None
+        try:
+            profile = RequestProfile(threading.get_ident(), self.interval, self.max_seconds)
+        except Exception:
+            self._active.release()
+            raise
+        endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', endpoint).strip('_')[:60] or 'root'
+        profile.file_name = (f'{profile.started_at:%Y%m%dT%H%M%S.%f}-{os.getpid()}-{request.method}-{slug}'
+                             f'{FORMATS[self.output_format]}')
+        profile.request_name = f'{request.method} {request.path}'
+        profile.endpoint = endpoint
+        profile.status = None
+        return profile
+    
+    def finish(self, profile, backend_seconds=None):
+        """Stop sampling and write the profile on a background thread"""
+        try:
+            profile.stop()
+        finally:
+            self._active.release()
+        threading.Thread(
+            target=self._write, args=(profile, backend_seconds), name='profile-writer', daemon=True
+        ).start()
+    
+    def _write(self, profile, backend_seconds):
+        summary = {
+            'file': profile.file_name,
+            'request': profile.request_name,
+            'endpoint': profile.endpoint,
+            'status': profile.status,
+            'started_at': profile.started_at.isoformat(),
+            'seconds': profile.elapsed,
+            'samples': profile.samples,
+            'sampled_backend_seconds': profile.backend_seconds(),
+            'backend_seconds': backend_seconds
+        }
+        try:
+            if self.output_format == 'speedscope':
+                name = f'{profile.request_name} -> {profile.status} in {profile.elapsed * 1000:.1f} ms'
+                body = json.dumps(profile.speedscope(name))
+            else:
+                body = profile.collapsed()
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, profile.file_name)
+            with open(path + '.tmp', 'w') as f:
+                f.write(body)
+            os.replace(path + '.tmp', path)
+            pruned = self.prune()
+        except Exception:
+            with self._lock:
+                self.failed_writes += 1
+            logger.exception('Could not write request profile %s', profile.file_name)
+            return
+        with self._lock:
+            self.written += 1
+            self.pruned += pruned
+            self._recent.append(summary)
+        logger.info('Profiled %s: %.1f ms, %.1f ms in storage calls, written to %s', profile.request_name,
+                    profile.elapsed * 1000, summary['sampled_backend_seconds'] * 1000, profile.file_name)
+    
+    def prune(self):
+        """Delete all but the newest ``max_files`` profiles in the directory and return how many went"""
+        suffixes = tuple(FORMATS.values())
+        # File names start with their UTC start time, so name order is age order across workers
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(suffixes))
+        pruned = 0
+        for name in names[:max(len(names) - self.max_files, 0)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+                pruned += 1
+            except FileNotFoundError:
+                # Another worker pruned it first
+                pass
+        return pruned
+    
+    def stats(self):
+        """Get trigger and write counters and the latest profiles written by this worker"""
+        with self._lock:
+            return {
+                'directory': os.path.abspath(self.directory),
+                'format': self.output_format,
+                'sample_rate': self.sample_rate,
+                'interval_seconds': self.interval,
+                'max_files': self.max_files,
+                'requested_by_header': self.requested_by_header,
+                'sampled': self.sampled,
+                'rejected_headers': self.rejected,
+                'busy': self.busy,
+                'written': self.written,
+                'failed_writes': self.failed_writes,
+                'pruned': self.pruned,
+                'recent': list(reversed(self._recent))
+            }
+
+def _start_profile():
+    if profiler.wanted():
+        profile = profiler.start()
+        if profile is not None:
+            g.profile = profile
+
+def _name_profile(response):
+    profile = g.get('profile')
+    if profile is not None:
+        profile.status = response.status_code
+        response.headers[PROFILE_FILE_HEADER] = profile.file_name
+    return response
+
+def _finish_profile(error=None):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        profiler.finish(profile, g.get('metrics_backend_seconds'))
+
+def init_profiling(app):
+    """Install the request profiling hooks on an app
+
+    Only called when PROFILING_ENABLED, so with profiling off requests run
+    no profiling code at all.
+    """
+    app.before_request(_start_profile)
+    app.after_request(_name_profile)
+    # Teardown runs after every after_request hook, and after a failed request too
+    app.teardown_request(_finish_profile)
+
+# Profiler for this worker, used by the hooks init_profiling installs
+profiler = Profiler()
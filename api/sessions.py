@@ -0,0 +1,272 @@
+import base64
+import functools
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from flask import g, jsonify, request
+from api.background import PerProcess
+from api.storage import get_storage
+from config import Config
+
+logger = logging.getLogger('sangam.sessions')
+
+# Bytes of the HMAC-SHA256 kept in a token's signature
+SIGNATURE_SIZE = 16
+
+# Query parameter carrying the token for clients that cannot set headers (EventSource)
+TOKEN_PARAM = 'access_token'
+
+Session = namedtuple('Session', ['user_id', 'family_version', 'issued_at', 'expires_at'])
+
+class InvalidSession(Exception):
+    """The request's session token is missing, malformed, expired or revoked"""
+    
+    status = 401
+
+class SessionMismatch(InvalidSession):
+    """The session token belongs to another user than the one in the URL"""
+    
+    status = 403
+
+class RoleRequired(InvalidSession):
+    """The session token is valid but its user may not use the endpoint"""
+    
+    status = 403
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _sign(payload):
+    # A key derived for tokens only, so no other use of SECRET_KEY can produce a token signature
+    key = hashlib.sha256(b'sangam-session-token:' + Config.SECRET_KEY.encode('utf-8')).digest()
+    return hmac.new(key, payload, hashlib.sha256).digest()[:SIGNATURE_SIZE]
+
+def _timestamp(isoformat):
+    """Epoch seconds of a naive UTC ISO timestamp"""
+    return datetime.fromisoformat(isoformat).replace(tzinfo=timezone.utc).timestamp()
+
+def issue_token(user_id, family_version=0, now=None):
+    """Sign a session token for user_id, valid for Config.SESSION_TOKEN_TTL seconds
+
+    The token carries the user's ``family_version`` at issue time, so a
+    worker whose cached profile is older can tell without a read.
+    """
+    issued_at = time.time() if now is None else now
+    payload = json.dumps({
+        'u': user_id,
+        'f': family_version,
+        'i': int(issued_at * 1000),
+        'e': int(issued_at + Config.SESSION_TOKEN_TTL)
+    }, separators=(',', ':')).encode('utf-8')
+    return f'{_b64encode(payload)}.{_b64encode(_sign(payload))}'
+
+def verify_token(token, now=None):
+    """Check a token's signature, expiry and revocation locally and return its Session
+
+    Raises InvalidSession. Never reads storage.
+    """
+    try:
+        payload, signature = (_b64decode(part) for part in token.split('.'))
+    except ValueError:
+        raise InvalidSession('Malformed session token')
+    if not hmac.compare_digest(signature, _sign(payload)):
+        raise InvalidSession('Invalid session token')
+    
+    claims = json.loads(payload)
+    session = Session(claims['u'], claims['f'], claims['i'] / 1000, claims['e'])
+    if session.expires_at <= (time.time() if now is None else now):
+        raise InvalidSession('Session token expired')
+    if revocations.is_revoked(session.user_id, session.issued_at):
+        raise InvalidSession('Session token revoked')
+    return session
+
+def request_token(authorization, query_token=None):
+    """The bearer token from an Authorization header, else from the access_token parameter"""
+    if authorization and authorization[:7].lower() == 'bearer ':
+        return authorization[7:].strip()
+    return query_token
+
+def authenticate(token, user_id):
+    """Verify a request's token and check it was issued to user_id"""
+    if not token:
+        raise InvalidSession('Session token required')
+    session = verify_token(token)
+    if session.user_id != user_id:
+        raise SessionMismatch('Session token is for another user')
+    return session
+
+def session_error(error):
+    """(payload, status, headers) for a request whose token was rejected"""
+    headers = {'WWW-Authenticate': 'Bearer'} if error.status == 401 else {}
+    return {
+        'success': False,
+        'error': str(error)
+    }, error.status, headers
+
+def require_session(view):
+    """Reject a /@<user_id>/ request without a valid token for that user
+
+    The verified Session is in ``g.session``.
+    """
+    @functools.wraps(view)
+    def wrapped(user_id, **kwargs):
+        token = request_token(request.headers.get('Authorization'), request.args.get(TOKEN_PARAM))
+        try:
+            g.session = authenticate(token, user_id)
+        except InvalidSession as e:
+            payload, status, headers = session_error(e)
+            return jsonify(payload), status, headers
+        return view(user_id, **kwargs)
+    return wrapped
+
+def is_responder(user_id):
+    """Whether the user may read other pilgrims' alerts: SOS responders and mela authorities"""
+    return user_id in Config.SOS_RESPONDERS or user_id in Config.BROADCAST_AUTHORITIES
+
+def role_session(authorization, allowed, error):
+    """Verify a bearer token of a user for whom ``allowed(user_id)`` is true
+
+    Raises InvalidSession, or RoleRequired with ``error`` for another user.
+    """
+    token = request_token(authorization)
+    if not token:
+        raise InvalidSession('Session token required')
+    session = verify_token(token)
+    if not allowed(session.user_id):
+        raise RoleRequired(error)
+    return session
+
+def require_role(allowed, error):
+    """Reject a request without a valid token of a user for whom ``allowed(user_id)`` is true
+
+    The verified Session is in ``g.session``.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapped(**kwargs):
+            try:
+                g.session = role_session(request.headers.get('Authorization'), allowed, error)
+            except InvalidSession as e:
+                payload, status, headers = session_error(e)
+                return jsonify(payload), status, headers
+            return view(**kwargs)
+        return wrapped
+    return decorator
+
+RESPONDERS_ONLY = "Only SOS responders can see other pilgrims' alerts"
+
+require_responder = require_role(is_responder, RESPONDERS_ONLY)
+
+class SessionRevocations:
+    """This worker's copy of recent session revocations
+
+    verify_token checks it on every request instead of reading storage. It
+    is loaded when the worker starts and then polls for revocations made
+    since, every ``interval`` seconds, so a logout reaches the other workers
+    within one interval and the worker that handled it at once. Revocations
+    older than the token lifetime are dropped: every token they could
+    revoke has expired.
+    """
+    
+    # Each poll re-reads this many seconds before the last one, covering
+    # clock skew between the workers that record revocations
+    OVERLAP = 30
+    
+    def __init__(self, ttl=None, interval=None, storage=None):
+        self.ttl = ttl or Config.SESSION_TOKEN_TTL
+        self.interval = interval or Config.SESSION_REVOCATION_POLL_SECONDS
+        self._storage = storage
+        self._lock = threading.Lock()
+        self._revoked = {}
+        self._since = None
+        self._stopped = threading.Event()
+        self._process = PerProcess()
+        self.polls = 0
+        self.failed_polls = 0
+        self.synced_at = None
+    
+    def start(self):
+        """Load revocations and start polling; a no-op if this process already has"""
+        self._process.start(self._start_polling)
+        return self
+    
+    def _start_polling(self):
+        # A forked child does not inherit the parent's poll thread
+        self._revoked = {}
+        self._since = (datetime.utcnow() - timedelta(seconds=self.ttl)).isoformat()
+        self._stopped = threading.Event()
+        self.poll()
+        threading.Thread(target=self._run, name='session-revocations', daemon=True).start()
+    
+    def stop(self):
+        self._stopped.set()
+    
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.poll()
+    
+    def poll(self):
+        """Pick up revocations recorded since the last poll"""
+        started = datetime.utcnow()
+        storage = self._storage or get_storage()
+        try:
+            revoked = storage.list_revocations(self._since)
+        except Exception as e:
+            self.failed_polls += 1
+            logger.warning('Failed to load session revocations: %s', e)
+            return
+        
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for user_id, revoked_at in revoked.items():
+                self._record(user_id, revoked_at)
+            self._revoked = {
+                user_id: revoked_at for user_id, revoked_at in self._revoked.items() if revoked_at > cutoff
+            }
+            self._since = (started - timedelta(seconds=self.OVERLAP)).isoformat()
+            self.polls += 1
+            self.synced_at = started.isoformat()
+    
+    def _record(self, user_id, revoked_at):
+        revoked_at = _timestamp(revoked_at)
+        if revoked_at > self._revoked.get(user_id, 0):
+            self._revoked[user_id] = revoked_at
+    
+    def record(self, user_id, revoked_at):
+        """Apply a revocation this worker just stored without waiting for the next poll"""
+        self.start()
+        with self._lock:
+            self._record(user_id, revoked_at)
+    
+    def is_revoked(self, user_id, issued_at):
+        """Whether a token issued to user_id at ``issued_at`` (epoch seconds) was revoked"""
+        self.start()
+        revoked_at = self._revoked.get(user_id)
+        return revoked_at is not None and issued_at <= revoked_at
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'revoked_users': len(self._revoked),
+                'polls': self.polls,
+                'failed_polls': self.failed_polls,
+                'synced_at': self.synced_at,
+                'interval_seconds': self.interval
+            }
+
+revocations = SessionRevocations()
+
+def revoke_sessions(user_id, storage=None):
+    """Revoke every token issued to user_id so far and return the revocation time"""
+    revoked_at = datetime.utcnow().isoformat()
+    (storage or get_storage()).revoke_sessions(user_id, revoked_at)
+    revocations.record(user_id, revoked_at)
+    return revoked_at
@@ -1,115 +1,527 @@
-from flask import Blueprint, request, jsonify
-import firebase_admin
-from firebase_admin import firestore
+from flask import Blueprint, request, jsonify, Response, stream_with_context, g
 from datetime import datetime
 import json
+import base64
+import logging
+import binascii
+from api.storage import get_storage
+from api.users import get_user, get_users, cached_user
+from api.notifications import dispatcher
+from api.events import alert_hub, stream_events
+from api.coalesce import coalescer, IdempotencyConflict
+from api.dashboard import active_alerts, parse_feed_args
+from api.pages import etag_matches
+from api.sessions import require_responder, require_session
+from api.journal import journal
+from api.breaker import BackendUnavailable, backend_breaker
+from api.archive import archive_cutoff, archive_tier
+from api.storage.base import ALERT_SCHEMA_VERSION
+from api.geo import (
+    parse_geo, public_geo, location_label, covering_cells, radius_bbox, in_bbox, distance_m
+)
 
 sos_bp = Blueprint('sos', __name__)
+logger = logging.getLogger('sangam.sos')
+
+# SOS history page sizes and the alert fields a history page reads
+HISTORY_DEFAULT_LIMIT = 20
+HISTORY_MAX_LIMIT = 100
+HISTORY_FIELDS = ['triggered_at', 'status', 'location', 'message', 'family_notified', 'geo']
+
+# Nearby search: radius in metres, page sizes and the alert fields it reads
+NEARBY_DEFAULT_RADIUS = 500
+NEARBY_MAX_RADIUS = 50000
+NEARBY_DEFAULT_LIMIT = 50
+NEARBY_MAX_LIMIT = 200
+# Fields read for the alerts a member was notified of
+FAMILY_ALERT_FIELDS = ['user_id', 'triggered_at', 'last_triggered_at', 'status', 'location', 'message', 'geo']
+NEARBY_FIELDS = ['user_id', 'triggered_at', 'last_triggered_at', 'status', 'location', 'message', 'geo']
+
+# Contact details a response fills in when asked (?expand=user,family): the
+# caller's, and the members' the alert notified
+EXPAND_OPTIONS = ('user', 'family')
+
+# Retry-After for an SOS request refused because storage is unavailable
+RETRY_AFTER_SECONDS = 1
+
+def encode_cursor(triggered_at):
+    """Encode the last alert's timestamp as an opaque page cursor"""
+    return base64.urlsafe_b64encode(triggered_at.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Decode a page cursor back to a timestamp, raising ValueError if invalid"""
+    try:
+        triggered_at = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        datetime.fromisoformat(triggered_at)
+    except (UnicodeError, binascii.Error) as e:
+        raise ValueError(str(e))
+    return triggered_at
+
+def contact_details(user_id, user_data):
+    """The contact fields an alert stores for the caller and each member"""
+    return {
+        'user_id': user_id,
+        'username': user_data['username'],
+        'email': user_data['email'],
+        'mobile_number': user_data['mobile_number']
+    }
+
+def build_alert(user_id, user_data, family_members, data, geo=None):
+    """Build a new SOS alert record from the request body and its parsed position
+
+    The alert refers to the members by ID, with the caller's
+    ``family_version`` as the version of the profile they came from.
+    ``user_details`` is kept in memory for notifications, streams and the
+    dashboard entry; storage does not store it on the alert.
+    """
+    alert = {
+        'schema_version': ALERT_SCHEMA_VERSION,
+        'user_id': user_id,
+        'triggered_at': datetime.utcnow().isoformat(),
+        'status': 'active',
+        'location': data.get('location', location_label(geo) if geo else 'Unknown'),
+        'message': data.get('message', 'Emergency SOS triggered'),
+        'family_notified': user_data.get('family_members', []),
+        'profile_version': user_data.get('family_version', 0),
+        'user_details': contact_details(user_id, user_data),
+        'delivery': dispatcher.initial_status(family_members)
+    }
+    if geo:
+        alert['geo'] = geo
+    return alert
+
+def unverified_user(user_id):
+    """The caller as this worker cached them, or a stand-in, for an alert raised while storage is down
+
+    The session token proved who the caller is. The alert is journaled
+    with ``details_pending``, and backfill_alert fills in their profile and
+    family once storage answers.
+    """
+    user_data = cached_user(user_id) or {
+        'user_id': user_id,
+        'username': None,
+        'email': None,
+        'mobile_number': None,
+        'family_members': []
+    }
+    return dict(user_data, details_pending=True)
+
+def pending_alert(user_id, user_data, data, geo=None):
+    """A new alert whose caller's profile or family could not be read; nobody is notified yet"""
+    alert = build_alert(user_id, user_data, [], data, geo)
+    alert.update(family_notified=[], details_pending=True)
+    return alert
+
+def backfill_alert(alert_id, alert):
+    """Fill in an alert journaled with ``details_pending`` and notify the caller's family
+
+    Called by the journal, through the breaker, before the alert reaches
+    storage.
+    """
+    storage = journal.storage
+    user_data = storage.get_user(alert['user_id'])
+    if user_data is None:
+        journal.fill_pending_alert(alert_id, {})
+        return
+    family_members = [
+        contact_details(member_data['user_id'], member_data)
+        for member_data in get_users(user_data.get('family_members', []), storage=storage)
+    ]
+    fields = {
+        'family_notified': user_data.get('family_members', []),
+        'profile_version': user_data.get('family_version', 0),
+        'user_details': contact_details(alert['user_id'], user_data),
+        'delivery': dispatcher.initial_status(family_members)
+    }
+    journal.fill_pending_alert(alert_id, fields)
+    
+    alert = dict(alert, **fields)
+    dispatcher.dispatch(alert_id, alert, family_members)
+    alert_hub.publish('sos_updated', alert_id, alert)
+
+# Alerts raised while storage was down are filled in before they reach it
+journal.backfill = backfill_alert
+
+# Streams hear of alerts raised in other workers through the active_alerts watch
+active_alerts.add_listener(alert_hub.apply_changes)
+
+def alert_update(data, geo=None):
+    """The update a repeated trigger or a location report adds to an active alert"""
+    update = {'triggered_at': datetime.utcnow().isoformat()}
+    for field in ('location', 'message'):
+        if data.get(field):
+            update[field] = data[field]
+    if geo:
+        update['geo'] = geo
+        update.setdefault('location', location_label(geo))
+    return update
+
+def coalesced_alert(user_id, user_data, claim, update):
+    """The active alert as published to streams after a repeated trigger"""
+    return {
+        'user_id': user_id,
+        'triggered_at': claim.triggered_at,
+        'status': 'active',
+        'location': update.get('location'),
+        'message': update.get('message'),
+        'geo': update.get('geo'),
+        'family_notified': user_data.get('family_members', []),
+        'user_details': contact_details(user_id, user_data)
+    }
+
+def with_caller(alert, user_data):
+    """Copy of an alert carrying the caller's contact details for streams, if it has none and they are known"""
+    if user_data is None or alert.get('user_details'):
+        return alert
+    return dict(alert, user_details=contact_details(alert['user_id'], user_data))
+
+def coalesced_response(user_id, claim, update):
+    """Response to a trigger that joined the user's active alert"""
+    return {
+        'success': True,
+        'message': 'SOS alert already active, update added',
+        'alert_id': claim.alert_id,
+        'user_id': user_id,
+        'triggered_at': claim.triggered_at,
+        'updated_at': update['triggered_at'],
+        'coalesced': True,
+        'notifications_queued': 0,
+        'status': 'active'
+    }
+
+def unavailable_error(error, action):
+    """(payload, status, headers) for a request that could not reach storage in time"""
+    return {
+        'success': False,
+        'error': f'{action}: {str(error)}'
+    }, 503, {'Retry-After': str(RETRY_AFTER_SECONDS)}
+
+def claim_error(error):
+    """(payload, status) for a request whose Idempotency-Key cannot be used"""
+    if isinstance(error, IdempotencyConflict):
+        return {
+            'success': False,
+            'error': 'A request with this Idempotency-Key is still in progress'
+        }, 409
+    return {
+        'success': False,
+        'error': str(error)
+    }, 400
+
+def parse_expand(args):
+    """Parse ``expand`` into a set of EXPAND_OPTIONS, raising ValueError with the client error"""
+    expand = {option.strip() for option in args.get('expand', '').split(',') if option.strip()}
+    if not expand <= set(EXPAND_OPTIONS):
+        raise ValueError('expand must be a comma-separated list of user and family')
+    return expand
+
+def expand_fields(fields, expand):
+    """The alert fields to read, plus the user IDs whose details are asked for"""
+    wanted = {'user': 'user_id', 'family': 'family_notified'}
+    return fields + [wanted[option] for option in EXPAND_OPTIONS
+                     if option in expand and wanted[option] not in fields]
+
+def expand_ids(alerts, records, expand):
+    """IDs of the users whose profiles an expanded page shows"""
+    user_ids = []
+    for alert in alerts:
+        alert_data = records[alert['alert_id']]
+        if 'user' in expand:
+            user_ids.append(alert_data['user_id'])
+        if 'family' in expand:
+            user_ids.extend(alert_data.get('family_notified', []))
+    return list(dict.fromkeys(user_ids))
+
+def fill_details(alerts, records, expand, profiles):
+    """Add the asked-for contact details to response alerts from profiles read by expand_ids"""
+    profiles = {profile['user_id']: profile for profile in profiles}
+    for alert in alerts:
+        alert_data = records[alert['alert_id']]
+        if 'user' in expand:
+            profile = profiles.get(alert_data['user_id'])
+            alert['user'] = contact_details(profile['user_id'], profile) if profile else None
+        if 'family' in expand:
+            alert['family_members'] = [
+                contact_details(member_id, profiles[member_id])
+                for member_id in alert_data.get('family_notified', []) if member_id in profiles
+            ]
+    return alerts
+
+def expand_alerts(alerts, sos_alerts, expand, storage=None):
+    """Fill in contact details on a response page with one batched profile read"""
+    if not expand:
+        return alerts
+    records = dict(sos_alerts)
+    profiles = get_users(expand_ids(alerts, records, expand), storage=storage)
+    return fill_details(alerts, records, expand, profiles)
+
+def parse_history_args(args):
+    """Parse limit, status and start_after, raising ValueError with the client error"""
+    try:
+        limit = int(args.get('limit', HISTORY_DEFAULT_LIMIT))
+    except ValueError:
+        limit = 0
+    
+    if not 1 <= limit <= HISTORY_MAX_LIMIT:
+        raise ValueError(f'limit must be between 1 and {HISTORY_MAX_LIMIT}')
+    
+    status = args.get('status')
+    if status and status not in ('active', 'resolved'):
+        raise ValueError('status must be active or resolved')
+    
+    start_after = args.get('start_after')
+    try:
+        start_after = decode_cursor(start_after) if start_after else None
+    except ValueError:
+        raise ValueError('Invalid start_after cursor')
+    
+    return limit, status, start_after
+
+def history_page(sos_alerts, limit):
+    """Turn up to limit + 1 listed alerts into a response page and next cursor"""
+    alerts = []
+    for alert_id, alert_data in sos_alerts[:limit]:
+        alerts.append({
+            'alert_id': alert_id,
+            'triggered_at': alert_data['triggered_at'],
+            'status': alert_data['status'],
+            'location': alert_data.get('location', 'Unknown'),
+            'message': alert_data.get('message', ''),
+            'geo': public_geo(alert_data.get('geo')),
+            'family_members_notified': len(alert_data.get('family_notified', []))
+        })
+    
+    next_cursor = None
+    if len(sos_alerts) > limit:
+        next_cursor = encode_cursor(alerts[-1]['triggered_at'])
+    return alerts, next_cursor
+
+def archive_tier_needed(sos_alerts, limit, status=None):
+    """Whether a history page of recent alerts may also need archived ones
+
+    Archived alerts were resolved, and so triggered, before the archive
+    cutoff. A full page of recent alerts that does not reach back past the
+    cutoff has none between or before its alerts.
+    """
+    if status == 'active' or not archive_tier.in_use():
+        return False
+    if len(sos_alerts) <= limit:
+        return True
+    return sos_alerts[-1][1]['triggered_at'] < archive_cutoff()
+
+def merge_tiers(recent, archived, limit):
+    """Interleave recent and archived alerts newest first, keeping limit + 1"""
+    # An alert archived while the page was read is in both tiers
+    alerts = dict(archived)
+    alerts.update(recent)
+    return sorted(alerts.items(), key=lambda item: item[1]['triggered_at'], reverse=True)[:limit + 1]
+
+def family_alerts_page(sos_alerts, limit):
+    """Turn up to limit + 1 alerts from a member's family into a response page and next cursor"""
+    alerts = []
+    for alert_id, alert_data in sos_alerts[:limit]:
+        alerts.append({
+            'alert_id': alert_id,
+            'user_id': alert_data['user_id'],
+            'triggered_at': alert_data['triggered_at'],
+            'last_triggered_at': alert_data.get('last_triggered_at', alert_data['triggered_at']),
+            'status': alert_data['status'],
+            'location': alert_data.get('location', 'Unknown'),
+            'message': alert_data.get('message', ''),
+            'geo': public_geo(alert_data.get('geo'))
+        })
+    
+    next_cursor = None
+    if len(sos_alerts) > limit:
+        next_cursor = encode_cursor(alerts[-1]['triggered_at'])
+    return alerts, next_cursor
+
+def _float_arg(args, name):
+    try:
+        return float(args[name])
+    except (TypeError, ValueError):
+        raise ValueError(f'{name} must be a number')
+
+def parse_nearby_args(args):
+    """Parse a nearby search into (bbox, center, radius, limit), raising ValueError with the client error
+
+    The area is either ``lat``, ``lon`` and ``radius`` (metres) or
+    ``bbox=south,west,north,east``. ``center`` is None for a box. Contact
+    details are not offered: ``expand`` is rejected.
+    """
+    if 'expand' in args:
+        raise ValueError('expand is not supported for nearby alerts')
+    try:
+        limit = int(args.get('limit', NEARBY_DEFAULT_LIMIT))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= NEARBY_MAX_LIMIT:
+        raise ValueError(f'limit must be between 1 and {NEARBY_MAX_LIMIT}')
+    
+    if args.get('bbox'):
+        try:
+            south, west, north, east = (float(value) for value in args['bbox'].split(','))
+        except ValueError:
+            raise ValueError('bbox must be south,west,north,east')
+        if not (-90 <= south <= north <= 90 and -180 <= west <= east <= 180):
+            raise ValueError('bbox must be south,west,north,east with south <= north and west <= east')
+        return (south, west, north, east), None, None, limit
+    
+    center = parse_geo(args)
+    if center is None:
+        raise ValueError('lat and lon, or bbox, are required')
+    radius = _float_arg(args, 'radius') if args.get('radius') else NEARBY_DEFAULT_RADIUS
+    if not 0 < radius <= NEARBY_MAX_RADIUS:
+        raise ValueError(f'radius must be between 0 and {NEARBY_MAX_RADIUS} metres')
+    return radius_bbox(center['lat'], center['lon'], radius), center, radius, limit
+
+def nearby_page(candidates, bbox, center, radius, limit):
+    """Keep the candidate alerts inside the search area, nearest (or newest) first"""
+    alerts = []
+    for alert_id, alert_data in candidates:
+        geo = alert_data.get('geo') or {}
+        if 'lat' not in geo or not in_bbox(geo['lat'], geo['lon'], bbox):
+            continue
+        distance = None
+        if center is not None:
+            distance = distance_m(center['lat'], center['lon'], geo['lat'], geo['lon'])
+            if distance > radius:
+                continue
+        alerts.append({
+            'alert_id': alert_id,
+            'user_id': alert_data['user_id'],
+            'triggered_at': alert_data['triggered_at'],
+            'last_triggered_at': alert_data.get('last_triggered_at', alert_data['triggered_at']),
+            'status': alert_data['status'],
+            'location': alert_data.get('location', 'Unknown'),
+            'message': alert_data.get('message', ''),
+            'geo': public_geo(geo),
+            'distance_m': round(distance, 1) if distance is not None else None
+        })
+    
+    if center is not None:
+        alerts.sort(key=lambda alert: alert['distance_m'])
+    else:
+        alerts.sort(key=lambda alert: alert['last_triggered_at'], reverse=True)
+    return alerts[:limit]
+
+def location_error(data, geo):
+    """Client error for a location report with nothing to report, else None"""
+    if geo is None and not data.get('location'):
+        return 'lat and lon, or location, are required'
+    return None
+
+def create_alert(storage, user_id, user_data, data, geo=None):
+    """Store a new alert, queue its notifications and return the response payload"""
+    family_member_ids = user_data.get('family_members', [])
+    
+    # Get family member details in a single batched read. With storage
+    # down, the journal notifies them once it can read them
+    family_members = []
+    if not user_data.get('details_pending'):
+        try:
+            family_members = [
+                contact_details(member_data['user_id'], member_data)
+                for member_data in get_users(family_member_ids, storage=storage)
+            ]
+        except BackendUnavailable:
+            if not journal.enabled:
+                raise
+            user_data = dict(user_data, details_pending=True)
+    
+    # Create SOS alert record
+    if user_data.get('details_pending'):
+        sos_alert = pending_alert(user_id, user_data, data, geo)
+    else:
+        sos_alert = build_alert(user_id, user_data, family_members, data, geo)
+    
+    # Journal the SOS alert; it reaches storage in the background
+    alert_id = journal.create_alert(sos_alert, storage=storage)
+    
+    # Fan out notifications in the background so the response does not
+    # wait on family size or on slow notification providers
+    notifications_queued = dispatcher.dispatch(alert_id, sos_alert, family_members)
+    alert_hub.publish('sos_triggered', alert_id, sos_alert)
+    
+    return {
+        'success': True,
+        'message': 'SOS alert triggered successfully',
+        'alert_id': alert_id,
+        'user_id': user_id,
+        'triggered_at': sos_alert['triggered_at'],
+        'family_members_notified': len(family_members),
+        'family_members': family_members,
+        'notifications_queued': notifications_queued,
+        'details_pending': bool(sos_alert.get('details_pending')),
+        'coalesced': False,
+        'status': 'active'
+    }
 
 @sos_bp.route('/@<user_id>/sos', methods=['POST'])
+@require_session
 def trigger_sos(user_id):
     """Trigger SOS alert for user and notify family members"""
     try:
         data = request.get_json() or {}
         
-        # Initialize Firestore client
-        db = firestore.client()
+        # Structured position, if the client sent coordinates
+        try:
+            geo = parse_geo(data)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
         
-        # Get user data
-        user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
+        # Get storage backend. Reads wait at most BACKEND_TIMEOUT, and fail
+        # at once while the backend is down, instead of holding the alert
+        storage = backend_breaker.guard(get_storage())
         
-        if not user_doc.exists:
+        # Get user data, re-read if the token has seen a newer family list.
+        # With storage down the alert is journaled all the same
+        try:
+            user_data = get_user(user_id, storage=storage, family_version=g.session.family_version)
+        except BackendUnavailable:
+            if not journal.enabled:
+                raise
+            user_data = unverified_user(user_id)
+        
+        if user_data is None:
             return jsonify({
                 'success': False,
                 'error': 'User not found'
             }), 404
         
-        user_data = user_doc.to_dict()
-        family_member_ids = user_data.get('family_members', [])
+        # A retry with the same Idempotency-Key gets the first response, and
+        # repeated presses join the user's active alert instead of creating
+        # and notifying again
+        try:
+            claim = coalescer.claim(user_id, request.headers.get('Idempotency-Key'))
+        except (ValueError, IdempotencyConflict) as e:
+            payload, status = claim_error(e)
+            return jsonify(payload), status
         
-        # Get user details for the alert
-        user_details = {
-            'user_id': user_id,
-            'username': user_data['username'],
-            'email': user_data['email'],
-            'mobile_number': user_data['mobile_number']
-        }
-        
-        # Get family member details
-        family_members = []
-        for member_id in family_member_ids:
-            member_ref = db.collection('users').document(member_id)
-            member_doc = member_ref.get()
-            
-            if member_doc.exists:
-                member_data = member_doc.to_dict()
-                family_members.append({
-                    'user_id': member_id,
-                    'username': member_data['username'],
-                    'email': member_data['email'],
-                    'mobile_number': member_data['mobile_number']
-                })
-        
-        # Create SOS alert record
-        sos_alert = {
-            'user_id': user_id,
-            'triggered_at': datetime.utcnow().isoformat(),
-            'status': 'active',
-            'location': data.get('location', 'Unknown'),
-            'message': data.get('message', 'Emergency SOS triggered'),
-            'family_notified': family_member_ids,
-            'user_details': user_details,
-            'family_members': family_members
-        }
-        
-        # Store SOS alert in Firestore
-        sos_ref = db.collection('sos_alerts').document()
-        sos_ref.set(sos_alert)
-        
-        # Simulate SOS alert notification (in production, this would send actual notifications)
-        print("\n" + "="*80)
-        print("🚨 SOS ALERT TRIGGERED 🚨")
-        print("="*80)
-        print(f"User ID: {user_id}")
-        print(f"Username: {user_data['username']}")
-        print(f"Email: {user_data['email']}")
-        print(f"Mobile: {user_data['mobile_number']}")
-        print(f"Location: {data.get('location', 'Unknown')}")
-        print(f"Message: {data.get('message', 'Emergency SOS triggered')}")
-        print(f"Triggered at: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}")
-        print("\n📱 FAMILY MEMBERS NOTIFIED:")
-        print("-" * 40)
-        
-        if family_members:
-            for i, member in enumerate(family_members, 1):
-                print(f"{i}. {member['username']} ({member['user_id']})")
-                print(f"   Email: {member['email']}")
-                print(f"   Mobile: {member['mobile_number']}")
-                print()
-        else:
-            print("   No family members registered")
-            print("   Consider adding family members for emergency contacts")
-        
-        print("="*80)
-        print("🔔 NOTIFICATION SIMULATION:")
-        print("   - SMS sent to all family members")
-        print("   - Email alerts dispatched")
-        print("   - Push notifications sent to mobile apps")
-        print("   - Emergency services contacted (if configured)")
-        print("="*80 + "\n")
+        if claim.replay is not None:
+            return jsonify(claim.replay), 200, {'Idempotent-Replayed': 'true'}
         
-        return jsonify({
-            'success': True,
-            'message': 'SOS alert triggered successfully',
-            'alert_id': sos_ref.id,
-            'user_id': user_id,
-            'triggered_at': sos_alert['triggered_at'],
-            'family_members_notified': len(family_members),
-            'family_members': family_members,
-            'status': 'active'
-        }), 200
+        try:
+            if claim.coalesced:
+                update = alert_update(data, geo)
+                journal.append_alert_update(claim.alert_id, update, storage=storage)
+                alert_hub.publish('sos_updated', claim.alert_id, coalesced_alert(user_id, user_data, claim, update))
+                payload = coalesced_response(user_id, claim, update)
+            else:
+                payload = create_alert(storage, user_id, user_data, data, geo)
+        except Exception:
+            coalescer.abandon(claim)
+            raise
+        
+        coalescer.complete(claim, payload)
+        return jsonify(payload), 200
         
+    except BackendUnavailable as e:
+        payload, status, headers = unavailable_error(e, 'SOS alert failed')
+        return jsonify(payload), status, headers
     except Exception as e:
         return jsonify({
             'success': False,
@@ -117,70 +529,296 @@ def trigger_sos(user_id):
         }), 500
 
 @sos_bp.route('/@<user_id>/sos/history', methods=['GET'])
+@require_session
 def get_sos_history(user_id):
     """Get SOS alert history for a user"""
     try:
-        # Initialize Firestore client
-        db = firestore.client()
+        # Get storage backend
+        storage = get_storage()
+        
+        # Parse pagination, filter and expand parameters
+        try:
+            limit, status, start_after = parse_history_args(request.args)
+            expand = parse_expand(request.args)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        # Get one page of SOS alerts for this user, transferring only the
+        # fields in the response. Fetch one extra alert to tell whether
+        # another page exists.
+        sos_alerts = storage.list_alerts(
+            user_id,
+            fields=expand_fields(HISTORY_FIELDS, expand),
+            status=status,
+            limit=limit + 1,
+            start_after=start_after
+        )
+        
+        # Resolved alerts older than the archive cutoff are in monthly rollups
+        if archive_tier_needed(sos_alerts, limit, status):
+            archived = storage.list_archived_alerts(user_id, status=status, limit=limit + 1, start_after=start_after)
+            sos_alerts = merge_tiers(sos_alerts, archived, limit)
         
-        # Check if user exists
-        user_ref = db.collection('users').document(user_id)
-        user_doc = user_ref.get()
+        alerts, next_cursor = history_page(sos_alerts, limit)
+        expand_alerts(alerts, sos_alerts, expand, storage=storage)
         
-        if not user_doc.exists:
+        return jsonify({
+            'success': True,
+            'user_id': user_id,
+            'alerts': alerts,
+            'total_alerts': len(alerts),
+            'next_cursor': next_cursor
+        }), 200
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to get SOS history: {str(e)}'
+        }), 500
+
+@sos_bp.route('/@<user_id>/sos/family', methods=['GET'])
+@require_session
+def get_family_sos_alerts(user_id):
+    """Get recent SOS alerts from users who list this user as family"""
+    try:
+        # Get storage backend
+        storage = get_storage()
+        
+        # Parse pagination, filter and expand parameters
+        try:
+            limit, status, start_after = parse_history_args(request.args)
+            expand = parse_expand(request.args)
+        except ValueError as e:
             return jsonify({
                 'success': False,
-                'error': 'User not found'
-            }), 404
+                'error': str(e)
+            }), 400
         
-        # Get SOS alerts for this user
-        sos_alerts_ref = db.collection('sos_alerts')
-        sos_alerts = sos_alerts_ref.where('user_id', '==', user_id).order_by('triggered_at', direction=firestore.Query.DESCENDING).get()
-        
-        alerts = []
-        for alert_doc in sos_alerts:
-            alert_data = alert_doc.to_dict()
-            alerts.append({
-                'alert_id': alert_doc.id,
-                'triggered_at': alert_data['triggered_at'],
-                'status': alert_data['status'],
-                'location': alert_data.get('location', 'Unknown'),
-                'message': alert_data.get('message', ''),
-                'family_members_notified': len(alert_data.get('family_notified', []))
-            })
+        # One indexed query on the alerts' notified members, newest first
+        sos_alerts = storage.list_member_alerts(
+            user_id,
+            fields=expand_fields(FAMILY_ALERT_FIELDS, expand),
+            status=status,
+            limit=limit + 1,
+            start_after=start_after
+        )
+        
+        alerts, next_cursor = family_alerts_page(sos_alerts, limit)
+        expand_alerts(alerts, sos_alerts, expand, storage=storage)
         
         return jsonify({
             'success': True,
             'user_id': user_id,
             'alerts': alerts,
+            'total_alerts': len(alerts),
+            'next_cursor': next_cursor
+        }), 200
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to get family SOS alerts: {str(e)}'
+        }), 500
+
+@sos_bp.route('/sos/nearby', methods=['GET'])
+@require_responder
+def nearby_sos_alerts():
+    """Get active SOS alerts within a radius or bounding box, for responders"""
+    try:
+        # Parse the search area
+        try:
+            bbox, center, radius, limit = parse_nearby_args(request.args)
+            cells = covering_cells(bbox)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        # Read only the active alerts indexed under the cells covering the
+        # area, then drop the ones outside it
+        candidates = get_storage().list_alerts_in_cells(cells, status='active', fields=NEARBY_FIELDS)
+        alerts = nearby_page(candidates, bbox, center, radius, limit)
+        
+        return jsonify({
+            'success': True,
+            'alerts': alerts,
             'total_alerts': len(alerts)
         }), 200
         
     except Exception as e:
         return jsonify({
             'success': False,
-            'error': f'Failed to get SOS history: {str(e)}'
+            'error': f'Failed to search nearby SOS alerts: {str(e)}'
+        }), 500
+
+@sos_bp.route('/sos/active', methods=['GET'])
+@require_responder
+def active_sos_alerts():
+    """Get the responder dashboard feed of open alerts, oldest first"""
+    try:
+        try:
+            status, limit = parse_feed_args(request.args)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        
+        # Served from the in-process mirror of active_alerts, never from storage
+        etag, body = active_alerts.feed(status, limit)
+        headers = {'ETag': etag, 'Cache-Control': 'no-cache'}
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            return Response(status=304, headers=headers)
+        return Response(body, mimetype='application/json', headers=headers)
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to get active SOS alerts: {str(e)}'
+        }), 500
+
+@sos_bp.route('/@<user_id>/sos/<alert_id>/location', methods=['POST'])
+@require_session
+def update_sos_location(user_id, alert_id):
+    """Report a new position for an active SOS alert"""
+    try:
+        data = request.get_json() or {}
+        
+        # Validate the reported position
+        try:
+            geo = parse_geo(data)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), 400
+        error = location_error(data, geo)
+        if error:
+            return jsonify({
+                'success': False,
+                'error': error
+            }), 400
+        
+        # Get storage backend, guarded like the trigger path
+        storage = backend_breaker.guard(get_storage())
+        
+        # Get the SOS alert, from the journal if it has not reached storage yet
+        alert_data = journal.get_alert(alert_id, storage=storage)
+        
+        if alert_data is None:
+            return jsonify({
+                'success': False,
+                'error': 'SOS alert not found'
+            }), 404
+        
+        # Check if the alert belongs to the user
+        if alert_data['user_id'] != user_id:
+            return jsonify({
+                'success': False,
+                'error': 'Unauthorized access to SOS alert'
+            }), 403
+        
+        if alert_data['status'] != 'active':
+            return jsonify({
+                'success': False,
+                'error': 'SOS alert is already resolved'
+            }), 409
+        
+        # Append the update and move the alert in the nearby index
+        update = alert_update(data, geo)
+        journal.append_alert_update(alert_id, update, storage=storage)
+        alert_data.update({key: value for key, value in update.items() if key != 'triggered_at'})
+        alert_hub.publish('sos_updated', alert_id, with_caller(alert_data, cached_user(user_id)))
+        
+        return jsonify({
+            'success': True,
+            'alert_id': alert_id,
+            'updated_at': update['triggered_at'],
+            'location': alert_data['location'],
+            'geo': public_geo(alert_data.get('geo'))
+        }), 200
+        
+    except BackendUnavailable as e:
+        payload, status, headers = unavailable_error(e, 'Failed to update SOS location')
+        return jsonify(payload), status, headers
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to update SOS location: {str(e)}'
+        }), 500
+
+@sos_bp.route('/@<user_id>/sos/stream', methods=['GET'])
+@require_session
+def stream_sos_alerts(user_id):
+    """Stream the user's SOS alerts and those of users who list them as family over SSE"""
+    try:
+        # Get storage backend
+        storage = get_storage()
+        
+        # Get user data
+        user_data = get_user(user_id, storage=storage)
+        
+        if user_data is None:
+            return jsonify({
+                'success': False,
+                'error': 'User not found'
+            }), 404
+        
+        # Resume after the last event the client saw, if any
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        try:
+            last_event_id = int(last_event_id) if last_event_id else None
+        except ValueError:
+            last_event_id = None
+        
+        # Alerts from other workers arrive through the active_alerts watch
+        active_alerts.start()
+        
+        # Alerts reach the family members they notified, never the other way
+        subscription = alert_hub.subscribe(user_id, last_event_id)
+        
+        if subscription is None:
+            return jsonify({
+                'success': False,
+                'error': 'Too many open alert streams, retry shortly'
+            }), 503
+        
+        return Response(
+            stream_with_context(stream_events(alert_hub, subscription)),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            }
+        )
+        
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': f'Failed to open SOS stream: {str(e)}'
         }), 500
 
 @sos_bp.route('/@<user_id>/sos/<alert_id>/resolve', methods=['POST'])
+@require_session
 def resolve_sos_alert(user_id, alert_id):
     """Resolve an SOS alert"""
     try:
-        # Initialize Firestore client
-        db = firestore.client()
+        # Get storage backend, guarded like the trigger path
+        storage = backend_breaker.guard(get_storage())
         
-        # Get the SOS alert
-        sos_ref = db.collection('sos_alerts').document(alert_id)
-        sos_doc = sos_ref.get()
+        # Get the SOS alert, from the journal if it has not reached storage yet
+        alert_data = journal.get_alert(alert_id, storage=storage)
         
-        if not sos_doc.exists:
+        if alert_data is None:
             return jsonify({
                 'success': False,
                 'error': 'SOS alert not found'
             }), 404
         
-        alert_data = sos_doc.to_dict()
-        
         # Check if the alert belongs to the user
         if alert_data['user_id'] != user_id:
             return jsonify({
@@ -188,23 +826,27 @@ def resolve_sos_alert(user_id, alert_id):
                 'error': 'Unauthorized access to SOS alert'
             }), 403
         
-        # Update alert status
-        sos_ref.update({
-            'status': 'resolved',
-            'resolved_at': datetime.utcnow().isoformat()
-        })
+        # Close the coalescing window so the next press raises a new alert
+        coalescer.end(user_id, alert_id)
+        
+        # Update alert status and its dashboard entry
+        resolved_at = datetime.utcnow().isoformat()
+        alert_data.update({'status': 'resolved', 'resolved_at': resolved_at})
+        journal.resolve_alert(alert_id, alert_data, storage=storage)
+        alert_hub.publish('sos_resolved', alert_id, with_caller(alert_data, cached_user(user_id)))
         
-        print(f"\n✅ SOS Alert Resolved: {alert_id}")
-        print(f"   User: {user_id}")
-        print(f"   Resolved at: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}\n")
+        logger.info('SOS alert %s resolved by %s', alert_id, user_id)
         
         return jsonify({
             'success': True,
             'message': 'SOS alert resolved successfully',
             'alert_id': alert_id,
-            'resolved_at': datetime.utcnow().isoformat()
+            'resolved_at': resolved_at
         }), 200
         
+    except BackendUnavailable as e:
+        payload, status, headers = unavailable_error(e, 'Failed to resolve SOS alert')
+        return jsonify(payload), status, headers
     except Exception as e:
         return jsonify({
             'success': False,
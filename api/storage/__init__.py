@@ -0,0 +1,45 @@
+import threading
+from config import Config
+from api.storage.base import (
+    Storage, EmailAlreadyRegistered, UserIdCollision, normalize_email, email_index_id
+)
+
+_storage = None
+_storage_lock = threading.Lock()
+
+def create_storage(backend=None, client=None):
+    """Build the storage backend named by Config.STORAGE_BACKEND
+
+    ``client`` overrides the Firestore client (used by the benchmarks).
+    The backend is wrapped with call counters and timers when metrics are
+    enabled.
+    """
+    backend = backend or Config.STORAGE_BACKEND
+    if backend == 'firestore':
+        from api.storage.firestore_backend import FirestoreStorage
+        storage = FirestoreStorage(client)
+    elif backend == 'sqlite':
+        from api.storage.sqlite_backend import SQLiteStorage
+        storage = SQLiteStorage(Config.SQLITE_PATH, Config.SQLITE_POOL_SIZE, Config.SQLITE_TIMEOUT)
+    else:
+        raise ValueError(f'Unknown storage backend: {backend}')
+    
+    if Config.METRICS_ENABLED:
+        from api.metrics import instrument_storage
+        storage = instrument_storage(storage)
+    return storage
+
+def get_storage():
+    """Get the shared storage backend, creating it on first use"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = create_storage()
+    return _storage
+
+def set_storage(storage):
+    """Replace the shared storage backend"""
+    global _storage
+    _storage = storage
+    return storage
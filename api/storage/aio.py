@@ -0,0 +1,140 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+
+class AsyncStorage:
+    """Coroutine version of the Storage interface for the ASGI app
+
+    Every method takes the same arguments and returns the same values as
+    its Storage counterpart. Delivery status, buffered profile updates,
+    session revocation polling and archiving are not here: background
+    threads run them through the sync backend.
+    """
+    
+    name = None
+    
+    async def warm_up(self):
+        """Open connections before the worker takes traffic"""
+    
+    async def get_user(self, user_id):
+        raise NotImplementedError
+    
+    async def get_users(self, user_ids, fields=None):
+        raise NotImplementedError
+    
+    async def create_user(self, user_data):
+        raise NotImplementedError
+    
+    async def update_user(self, user_id, fields):
+        raise NotImplementedError
+    
+    async def add_family_member(self, user_id, member_id, reciprocal=False, updated_at=None):
+        raise NotImplementedError
+    
+    async def remove_family_member(self, user_id, member_id, reciprocal=False, updated_at=None):
+        raise NotImplementedError
+    
+    async def get_listed_by(self, member_id):
+        raise NotImplementedError
+    
+    async def revoke_sessions(self, user_id, revoked_at):
+        raise NotImplementedError
+    
+    async def create_alert(self, alert):
+        raise NotImplementedError
+    
+    async def get_alert(self, alert_id):
+        raise NotImplementedError
+    
+    async def update_alert(self, alert_id, fields):
+        raise NotImplementedError
+    
+    async def append_alert_update(self, alert_id, update):
+        raise NotImplementedError
+    
+    async def resolve_alert(self, alert_id, alert):
+        raise NotImplementedError
+    
+    async def list_alerts(self, user_id, fields=None, status=None, limit=None, start_after=None):
+        raise NotImplementedError
+    
+    async def list_alerts_in_cells(self, cells, status='active', fields=None):
+        raise NotImplementedError
+    
+    async def list_member_alerts(self, member_id, fields=None, status=None, limit=None, start_after=None):
+        raise NotImplementedError
+    
+    async def list_archived_alerts(self, user_id, status=None, limit=None, start_after=None):
+        raise NotImplementedError
+
+# Storage operations available on AsyncStorage
+ASYNC_OPERATIONS = (
+    'warm_up', 'get_user', 'get_users', 'create_user', 'update_user',
+    'add_family_member', 'remove_family_member', 'get_listed_by', 'revoke_sessions',
+    'create_alert', 'get_alert', 'update_alert', 'append_alert_update', 'resolve_alert',
+    'list_alerts', 'list_alerts_in_cells', 'list_member_alerts', 'list_archived_alerts'
+)
+
+def _in_thread(operation):
+    async def call(self, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        method = getattr(self._storage, operation)
+        # Carry the request's context over so metrics count the call
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(context.run, method, *args, **kwargs)
+        )
+    call.__name__ = operation
+    return call
+
+class ThreadedAsyncStorage(AsyncStorage):
+    """Run a blocking Storage backend on a small thread pool
+
+    For backends without an asyncio driver, such as SQLite. Requests still
+    wait on a thread while the backend works, but the pool is bounded and
+    shared instead of one thread per open request.
+    """
+    
+    def __init__(self, storage, max_workers=None):
+        self._storage = storage
+        self.name = storage.name
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'{storage.name}-io')
+
+for _operation in ASYNC_OPERATIONS:
+    setattr(ThreadedAsyncStorage, _operation, _in_thread(_operation))
+
+_storage = None
+
+def create_async_storage(backend=None, client=None):
+    """Build the async storage backend named by Config.STORAGE_BACKEND
+
+    ``client`` overrides the async Firestore client (used by the benchmarks).
+    Other backends share the sync backend from get_storage(), which is
+    already instrumented.
+    """
+    if (backend or Config.STORAGE_BACKEND) != 'firestore':
+        from api.storage import create_storage, get_storage
+        storage = create_storage(backend) if backend else get_storage()
+        return ThreadedAsyncStorage(storage, Config.SQLITE_POOL_SIZE)
+    
+    from api.storage.firestore_async_backend import AsyncFirestoreStorage
+    storage = AsyncFirestoreStorage(client)
+    if Config.METRICS_ENABLED:
+        from api.metrics import instrument_async_storage
+        storage = instrument_async_storage(storage)
+    return storage
+
+def get_async_storage():
+    """Get the shared async storage backend, creating it on first use"""
+    global _storage
+    if _storage is None:
+        _storage = create_async_storage()
+    return _storage
+
+def set_async_storage(storage):
+    """Replace the shared async storage backend"""
+    global _storage
+    _storage = storage
+    return storage
@@ -0,0 +1,474 @@
+import hashlib
+import re
+import secrets
+import zlib
+from api.geo import public_geo
+
+# Characters and length of alert IDs, as in Firestore's generated document IDs
+ALERT_ID_ALPHABET = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789'
+ALERT_ID_LENGTH = 20
+
+class EmailAlreadyRegistered(Exception):
+    """The email is already claimed by another user"""
+
+class UserIdCollision(Exception):
+    """The generated user ID is already taken"""
+
+def normalize_email(email):
+    """Normalize an email for uniqueness checks"""
+    return email.strip().lower()
+
+def email_index_id(email):
+    """Document ID of an email's entry in the email_index collection
+
+    Hashed so that any email is a valid Firestore document ID.
+    """
+    return hashlib.sha256(normalize_email(email).encode('utf-8')).hexdigest()
+
+def new_alert_id():
+    """Random alert ID, chosen before the alert is stored so a retried write lands on the same document"""
+    return ''.join(secrets.choice(ALERT_ID_ALPHABET) for _ in range(ALERT_ID_LENGTH))
+
+# Schema of the alerts build_alert writes: member IDs and a profile version
+# instead of copies of everyone's contact details. Alerts without a
+# schema_version are version 1 and embed them.
+ALERT_SCHEMA_VERSION = 2
+
+# Contact details an alert may carry in memory but that are never stored on
+# it: the caller's only reach its active_alerts entry, and members' are
+# read when a response asks for them
+ALERT_DETAIL_FIELDS = ('user_details', 'family_members')
+
+def alert_document(alert):
+    """The sos_alerts document for an alert: the alert without contact details"""
+    return {field: value for field, value in alert.items() if field not in ALERT_DETAIL_FIELDS}
+
+def compact_alert(alert):
+    """Rewrite a stored alert in the current schema, or return None if it already is"""
+    if alert.get('schema_version', 1) >= ALERT_SCHEMA_VERSION:
+        return None
+    compact = alert_document(alert)
+    if 'family_notified' not in compact:
+        compact['family_notified'] = [member['user_id'] for member in alert.get('family_members') or []]
+    compact['schema_version'] = ALERT_SCHEMA_VERSION
+    return compact
+
+# Alert fields copied into its active_alerts entry
+ACTIVE_ALERT_FIELDS = ('user_id', 'triggered_at', 'last_triggered_at', 'status', 'resolved_at', 'location', 'message',
+                       'family_notified')
+
+def active_entry(alert):
+    """Compact copy of an alert for the active_alerts collection and the responder dashboard
+
+    The caller's username and mobile number come from ``user_details``,
+    which a new alert carries in memory. A stored alert has none, so
+    resolving it merges the entry instead of replacing it.
+    """
+    entry = {field: alert[field] for field in ACTIVE_ALERT_FIELDS if alert.get(field) is not None}
+    user_details = alert.get('user_details') or {}
+    for field in ('username', 'mobile_number'):
+        if user_details.get(field) is not None:
+            entry[field] = user_details[field]
+    if alert.get('geo'):
+        entry['geo'] = public_geo(alert['geo'])
+    return entry
+
+def active_entry_update(update):
+    """Fields of an active_alerts entry changed by append_alert_update"""
+    fields = {'last_triggered_at': update['triggered_at']}
+    if 'location' in update:
+        fields['location'] = update['location']
+    if 'geo' in update:
+        fields['geo'] = public_geo(update['geo'])
+    return fields
+
+# Fields a resolved alert keeps once archived into its user's monthly rollup
+ARCHIVE_FIELDS = ('triggered_at', 'last_triggered_at', 'status', 'resolved_at', 'location', 'message',
+                  'family_notified', 'geo')
+
+def archive_month(alert):
+    """Month an alert is archived under, from when it was triggered (YYYY-MM)"""
+    return alert['triggered_at'][:7]
+
+def archive_record(alert):
+    """Compact copy of a resolved alert for its monthly rollup
+
+    Delivery statuses and location updates are dropped, and the position
+    loses its geohash index cells, which only serve nearby queries.
+    """
+    record = {field: alert[field] for field in ARCHIVE_FIELDS if alert.get(field) is not None}
+    if alert.get('geo'):
+        record['geo'] = public_geo(alert['geo'])
+    return record
+
+def archive_rollups(alerts):
+    """Group (alert_id, alert) pairs into {(user_id, month): {alert_id: archive_record}}"""
+    rollups = {}
+    for alert_id, alert in alerts:
+        rollups.setdefault((alert['user_id'], archive_month(alert)), {})[alert_id] = archive_record(alert)
+    return rollups
+
+def archived_page(user_id, rollups, status=None, limit=None, start_after=None):
+    """Page through a user's rollups, newest month first, as (alert_id, alert) pairs newest first
+
+    Stops reading rollups once the page is full.
+    """
+    alerts = []
+    for records in rollups:
+        for alert_id, record in sorted(records.items(), key=lambda item: item[1]['triggered_at'], reverse=True):
+            if start_after and record['triggered_at'] >= start_after:
+                continue
+            if status and record.get('status') != status:
+                continue
+            alerts.append((alert_id, dict(record, user_id=user_id)))
+            if limit and len(alerts) >= limit:
+                return alerts
+    return alerts
+
+# Users in a zone are spread over this many slots by a hash of their ID, so a
+# broadcast can split the zone into shards that each cover a range of slots
+ZONE_SLOTS = 256
+
+# Zone names: a lowercase letter or digit, then letters, digits, - and _
+ZONE_PATTERN = re.compile(r'^[a-z0-9][a-z0-9_-]{0,63}$')
+
+def normalize_zone(zone):
+    """Normalize a zone name, raising ValueError if it is not one"""
+    if not isinstance(zone, str) or not ZONE_PATTERN.match(zone.strip().lower()):
+        raise ValueError('zone must be 1-64 letters, digits, - or _')
+    return zone.strip().lower()
+
+def zone_slot(user_id):
+    """The slot a user falls in within their zone, stable across processes"""
+    return zlib.crc32(user_id.encode('utf-8')) % ZONE_SLOTS
+
+def zone_fields(user_id, zone):
+    """The user fields that place a user in a zone, or take them out of theirs with zone None"""
+    if zone is None:
+        return {'zone': None, 'zone_slot': None}
+    return {'zone': zone, 'zone_slot': zone_slot(user_id)}
+
+def shard_slots(shards):
+    """Split the zone slots into ``shards`` contiguous [first, end) ranges"""
+    shards = max(1, min(shards, ZONE_SLOTS))
+    return [(ZONE_SLOTS * i // shards, ZONE_SLOTS * (i + 1) // shards) for i in range(shards)]
+
+def broadcast_shards(broadcast_id, broadcast, shards, lease_until):
+    """The shard records a new broadcast is delivered by
+
+    Each shard carries the inbox ``entry`` its recipients get, so a worker
+    that claims it needs no other read. ``lease_until`` starts at the
+    broadcast's creation time, so shards are claimed oldest broadcast first.
+    """
+    entry = inbox_entry(broadcast_id, broadcast)
+    return [{
+        'broadcast_id': broadcast_id,
+        'shard': shard,
+        'slots': [first, end],
+        'zone': broadcast['zone'],
+        'entry': entry,
+        'status': 'open',
+        'owner': None,
+        'lease_until': lease_until,
+        'cursor': None,
+        'delivered': 0,
+        'batches': 0,
+        'started_at': None,
+        'finished_at': None,
+        'updated_at': broadcast['created_at']
+    } for shard, (first, end) in enumerate(shard_slots(shards))]
+
+# Broadcast fields copied into every recipient's inbox entry
+INBOX_FIELDS = ('zone', 'category', 'message', 'created_at', 'expires_at')
+
+def inbox_entry(broadcast_id, broadcast):
+    return dict({field: broadcast.get(field) for field in INBOX_FIELDS}, broadcast_id=broadcast_id)
+
+class Storage:
+    """Interface for the users, family links and SOS alerts the API stores
+
+    Users and alerts are plain dicts shaped like the original Firestore
+    documents, so handlers behave the same on every backend.
+    """
+    
+    name = None
+    
+    def warm_up(self):
+        """Open connections before the worker takes traffic"""
+    
+    # Users and family links
+    
+    def get_user(self, user_id):
+        """Get a full user dict, or None if the user does not exist"""
+        raise NotImplementedError
+    
+    def get_users(self, user_ids, fields=None):
+        """Get several users in one round trip as a dict keyed by user ID
+
+        ``fields`` limits each dict to those fields plus ``user_id``.
+        Missing users are left out.
+        """
+        raise NotImplementedError
+    
+    def create_user(self, user_data):
+        """Create a user, claiming its email atomically
+
+        Raises EmailAlreadyRegistered or UserIdCollision.
+        """
+        raise NotImplementedError
+    
+    def create_users(self, users):
+        """Create users in as few write batches as possible, like create_user, and return the IDs left out
+
+        Each user commits with its email claim and its family_index entries.
+        Users whose ID or email is already taken are left out, so creating
+        the same users again has no effect.
+        """
+        raise NotImplementedError
+    
+    def find_emails(self, emails):
+        """Get the normalized emails already registered among ``emails``, in one round trip"""
+        raise NotImplementedError
+    
+    def scan_users(self, limit, start_after=None):
+        """List up to ``limit`` full user dicts in user ID order, after the ``start_after`` user ID"""
+        raise NotImplementedError
+    
+    def update_user(self, user_id, fields):
+        """Set top-level fields on an existing user"""
+        raise NotImplementedError
+    
+    def update_users(self, updates):
+        """Set top-level fields on several users in one write batch
+
+        ``updates`` maps user IDs to their fields. Used by the write-behind
+        buffer; users that no longer exist are skipped.
+        """
+        raise NotImplementedError
+    
+    def add_family_member(self, user_id, member_id, reciprocal=False, updated_at=None):
+        """Link member_id into user_id's family list, and back if reciprocal
+
+        Every changed family list also gets its ``family_version`` bumped.
+        Returns user_id's ``family_version`` after the change.
+        """
+        raise NotImplementedError
+    
+    def remove_family_member(self, user_id, member_id, reciprocal=False, updated_at=None):
+        """Unlink member_id from user_id's family list, and back if reciprocal
+
+        Bumps and returns ``family_version`` like add_family_member.
+        """
+        raise NotImplementedError
+    
+    def get_listed_by(self, member_id):
+        """IDs of the users whose family list includes member_id, in one indexed lookup
+
+        The reverse index is updated in the same commit as the family lists.
+        """
+        raise NotImplementedError
+    
+    # Sessions
+    
+    def revoke_sessions(self, user_id, revoked_at):
+        """Record that every session token issued to user_id up to revoked_at is revoked
+
+        A revocation only needs to outlive the tokens it revokes, so backends
+        may drop it Config.SESSION_TOKEN_TTL seconds later.
+        """
+        raise NotImplementedError
+    
+    def list_revocations(self, since=None):
+        """Get revocations recorded after ``since`` as a dict of user ID to revoked_at"""
+        raise NotImplementedError
+    
+    # SOS alerts
+    
+    def create_alert(self, alert):
+        """Store a new alert and return its ID
+
+        The alert is stored as alert_document(alert); its ``user_details``
+        only go into the active_alerts entry.
+        """
+        raise NotImplementedError
+    
+    def create_alerts(self, alerts):
+        """Store new alerts under the IDs they were given, in one batch, like create_alert
+
+        ``alerts`` maps alert IDs (from new_alert_id) to alerts. An alert
+        that already exists is left as it is, so writing the same alerts
+        again has no effect.
+        """
+        raise NotImplementedError
+    
+    def import_alerts(self, alerts):
+        """Store exported alerts under their IDs, in one batch
+
+        ``alerts`` maps alert IDs to stored alerts as scan_alerts returns
+        them. Only active ones get an active_alerts entry. Alerts that
+        already exist are left as they are.
+        """
+        raise NotImplementedError
+    
+    def scan_alerts(self, limit, start_after=None):
+        """List up to ``limit`` full alerts in alert ID order, after the ``start_after`` alert ID, as (alert_id, alert) pairs"""
+        raise NotImplementedError
+    
+    def get_alert(self, alert_id):
+        """Get an alert dict, or None if it does not exist"""
+        raise NotImplementedError
+    
+    def update_alert(self, alert_id, fields):
+        """Set top-level fields on an existing alert"""
+        raise NotImplementedError
+    
+    def append_alert_update(self, alert_id, update):
+        """Add a repeated trigger's update to an active alert in one write
+
+        ``update`` has ``triggered_at`` and optionally ``location``,
+        ``message`` and ``geo``. It is appended to ``location_updates``, and
+        its location and geo, if any, become the alert's current ones.
+        Appending the same update twice adds it once.
+        """
+        raise NotImplementedError
+    
+    def resolve_alert(self, alert_id, alert):
+        """Mark an alert resolved and turn its active_alerts entry into a resolved one
+
+        ``alert`` is the whole alert with its new ``status`` and
+        ``resolved_at``. The entry keeps the fields this alert does not
+        have, such as the caller's contact details, and expires after
+        Config.ACTIVE_ALERTS_RETENTION seconds.
+        """
+        raise NotImplementedError
+    
+    def list_active_alerts(self):
+        """List active_alerts entries as (alert_id, entry) pairs, resolved ones until they expire"""
+        raise NotImplementedError
+    
+    def watch_active_alerts(self, on_change):
+        """Call ``on_change(changes, reset)`` whenever active_alerts entries change
+
+        ``changes`` is a list of (alert_id, entry) pairs, with None as the
+        entry of a removed one. When ``reset`` is true they are the whole
+        collection and replace what the caller had. Returns a handle whose
+        ``unsubscribe()`` stops the watch.
+        """
+        raise NotImplementedError
+    
+    def list_alerts_in_cells(self, cells, status='active', fields=None):
+        """List alerts whose position is in any of the geohash prefixes as (alert_id, alert) pairs
+
+        The prefixes all have one of the lengths in api.geo.INDEX_PRECISIONS.
+        Alerts without a position are never returned.
+        """
+        raise NotImplementedError
+    
+    def set_delivery_status(self, alert_id, member_id, channel, delivery):
+        """Record one member's notification status on one channel"""
+        raise NotImplementedError
+    
+    def claim_delivery(self, alert_id, member_id, channel, expected, delivery):
+        """Replace one member's notification status on one channel if it is still ``expected``
+
+        Returns whether it was replaced, so only one worker claims a delivery.
+        """
+        raise NotImplementedError
+    
+    def list_pending_deliveries(self):
+        """List active alerts with a notification still pending as (alert_id, alert) pairs"""
+        raise NotImplementedError
+    
+    def list_alerts(self, user_id, fields=None, status=None, limit=None, start_after=None):
+        """List a user's alerts newest first as (alert_id, alert) pairs
+
+        ``start_after`` is the ``triggered_at`` of the last alert on the
+        previous page.
+        """
+        raise NotImplementedError
+    
+    def list_member_alerts(self, member_id, fields=None, status=None, limit=None, start_after=None):
+        """List alerts that notified member_id newest first as (alert_id, alert) pairs
+
+        These are the alerts of users who listed member_id as family when
+        they triggered. Arguments are as for list_alerts.
+        """
+        raise NotImplementedError
+    
+    # Archive
+    
+    def list_resolved_alerts(self, resolved_before, limit):
+        """List up to ``limit`` alerts resolved before ``resolved_before``, oldest first, as (alert_id, alert) pairs
+
+        Each alert has ``user_id`` and the ARCHIVE_FIELDS it has.
+        """
+        raise NotImplementedError
+    
+    def archive_alerts(self, alerts):
+        """Move resolved alerts into their users' monthly rollups in one commit
+
+        ``alerts`` are (alert_id, alert) pairs from list_resolved_alerts.
+        Each is merged into the ``alert_archive`` rollup of its user and
+        archive_month as archive_record(alert), and its alert and
+        active_alerts entry are deleted. Archiving an alert again stores it
+        once, so an interrupted run can simply be repeated.
+        """
+        raise NotImplementedError
+    
+    def list_archived_alerts(self, user_id, status=None, limit=None, start_after=None):
+        """List a user's archived alerts newest first as (alert_id, alert) pairs, like list_alerts
+
+        Archived alerts hold the ARCHIVE_FIELDS and ``user_id``.
+        """
+        raise NotImplementedError
+    
+    def has_archived_alerts(self):
+        """Whether any alert has been archived yet"""
+        raise NotImplementedError
+    
+    # Zones and broadcasts
+    
+    def list_zone_users(self, zone, slots, limit, start_after=None):
+        """List up to ``limit`` users in a zone whose zone_slot is in the [first, end) ``slots``
+
+        Returns (zone_slot, user_id) pairs in that order, after the
+        ``start_after`` pair, from one indexed query.
+        """
+        raise NotImplementedError
+    
+    def create_broadcast(self, broadcast_id, broadcast, shards):
+        """Store a broadcast and its shard records from broadcast_shards() in one commit"""
+        raise NotImplementedError
+    
+    def get_broadcast(self, broadcast_id):
+        """Get (broadcast, shards) with the shards in order, or None if there is no such broadcast"""
+        raise NotImplementedError
+    
+    def claim_broadcast_shard(self, owner, lease_until, now):
+        """Lease the open shard whose lease ran out longest ago to ``owner`` and return it, or None
+
+        A shard is open until its last batch is delivered, and free to claim
+        once its ``lease_until`` (epoch seconds) is before ``now``. Claims
+        are atomic: two workers never get the same lease.
+        """
+        raise NotImplementedError
+    
+    def deliver_broadcast_batch(self, broadcast_id, shard, owner, entries, progress):
+        """Write inbox entries and a shard's progress in one commit, if ``owner`` still holds its lease
+
+        ``entries`` are (user_id, inbox_entry) pairs, at most 499 of them.
+        ``progress`` holds the shard fields to set, such as its cursor,
+        delivered count, lease and status. Returns False, writing nothing,
+        if the shard is gone or has been claimed by another owner, which
+        resumes from the last cursor written. An entry already in a user's
+        inbox is written again in place.
+        """
+        raise NotImplementedError
+    
+    def list_inbox(self, user_id, since, limit=None, start_after=None):
+        """List a user's inbox entries created after ``since``, newest first
+
+        ``start_after`` is the ``created_at`` of the last entry on the
+        previous page. Older entries may still be stored until they expire.
+        """
+        raise NotImplementedError
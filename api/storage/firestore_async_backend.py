@@ -0,0 +1,203 @@
+import os
+from firebase_admin import firestore
+from google.cloud.firestore import AsyncClient
+from config import Config
+from api.storage.aio import AsyncStorage
+from api.storage.base import (
+    EmailAlreadyRegistered, UserIdCollision, normalize_email, email_index_id,
+    active_entry, active_entry_update, alert_document, archived_page
+)
+from api.storage.firestore_backend import (
+    TunedChannelMixin, initialize_app, alert_update_fields, resolved_entry,
+    alert_page_query, revocation_record, archive_query
+)
+
+class TunedAsyncClient(TunedChannelMixin, AsyncClient):
+    """Async Firestore client whose gRPC channel uses Config's channel options"""
+
+_client = None
+
+def _reset_client_after_fork():
+    # grpc.aio channels are tied to the parent's event loop
+    global _client
+    _client = None
+
+os.register_at_fork(after_in_child=_reset_client_after_fork)
+
+def get_async_client():
+    """Get this process's shared async Firestore client, creating it on first use
+
+    Only called from the event loop thread, so no lock is needed.
+    """
+    global _client
+    if _client is None:
+        app = initialize_app()
+        _client = TunedAsyncClient(
+            project=app.project_id,
+            credentials=app.credential.get_credential(),
+            channel_options=Config.get_firestore_channel_options()
+        )
+    return _client
+
+@firestore.async_transactional
+async def _create_user(transaction, db, user_data):
+    """Claim the user's email and create the user document atomically"""
+    index_ref = db.collection('email_index').document(email_index_id(user_data['email']))
+    user_ref = db.collection('users').document(user_data['user_id'])
+    
+    # Check both keys in one round trip
+    async for doc in db.get_all([index_ref, user_ref], transaction=transaction):
+        if not doc.exists:
+            continue
+        if doc.id == index_ref.id:
+            raise EmailAlreadyRegistered()
+        raise UserIdCollision()
+    
+    transaction.create(index_ref, {
+        'email': normalize_email(user_data['email']),
+        'user_id': user_data['user_id'],
+        'created_at': user_data['created_at']
+    })
+    transaction.create(user_ref, user_data)
+
+class AsyncFirestoreStorage(AsyncStorage):
+    """Storage backed by Cloud Firestore through the asyncio client"""
+    
+    name = 'firestore'
+    
+    def __init__(self, client=None):
+        self._client = client
+    
+    @property
+    def db(self):
+        return self._client or get_async_client()
+    
+    async def warm_up(self):
+        # One cheap read opens the gRPC channel and fetches an access token
+        await self.db.collection('users').document('_warmup').get(timeout=Config.FIRESTORE_WARMUP_TIMEOUT)
+    
+    async def get_user(self, user_id):
+        user_doc = await self.db.collection('users').document(user_id).get()
+        return user_doc.to_dict() if user_doc.exists else None
+    
+    async def get_users(self, user_ids, fields=None):
+        db = self.db
+        users_ref = db.collection('users')
+        refs = [users_ref.document(user_id) for user_id in dict.fromkeys(user_ids)]
+        
+        users = {}
+        async for doc in db.get_all(refs, field_paths=fields):
+            if doc.exists:
+                user_data = doc.to_dict()
+                user_data['user_id'] = doc.id
+                users[doc.id] = user_data
+        return users
+    
+    async def create_user(self, user_data):
+        db = self.db
+        await _create_user(db.transaction(), db, user_data)
+    
+    async def update_user(self, user_id, fields):
+        await self.db.collection('users').document(user_id).update(fields)
+    
+    async def add_family_member(self, user_id, member_id, reciprocal=False, updated_at=None):
+        return await self._update_family(firestore.ArrayUnion, user_id, member_id, reciprocal, updated_at)
+    
+    async def remove_family_member(self, user_id, member_id, reciprocal=False, updated_at=None):
+        return await self._update_family(firestore.ArrayRemove, user_id, member_id, reciprocal, updated_at)
+    
+    async def _update_family(self, transform, user_id, member_id, reciprocal, updated_at):
+        db = self.db
+        users_ref = db.collection('users')
+        index_ref = db.collection('family_index')
+        batch = db.batch()
+        batch.update(users_ref.document(user_id), {
+            'family_members': transform([member_id]),
+            'family_version': firestore.Increment(1),
+            'updated_at': updated_at
+        })
+        batch.set(index_ref.document(member_id), {
+            'listed_by': transform([user_id]),
+            'updated_at': updated_at
+        }, merge=True)
+        if reciprocal:
+            batch.update(users_ref.document(member_id), {
+                'family_members': transform([user_id]),
+                'family_version': firestore.Increment(1),
+                'updated_at': updated_at
+            })
+            batch.set(index_ref.document(user_id), {
+                'listed_by': transform([member_id]),
+                'updated_at': updated_at
+            }, merge=True)
+        await batch.commit()
+        user_doc = await users_ref.document(user_id).get(field_paths=['family_version'])
+        return (user_doc.to_dict() or {}).get('family_version', 0)
+    
+    async def get_listed_by(self, member_id):
+        index_doc = await self.db.collection('family_index').document(member_id).get()
+        return (index_doc.to_dict() or {}).get('listed_by', [])
+    
+    async def revoke_sessions(self, user_id, revoked_at):
+        await self.db.collection('session_revocations').document(user_id).set(revocation_record(revoked_at))
+    
+    async def create_alert(self, alert):
+        db = self.db
+        sos_ref = db.collection('sos_alerts').document()
+        batch = db.batch()
+        batch.set(sos_ref, alert_document(alert))
+        batch.set(db.collection('active_alerts').document(sos_ref.id), active_entry(alert))
+        await batch.commit()
+        return sos_ref.id
+    
+    async def get_alert(self, alert_id):
+        sos_doc = await self.db.collection('sos_alerts').document(alert_id).get()
+        return sos_doc.to_dict() if sos_doc.exists else None
+    
+    async def update_alert(self, alert_id, fields):
+        await self.db.collection('sos_alerts').document(alert_id).update(fields)
+    
+    async def append_alert_update(self, alert_id, update):
+        db = self.db
+        batch = db.batch()
+        batch.update(db.collection('sos_alerts').document(alert_id), alert_update_fields(update))
+        batch.update(db.collection('active_alerts').document(alert_id), active_entry_update(update))
+        await batch.commit()
+    
+    async def resolve_alert(self, alert_id, alert):
+        db = self.db
+        batch = db.batch()
+        batch.update(db.collection('sos_alerts').document(alert_id), {
+            'status': alert['status'],
+            'resolved_at': alert['resolved_at']
+        })
+        batch.set(db.collection('active_alerts').document(alert_id), resolved_entry(alert), merge=True)
+        await batch.commit()
+    
+    async def list_alerts_in_cells(self, cells, status='active', fields=None):
+        query = (self.db.collection('sos_alerts')
+                 .where('status', '==', status)
+                 .where('geo.cells', 'array_contains_any', list(cells)))
+        if fields:
+            query = query.select(fields)
+        return [(alert_doc.id, alert_doc.to_dict()) async for alert_doc in query.stream()]
+    
+    async def list_alerts(self, user_id, fields=None, status=None, limit=None, start_after=None):
+        query = self.db.collection('sos_alerts').where('user_id', '==', user_id)
+        query = alert_page_query(query, fields, status, limit, start_after)
+        return [(alert_doc.id, alert_doc.to_dict()) async for alert_doc in query.stream()]
+    
+    async def list_member_alerts(self, member_id, fields=None, status=None, limit=None, start_after=None):
+        query = self.db.collection('sos_alerts').where('family_notified', 'array_contains', member_id)
+        query = alert_page_query(query, fields, status, limit, start_after)
+        return [(alert_doc.id, alert_doc.to_dict()) async for alert_doc in query.stream()]
+    
+    async def list_archived_alerts(self, user_id, status=None, limit=None, start_after=None):
+        query = archive_query(self.db.collection('alert_archive'), user_id, start_after)
+        alerts = []
+        async for rollup_doc in query.stream():
+            remaining = limit - len(alerts) if limit else None
+            alerts += archived_page(user_id, [rollup_doc.get('alerts') or {}], status, remaining, start_after)
+            if limit and len(alerts) >= limit:
+                break
+        return alerts
@@ -0,0 +1,654 @@
+import inspect
+import logging
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+import firebase_admin
+from firebase_admin import credentials, firestore
+from google.api_core.exceptions import AlreadyExists, NotFound
+from google.cloud.firestore import Client, __version__ as FIRESTORE_VERSION
+from config import Config
+from api.storage.base import (
+    Storage, EmailAlreadyRegistered, UserIdCollision, normalize_email, email_index_id,
+    active_entry, active_entry_update, alert_document, ARCHIVE_FIELDS, archive_rollups, archived_page
+)
+
+logger = logging.getLogger('sangam.storage')
+
+# The channel hook overrides BaseClient._firestore_api_helper and reads the
+# client's private attributes, as the client has no public way to pass gRPC
+# channel options. requirements.txt pins the version this was written against.
+CHANNEL_HOOK_PARAMS = ['transport', 'client_class', 'client_module']
+CHANNEL_HOOK_ATTRS = (
+    '_firestore_api_internal', '_emulator_host', '_target', '_credentials', '_client_options', '_client_info'
+)
+
+class TunedChannelMixin:
+    """Build the client's gRPC channel with Config's channel options"""
+    
+    def __init__(self, *args, channel_options=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._channel_options = channel_options
+        if channel_options:
+            self._check_channel_hook()
+    
+    def _check_channel_hook(self):
+        """Fail loudly if the installed client no longer has the internals the hook relies on"""
+        helper = getattr(super(), '_firestore_api_helper', None)
+        params = list(inspect.signature(helper).parameters) if helper else None
+        missing = [attr for attr in CHANNEL_HOOK_ATTRS if not hasattr(self, attr)]
+        if params != CHANNEL_HOOK_PARAMS or missing:
+            raise RuntimeError(
+                f'google-cloud-firestore {FIRESTORE_VERSION} cannot take the Firestore gRPC channel options: '
+                f'_firestore_api_helper takes {params}, client lacks {missing}. '
+                'Install the version pinned in requirements.txt.'
+            )
+    
+    def _firestore_api_helper(self, transport, client_class, client_module):
+        if self._firestore_api_internal is None and self._emulator_host is None and self._channel_options:
+            channel = transport.create_channel(
+                self._target,
+                credentials=self._credentials,
+                options=self._channel_options
+            )
+            self._transport = transport(host=self._target, channel=channel)
+            self._firestore_api_internal = client_class(
+                transport=self._transport, client_options=self._client_options
+            )
+            client_module._client_info = self._client_info
+        return super()._firestore_api_helper(transport, client_class, client_module)
+
+class TunedClient(TunedChannelMixin, Client):
+    """Firestore client whose gRPC channel uses Config's channel options"""
+
+_client = None
+_client_lock = threading.Lock()
+
+def _reset_client_after_fork():
+    # A gRPC channel must never be shared across fork(); each child builds its own
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_client_after_fork)
+
+def initialize_app():
+    """Initialize the Firebase Admin app from the service account file"""
+    if not firebase_admin._apps:
+        cred = credentials.Certificate(Config.get_firebase_credentials_path())
+        firebase_admin.initialize_app(cred)
+    return firebase_admin.get_app()
+
+def get_client():
+    """Get this process's shared Firestore client, creating it on first use"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                app = initialize_app()
+                _client = TunedClient(
+                    project=app.project_id,
+                    credentials=app.credential.get_credential(),
+                    channel_options=Config.get_firestore_channel_options()
+                )
+    return _client
+
+@firestore.transactional
+def _create_user(transaction, db, user_data):
+    """Claim the user's email and create the user document atomically"""
+    index_ref = db.collection('email_index').document(email_index_id(user_data['email']))
+    user_ref = db.collection('users').document(user_data['user_id'])
+    
+    # Check both keys in one round trip
+    for doc in transaction.get_all([index_ref, user_ref]):
+        if not doc.exists:
+            continue
+        if doc.id == index_ref.id:
+            raise EmailAlreadyRegistered()
+        raise UserIdCollision()
+    
+    transaction.create(index_ref, {
+        'email': normalize_email(user_data['email']),
+        'user_id': user_data['user_id'],
+        'created_at': user_data['created_at']
+    })
+    transaction.create(user_ref, user_data)
+
+# Writes a Firestore batch may hold
+MAX_BATCH_WRITES = 500
+
+def user_writes(db, user_data):
+    """The writes that create one user: its email claim, the user and its family_index entries"""
+    user_id = user_data['user_id']
+    updated_at = user_data.get('updated_at') or user_data.get('created_at')
+    writes = [
+        ('create', db.collection('email_index').document(email_index_id(user_data['email'])), {
+            'email': normalize_email(user_data['email']),
+            'user_id': user_id,
+            'created_at': user_data.get('created_at')
+        }),
+        ('create', db.collection('users').document(user_id), user_data)
+    ]
+    for member_id in user_data.get('family_members') or []:
+        writes.append(('set', db.collection('family_index').document(member_id), {
+            'listed_by': firestore.ArrayUnion([user_id]),
+            'updated_at': updated_at
+        }))
+    return writes
+
+def commit_writes(db, writes):
+    batch = db.batch()
+    for method, reference, data in writes:
+        if method == 'set':
+            batch.set(reference, data, merge=True)
+        else:
+            getattr(batch, method)(reference, data)
+    batch.commit()
+
+def alert_update_fields(update):
+    """Field transforms that append a repeated trigger's update to an alert"""
+    fields = {
+        'location_updates': firestore.ArrayUnion([update]),
+        'last_triggered_at': update['triggered_at']
+    }
+    for field in ('location', 'geo'):
+        if field in update:
+            fields[field] = update[field]
+    return fields
+
+def alert_page_query(query, fields=None, status=None, limit=None, start_after=None):
+    """Narrow an alerts query to one page, newest first"""
+    if status:
+        query = query.where('status', '==', status)
+    query = query.order_by('triggered_at', direction=firestore.Query.DESCENDING)
+    if fields:
+        query = query.select(fields)
+    if start_after:
+        query = query.start_after({'triggered_at': start_after})
+    if limit:
+        query = query.limit(limit)
+    return query
+
+def resolved_alerts_query(collection, resolved_before, limit):
+    """The oldest alerts resolved before a cutoff, with the fields their archive records need"""
+    return (collection
+            .where('status', '==', 'resolved')
+            .where('resolved_at', '<', resolved_before)
+            .order_by('resolved_at')
+            .select(['user_id', *ARCHIVE_FIELDS])
+            .limit(limit))
+
+def archive_batch(db, batch, alerts):
+    """Add the rollup merges and deletes that archive alerts to a write batch
+
+    Rollups are alert_archive/<user_id>_<month> documents whose ``alerts``
+    map is merged into, so concurrent archivers never drop each other's
+    alerts. A batch takes up to 500 writes: at most two per alert plus one
+    per rollup.
+    """
+    archive_ref = db.collection('alert_archive')
+    for (user_id, month), records in archive_rollups(alerts).items():
+        batch.set(archive_ref.document(f'{user_id}_{month}'), {
+            'user_id': user_id,
+            'month': month,
+            'alerts': records
+        }, merge=True)
+    for alert_id, _ in alerts:
+        batch.delete(db.collection('sos_alerts').document(alert_id))
+        batch.delete(db.collection('active_alerts').document(alert_id))
+    return batch
+
+def archive_query(collection, user_id, start_after=None):
+    """A user's rollups newest month first, from the month of ``start_after`` on"""
+    query = collection.where('user_id', '==', user_id)
+    if start_after:
+        query = query.where('month', '<=', start_after[:7])
+    return query.order_by('month', direction=firestore.Query.DESCENDING)
+
+def resolved_entry(alert):
+    """active_alerts entry of a resolved alert, with the expire_at its TTL policy deletes it by"""
+    entry = active_entry(alert)
+    entry['expire_at'] = datetime.now(timezone.utc) + timedelta(seconds=Config.ACTIVE_ALERTS_RETENTION)
+    return entry
+
+def active_snapshot_handler(on_change):
+    """on_snapshot callback that hands active_alerts changes to a watch_active_alerts callback"""
+    first = [True]
+    
+    def on_snapshot(docs, changes, read_time):
+        # A new listener's first snapshot is the whole collection
+        if first[0]:
+            first[0] = False
+            on_change([(doc.id, _entry(doc)) for doc in docs], True)
+            return
+        on_change([
+            (change.document.id, None if change.type.name == 'REMOVED' else _entry(change.document))
+            for change in changes
+        ], False)
+    return on_snapshot
+
+def revocation_record(revoked_at):
+    """session_revocations document, with the expire_at its TTL policy deletes it by"""
+    return {
+        'revoked_at': revoked_at,
+        'expire_at': datetime.now(timezone.utc) + timedelta(seconds=Config.SESSION_TOKEN_TTL)
+    }
+
+def inbox_record(user_id, entry):
+    """inbox document, with the expire_at its TTL policy deletes it by"""
+    expires_at = datetime.fromisoformat(entry['expires_at']).replace(tzinfo=timezone.utc)
+    return dict(entry, user_id=user_id, expire_at=expires_at)
+
+def shard_id(broadcast_id, shard):
+    return f'{broadcast_id}_{shard:03d}'
+
+@firestore.transactional
+def _claim_shard(transaction, shard_ref, owner, lease_until, now):
+    """Lease a shard to owner if it is still open and its lease has run out"""
+    shard_doc = next(iter(transaction.get_all([shard_ref])), None)
+    if shard_doc is None or not shard_doc.exists:
+        return None
+    shard = shard_doc.to_dict()
+    if shard['status'] != 'open' or shard['lease_until'] >= now:
+        return None
+    claim = {
+        'owner': owner,
+        'lease_until': lease_until,
+        'started_at': shard.get('started_at') or datetime.utcnow().isoformat()
+    }
+    transaction.update(shard_ref, claim)
+    return dict(shard, **claim)
+
+@firestore.transactional
+def _deliver_batch(transaction, shard_ref, inbox_ref, owner, broadcast_id, entries, progress):
+    """Write inbox entries and a shard's progress if owner still holds the shard"""
+    shard_doc = next(iter(transaction.get_all([shard_ref])), None)
+    if shard_doc is None or not shard_doc.exists or shard_doc.to_dict().get('owner') != owner:
+        return False
+    for user_id, entry in entries:
+        transaction.set(inbox_ref.document(f'{user_id}_{broadcast_id}'), inbox_record(user_id, entry))
+    transaction.update(shard_ref, progress)
+    return True
+
+@firestore.transactional
+def _claim_delivery(transaction, alert_ref, member_id, channel, expected, delivery):
+    """Replace a delivery status if it still reads as expected"""
+    alert_doc = next(iter(transaction.get_all([alert_ref])), None)
+    if alert_doc is None or not alert_doc.exists:
+        return False
+    current = (alert_doc.to_dict().get('delivery') or {}).get(member_id, {}).get(channel)
+    if current != expected:
+        return False
+    transaction.update(alert_ref, {f'delivery.{member_id}.{channel}': delivery})
+    return True
+
+def _entry(doc):
+    entry = doc.to_dict()
+    entry.pop('expire_at', None)
+    return entry
+
+class FirestoreStorage(Storage):
+    """Storage backed by Cloud Firestore"""
+    
+    name = 'firestore'
+    
+    def __init__(self, client=None):
+        self._client = client
+    
+    @property
+    def db(self):
+        return self._client or get_client()
+    
+    def warm_up(self):
+        # One cheap read opens the gRPC channel and fetches an access token
+        self.db.collection('users').document('_warmup').get(timeout=Config.FIRESTORE_WARMUP_TIMEOUT)
+    
+    def get_user(self, user_id):
+        user_doc = self.db.collection('users').document(user_id).get()
+        return user_doc.to_dict() if user_doc.exists else None
+    
+    def get_users(self, user_ids, fields=None):
+        db = self.db
+        users_ref = db.collection('users')
+        refs = [users_ref.document(user_id) for user_id in dict.fromkeys(user_ids)]
+        
+        users = {}
+        for doc in db.get_all(refs, field_paths=fields):
+            if doc.exists:
+                user_data = doc.to_dict()
+                user_data['user_id'] = doc.id
+                users[doc.id] = user_data
+        return users
+    
+    def create_user(self, user_data):
+        db = self.db
+        _create_user(db.transaction(), db, user_data)
+    
+    def create_users(self, users):
+        db = self.db
+        skipped = []
+        # Pack whole users into batches, each within Firestore's write limit
+        batches = []
+        size = MAX_BATCH_WRITES
+        for user_data in users:
+            writes = user_writes(db, user_data)
+            if size + len(writes) > MAX_BATCH_WRITES:
+                batches.append([])
+                size = 0
+            batches[-1].append((user_data['user_id'], writes))
+            size += len(writes)
+        
+        for batch in batches:
+            try:
+                commit_writes(db, [write for _, writes in batch for write in writes])
+            except AlreadyExists:
+                # One taken ID or email fails the whole batch; write the rest one by one
+                for user_id, writes in batch:
+                    try:
+                        commit_writes(db, writes)
+                    except AlreadyExists:
+                        skipped.append(user_id)
+        return skipped
+    
+    def find_emails(self, emails):
+        db = self.db
+        index_ref = db.collection('email_index')
+        refs = [index_ref.document(email_index_id(email)) for email in dict.fromkeys(emails)]
+        return {doc.get('email') for doc in db.get_all(refs, field_paths=['email']) if doc.exists}
+    
+    def scan_users(self, limit, start_after=None):
+        query = self.db.collection('users').order_by('__name__').limit(limit)
+        if start_after:
+            query = query.start_after({'__name__': start_after})
+        return [dict(user_doc.to_dict(), user_id=user_doc.id) for user_doc in query.stream()]
+    
+    def update_user(self, user_id, fields):
+        self.db.collection('users').document(user_id).update(fields)
+    
+    def update_users(self, updates):
+        db = self.db
+        users_ref = db.collection('users')
+        batch = db.batch()
+        for user_id, fields in updates.items():
+            batch.update(users_ref.document(user_id), fields)
+        try:
+            batch.commit()
+        except NotFound:
+            # One missing user fails the whole batch; write the rest one by one
+            for user_id, fields in updates.items():
+                try:
+                    users_ref.document(user_id).update(fields)
+                except NotFound:
+                    logger.warning('Skipped buffered update for missing user %s', user_id)
+    
+    def add_family_member(self, user_id, member_id, reciprocal=False, updated_at=None):
+        return self._update_family(firestore.ArrayUnion, user_id, member_id, reciprocal, updated_at)
+    
+    def remove_family_member(self, user_id, member_id, reciprocal=False, updated_at=None):
+        return self._update_family(firestore.ArrayRemove, user_id, member_id, reciprocal, updated_at)
+    
+    def _update_family(self, transform, user_id, member_id, reciprocal, updated_at):
+        # Server-side array transforms let concurrent edits merge instead of
+        # overwriting each other; the reverse link commits in the same batch
+        db = self.db
+        users_ref = db.collection('users')
+        index_ref = db.collection('family_index')
+        batch = db.batch()
+        batch.update(users_ref.document(user_id), {
+            'family_members': transform([member_id]),
+            'family_version': firestore.Increment(1),
+            'updated_at': updated_at
+        })
+        # family_index/<member> lists who has the member in their family
+        batch.set(index_ref.document(member_id), {
+            'listed_by': transform([user_id]),
+            'updated_at': updated_at
+        }, merge=True)
+        if reciprocal:
+            batch.update(users_ref.document(member_id), {
+                'family_members': transform([user_id]),
+                'family_version': firestore.Increment(1),
+                'updated_at': updated_at
+            })
+            batch.set(index_ref.document(user_id), {
+                'listed_by': transform([member_id]),
+                'updated_at': updated_at
+            }, merge=True)
+        batch.commit()
+        # The increment is applied on the server; read back the version it left
+        user_doc = users_ref.document(user_id).get(field_paths=['family_version'])
+        return (user_doc.to_dict() or {}).get('family_version', 0)
+    
+    def get_listed_by(self, member_id):
+        index_doc = self.db.collection('family_index').document(member_id).get()
+        return (index_doc.to_dict() or {}).get('listed_by', [])
+    
+    def revoke_sessions(self, user_id, revoked_at):
+        self.db.collection('session_revocations').document(user_id).set(revocation_record(revoked_at))
+    
+    def list_revocations(self, since=None):
+        query = self.db.collection('session_revocations')
+        if since:
+            query = query.where('revoked_at', '>', since)
+        return {doc.id: doc.get('revoked_at') for doc in query.select(['revoked_at']).stream()}
+    
+    def create_alert(self, alert):
+        db = self.db
+        sos_ref = db.collection('sos_alerts').document()
+        # The alert and its active_alerts entry commit together
+        batch = db.batch()
+        batch.set(sos_ref, alert_document(alert))
+        batch.set(db.collection('active_alerts').document(sos_ref.id), active_entry(alert))
+        batch.commit()
+        return sos_ref.id
+    
+    def create_alerts(self, alerts):
+        db = self.db
+        batch = db.batch()
+        for alert_id, alert in alerts.items():
+            self._create_alert(batch, alert_id, alert)
+        try:
+            batch.commit()
+        except AlreadyExists:
+            # One alert already stored fails the whole batch; write the rest one by one
+            for alert_id, alert in alerts.items():
+                batch = db.batch()
+                self._create_alert(batch, alert_id, alert)
+                try:
+                    batch.commit()
+                except AlreadyExists:
+                    pass
+    
+    def _create_alert(self, batch, alert_id, alert):
+        # create() fails if the alert exists, so a replay never resets its entry
+        batch.create(self.db.collection('sos_alerts').document(alert_id), alert_document(alert))
+        batch.set(self.db.collection('active_alerts').document(alert_id), active_entry(alert))
+    
+    def import_alerts(self, alerts):
+        # An alert and its entry take two writes
+        alert_ids = list(alerts)
+        step = MAX_BATCH_WRITES // 2
+        for start in range(0, len(alert_ids), step):
+            chunk = alert_ids[start:start + step]
+            try:
+                self._import_alerts(chunk, alerts)
+            except AlreadyExists:
+                for alert_id in chunk:
+                    try:
+                        self._import_alerts([alert_id], alerts)
+                    except AlreadyExists:
+                        pass
+    
+    def _import_alerts(self, alert_ids, alerts):
+        db = self.db
+        batch = db.batch()
+        for alert_id in alert_ids:
+            alert = alerts[alert_id]
+            batch.create(db.collection('sos_alerts').document(alert_id), alert_document(alert))
+            if alert.get('status') == 'active':
+                batch.set(db.collection('active_alerts').document(alert_id), active_entry(alert))
+        batch.commit()
+    
+    def scan_alerts(self, limit, start_after=None):
+        query = self.db.collection('sos_alerts').order_by('__name__').limit(limit)
+        if start_after:
+            query = query.start_after({'__name__': start_after})
+        return [(alert_doc.id, alert_doc.to_dict()) for alert_doc in query.stream()]
+    
+    def get_alert(self, alert_id):
+        sos_doc = self.db.collection('sos_alerts').document(alert_id).get()
+        return sos_doc.to_dict() if sos_doc.exists else None
+    
+    def update_alert(self, alert_id, fields):
+        self.db.collection('sos_alerts').document(alert_id).update(fields)
+    
+    def append_alert_update(self, alert_id, update):
+        db = self.db
+        batch = db.batch()
+        batch.update(db.collection('sos_alerts').document(alert_id), alert_update_fields(update))
+        batch.update(db.collection('active_alerts').document(alert_id), active_entry_update(update))
+        batch.commit()
+    
+    def resolve_alert(self, alert_id, alert):
+        db = self.db
+        batch = db.batch()
+        batch.update(db.collection('sos_alerts').document(alert_id), {
+            'status': alert['status'],
+            'resolved_at': alert['resolved_at']
+        })
+        batch.set(db.collection('active_alerts').document(alert_id), resolved_entry(alert), merge=True)
+        batch.commit()
+    
+    def list_active_alerts(self):
+        return [(doc.id, _entry(doc)) for doc in self.db.collection('active_alerts').stream()]
+    
+    def watch_active_alerts(self, on_change):
+        return self.db.collection('active_alerts').on_snapshot(active_snapshot_handler(on_change))
+    
+    def set_delivery_status(self, alert_id, member_id, channel, delivery):
+        self.db.collection('sos_alerts').document(alert_id).update({
+            f'delivery.{member_id}.{channel}': delivery
+        })
+    
+    def claim_delivery(self, alert_id, member_id, channel, expected, delivery):
+        alert_ref = self.db.collection('sos_alerts').document(alert_id)
+        return _claim_delivery(self.db.transaction(), alert_ref, member_id, channel, expected, delivery)
+    
+    def list_pending_deliveries(self):
+        # Open alerts are few; the pending ones are picked out here
+        query = self.db.collection('sos_alerts').where('status', '==', 'active')
+        alerts = []
+        for alert_doc in query.stream():
+            alert = alert_doc.to_dict()
+            if any(delivery.get('status') == 'pending'
+                   for channels in (alert.get('delivery') or {}).values() for delivery in channels.values()):
+                alerts.append((alert_doc.id, alert))
+        return alerts
+    
+    def list_alerts_in_cells(self, cells, status='active', fields=None):
+        # One query for every cell; composite index in firestore.indexes.json
+        query = (self.db.collection('sos_alerts')
+                 .where('status', '==', status)
+                 .where('geo.cells', 'array_contains_any', list(cells)))
+        if fields:
+            query = query.select(fields)
+        return [(alert_doc.id, alert_doc.to_dict()) for alert_doc in query.stream()]
+    
+    def list_alerts(self, user_id, fields=None, status=None, limit=None, start_after=None):
+        # Composite indexes for these queries are in firestore.indexes.json
+        query = self.db.collection('sos_alerts').where('user_id', '==', user_id)
+        query = alert_page_query(query, fields, status, limit, start_after)
+        return [(alert_doc.id, alert_doc.to_dict()) for alert_doc in query.get()]
+    
+    def list_member_alerts(self, member_id, fields=None, status=None, limit=None, start_after=None):
+        query = self.db.collection('sos_alerts').where('family_notified', 'array_contains', member_id)
+        query = alert_page_query(query, fields, status, limit, start_after)
+        return [(alert_doc.id, alert_doc.to_dict()) for alert_doc in query.get()]
+    
+    def list_resolved_alerts(self, resolved_before, limit):
+        query = resolved_alerts_query(self.db.collection('sos_alerts'), resolved_before, limit)
+        return [(alert_doc.id, alert_doc.to_dict()) for alert_doc in query.stream()]
+    
+    def archive_alerts(self, alerts):
+        db = self.db
+        archive_batch(db, db.batch(), alerts).commit()
+    
+    def list_archived_alerts(self, user_id, status=None, limit=None, start_after=None):
+        # Rollups are streamed, so a page only reads the months it needs
+        query = archive_query(self.db.collection('alert_archive'), user_id, start_after)
+        rollups = (rollup_doc.get('alerts') or {} for rollup_doc in query.stream())
+        return archived_page(user_id, rollups, status, limit, start_after)
+    
+    def has_archived_alerts(self):
+        return bool(self.db.collection('alert_archive').select(['month']).limit(1).get())
+    
+    def list_zone_users(self, zone, slots, limit, start_after=None):
+        # Composite index on (zone, zone_slot) in firestore.indexes.json
+        first, end = slots
+        query = (self.db.collection('users')
+                 .where('zone', '==', zone)
+                 .where('zone_slot', '>=', first)
+                 .where('zone_slot', '<', end)
+                 .order_by('zone_slot')
+                 .order_by('__name__')
+                 .select(['zone_slot'])
+                 .limit(limit))
+        if start_after:
+            query = query.start_after({'zone_slot': start_after[0], '__name__': start_after[1]})
+        return [(user_doc.get('zone_slot'), user_doc.id) for user_doc in query.stream()]
+    
+    def create_broadcast(self, broadcast_id, broadcast, shards):
+        db = self.db
+        batch = db.batch()
+        batch.create(db.collection('broadcasts').document(broadcast_id), broadcast)
+        for shard in shards:
+            batch.create(db.collection('broadcast_shards').document(shard_id(broadcast_id, shard['shard'])), shard)
+        batch.commit()
+    
+    def get_broadcast(self, broadcast_id):
+        db = self.db
+        broadcast_doc = db.collection('broadcasts').document(broadcast_id).get()
+        if not broadcast_doc.exists:
+            return None
+        query = db.collection('broadcast_shards').where('broadcast_id', '==', broadcast_id)
+        shards = sorted((shard_doc.to_dict() for shard_doc in query.stream()), key=lambda shard: shard['shard'])
+        return broadcast_doc.to_dict(), shards
+    
+    def claim_broadcast_shard(self, owner, lease_until, now):
+        db = self.db
+        shards_ref = db.collection('broadcast_shards')
+        # A few candidates, in case other workers claim the first ones first
+        query = (shards_ref
+                 .where('status', '==', 'open')
+                 .where('lease_until', '<', now)
+                 .order_by('lease_until')
+                 .select(['broadcast_id', 'shard'])
+                 .limit(5))
+        for shard_doc in query.stream():
+            shard = _claim_shard(db.transaction(), shards_ref.document(shard_doc.id), owner, lease_until, now)
+            if shard is not None:
+                return shard
+        return None
+    
+    def deliver_broadcast_batch(self, broadcast_id, shard, owner, entries, progress):
+        db = self.db
+        # A transaction rather than a batch: the writes depend on the lease
+        shard_ref = db.collection('broadcast_shards').document(shard_id(broadcast_id, shard))
+        return _deliver_batch(db.transaction(), shard_ref, db.collection('inbox'), owner, broadcast_id,
+                              entries, progress)
+    
+    def list_inbox(self, user_id, since, limit=None, start_after=None):
+        query = (self.db.collection('inbox')
+                 .where('user_id', '==', user_id)
+                 .where('created_at', '>', since)
+                 .order_by('created_at', direction=firestore.Query.DESCENDING))
+        if start_after:
+            query = query.start_after({'created_at': start_after})
+        if limit:
+            query = query.limit(limit)
+        entries = []
+        for entry_doc in query.stream():
+            entry = _entry(entry_doc)
+            entry.pop('user_id', None)
+            entries.append(entry)
+        return entries
@@ -0,0 +1,957 @@
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from config import Config
+from api.storage.base import (
+    Storage, EmailAlreadyRegistered, UserIdCollision, normalize_email, active_entry, active_entry_update,
+    alert_document, ARCHIVE_FIELDS, archive_rollups, archived_page
+)
+
+logger = logging.getLogger('sangam.storage')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    email TEXT NOT NULL,
+    email_normalized TEXT NOT NULL UNIQUE,
+    mobile_number TEXT,
+    created_at TEXT,
+    last_login TEXT,
+    updated_at TEXT,
+    is_active INTEGER NOT NULL DEFAULT 1,
+    family_version INTEGER NOT NULL DEFAULT 0,
+    zone TEXT,
+    zone_slot INTEGER,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+
+CREATE TABLE IF NOT EXISTS family_links (
+    user_id TEXT NOT NULL,
+    member_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    PRIMARY KEY (user_id, member_id)
+);
+CREATE INDEX IF NOT EXISTS family_links_by_position ON family_links (user_id, position);
+CREATE INDEX IF NOT EXISTS family_links_by_member ON family_links (member_id);
+
+CREATE TABLE IF NOT EXISTS sos_alerts (
+    alert_id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    triggered_at TEXT NOT NULL,
+    status TEXT NOT NULL,
+    resolved_at TEXT,
+    location TEXT,
+    message TEXT,
+    family_notified TEXT NOT NULL DEFAULT '[]',
+    geohash TEXT,
+    extra TEXT NOT NULL DEFAULT '{}'
+);
+CREATE INDEX IF NOT EXISTS sos_alerts_by_user ON sos_alerts (user_id, triggered_at);
+CREATE INDEX IF NOT EXISTS sos_alerts_by_user_status ON sos_alerts (user_id, status, triggered_at);
+CREATE INDEX IF NOT EXISTS sos_alerts_by_status_resolved ON sos_alerts (status, resolved_at);
+
+CREATE TABLE IF NOT EXISTS sos_deliveries (
+    alert_id TEXT NOT NULL,
+    member_id TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    delivery TEXT NOT NULL,
+    PRIMARY KEY (alert_id, member_id, channel)
+);
+
+-- Reverse index of family_notified: the alerts each member was notified of
+CREATE TABLE IF NOT EXISTS alert_recipients (
+    member_id TEXT NOT NULL,
+    triggered_at TEXT NOT NULL,
+    alert_id TEXT NOT NULL,
+    PRIMARY KEY (member_id, triggered_at, alert_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS active_alerts (
+    alert_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    entry TEXT NOT NULL,
+    expire_at REAL
+);
+
+-- Archived alerts: per user and month, a zlib-compressed JSON map of alert
+-- IDs to archive records
+CREATE TABLE IF NOT EXISTS alert_archive (
+    user_id TEXT NOT NULL,
+    month TEXT NOT NULL,
+    alerts BLOB NOT NULL,
+    PRIMARY KEY (user_id, month)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS session_revocations (
+    user_id TEXT PRIMARY KEY,
+    revoked_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS session_revocations_by_time ON session_revocations (revoked_at);
+
+CREATE TABLE IF NOT EXISTS broadcasts (
+    broadcast_id TEXT PRIMARY KEY,
+    record TEXT NOT NULL
+);
+
+-- Shard records as JSON, with the fields claims filter on in columns
+CREATE TABLE IF NOT EXISTS broadcast_shards (
+    broadcast_id TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    lease_until REAL NOT NULL,
+    record TEXT NOT NULL,
+    PRIMARY KEY (broadcast_id, shard)
+);
+CREATE INDEX IF NOT EXISTS broadcast_shards_by_lease ON broadcast_shards (status, lease_until);
+
+-- Broadcast inbox entries, newest first per user
+CREATE TABLE IF NOT EXISTS inbox (
+    user_id TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    broadcast_id TEXT NOT NULL,
+    entry TEXT NOT NULL,
+    PRIMARY KEY (user_id, created_at, broadcast_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS inbox_by_created ON inbox (created_at);
+"""
+
+# Columns added after a table was first released: (table, column, definition)
+ADDED_COLUMNS = [
+    ('sos_alerts', 'geohash', 'TEXT'),
+    ('users', 'family_version', 'INTEGER NOT NULL DEFAULT 0'),
+    ('users', 'zone', 'TEXT'),
+    ('users', 'zone_slot', 'INTEGER')
+]
+
+# Indexes on added columns, created once the columns exist
+ADDED_INDEXES = """
+CREATE INDEX IF NOT EXISTS sos_alerts_by_status_geohash ON sos_alerts (status, geohash);
+CREATE INDEX IF NOT EXISTS users_by_zone ON users (zone, zone_slot, user_id) WHERE zone IS NOT NULL;
+"""
+
+# Top-level fields stored in their own columns; anything else goes in `extra`
+USER_COLUMNS = ('user_id', 'username', 'email', 'mobile_number', 'created_at',
+                'last_login', 'updated_at', 'is_active', 'family_version', 'zone', 'zone_slot')
+ALERT_COLUMNS = ('user_id', 'triggered_at', 'status', 'resolved_at', 'location',
+                 'message', 'family_notified')
+
+# Columns holding JSON-encoded values
+JSON_COLUMNS = ('location', 'family_notified')
+
+FAMILY_MEMBERS_SQL = (
+    "(SELECT json_group_array(member_id) FROM "
+    "(SELECT member_id FROM family_links f WHERE f.user_id = users.user_id ORDER BY position))"
+)
+DELIVERIES_SQL = (
+    "(SELECT json_group_array(json_array(member_id, channel, json(delivery))) "
+    "FROM sos_deliveries d WHERE d.alert_id = sos_alerts.alert_id)"
+)
+
+def pack_rollup(records):
+    """Encode an alert_archive rollup"""
+    return zlib.compress(json.dumps(records, separators=(',', ':')).encode('utf-8'))
+
+def unpack_rollup(blob):
+    return json.loads(zlib.decompress(blob))
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections shared by request threads
+
+    Connections are opened lazily in WAL mode and keep a per-connection
+    prepared statement cache. The pool resets itself after a fork so
+    workers never share a connection with their parent.
+    """
+    
+    def __init__(self, path, size=8, timeout=5.0, on_connect=None):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self._on_connect = on_connect
+        self._reset()
+    
+    def _reset(self):
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._pid = os.getpid()
+    
+    def _connect(self):
+        conn = sqlite3.connect(
+            self.path,
+            timeout=self.timeout,
+            isolation_level=None,
+            check_same_thread=False,
+            cached_statements=256
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA busy_timeout={int(self.timeout * 1000)}')
+        if self._on_connect:
+            self._on_connect(conn)
+        return conn
+    
+    @contextmanager
+    def connection(self):
+        if self._pid != os.getpid():
+            self._reset()
+        
+        if not self._slots.acquire(timeout=self.timeout):
+            raise TimeoutError('Timed out waiting for a SQLite connection')
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            try:
+                yield conn
+            finally:
+                self._idle.put(conn)
+        finally:
+            self._slots.release()
+
+class SQLiteStorage(Storage):
+    """Storage backed by an embedded SQLite database
+
+    For self-hosted and offline deployments and for benchmarks. Every
+    endpoint maps to one statement served by an index.
+    """
+    
+    name = 'sqlite'
+    
+    def __init__(self, path, pool_size=8, timeout=5.0):
+        self.path = path
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+        self._pool = ConnectionPool(path, pool_size, timeout, on_connect=self._ensure_schema)
+    
+    def warm_up(self):
+        with self._pool.connection() as conn:
+            conn.execute("SELECT 1").fetchone()
+    
+    def _ensure_schema(self, conn):
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if not self._schema_ready:
+                tables = {row['name'] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+                conn.executescript(SCHEMA)
+                self._add_columns(conn)
+                conn.executescript(ADDED_INDEXES)
+                self._backfill_active_alerts(conn)
+                if 'sos_alerts' in tables and 'alert_recipients' not in tables:
+                    self._backfill_alert_recipients(conn)
+                self._schema_ready = True
+    
+    @staticmethod
+    def _add_columns(conn):
+        """Bring databases created by older releases up to SCHEMA"""
+        for table, column, definition in ADDED_COLUMNS:
+            existing = {row['name'] for row in conn.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+    
+    def _backfill_active_alerts(self, conn):
+        """Add active_alerts entries for active alerts created before the table existed"""
+        rows = conn.execute(
+            "SELECT * FROM sos_alerts WHERE status = 'active' "
+            "AND alert_id NOT IN (SELECT alert_id FROM active_alerts)"
+        ).fetchall()
+        conn.executemany(
+            "INSERT OR IGNORE INTO active_alerts (alert_id, status, entry) VALUES (?, 'active', ?)",
+            [(alert_id, json.dumps(active_entry(alert))) for alert_id, alert in self._alert_records(rows)]
+        )
+    
+    @staticmethod
+    def _backfill_alert_recipients(conn):
+        """Index the recipients of alerts stored before alert_recipients existed"""
+        conn.execute(
+            "INSERT OR IGNORE INTO alert_recipients (member_id, triggered_at, alert_id) "
+            "SELECT member.value, sos_alerts.triggered_at, sos_alerts.alert_id "
+            "FROM sos_alerts, json_each(sos_alerts.family_notified) AS member"
+        )
+    
+    @contextmanager
+    def _transaction(self):
+        with self._pool.connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+    
+    # Row conversion
+    
+    @staticmethod
+    def _split(record, columns):
+        """Split a record into column values and the JSON `extra` remainder"""
+        values = {}
+        extra = {}
+        for key, value in record.items():
+            if key in columns:
+                values[key] = json.dumps(value) if key in JSON_COLUMNS else value
+            else:
+                extra[key] = value
+        return values, extra
+    
+    @staticmethod
+    def _to_dict(row):
+        record = {}
+        for key in row.keys():
+            value = row[key]
+            if key == 'extra':
+                record.update(json.loads(value))
+            elif key in ('family_members', 'family_notified', 'location') and value is not None:
+                record[key] = json.loads(value)
+            elif key == 'geohash':
+                # Index column only; the alert's geohash is in `geo`
+                continue
+            elif key == 'is_active':
+                record[key] = bool(value)
+            elif key == 'deliveries':
+                delivery = {}
+                for member_id, channel, status in json.loads(value):
+                    delivery.setdefault(member_id, {})[channel] = status
+                record['delivery'] = delivery
+            else:
+                record[key] = value
+        return record
+    
+    @staticmethod
+    def _alert_columns(fields):
+        if fields is None:
+            return f"sos_alerts.*, {DELIVERIES_SQL} AS deliveries"
+        # Qualified so the columns can be selected from a join
+        columns = ', '.join(
+            f"sos_alerts.{column}" for column in ['alert_id'] + [field for field in fields if field in ALERT_COLUMNS]
+        )
+        if any(field not in ALERT_COLUMNS for field in fields):
+            columns += ', sos_alerts.extra'
+        return columns
+    
+    def _alert_records(self, rows):
+        alerts = []
+        for row in rows:
+            record = self._to_dict(row)
+            alerts.append((record.pop('alert_id'), record))
+        return alerts
+    
+    @staticmethod
+    def _user_columns(fields):
+        if fields is None:
+            return f"users.*, {FAMILY_MEMBERS_SQL} AS family_members"
+        columns = ['user_id'] + [field for field in fields if field in USER_COLUMNS and field != 'user_id']
+        if 'family_members' in fields:
+            columns.append(f"{FAMILY_MEMBERS_SQL} AS family_members")
+        if any(field not in USER_COLUMNS and field != 'family_members' for field in fields):
+            columns.append('extra')
+        return ', '.join(columns)
+    
+    # Users and family links
+    
+    def get_user(self, user_id):
+        with self._pool.connection() as conn:
+            row = conn.execute(
+                f"SELECT {self._user_columns(None)} FROM users WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return self._user_record(row) if row else None
+    
+    def _user_record(self, row, fields=None):
+        record = self._to_dict(row)
+        record.pop('email_normalized', None)
+        # Users outside any zone have no zone fields, as in Firestore
+        for field in ('zone', 'zone_slot'):
+            if field in record and record[field] is None:
+                del record[field]
+        if fields is not None:
+            record = {key: value for key, value in record.items() if key in fields or key == 'user_id'}
+        return record
+    
+    def get_users(self, user_ids, fields=None):
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            return {}
+        placeholders = ', '.join('?' * len(user_ids))
+        with self._pool.connection() as conn:
+            rows = conn.execute(
+                f"SELECT {self._user_columns(fields)} FROM users WHERE user_id IN ({placeholders})", user_ids
+            ).fetchall()
+        return {row['user_id']: self._user_record(row, fields) for row in rows}
+    
+    def create_user(self, user_data):
+        try:
+            with self._transaction() as conn:
+                self._insert_user(conn, user_data)
+        except sqlite3.IntegrityError as e:
+            if 'email_normalized' in str(e):
+                raise EmailAlreadyRegistered() from e
+            raise UserIdCollision() from e
+    
+    def create_users(self, users):
+        skipped = []
+        with self._transaction() as conn:
+            for user_data in users:
+                if not self._insert_user(conn, user_data, or_ignore=True):
+                    skipped.append(user_data['user_id'])
+        return skipped
+    
+    def _insert_user(self, conn, user_data, or_ignore=False):
+        """Insert a user and its family links; returns False if OR IGNORE skipped a taken ID or email"""
+        values, extra = self._split(user_data, USER_COLUMNS)
+        family_members = extra.pop('family_members', [])
+        values['email_normalized'] = normalize_email(user_data['email'])
+        values['is_active'] = int(values.get('is_active', True))
+        values['extra'] = json.dumps(extra)
+        columns = ', '.join(values)
+        placeholders = ', '.join('?' * len(values))
+        
+        cursor = conn.execute(
+            f"INSERT {'OR IGNORE ' if or_ignore else ''}INTO users ({columns}) VALUES ({placeholders})",
+            list(values.values())
+        )
+        if cursor.rowcount == 0:
+            return False
+        conn.executemany(
+            "INSERT OR IGNORE INTO family_links (user_id, member_id, position) VALUES (?, ?, ?)",
+            [(user_data['user_id'], member_id, position) for position, member_id in enumerate(family_members, 1)]
+        )
+        return True
+    
+    def find_emails(self, emails):
+        emails = list(dict.fromkeys(normalize_email(email) for email in emails))
+        found = set()
+        with self._pool.connection() as conn:
+            # In chunks that stay under SQLite's bound parameter limit
+            for start in range(0, len(emails), 500):
+                chunk = emails[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT email_normalized FROM users WHERE email_normalized IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                found.update(row['email_normalized'] for row in rows)
+        return found
+    
+    def scan_users(self, limit, start_after=None):
+        with self._pool.connection() as conn:
+            rows = conn.execute(
+                f"SELECT {self._user_columns(None)} FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?",
+                (start_after or '', limit)
+            ).fetchall()
+        return [self._user_record(row) for row in rows]
+    
+    def _update_statement(self, table, key_column, fields, columns):
+        """UPDATE statement and parameters, without the key, or None if there is nothing to set"""
+        values, extra = self._split(fields, columns)
+        if 'is_active' in values:
+            values['is_active'] = int(values['is_active'])
+        assignments = [f"{column} = ?" for column in values]
+        params = list(values.values())
+        for field, value in extra.items():
+            assignments.append("extra = json_set(extra, ?, json(?))")
+            params.extend([f'$."{field}"', json.dumps(value)])
+        if not assignments:
+            return None
+        return f"UPDATE {table} SET {', '.join(assignments)} WHERE {key_column} = ?", params
+    
+    def _update(self, table, key_column, key, fields, columns):
+        statement = self._update_statement(table, key_column, fields, columns)
+        if statement is None:
+            return
+        
+        sql, params = statement
+        with self._pool.connection() as conn:
+            cursor = conn.execute(sql, params + [key])
+        if cursor.rowcount == 0:
+            raise KeyError(f'No {table} row to update: {key}')
+    
+    def update_user(self, user_id, fields):
+        fields = dict(fields)
+        fields.pop('family_members', None)
+        self._update('users', 'user_id', user_id, fields, USER_COLUMNS)
+    
+    def update_users(self, updates):
+        with self._transaction() as conn:
+            for user_id, fields in updates.items():
+                fields = {field: value for field, value in fields.items() if field != 'family_members'}
+                statement = self._update_statement('users', 'user_id', fields, USER_COLUMNS)
+                if statement is not None:
+                    sql, params = statement
+                    conn.execute(sql, params + [user_id])
+    
+    def add_family_member(self, user_id, member_id, reciprocal=False, updated_at=None):
+        links = [(user_id, member_id)] + ([(member_id, user_id)] if reciprocal else [])
+        with self._transaction() as conn:
+            for owner_id, linked_id in links:
+                conn.execute(
+                    "INSERT OR IGNORE INTO family_links (user_id, member_id, position) "
+                    "VALUES (?, ?, (SELECT COALESCE(MAX(position), 0) + 1 FROM family_links WHERE user_id = ?))",
+                    (owner_id, linked_id, owner_id)
+                )
+                conn.execute(
+                    "UPDATE users SET updated_at = ?, family_version = family_version + 1 WHERE user_id = ?",
+                    (updated_at, owner_id)
+                )
+            return self._family_version(conn, user_id)
+    
+    def remove_family_member(self, user_id, member_id, reciprocal=False, updated_at=None):
+        links = [(user_id, member_id)] + ([(member_id, user_id)] if reciprocal else [])
+        with self._transaction() as conn:
+            for owner_id, linked_id in links:
+                conn.execute(
+                    "DELETE FROM family_links WHERE user_id = ? AND member_id = ?", (owner_id, linked_id)
+                )
+                conn.execute(
+                    "UPDATE users SET updated_at = ?, family_version = family_version + 1 WHERE user_id = ?",
+                    (updated_at, owner_id)
+                )
+            return self._family_version(conn, user_id)
+    
+    @staticmethod
+    def _family_version(conn, user_id):
+        row = conn.execute("SELECT family_version FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return row['family_version'] if row is not None else None
+    
+    def get_listed_by(self, member_id):
+        # family_links_by_member is the reverse index
+        with self._pool.connection() as conn:
+            rows = conn.execute("SELECT user_id FROM family_links WHERE member_id = ?", (member_id,)).fetchall()
+        return [row['user_id'] for row in rows]
+    
+    # Sessions
+    
+    def revoke_sessions(self, user_id, revoked_at):
+        # Revocations older than the token lifetime no longer revoke anything
+        cutoff = (datetime.utcnow() - timedelta(seconds=Config.SESSION_TOKEN_TTL)).isoformat()
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO session_revocations (user_id, revoked_at) VALUES (?, ?)",
+                (user_id, revoked_at)
+            )
+            conn.execute("DELETE FROM session_revocations WHERE revoked_at < ?", (cutoff,))
+    
+    def list_revocations(self, since=None):
+        with self._pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT user_id, revoked_at FROM session_revocations WHERE revoked_at > ?", (since or '',)
+            ).fetchall()
+        return {row['user_id']: row['revoked_at'] for row in rows}
+    
+    # SOS alerts
+    
+    def create_alert(self, alert):
+        alert_id = uuid.uuid4().hex[:20]
+        with self._transaction() as conn:
+            self._insert_alert(conn, alert_id, alert)
+        return alert_id
+    
+    def create_alerts(self, alerts):
+        with self._transaction() as conn:
+            for alert_id, alert in alerts.items():
+                if conn.execute("SELECT 1 FROM sos_alerts WHERE alert_id = ?", (alert_id,)).fetchone() is None:
+                    self._insert_alert(conn, alert_id, alert)
+    
+    def import_alerts(self, alerts):
+        with self._transaction() as conn:
+            for alert_id, alert in alerts.items():
+                if conn.execute("SELECT 1 FROM sos_alerts WHERE alert_id = ?", (alert_id,)).fetchone() is None:
+                    self._insert_alert(conn, alert_id, alert, entry=alert.get('status') == 'active')
+    
+    def scan_alerts(self, limit, start_after=None):
+        with self._pool.connection() as conn:
+            rows = conn.execute(
+                f"SELECT {self._alert_columns(None)} FROM sos_alerts WHERE alert_id > ? ORDER BY alert_id LIMIT ?",
+                (start_after or '', limit)
+            ).fetchall()
+        return self._alert_records(rows)
+    
+    def _insert_alert(self, conn, alert_id, alert, entry=True):
+        values, extra = self._split(alert_document(alert), ALERT_COLUMNS)
+        delivery = extra.pop('delivery', {})
+        values['alert_id'] = alert_id
+        values['geohash'] = (alert.get('geo') or {}).get('geohash')
+        values['extra'] = json.dumps(extra)
+        columns = ', '.join(values)
+        placeholders = ', '.join('?' * len(values))
+        
+        conn.execute(f"INSERT INTO sos_alerts ({columns}) VALUES ({placeholders})", list(values.values()))
+        if entry:
+            conn.execute(
+                "INSERT OR REPLACE INTO active_alerts (alert_id, status, entry) VALUES (?, ?, ?)",
+                (alert_id, alert['status'], json.dumps(active_entry(alert)))
+            )
+        conn.executemany(
+            "INSERT OR IGNORE INTO alert_recipients (member_id, triggered_at, alert_id) VALUES (?, ?, ?)",
+            [(member_id, alert['triggered_at'], alert_id) for member_id in alert.get('family_notified', [])]
+        )
+        # A delivery already recorded for the alert is newer than its initial status
+        conn.executemany(
+            "INSERT OR IGNORE INTO sos_deliveries (alert_id, member_id, channel, delivery) VALUES (?, ?, ?, ?)",
+            [
+                (alert_id, member_id, channel, json.dumps(status))
+                for member_id, channels in delivery.items()
+                for channel, status in channels.items()
+            ]
+        )
+    
+    def get_alert(self, alert_id):
+        with self._pool.connection() as conn:
+            row = conn.execute(
+                f"SELECT sos_alerts.*, {DELIVERIES_SQL} AS deliveries FROM sos_alerts WHERE alert_id = ?",
+                (alert_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        record = self._to_dict(row)
+        record.pop('alert_id', None)
+        return record
+    
+    def update_alert(self, alert_id, fields):
+        self._update('sos_alerts', 'alert_id', alert_id, fields, ALERT_COLUMNS)
+    
+    def append_alert_update(self, alert_id, update):
+        location = json.dumps(update['location']) if 'location' in update else None
+        geo = update.get('geo')
+        encoded = json.dumps(update)
+        entry_fields = active_entry_update(update)
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE sos_alerts SET location = COALESCE(?, location), geohash = COALESCE(?, geohash), "
+                "extra = json_set(extra, "
+                "'$.location_updates', json_insert(COALESCE(json_extract(extra, '$.location_updates'), '[]'), '$[#]', json(?)), "
+                "'$.last_triggered_at', ?, "
+                "'$.geo', COALESCE(json(?), json_extract(extra, '$.geo'))) "
+                "WHERE alert_id = ? AND NOT EXISTS ("
+                "SELECT 1 FROM json_each(extra, '$.location_updates') WHERE json_each.value = json(?))",
+                (location, geo['geohash'] if geo else None, encoded, update['triggered_at'],
+                 json.dumps(geo) if geo else None, alert_id, encoded)
+            )
+            if cursor.rowcount == 0:
+                if conn.execute("SELECT 1 FROM sos_alerts WHERE alert_id = ?", (alert_id,)).fetchone() is None:
+                    raise KeyError(f'No sos_alerts row to update: {alert_id}')
+                # Already appended, as when a journal replays it
+                return
+            self._set_entry_fields(conn, alert_id, entry_fields)
+    
+    @staticmethod
+    def _set_entry_fields(conn, alert_id, fields):
+        paths = ', '.join('?, json(?)' for _ in fields)
+        params = []
+        for field, value in fields.items():
+            params.extend([f'$."{field}"', json.dumps(value)])
+        conn.execute(f"UPDATE active_alerts SET entry = json_set(entry, {paths}) WHERE alert_id = ?",
+                     params + [alert_id])
+    
+    def resolve_alert(self, alert_id, alert):
+        now = time.time()
+        with self._transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE sos_alerts SET status = ?, resolved_at = ? WHERE alert_id = ?",
+                (alert['status'], alert['resolved_at'], alert_id)
+            )
+            if cursor.rowcount == 0:
+                raise KeyError(f'No sos_alerts row to update: {alert_id}')
+            # Merged so the entry keeps the caller's details, which the stored alert lacks
+            conn.execute(
+                "INSERT INTO active_alerts (alert_id, status, entry, expire_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (alert_id) DO UPDATE SET status = excluded.status, "
+                "entry = json_patch(entry, excluded.entry), expire_at = excluded.expire_at",
+                (alert_id, alert['status'], json.dumps(active_entry(alert)), now + Config.ACTIVE_ALERTS_RETENTION)
+            )
+            # Resolved entries past their retention go on the next resolve
+            conn.execute("DELETE FROM active_alerts WHERE expire_at < ?", (now,))
+    
+    def list_active_alerts(self):
+        with self._pool.connection() as conn:
+            return self._active_entries(conn)
+    
+    @staticmethod
+    def _active_entries(conn):
+        rows = conn.execute(
+            "SELECT alert_id, entry FROM active_alerts WHERE expire_at IS NULL OR expire_at >= ?", (time.time(),)
+        ).fetchall()
+        return [(row['alert_id'], json.loads(row['entry'])) for row in rows]
+    
+    def watch_active_alerts(self, on_change):
+        watch = SQLiteWatch(self, on_change, Config.ACTIVE_ALERTS_POLL_SECONDS)
+        watch.start()
+        return watch
+    
+    def set_delivery_status(self, alert_id, member_id, channel, delivery):
+        with self._pool.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sos_deliveries (alert_id, member_id, channel, delivery) VALUES (?, ?, ?, ?)",
+                (alert_id, member_id, channel, json.dumps(delivery))
+            )
+    
+    def claim_delivery(self, alert_id, member_id, channel, expected, delivery):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT delivery FROM sos_deliveries WHERE alert_id = ? AND member_id = ? AND channel = ?",
+                (alert_id, member_id, channel)
+            ).fetchone()
+            if row is None or json.loads(row['delivery']) != expected:
+                return False
+            conn.execute(
+                "UPDATE sos_deliveries SET delivery = ? WHERE alert_id = ? AND member_id = ? AND channel = ?",
+                (json.dumps(delivery), alert_id, member_id, channel)
+            )
+        return True
+    
+    def list_pending_deliveries(self):
+        with self._pool.connection() as conn:
+            rows = conn.execute(
+                f"SELECT {self._alert_columns(None)} FROM sos_alerts WHERE status = 'active' AND EXISTS ("
+                "SELECT 1 FROM sos_deliveries d WHERE d.alert_id = sos_alerts.alert_id "
+                "AND json_extract(d.delivery, '$.status') = 'pending')"
+            ).fetchall()
+        return self._alert_records(rows)
+    
+    def list_alerts_in_cells(self, cells, status='active', fields=None):
+        cells = list(dict.fromkeys(cells))
+        if not cells:
+            return []
+        columns = self._alert_columns(fields)
+        # One range scan of the (status, geohash) index per cell
+        sql = " UNION ALL ".join(
+            f"SELECT {columns} FROM sos_alerts WHERE status = ? AND geohash >= ? AND geohash < ?"
+            for _ in cells
+        )
+        params = []
+        for cell in cells:
+            params.extend([status, cell, cell + '~'])
+        
+        with self._pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return self._alert_records(rows)
+    
+    def list_alerts(self, user_id, fields=None, status=None, limit=None, start_after=None):
+        sql = f"SELECT {self._alert_columns(fields)} FROM sos_alerts WHERE user_id = ?"
+        params = [user_id]
+        if status:
+            sql += " AND status = ?"
+            params.append(status)
+        if start_after:
+            sql += " AND triggered_at < ?"
+            params.append(start_after)
+        sql += " ORDER BY triggered_at DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        
+        with self._pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return self._alert_records(rows)
+    
+    def list_member_alerts(self, member_id, fields=None, status=None, limit=None, start_after=None):
+        # Served by the alert_recipients primary key, newest first
+        sql = (f"SELECT {self._alert_columns(fields)} FROM alert_recipients r "
+               "JOIN sos_alerts ON sos_alerts.alert_id = r.alert_id WHERE r.member_id = ?")
+        params = [member_id]
+        if status:
+            sql += " AND sos_alerts.status = ?"
+            params.append(status)
+        if start_after:
+            sql += " AND r.triggered_at < ?"
+            params.append(start_after)
+        sql += " ORDER BY r.triggered_at DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        
+        with self._pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return self._alert_records(rows)
+    
+    # Archive
+    
+    def list_resolved_alerts(self, resolved_before, limit):
+        # Served by the (status, resolved_at) index, oldest first
+        with self._pool.connection() as conn:
+            rows = conn.execute(
+                f"SELECT {self._alert_columns(['user_id', *ARCHIVE_FIELDS])} FROM sos_alerts "
+                "WHERE status = 'resolved' AND resolved_at < ? ORDER BY resolved_at LIMIT ?",
+                (resolved_before, limit)
+            ).fetchall()
+        return self._alert_records(rows)
+    
+    def archive_alerts(self, alerts):
+        with self._transaction() as conn:
+            for (user_id, month), records in archive_rollups(alerts).items():
+                row = conn.execute(
+                    "SELECT alerts FROM alert_archive WHERE user_id = ? AND month = ?", (user_id, month)
+                ).fetchone()
+                if row is not None:
+                    records = dict(unpack_rollup(row['alerts']), **records)
+                conn.execute(
+                    "INSERT OR REPLACE INTO alert_archive (user_id, month, alerts) VALUES (?, ?, ?)",
+                    (user_id, month, pack_rollup(records))
+                )
+            conn.executemany(
+                "DELETE FROM alert_recipients WHERE member_id = ? AND triggered_at = ? AND alert_id = ?",
+                [
+                    (member_id, alert['triggered_at'], alert_id)
+                    for alert_id, alert in alerts
+                    for member_id in alert.get('family_notified', [])
+                ]
+            )
+            alert_ids = [(alert_id,) for alert_id, _ in alerts]
+            for table in ('sos_alerts', 'sos_deliveries', 'active_alerts'):
+                conn.executemany(f"DELETE FROM {table} WHERE alert_id = ?", alert_ids)
+    
+    def list_archived_alerts(self, user_id, status=None, limit=None, start_after=None):
+        sql = "SELECT alerts FROM alert_archive WHERE user_id = ?"
+        params = [user_id]
+        if start_after:
+            sql += " AND month <= ?"
+            params.append(start_after[:7])
+        sql += " ORDER BY month DESC"
+        
+        with self._pool.connection() as conn:
+            # Rollups are decompressed one at a time until the page is full
+            cursor = conn.execute(sql, params)
+            try:
+                rollups = (unpack_rollup(row['alerts']) for row in cursor)
+                return archived_page(user_id, rollups, status, limit, start_after)
+            finally:
+                cursor.close()
+    
+    def has_archived_alerts(self):
+        with self._pool.connection() as conn:
+            return conn.execute("SELECT 1 FROM alert_archive LIMIT 1").fetchone() is not None
+    
+    # Zones and broadcasts
+    
+    def list_zone_users(self, zone, slots, limit, start_after=None):
+        # Served by the partial users_by_zone index
+        first, end = slots
+        after_slot, after_user = start_after or (first, '')
+        with self._pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT zone_slot, user_id FROM users WHERE zone = ? AND zone_slot >= ? AND zone_slot < ? "
+                "AND (zone_slot, user_id) > (?, ?) ORDER BY zone_slot, user_id LIMIT ?",
+                (zone, first, end, after_slot, after_user, limit)
+            ).fetchall()
+        return [(row['zone_slot'], row['user_id']) for row in rows]
+    
+    def create_broadcast(self, broadcast_id, broadcast, shards):
+        with self._transaction() as conn:
+            conn.execute(
+                "INSERT INTO broadcasts (broadcast_id, record) VALUES (?, ?)", (broadcast_id, json.dumps(broadcast))
+            )
+            conn.executemany(
+                "INSERT INTO broadcast_shards (broadcast_id, shard, status, lease_until, record) VALUES (?, ?, ?, ?, ?)",
+                [(broadcast_id, shard['shard'], shard['status'], shard['lease_until'], json.dumps(shard))
+                 for shard in shards]
+            )
+            # Inbox entries past their retention go when the next broadcast is sent
+            cutoff = (datetime.utcnow() - timedelta(seconds=Config.BROADCAST_INBOX_RETENTION)).isoformat()
+            conn.execute("DELETE FROM inbox WHERE created_at < ?", (cutoff,))
+    
+    def get_broadcast(self, broadcast_id):
+        with self._pool.connection() as conn:
+            row = conn.execute("SELECT record FROM broadcasts WHERE broadcast_id = ?", (broadcast_id,)).fetchone()
+            if row is None:
+                return None
+            shards = conn.execute(
+                "SELECT record FROM broadcast_shards WHERE broadcast_id = ? ORDER BY shard", (broadcast_id,)
+            ).fetchall()
+        return json.loads(row['record']), [json.loads(shard['record']) for shard in shards]
+    
+    def claim_broadcast_shard(self, owner, lease_until, now):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT broadcast_id, shard, record FROM broadcast_shards "
+                "WHERE status = 'open' AND lease_until < ? ORDER BY lease_until LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            shard = json.loads(row['record'])
+            shard.update(owner=owner, lease_until=lease_until,
+                         started_at=shard.get('started_at') or datetime.utcnow().isoformat())
+            self._save_shard(conn, row['broadcast_id'], row['shard'], shard)
+        return shard
+    
+    @staticmethod
+    def _save_shard(conn, broadcast_id, shard_number, shard):
+        conn.execute(
+            "UPDATE broadcast_shards SET status = ?, lease_until = ?, record = ? WHERE broadcast_id = ? AND shard = ?",
+            (shard['status'], shard['lease_until'], json.dumps(shard), broadcast_id, shard_number)
+        )
+    
+    def deliver_broadcast_batch(self, broadcast_id, shard, owner, entries, progress):
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT record FROM broadcast_shards WHERE broadcast_id = ? AND shard = ?", (broadcast_id, shard)
+            ).fetchone()
+            record = json.loads(row['record']) if row is not None else None
+            if record is None or record.get('owner') != owner:
+                return False
+            conn.executemany(
+                "INSERT OR REPLACE INTO inbox (user_id, created_at, broadcast_id, entry) VALUES (?, ?, ?, ?)",
+                [(user_id, entry['created_at'], broadcast_id, json.dumps(entry)) for user_id, entry in entries]
+            )
+            self._save_shard(conn, broadcast_id, shard, dict(record, **progress))
+        return True
+    
+    def list_inbox(self, user_id, since, limit=None, start_after=None):
+        # Served by the inbox primary key, newest first
+        sql = "SELECT entry FROM inbox WHERE user_id = ? AND created_at > ?"
+        params = [user_id, since]
+        if start_after:
+            sql += " AND created_at < ?"
+            params.append(start_after)
+        sql += " ORDER BY created_at DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        
+        with self._pool.connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [json.loads(row['entry']) for row in rows]
+
+class SQLiteWatch(threading.Thread):
+    """Poll a SQLite database for active_alerts changes
+
+    SQLite has no change feed, so this checks ``PRAGMA data_version`` on
+    its own connection, which changes whenever another connection commits,
+    and reloads the whole active_alerts table when it does. The table only
+    holds open and recently resolved alerts, so a reload is small.
+    """
+    
+    def __init__(self, storage, on_change, interval):
+        super().__init__(name='active-alerts-watch', daemon=True)
+        self._storage = storage
+        self._on_change = on_change
+        self._interval = interval
+        self._stopped = threading.Event()
+    
+    def run(self):
+        # Opened through the pool's settings, but held for the watch's lifetime
+        conn = self._storage._pool._connect()
+        version = None
+        try:
+            while not self._stopped.is_set():
+                try:
+                    current = conn.execute('PRAGMA data_version').fetchone()[0]
+                    if current != version:
+                        self._on_change(self._storage._active_entries(conn), True)
+                        version = current
+                except Exception:
+                    logger.exception('Error reloading active_alerts')
+                self._stopped.wait(self._interval)
+        finally:
+            conn.close()
+    
+    def unsubscribe(self):
+        self._stopped.set()
@@ -0,0 +1,96 @@
+from api.cache import ProfileCache
+from api.storage import get_storage
+from config import Config
+
+# Profile fields the family and SOS handlers actually read
+USER_FIELDS = ['username', 'email', 'mobile_number', 'is_active']
+
+# Full user documents, keyed by user ID
+profile_cache = ProfileCache(Config.PROFILE_CACHE_MAX_SIZE, Config.PROFILE_CACHE_TTL)
+
+# Projected member profiles returned by get_users(), keyed by user ID
+member_cache = ProfileCache(Config.PROFILE_CACHE_MAX_SIZE, Config.PROFILE_CACHE_TTL)
+
+def get_user(user_id, storage=None, family_version=0):
+    """Get a user document as a dict, or None if the user does not exist
+
+    A cached profile older than ``family_version`` (from the caller's
+    session token) is re-read: another worker changed the family list.
+    """
+    user_data = profile_cache.get(user_id)
+    if user_data is not None and user_data.get('family_version', 0) >= family_version:
+        return user_data
+    
+    storage = storage or get_storage()
+    user_data = storage.get_user(user_id)
+    if user_data is None:
+        return None
+    
+    profile_cache.set(user_id, user_data)
+    return user_data
+
+def cached_user(user_id):
+    """Get a user document from this worker's cache without reading storage, or None"""
+    return profile_cache.get(user_id)
+
+def load_users(user_ids, storage=None):
+    """Read full user documents in one round trip, bypassing the cache
+
+    Used before writes that must see current data. Returns a dict keyed by
+    user ID containing only the users that exist, and refreshes the cache.
+    """
+    storage = storage or get_storage()
+    users = storage.get_users(user_ids)
+    for user_id, user_data in users.items():
+        profile_cache.set(user_id, user_data)
+    return users
+
+def get_users(user_ids, fields=USER_FIELDS, storage=None):
+    """Get several user profiles in one multi-document read
+
+    Returns one dict per existing user (with ``user_id`` set), in the same
+    order as ``user_ids``. Missing users are skipped. Profiles already in
+    the member cache are not re-read.
+    """
+    if not user_ids:
+        return []
+    
+    found, missing_ids = cached_members(user_ids, fields)
+    if missing_ids:
+        # Fetch each missing user once, projecting only the needed fields
+        storage = storage or get_storage()
+        cache_members(found, storage.get_users(missing_ids, fields=fields), fields)
+    
+    # Backends do not preserve request order, so restore it here
+    return [found[user_id] for user_id in user_ids if user_id in found]
+
+def cached_members(user_ids, fields=USER_FIELDS):
+    """Split user IDs into cached member profiles and the IDs still to read"""
+    found = {}
+    missing_ids = []
+    for user_id in dict.fromkeys(user_ids):
+        user_data = member_cache.get(user_id) if fields is USER_FIELDS else None
+        if user_data is not None:
+            found[user_id] = user_data
+        else:
+            missing_ids.append(user_id)
+    return found, missing_ids
+
+def cache_members(found, users, fields=USER_FIELDS):
+    """Merge freshly read member profiles into ``found`` and the member cache"""
+    for user_id, user_data in users.items():
+        found[user_id] = user_data
+        if fields is USER_FIELDS:
+            member_cache.set(user_id, user_data)
+
+def invalidate_user(user_id):
+    """Drop a user from every profile cache after a write"""
+    profile_cache.invalidate(user_id)
+    member_cache.invalidate(user_id)
+
+def cache_stats():
+    """Get counters for every profile cache"""
+    return {
+        'profiles': profile_cache.stats(),
+        'members': member_cache.stats()
+    }
@@ -0,0 +1,178 @@
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from api.background import PerProcess
+from api.metrics import latency_summary
+from api.storage import get_storage
+from config import Config
+
+logger = logging.getLogger('sangam.writebehind')
+
+class WriteBehindBuffer:
+    """Coalesce non-critical field updates per document and write them in batches
+
+    ``defer`` only records the update in memory. Updates to a document that
+    is already buffered merge into it, the later value of each field
+    winning, so a burst of logins by one user costs one write. A flush
+    thread hands the buffer to ``write`` (a dict of key to fields, written
+    as one batch) every ``interval`` seconds, or as soon as ``max_batch``
+    documents are waiting.
+
+    Buffered updates are lost if the process dies without flushing, so only
+    use it for fields that can be: timestamps and other bookkeeping. When
+    ``max_pending`` documents are waiting, new documents are dropped. A
+    batch that fails goes back into the buffer and is dropped after
+    ``max_attempts`` failures.
+
+    The thread starts lazily on first use, so each forked gunicorn worker
+    gets its own; shutdown() flushes what is left.
+    """
+    
+    def __init__(self, write, interval=None, max_batch=None, max_pending=None, max_attempts=3, name='write-behind'):
+        self.write = write
+        self.interval = Config.WRITE_BEHIND_INTERVAL if interval is None else interval
+        self.max_batch = max_batch or Config.WRITE_BEHIND_MAX_BATCH
+        self.max_pending = max_pending or Config.WRITE_BEHIND_MAX_PENDING
+        self.max_attempts = max_attempts
+        self.name = name
+        
+        self._pending = {}
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._process = PerProcess(self._lock)
+        
+        self.deferred = 0
+        self.merged = 0
+        self.dropped = 0
+        self.written = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self._latencies = deque(maxlen=1000)
+    
+    def defer(self, key, fields):
+        """Buffer an update; returns False if it was dropped because the buffer is full"""
+        self._ensure_started()
+        with self._lock:
+            self.deferred += 1
+            pending = self._pending.get(key)
+            if pending is not None:
+                pending.update(fields)
+                self.merged += 1
+                return True
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending[key] = dict(fields)
+            full = len(self._pending) >= self.max_batch
+        if full:
+            self._wake.set()
+        return True
+    
+    def flush(self):
+        """Write everything buffered now and return the number of documents written"""
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            keys = list(pending)
+            written = 0
+            for start in range(0, len(keys), self.max_batch):
+                batch = {key: pending[key] for key in keys[start:start + self.max_batch]}
+                if self._write(batch):
+                    written += len(batch)
+            return written
+    
+    def _write(self, batch):
+        started = time.perf_counter()
+        try:
+            self.write(batch)
+        except Exception as e:
+            logger.error('Failed to flush %d buffered %s updates: %s', len(batch), self.name, e)
+            self._requeue(batch)
+            return False
+        
+        with self._lock:
+            self._latencies.append(time.perf_counter() - started)
+            self.flushes += 1
+            self.written += len(batch)
+            for key in batch:
+                self._attempts.pop(key, None)
+        return True
+    
+    def _requeue(self, batch):
+        """Put a failed batch back under any newer updates to the same documents"""
+        with self._lock:
+            self.failed_flushes += 1
+            for key, fields in batch.items():
+                attempts = self._attempts.get(key, 0) + 1
+                if attempts >= self.max_attempts:
+                    self._attempts.pop(key, None)
+                    self.dropped += 1
+                    continue
+                self._attempts[key] = attempts
+                self._pending[key] = dict(fields, **self._pending.get(key, {}))
+    
+    def start(self):
+        """Start the flush thread now instead of on the first update"""
+        self._ensure_started()
+    
+    def _ensure_started(self):
+        self._process.start(self._start_thread)
+    
+    def _start_thread(self):
+        # A forked child does not inherit the parent's buffer or thread
+        self._pending = {}
+        self._attempts = {}
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name=f'{self.name}-flush', daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Write-behind flush error')
+    
+    def shutdown(self, timeout=5):
+        """Stop the flush thread and write what is still buffered"""
+        if not self._process.started:
+            return 0
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join(timeout)
+        self._process.stopped()
+        return self.flush()
+    
+    def stats(self):
+        """Get buffer depth, merge and drop counters and flush latency percentiles"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                'pending': len(self._pending),
+                'deferred': self.deferred,
+                'merged': self.merged,
+                'dropped': self.dropped,
+                'written': self.written,
+                'flushes': self.flushes,
+                'failed_flushes': self.failed_flushes,
+                'interval_seconds': self.interval,
+                'max_batch': self.max_batch
+            }
+        
+        stats['flush_latency_seconds'] = latency_summary(latencies)
+        return stats
+
+def _update_users(updates):
+    get_storage().update_users(updates)
+
+# Deferred profile bookkeeping (last_login) for this worker process
+user_writes = WriteBehindBuffer(_update_users, name='user')
+atexit.register(user_writes.shutdown)
@@ -1,73 +1,290 @@
-from flask import Flask, render_template, send_from_directory
-import firebase_admin
-from firebase_admin import credentials, firestore
+from flask import Flask
 import os
+import time
+import logging
+from contextlib import contextmanager
 from config import Config
 
-# Initialize Flask app
-app = Flask(__name__)
-app.config.from_object(Config)
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('sangam.startup')
 
-# Initialize Firebase Admin SDK
-def initialize_firebase():
-    """Initialize Firebase Admin SDK with credentials"""
-    try:
-        # Check if Firebase is already initialized
-        if not firebase_admin._apps:
-            # Use the service account JSON file directly
-            cred = credentials.Certificate(Config.get_firebase_credentials_path())
-            firebase_admin.initialize_app(cred)
-        return firestore.client()
-    except Exception as e:
-        print(f"Firebase initialization error: {e}")
-        return None
+# Templates served as fully static pages
+PAGES = ['home.html', 'story.html', 'login.html', 'index.html']
 
-# Initialize Firestore client
-db = initialize_firebase()
+@contextmanager
+def startup_phase(app, phase):
+    """Time one startup phase and record it on the app"""
+    start = time.perf_counter()
+    yield
+    app.extensions['startup_timings'][phase] = time.perf_counter() - start
 
-# Import and register blueprints
-from api.auth import auth_bp
-from api.family import family_bp
-from api.sos import sos_bp
+def create_app(config_object=Config):
+    """Build the Flask application
 
-app.register_blueprint(auth_bp, url_prefix='/api')
-app.register_blueprint(family_bp, url_prefix='/api')
-app.register_blueprint(sos_bp, url_prefix='/api')
+    Nothing here opens a network connection, so the app is safe to create
+    before gunicorn forks its workers. Call warm_up() in each worker.
+    """
+    start = time.perf_counter()
+    # Static files are served by the cached static_files route below
+    app = Flask(__name__, static_folder=None)
+    app.extensions['startup_timings'] = {}
+    app.config.from_object(config_object)
+    
+    with startup_phase(app, 'firebase_app'):
+        if config_object.STORAGE_BACKEND == 'firestore':
+            try:
+                from api.storage.firestore_backend import initialize_app
+                initialize_app()
+            except Exception as e:
+                print(f"Firebase initialization error: {e}")
+    
+    with startup_phase(app, 'blueprints'):
+        # Import and register blueprints
+        from api.auth import auth_bp
+        from api.family import family_bp
+        from api.sos import sos_bp
+        from api.broadcasts import broadcasts_bp
+        
+        app.register_blueprint(auth_bp, url_prefix='/api')
+        app.register_blueprint(family_bp, url_prefix='/api')
+        app.register_blueprint(sos_bp, url_prefix='/api')
+        app.register_blueprint(broadcasts_bp, url_prefix='/api')
+        register_routes(app)
+        
+        # Record per-route latency and backend calls
+        if config_object.METRICS_ENABLED:
+            from api.metrics import init_metrics
+            init_metrics(app)
+        
+        # Sample the stacks of requests asking for a profile; no hooks at all when off
+        if config_object.PROFILING_ENABLED:
+            from api.profiling import init_profiling
+            init_profiling(app)
+    
+    with startup_phase(app, 'pages'):
+        # Render and compress the pages once rather than on every view
+        from api.pages import init_pages
+        init_pages(app, PAGES)
+    
+    app.extensions['startup_timings']['create_app'] = time.perf_counter() - start
+    return app
 
-@app.route('/')
-def home():
-    """Serve the home page"""
-    return render_template('home.html')
+def check_secret_key(app):
+    """Refuse to serve with the public default SECRET_KEY outside debug mode"""
+    if Config.SECRET_KEY == Config.DEFAULT_SECRET_KEY and not app.debug:
+        raise RuntimeError(
+            'SECRET_KEY is not set: session tokens would be signed with the public default key, '
+            'so anyone could forge them. Set SECRET_KEY to the same long random secret on every '
+            'host, or FLASK_DEBUG=true for local development.'
+        )
 
-@app.route('/story')
-def story():
-    """Serve the scrolly-telling story page"""
-    return render_template('story.html')
+def warm_up(app):
+    """Open backend connections and start background workers
 
-@app.route('/login')
-def login():
-    """Serve the login/signup page"""
-    return render_template('login.html')
+    Run once per worker process, after fork and before it accepts traffic,
+    so the first SOS request does not pay for connection setup. Raises
+    if SECRET_KEY is unset outside debug mode.
+    """
+    check_secret_key(app)
+    start = time.perf_counter()
+    
+    with startup_phase(app, 'storage'):
+        from api.storage import get_storage
+        try:
+            get_storage().warm_up()
+        except Exception as e:
+            logger.warning('Storage warm-up failed: %s', e)
+    
+    with startup_phase(app, 'notifications'):
+        from api.notifications import dispatcher
+        dispatcher.start()
+    
+    with startup_phase(app, 'active_alerts'):
+        from api.dashboard import active_alerts
+        try:
+            active_alerts.start()
+        except Exception as e:
+            logger.warning('Active alerts mirror failed to start: %s', e)
+    
+    with startup_phase(app, 'sessions'):
+        from api.sessions import revocations
+        revocations.start()
+    
+    with startup_phase(app, 'journal'):
+        # Replays SOS writes left in the journals of workers that died
+        from api.journal import journal
+        if journal.enabled:
+            journal.start()
+    
+    with startup_phase(app, 'archive'):
+        # Moves old resolved alerts into the archive tier, on processes configured to
+        if Config.ALERT_ARCHIVE_ENABLED:
+            from api.archive import archiver
+            archiver.start()
+    
+    with startup_phase(app, 'broadcasts'):
+        # Delivers zone broadcast shards that no other worker holds
+        if Config.BROADCAST_FANOUT_ENABLED:
+            from api.fanout import fanout
+            fanout.start()
+    
+    timings = app.extensions['startup_timings']
+    timings['warm_up'] = time.perf_counter() - start
+    logger.info('Worker %s ready: %s', os.getpid(), ', '.join(
+        f'{phase}={seconds * 1000:.1f}ms' for phase, seconds in timings.items()
+    ))
+    
+    if app.config.get('METRICS_ENABLED'):
+        from api.metrics import record_startup
+        record_startup(timings)
 
-@app.route('/app')
-def app_page():
-    """Serve the main app (original index.html)"""
-    return render_template('index.html')
+def shut_down():
+    """Flush buffered writes before the worker exits
 
-@app.route('/static/<path:filename>')
-def static_files(filename):
-    """Serve static files"""
-    return send_from_directory('static', filename)
+    Called from gunicorn's worker_exit hook and the ASGI lifespan. The
+    buffer also flushes at interpreter exit, which covers `flask run`.
+    SOS writes the journal could not replicate stay in its file for the
+    next worker to replay.
+    """
+    from api.writebehind import user_writes
+    from api.journal import journal
+    from api.archive import archiver
+    from api.fanout import fanout
+    archiver.shutdown()
+    fanout.shutdown()
+    written = user_writes.shutdown()
+    journaled = journal.shutdown()
+    logger.info('Worker %s stopped: flushed %d buffered profile updates, %d SOS writes left in the journal',
+                os.getpid(), written, journaled)
 
-@app.errorhandler(404)
-def not_found(error):
-    """Handle 404 errors"""
-    return {'error': 'Not found'}, 404
+def register_routes(app):
+    """Register page, stats and error routes"""
+    
+    @app.route('/')
+    def home():
+        """Serve the home page"""
+        return app.extensions['page_cache'].response('home.html')
+    
+    @app.route('/story')
+    def story():
+        """Serve the scrolly-telling story page"""
+        return app.extensions['page_cache'].response('story.html')
+    
+    @app.route('/login')
+    def login():
+        """Serve the login/signup page"""
+        return app.extensions['page_cache'].response('login.html')
+    
+    @app.route('/app')
+    def app_page():
+        """Serve the main app (original index.html)"""
+        return app.extensions['page_cache'].response('index.html')
+    
+    @app.route('/static/<path:filename>')
+    def static_files(filename):
+        """Serve static files"""
+        return app.extensions['static_assets'].response(filename)
+    
+    @app.route('/api/cache/stats')
+    def cache_stats():
+        """Report profile cache hit/miss/eviction counters for this worker"""
+        from api.users import cache_stats as get_cache_stats
+        return get_cache_stats()
+    
+    @app.route('/api/notifications/stats')
+    def notification_stats():
+        """Report SOS notification queue depth and delivery latency for this worker"""
+        from api.notifications import dispatcher
+        return dispatcher.stats()
+    
+    @app.route('/api/events/stats')
+    def event_stats():
+        """Report open SOS alert streams for this worker"""
+        from api.events import alert_hub
+        return alert_hub.stats()
+    
+    @app.route('/api/coalescing/stats')
+    def coalescing_stats():
+        """Report created, coalesced and replayed SOS triggers for this worker"""
+        from api.coalesce import coalescer
+        return coalescer.stats()
+    
+    @app.route('/api/writebehind/stats')
+    def writebehind_stats():
+        """Report buffered, merged and dropped profile updates and flush latency for this worker"""
+        from api.writebehind import user_writes
+        return user_writes.stats()
+    
+    @app.route('/api/sessions/stats')
+    def session_stats():
+        """Report this worker's copy of session revocations and when it last synced"""
+        from api.sessions import revocations
+        return revocations.stats()
+    
+    @app.route('/api/journal/stats')
+    def journal_stats():
+        """Report SOS journal depth, replication lag and circuit breaker state for this worker"""
+        from api.journal import journal
+        return journal.stats()
+    
+    @app.route('/api/archive/stats')
+    def archive_stats():
+        """Report how many alerts this process archived and how fast"""
+        from api.archive import archiver
+        return archiver.stats()
+    
+    @app.route('/api/profiling/stats')
+    def profiling_stats():
+        """Report profiled requests and the latest profiles written by this worker"""
+        if not app.config.get('PROFILING_ENABLED'):
+            return {'error': 'Not found'}, 404
+        from api.profiling import profiler
+        return profiler.stats()
+    
+    @app.route('/api/fanout/stats')
+    def fanout_stats():
+        """Report broadcast shards and inbox entries this worker delivered, and time it paused for SOS traffic"""
+        from api.fanout import fanout
+        return fanout.stats()
+    
+    @app.route('/api/dashboard/stats')
+    def dashboard_stats():
+        """Report the responder dashboard mirror's sync state for this worker"""
+        from api.dashboard import active_alerts
+        return active_alerts.stats()
+    
+    @app.route('/api/startup/stats')
+    def startup_stats():
+        """Report how long each startup phase took in this worker"""
+        return {
+            'pid': os.getpid(),
+            'phases_seconds': app.extensions['startup_timings']
+        }
+    
+    @app.route('/metrics')
+    def metrics():
+        """Expose request and backend metrics in Prometheus text format"""
+        if not app.config.get('METRICS_ENABLED'):
+            return {'error': 'Not found'}, 404
+        from api.metrics import render_metrics
+        body, content_type = render_metrics()
+        return body, 200, {'Content-Type': content_type}
+    
+    @app.errorhandler(404)
+    def not_found(error):
+        """Handle 404 errors"""
+        return {'error': 'Not found'}, 404
+    
+    @app.errorhandler(500)
+    def internal_error(error):
+        """Handle 500 errors"""
+        return {'error': 'Internal server error'}, 500
 
-@app.errorhandler(500)
-def internal_error(error):
-    """Handle 500 errors"""
-    return {'error': 'Internal server error'}, 500
+# Module-level app for `gunicorn app:app` and `flask run`
+app = create_app()
 
 if __name__ == '__main__':
+    # The development server, so the default SECRET_KEY is allowed
+    app.debug = True
+    warm_up(app)
     app.run(debug=True, host='0.0.0.0', port=5000)
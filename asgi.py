@@ -0,0 +1,58 @@
+import asyncio
+import logging
+import re
+from contextlib import asynccontextmanager
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.routing import Mount, Route
+from config import Config
+
+logger = logging.getLogger('sangam.startup')
+
+def flask_rule(path):
+    """Turn a Starlette path into the matching Flask rule, e.g. {user_id} -> <user_id>"""
+    return re.sub(r'\{(\w+)\}', r'<\1>', path)
+
+def create_asgi_app(flask_app=None, config_object=Config):
+    """Build the ASGI application
+
+    The auth, family and SOS endpoints run as coroutines on the async
+    storage backend, so a worker waiting on Firestore holds no thread.
+    Everything else (pages, SSE streams, stats and /metrics) falls through
+    to the Flask app on a thread pool.
+    """
+    from api.aio import MetricsMiddleware, auth, family, sos
+    from api.storage.aio import get_async_storage
+    from app import warm_up, shut_down
+    
+    if flask_app is None:
+        from app import app as flask_app
+    
+    routes = [
+        Route('/api' + route.path, route.endpoint, methods=route.methods)
+        for route in auth.routes + family.routes + sos.routes
+    ]
+    
+    @asynccontextmanager
+    async def lifespan(app):
+        # Same warm-up as a gunicorn worker, plus the async client's channel
+        await asyncio.to_thread(warm_up, flask_app)
+        try:
+            await get_async_storage().warm_up()
+        except Exception as e:
+            logger.warning('Async storage warm-up failed: %s', e)
+        yield
+        await asyncio.to_thread(shut_down)
+    
+    app = Starlette(
+        routes=routes + [Mount('/', app=WSGIMiddleware(flask_app, workers=config_object.ASGI_WSGI_THREADS))],
+        lifespan=lifespan
+    )
+    if config_object.METRICS_ENABLED:
+        app.add_middleware(MetricsMiddleware, endpoints={
+            route.endpoint: flask_rule(route.path) for route in routes
+        })
+    return app
+
+# Module-level app for `uvicorn asgi:app`
+app = create_asgi_app()
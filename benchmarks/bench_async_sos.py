@@ -0,0 +1,155 @@
+"""Concurrent in-flight SOS requests per worker: sync (threads) vs async (ASGI).
+
+Fires bursts of simultaneous SOS requests at one worker while every
+Firestore round trip takes ``--latency`` seconds. The sync path runs the
+Flask app on ``--threads`` threads, like one gunicorn gthread worker, so at
+most that many requests are in flight and the rest queue. The async path
+runs the ASGI app on one event loop: every request in the burst is in
+flight at once, and the caller's read, the member reads and the alert
+write overlap.
+
+Notification channels are disabled so only the request path is measured.
+
+Usage: python -m benchmarks.bench_async_sos [--latency 0.02] [--concurrency 16,64,256,1024]
+"""
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from api.sessions import issue_token
+from benchmarks.bench_family_lookup import seed_users
+from benchmarks.fake_firestore import FakeFirestore, install
+
+
+class InFlight:
+    """Counts requests inside the app and remembers the peak"""
+
+    def __init__(self):
+        self.current = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+
+    def leave(self):
+        with self._lock:
+            self.current -= 1
+
+
+def reset_caches():
+    from api.users import profile_cache, member_cache
+    profile_cache.clear()
+    member_cache.clear()
+
+
+def run_sync(app, callers, threads, in_flight):
+    """Send one SOS per caller at once through a fixed thread pool"""
+    wsgi_app = app.wsgi_app
+
+    def counted(environ, start_response):
+        in_flight.enter()
+        try:
+            return wsgi_app(environ, start_response)
+        finally:
+            in_flight.leave()
+
+    app.wsgi_app = counted
+    try:
+        def send(user_id, submitted):
+            response = app.test_client().post(f'/api/@{user_id}/sos', json={'location': 'Ram Ghat'},
+                                              headers={'Authorization': f'Bearer {issue_token(user_id)}'})
+            return response.status_code, time.perf_counter() - submitted
+
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            start = time.perf_counter()
+            futures = [pool.submit(send, user_id, start) for user_id in callers]
+            results = [future.result() for future in futures]
+        return results, time.perf_counter() - start
+    finally:
+        app.wsgi_app = wsgi_app
+
+
+async def run_async(app, callers, in_flight):
+    """Send one SOS per caller at once on a single event loop"""
+    import httpx
+
+    async def counted(scope, receive, send):
+        in_flight.enter()
+        try:
+            await app(scope, receive, send)
+        finally:
+            in_flight.leave()
+
+    transport = httpx.ASGITransport(app=counted)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        async def send(user_id, submitted):
+            response = await client.post(f'/api/@{user_id}/sos', json={'location': 'Ram Ghat'},
+                                         headers={'Authorization': f'Bearer {issue_token(user_id)}'})
+            return response.status_code, time.perf_counter() - submitted
+
+        start = time.perf_counter()
+        results = await asyncio.gather(*(send(user_id, start) for user_id in callers))
+        return results, time.perf_counter() - start
+
+
+def report(mode, concurrency, results, elapsed, in_flight):
+    latencies = sorted(latency for _, latency in results)
+    errors = sum(1 for status, _ in results if status != 200)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f'{mode:>5} | {concurrency:>6} | {in_flight.peak:>9} | {len(results) / elapsed:>8.1f} | '
+          f'{statistics.median(latencies) * 1000:>8.1f} | {p99 * 1000:>8.1f} | {errors:>4}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.02, help='fake Firestore seconds per round trip')
+    parser.add_argument('--concurrency', default='16,64,256,1024', help='comma-separated burst sizes')
+    parser.add_argument('--threads', type=int, default=16, help='threads per sync worker (GUNICORN_THREADS)')
+    parser.add_argument('--family-size', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    logging.disable(logging.CRITICAL)
+    random.seed(args.seed)
+    db = install(FakeFirestore())
+    ids = seed_users(db, max(levels) + args.family_size * 4)
+    for user_id in ids:
+        db.collection('users').document(user_id).update({'family_members': random.sample(ids, args.family_size)})
+    db.latency = args.latency
+
+    from app import app
+    from asgi import create_asgi_app
+    from api.notifications import dispatcher
+    asgi_app = create_asgi_app(app)
+    dispatcher.channels.clear()
+
+    print(f'Firestore latency {args.latency * 1000:.0f} ms, family size {args.family_size}, '
+          f'{args.threads} threads per sync worker')
+    print(f"{'mode':>5} | {'burst':>6} | {'in flight':>9} | {'req/s':>8} | {'p50 ms':>8} | {'p99 ms':>8} | {'errs':>4}")
+    for concurrency in levels:
+        callers = ids[:concurrency]
+
+        reset_caches()
+        in_flight = InFlight()
+        results, elapsed = run_sync(app, callers, args.threads, in_flight)
+        report('sync', concurrency, results, elapsed, in_flight)
+
+        reset_caches()
+        in_flight = InFlight()
+        results, elapsed = asyncio.run(run_async(asgi_app, callers, in_flight))
+        report('async', concurrency, results, elapsed, in_flight)
+
+    dispatcher.shutdown()
+
+
+if __name__ == '__main__':
+    main()
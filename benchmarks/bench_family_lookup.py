@@ -0,0 +1,96 @@
+"""Family-member lookup latency as family size grows.
+
+Compares the old one-read-per-member loop against the batched
+``api.users.get_users`` read on a fake Firestore with fixed round-trip latency.
+The batched read is timed cold, with the profile and member caches cleared
+before every run, and warm, served by the member cache as on a worker that
+has looked the family up before.
+
+Usage: python -m benchmarks.bench_family_lookup [--latency 0.02] [--repeat 5]
+"""
+import argparse
+import statistics
+import time
+
+from api.storage.firestore_backend import FirestoreStorage
+from api.users import get_users, member_cache, profile_cache
+from benchmarks.fake_firestore import FakeFirestore
+
+FAMILY_SIZES = [0, 1, 2, 5, 10, 20, 50]
+
+
+def seed_users(db, count):
+    users_ref = db.collection('users')
+    ids = []
+    for i in range(count):
+        user_id = f'SANGAM_{i:08d}'
+        users_ref.document(user_id).set({
+            'user_id': user_id,
+            'username': f'pilgrim{i}',
+            'email': f'pilgrim{i}@example.com',
+            'mobile_number': f'+91{9000000000 + i}',
+            'family_members': [],
+            'is_active': True,
+        })
+        ids.append(user_id)
+    return ids
+
+
+def sequential_lookup(db, member_ids):
+    """The per-member loop the handlers used before batching"""
+    members = []
+    for member_id in member_ids:
+        member_doc = db.collection('users').document(member_id).get()
+        if member_doc.exists:
+            members.append(member_doc.to_dict())
+    return members
+
+
+def batched_lookup(db, member_ids):
+    return get_users(member_ids, storage=FirestoreStorage(db))
+
+
+def clear_caches():
+    profile_cache.clear()
+    member_cache.clear()
+
+
+def measure(db, lookup, member_ids, repeat, cold=True):
+    timings = []
+    for _ in range(repeat):
+        if cold:
+            clear_caches()
+        db.reset_calls()
+        start = time.perf_counter()
+        lookup(db, member_ids)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000, db.calls['rpc']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds per round trip')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    db = FakeFirestore(latency=0)
+    ids = seed_users(db, max(FAMILY_SIZES))
+    db.latency = args.latency
+
+    print(f'Round-trip latency: {args.latency * 1000:.1f} ms')
+    print(f"{'family':>6} | {'sequential ms':>13} {'rpcs':>5} | {'batched ms':>10} {'rpcs':>5} | {'speedup':>7} | "
+          f"{'cached ms':>9} {'rpcs':>5}")
+    for size in FAMILY_SIZES:
+        member_ids = ids[:size]
+        seq_ms, seq_rpcs = measure(db, sequential_lookup, member_ids, args.repeat)
+        bat_ms, bat_rpcs = measure(db, batched_lookup, member_ids, args.repeat)
+        # Fill the caches once, then time lookups they serve
+        batched_lookup(db, member_ids)
+        warm_ms, warm_rpcs = measure(db, batched_lookup, member_ids, args.repeat, cold=False)
+        speedup = seq_ms / bat_ms if bat_ms else float('nan')
+        print(f'{size:>6} | {seq_ms:>13.1f} {seq_rpcs:>5} | {bat_ms:>10.1f} {bat_rpcs:>5} | {speedup:>6.1f}x | '
+              f'{warm_ms:>9.2f} {warm_rpcs:>5}')
+
+
+if __name__ == '__main__':
+    main()
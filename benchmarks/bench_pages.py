@@ -0,0 +1,83 @@
+"""Bytes and time saved per page by prerendered, precompressed responses.
+
+For each page, compares the old path (render the template on every request,
+send it uncompressed) with the cached path: a full response with gzip or
+brotli, and a 304 revalidation with If-None-Match. Transfer time is
+estimated for a congested mobile link of ``--bandwidth-kbps`` with
+``--rtt-ms`` round-trip time.
+
+Usage: python -m benchmarks.bench_pages [--bandwidth-kbps 256] [--rtt-ms 300]
+"""
+import argparse
+import logging
+import time
+
+from benchmarks.fake_firestore import FakeFirestore, install
+
+
+def server_time(app, fn, path, headers, repeat):
+    """Median seconds per call of fn() inside a request context"""
+    timings = []
+    with app.test_request_context(path, headers=headers):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bandwidth-kbps', type=float, default=256)
+    parser.add_argument('--rtt-ms', type=float, default=300)
+    parser.add_argument('--repeat', type=int, default=500)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    install(FakeFirestore())
+
+    from flask import render_template
+    from app import app, PAGES
+    from api.pages import brotli
+
+    client = app.test_client()
+    page_cache = app.extensions['page_cache']
+    routes = {'home.html': '/', 'story.html': '/story', 'login.html': '/login', 'index.html': '/app'}
+    encodings = ['identity', 'gzip'] + (['br'] if brotli is not None else [])
+
+    def transfer_ms(size):
+        return args.rtt_ms + size * 8 / args.bandwidth_kbps
+
+    print(f'Link: {args.bandwidth_kbps:.0f} kbps, {args.rtt_ms:.0f} ms RTT')
+    print(f"{'page':>11} | {'encoding':>8} | {'bytes':>7} | {'saved':>6} | {'server us':>9} | {'transfer ms':>11}")
+    for template in PAGES:
+        path = routes[template]
+        render_us = server_time(app, lambda: render_template(template), path, {}, args.repeat) * 1e6
+        baseline = len(render_template_bytes(app, template))
+        print(f'{template:>11} | {"render":>8} | {baseline:>7} | {"":>6} | {render_us:>9.1f} | {transfer_ms(baseline):>11.0f}')
+
+        for encoding in encodings:
+            headers = {'Accept-Encoding': encoding}
+            response = client.get(path, headers=headers)
+            size = len(response.data)
+            served_us = server_time(
+                app, lambda: page_cache.response(template), path, headers, args.repeat
+            ) * 1e6
+            print(f'{"":>11} | {encoding:>8} | {size:>7} | {1 - size / baseline:>6.0%} | '
+                  f'{served_us:>9.1f} | {transfer_ms(size):>11.0f}')
+
+        etag = client.get(path, headers={'Accept-Encoding': encodings[-1]}).headers['ETag']
+        response = client.get(path, headers={'Accept-Encoding': encodings[-1], 'If-None-Match': etag})
+        assert response.status_code == 304
+        print(f'{"":>11} | {"304":>8} | {len(response.data):>7} | {1:>6.0%} | {"":>9} | {transfer_ms(0):>11.0f}')
+
+
+def render_template_bytes(app, template):
+    from flask import render_template
+    with app.test_request_context():
+        return render_template(template).encode('utf-8')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""SOS request latency with a slow, flaky notification provider.
+
+Triggers SOS alerts through the Flask app for growing family sizes while
+every channel takes ``--provider-latency`` seconds per send and fails
+``--failure-rate`` of the time. The request latency should stay flat; the
+fan-out completes in the background. Coalescing is off, so every press
+raises an alert and notifies the family.
+
+Usage: python -m benchmarks.bench_sos_notifications [--provider-latency 0.2]
+"""
+import argparse
+import logging
+import random
+import statistics
+import time
+
+from api.sessions import issue_token
+from benchmarks.bench_family_lookup import seed_users
+from benchmarks.fake_firestore import FakeFirestore, install
+
+FAMILY_SIZES = [0, 1, 5, 10, 20]
+
+
+class SlowChannel:
+    """Channel stand-in with fixed send latency and random failures"""
+
+    def __init__(self, name, latency, failure_rate, max_concurrency=4):
+        self.name = name
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.max_concurrency = max_concurrency
+
+    def address(self, member):
+        return member['user_id']
+
+    def send(self, address, member, alert):
+        time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise ConnectionError('provider unavailable')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--provider-latency', type=float, default=0.2)
+    parser.add_argument('--failure-rate', type=float, default=0.1)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    db = install(FakeFirestore())
+    ids = seed_users(db, max(FAMILY_SIZES) + 1)
+
+    from app import app
+    from api.coalesce import SOSCoalescer, MemoryCoalescingStore
+    from api.notifications import NotificationDispatcher, dispatcher
+    from api.users import invalidate_user
+    import api.sos
+
+    channels = [SlowChannel(name, args.provider_latency, args.failure_rate) for name in ('sms', 'email', 'push')]
+    api.sos.dispatcher = NotificationDispatcher(channels=channels, backoff_base=0.05)
+    # Every press raises a new alert: repeated presses would otherwise join the
+    # first one and notify nobody
+    api.sos.coalescer = SOSCoalescer(MemoryCoalescingStore(), window=0, key_ttl=0)
+    client = app.test_client()
+    owner_id = ids[0]
+
+    print(f'Provider latency {args.provider_latency * 1000:.0f} ms, failure rate {args.failure_rate:.0%}')
+    print(f"{'family':>6} | {'request ms':>10} | {'jobs':>5} | {'fan-out done s':>14}")
+    for size in FAMILY_SIZES:
+        db.collection('users').document(owner_id).update({'family_members': ids[1:size + 1]})
+        invalidate_user(owner_id)
+
+        timings = []
+        jobs = 0
+        start_all = time.perf_counter()
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            response = client.post(f'/api/@{owner_id}/sos', json={'location': 'Ram Ghat'},
+                                   headers={'Authorization': f'Bearer {issue_token(owner_id)}'})
+            timings.append(time.perf_counter() - start)
+            jobs += response.get_json()['notifications_queued']
+        api.sos.dispatcher.wait_idle()
+        fan_out = time.perf_counter() - start_all
+        print(f'{size:>6} | {statistics.median(timings) * 1000:>10.1f} | {jobs:>5} | {fan_out:>14.2f}')
+
+    stats = api.sos.dispatcher.stats()
+    print('\nDispatcher:', {key: stats.get(key, 0) for key in ('queued', 'sent', 'failed', 'retried')})
+    print('Delivery latency (s):', stats['delivery_latency_seconds'])
+    api.sos.dispatcher.shutdown()
+    dispatcher.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,562 @@
+"""In-memory stand-in for the Firestore client used by the benchmarks.
+
+Every call that would be a network round trip sleeps for ``latency`` seconds
+(plus up to ``jitter`` seconds of random noise) and is counted in ``calls``.
+While ``unavailable`` is set, every round trip fails with ServiceUnavailable.
+``AsyncFakeFirestore`` is an asyncio view of the same data whose round trips
+await instead of blocking, standing in for ``firestore.AsyncClient``.
+"""
+import asyncio
+import copy
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+
+from google.api_core.exceptions import AlreadyExists, NotFound, ServiceUnavailable
+from google.cloud.firestore_v1.transforms import DELETE_FIELD, ArrayRemove, ArrayUnion, Increment
+from google.cloud.firestore_v1.watch import ChangeType, DocumentChange
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return self._data.get(field) if self._data is not None else None
+
+
+def _apply_transform(current, value):
+    """Resolve server-side transforms against the stored value"""
+    if isinstance(value, ArrayUnion):
+        current = list(current or [])
+        return current + [item for item in value.values if item not in current]
+    if isinstance(value, ArrayRemove):
+        return [item for item in current or [] if item not in value.values]
+    if isinstance(value, Increment):
+        return (current or 0) + value.value
+    return copy.deepcopy(value)
+
+
+def _merge(current, value):
+    """Merge a set(merge=True) value into the stored one; maps merge key by key, as in Firestore"""
+    if isinstance(value, dict) and isinstance(current, dict):
+        merged = dict(current)
+        for key, item in value.items():
+            merged[key] = _merge(current.get(key), item)
+        return merged
+    return _apply_transform(current, value)
+
+
+class FakeDocumentReference:
+    def __init__(self, collection, document_id):
+        self._collection = collection
+        self._db = collection._db
+        self.id = document_id
+
+    def get(self, field_paths=None, transaction=None, **kwargs):
+        self._db._round_trip('read')
+        return self._db._snapshot(self, field_paths)
+
+    def create(self, data):
+        self._db._round_trip('write')
+        self._apply_create(data)
+
+    def set(self, data, merge=False):
+        self._db._round_trip('write')
+        self._apply_set(data, merge)
+
+    def update(self, data):
+        self._db._round_trip('write')
+        self._apply_update(data)
+
+    def delete(self):
+        self._db._round_trip('write')
+        self._apply_delete()
+
+    def _apply_create(self, data):
+        with self._db._lock:
+            if self.id in self._collection._docs:
+                raise AlreadyExists(f'Document already exists: {self.id}')
+            self._collection._docs[self.id] = copy.deepcopy(data)
+        self._collection._changed(self, ChangeType.ADDED)
+
+    def _apply_set(self, data, merge=False):
+        with self._db._lock:
+            existed = self.id in self._collection._docs
+            if merge and existed:
+                document = self._collection._docs[self.id]
+                for field, value in data.items():
+                    document[field] = _merge(document.get(field), value)
+            else:
+                self._collection._docs[self.id] = {
+                    field: _apply_transform(None, value) for field, value in data.items()
+                }
+        self._collection._changed(self, ChangeType.MODIFIED if existed else ChangeType.ADDED)
+
+    def _apply_update(self, data):
+        with self._db._lock:
+            if self.id not in self._collection._docs:
+                raise NotFound(f'No document to update: {self.id}')
+            document = self._collection._docs[self.id]
+            for field_path, value in data.items():
+                # Dotted paths update nested maps, as in Firestore
+                *parents, leaf = field_path.split('.')
+                target = document
+                for parent in parents:
+                    target = target.setdefault(parent, {})
+                if value is DELETE_FIELD:
+                    target.pop(leaf, None)
+                else:
+                    target[leaf] = _apply_transform(target.get(leaf), value)
+        self._collection._changed(self, ChangeType.MODIFIED)
+
+    def _apply_delete(self):
+        with self._db._lock:
+            existed = self._collection._docs.pop(self.id, None) is not None
+        if existed:
+            self._collection._changed(self, ChangeType.REMOVED)
+
+
+_OPERATORS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a is not None and a < b,
+    '<=': lambda a, b: a is not None and a <= b,
+    '>': lambda a, b: a is not None and a > b,
+    '>=': lambda a, b: a is not None and a >= b,
+    'in': lambda a, b: a in b,
+    'array_contains': lambda a, b: isinstance(a, list) and b in a,
+    'array_contains_any': lambda a, b: isinstance(a, list) and any(item in a for item in b),
+}
+
+
+class FakeQuery:
+    """Immutable query over one collection; each get()/stream() is one round trip"""
+
+    def __init__(self, collection, filters=(), orders=(), fields=None, cursor=None, limit=None):
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._fields = fields
+        self._cursor = cursor
+        self._limit = limit
+
+    def _copy(self, **changes):
+        state = {
+            'filters': self._filters, 'orders': self._orders, 'fields': self._fields,
+            'cursor': self._cursor, 'limit': self._limit,
+        }
+        state.update(changes)
+        return self._collection.query_class(self._collection, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def select(self, field_paths):
+        return self._copy(fields=list(field_paths))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, document_fields_or_snapshot):
+        cursor = document_fields_or_snapshot
+        if isinstance(cursor, FakeSnapshot):
+            cursor = dict(cursor._data, __name__=cursor.id)
+        return self._copy(cursor=cursor)
+
+    def get(self, transaction=None):
+        return list(self.stream(transaction=transaction))
+
+    def stream(self, transaction=None):
+        self._collection._db._round_trip('query')
+        yield from self._results()
+
+    def _results(self):
+        db = self._collection._db
+        with db._lock:
+            matches = [
+                (document_id, data) for document_id, data in self._collection._docs.items()
+                if all(_OPERATORS[op](_field(data, field), value) for field, op, value in self._filters)
+            ]
+        matches = [(document_id, data) for document_id, data in matches
+                   if all(field == '__name__' or _field(data, field) is not None for field, _ in self._orders)]
+        for field, direction in reversed(self._orders + (('__name__', self._last_direction()),)):
+            matches.sort(key=lambda item: item[0] if field == '__name__' else _field(item[1], field),
+                         reverse=direction == 'DESCENDING')
+        if self._cursor is not None:
+            matches = [item for item in matches if self._after_cursor(item)]
+        if self._limit is not None:
+            matches = matches[:self._limit]
+        db.calls['read'] += len(matches)
+        return [db._snapshot(self._collection.document(document_id), self._fields)
+                for document_id, _ in matches]
+
+    def _last_direction(self):
+        return self._orders[-1][1] if self._orders else 'ASCENDING'
+
+    def _after_cursor(self, item):
+        document_id, data = item
+        for field, direction in self._orders + (('__name__', self._last_direction()),):
+            if field not in self._cursor:
+                # Equal on every cursor field counts as "at", not after
+                return False
+            value = document_id if field == '__name__' else _field(data, field)
+            if value == self._cursor[field]:
+                continue
+            return value < self._cursor[field] if direction == 'DESCENDING' else value > self._cursor[field]
+        return False
+
+
+def _field(data, field_path):
+    for part in field_path.split('.'):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(part)
+    return data
+
+
+class FakeCollection(FakeQuery):
+    query_class = FakeQuery
+
+    def __init__(self, db, name):
+        super().__init__(self)
+        self._db = db
+        self._docs = {}
+        self._listeners = []
+        self.id = name
+
+    def document(self, document_id=None):
+        return FakeDocumentReference(self, document_id or uuid.uuid4().hex[:20])
+
+    def on_snapshot(self, callback):
+        """Listen to the collection like Firestore's Watch, delivering on the writer's thread"""
+        watch = FakeWatch(self._listeners, callback)
+        with self._db._lock:
+            docs = [FakeSnapshot(self.document(doc_id), copy.deepcopy(data)) for doc_id, data in self._docs.items()]
+            self._listeners.append(watch)
+        callback(docs, [DocumentChange(ChangeType.ADDED, doc, -1, i) for i, doc in enumerate(docs)], None)
+        return watch
+
+    def _changed(self, reference, change_type):
+        if not self._listeners:
+            return
+        snapshot = self._db._snapshot(reference, None)
+        change = DocumentChange(change_type, snapshot, -1, -1)
+        for watch in list(self._listeners):
+            watch.callback(None, [change], None)
+
+
+class FakeWatch:
+    def __init__(self, listeners, callback):
+        self._listeners = listeners
+        self.callback = callback
+
+    def unsubscribe(self):
+        if self in self._listeners:
+            self._listeners.remove(self)
+
+
+class FakeTransaction:
+    """Serializable transaction: holds a database-wide lock from begin to commit
+
+    Implements the private hooks ``firestore.transactional`` drives, so
+    handler code runs unchanged against the fake.
+    """
+
+    _read_only = False
+    _max_attempts = 5
+
+    def __init__(self, db):
+        self._db = db
+        self._id = None
+        self._writes = []
+
+    def _clean_up(self):
+        self._writes = []
+
+    def _begin(self, retry_id=None):
+        self._db._transaction_lock.acquire()
+        self._id = uuid.uuid4().bytes
+
+    def _commit(self):
+        self._db._round_trip('commit')
+        self._db.calls['write'] += len(self._writes)
+        try:
+            for method, reference, data in self._writes:
+                getattr(reference, method)(*data)
+        finally:
+            self._release()
+
+    def _rollback(self):
+        self._release()
+
+    def _release(self):
+        self._writes = []
+        if self._id is not None:
+            self._id = None
+            self._db._transaction_lock.release()
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return FakeTransaction(self)
+
+    def get_all(self, references, field_paths=None):
+        return self._db.get_all(references, field_paths=field_paths)
+
+    def create(self, reference, data):
+        self._writes.append(('_apply_create', reference, (data,)))
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(('_apply_set', reference, (data, merge)))
+
+    def update(self, reference, data):
+        self._writes.append(('_apply_update', reference, (data,)))
+
+    def delete(self, reference):
+        self._writes.append(('_apply_delete', reference, ()))
+
+
+class FakeWriteBatch:
+    """Write batch applied atomically in one commit round trip"""
+
+    def __init__(self, db):
+        self._db = db
+        self._writes = []
+
+    def create(self, reference, data):
+        self._writes.append(('_apply_create', reference, (data,)))
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(('_apply_set', reference, (data, merge)))
+
+    def update(self, reference, data):
+        self._writes.append(('_apply_update', reference, (data,)))
+
+    def delete(self, reference):
+        self._writes.append(('_apply_delete', reference, ()))
+
+    def commit(self):
+        self._db._round_trip('commit')
+        self._apply()
+
+    def _apply(self):
+        with self._db._transaction_lock:
+            # Validate every write first so a failing batch changes nothing
+            with self._db._lock:
+                for method, reference, _ in self._writes:
+                    exists = reference.id in reference._collection._docs
+                    if method == '_apply_update' and not exists:
+                        raise NotFound(f'No document to update: {reference.id}')
+                    if method == '_apply_create' and exists:
+                        raise AlreadyExists(f'Document already exists: {reference.id}')
+            for method, reference, data in self._writes:
+                getattr(reference, method)(*data)
+        self._db.calls['write'] += len(self._writes)
+        self._writes = []
+
+    def __len__(self):
+        return len(self._writes)
+
+
+class FakeFirestore:
+    """Minimal Firestore client with simulated per-call latency"""
+
+    def __init__(self, latency=0.0, jitter=0.0, seed=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.unavailable = False
+        self.calls = Counter()
+        self._collections = {}
+        self._lock = threading.Lock()
+        self._transaction_lock = threading.Lock()
+        self._random = random.Random(seed)
+
+    def collection(self, name):
+        with self._lock:
+            if name not in self._collections:
+                self._collections[name] = FakeCollection(self, name)
+            return self._collections[name]
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return FakeTransaction(self)
+
+    def get_all(self, references, field_paths=None):
+        self._round_trip('batch_read')
+        for reference in references:
+            self.calls['read'] += 1
+            yield self._snapshot(reference, field_paths)
+
+    def reset_calls(self):
+        self.calls.clear()
+
+    def _round_trip(self, kind):
+        delay = self._count_round_trip(kind)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _count_round_trip(self, kind):
+        with self._lock:
+            self.calls['rpc'] += 1
+            self.calls[kind] += 1
+            if self.unavailable:
+                raise ServiceUnavailable('Firestore is unavailable')
+            return self.latency + self._random.uniform(0, self.jitter)
+
+    def _snapshot(self, reference, field_paths):
+        with self._lock:
+            data = reference._collection._docs.get(reference.id)
+            if data is not None:
+                if field_paths is not None:
+                    data = {k: v for k, v in data.items() if k in field_paths}
+                data = copy.deepcopy(data)
+        return FakeSnapshot(reference, data)
+
+
+class AsyncFakeDocumentReference(FakeDocumentReference):
+    async def get(self, field_paths=None, transaction=None, **kwargs):
+        await self._collection._adb._round_trip('read')
+        return self._db._snapshot(self, field_paths)
+
+    async def create(self, data):
+        await self._collection._adb._round_trip('write')
+        self._apply_create(data)
+
+    async def set(self, data, merge=False):
+        await self._collection._adb._round_trip('write')
+        self._apply_set(data, merge)
+
+    async def update(self, data):
+        await self._collection._adb._round_trip('write')
+        self._apply_update(data)
+
+    async def delete(self):
+        await self._collection._adb._round_trip('write')
+        self._apply_delete()
+
+
+class AsyncFakeQuery(FakeQuery):
+    async def get(self, transaction=None):
+        return [snapshot async for snapshot in self.stream(transaction=transaction)]
+
+    async def stream(self, transaction=None):
+        await self._collection._adb._round_trip('query')
+        for snapshot in self._results():
+            yield snapshot
+
+
+class AsyncFakeCollection(AsyncFakeQuery):
+    query_class = AsyncFakeQuery
+
+    def __init__(self, adb, collection):
+        super().__init__(self)
+        self._adb = adb
+        self._db = collection._db
+        self._docs = collection._docs
+        self._listeners = collection._listeners
+        self.id = collection.id
+
+    def document(self, document_id=None):
+        return AsyncFakeDocumentReference(self, document_id or uuid.uuid4().hex[:20])
+
+    _changed = FakeCollection._changed
+
+
+class AsyncFakeTransaction(FakeTransaction):
+    """Transaction for ``firestore.async_transactional``
+
+    Async transactions are serialized with each other by an asyncio lock, and
+    their writes apply under the same lock as sync batches.
+    """
+
+    def __init__(self, adb):
+        super().__init__(adb._db)
+        self._adb = adb
+
+    async def _begin(self, retry_id=None):
+        await self._adb._transaction_lock.acquire()
+        self._id = uuid.uuid4().bytes
+
+    async def _commit(self):
+        await self._adb._round_trip('commit')
+        self._db.calls['write'] += len(self._writes)
+        try:
+            with self._db._transaction_lock:
+                for method, reference, data in self._writes:
+                    getattr(reference, method)(*data)
+        finally:
+            self._release()
+
+    async def _rollback(self):
+        self._release()
+
+    def _release(self):
+        self._writes = []
+        if self._id is not None:
+            self._id = None
+            self._adb._transaction_lock.release()
+
+
+class AsyncFakeWriteBatch(FakeWriteBatch):
+    def __init__(self, adb):
+        super().__init__(adb._db)
+        self._adb = adb
+
+    async def commit(self):
+        await self._adb._round_trip('commit')
+        self._apply()
+
+
+class AsyncFakeFirestore:
+    """Asyncio view of a FakeFirestore sharing its documents and call counters"""
+
+    def __init__(self, db):
+        self._db = db
+        self.calls = db.calls
+        self._transaction_lock = asyncio.Lock()
+
+    def collection(self, name):
+        return AsyncFakeCollection(self, self._db.collection(name))
+
+    def batch(self):
+        return AsyncFakeWriteBatch(self)
+
+    def transaction(self, **kwargs):
+        return AsyncFakeTransaction(self)
+
+    async def get_all(self, references, field_paths=None, transaction=None):
+        await self._round_trip('batch_read')
+        for reference in references:
+            self.calls['read'] += 1
+            yield self._db._snapshot(reference, field_paths)
+
+    async def _round_trip(self, kind):
+        delay = self._db._count_round_trip(kind)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def install(db):
+    """Make the app's sync and async storage backends use ``db`` for the rest of the process"""
+    from api.storage import create_storage, set_storage
+    from api.storage.aio import create_async_storage, set_async_storage
+    set_storage(create_storage('firestore', client=db))
+    set_async_storage(create_async_storage('firestore', client=AsyncFakeFirestore(db)))
+    return db
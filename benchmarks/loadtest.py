@@ -0,0 +1,320 @@
+"""Load test every API endpoint against a local backend.
+
+Builds a synthetic population through the Flask app and then drives
+register, login, add_family, family, sos, sos/history and resolve. The
+backend is either a fake Firestore with per-call latency and jitter, or
+the embedded SQLite engine. For each endpoint it reports throughput,
+p50/p95/p99 latency and backend calls per request. Results can be saved
+as JSON and compared against an earlier run. Register and login hash
+the password at full strength, which dominates their latency; lower
+PASSWORD_HASH_ITERATIONS to compare them with runs from before passwords.
+
+Usage:
+    python -m benchmarks.loadtest --users 500 --family-sizes poisson:3 --output run.json
+    python -m benchmarks.loadtest --compare baseline.json --threshold 0.15
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from benchmarks.fake_firestore import FakeFirestore, install
+
+ENDPOINTS = ['register', 'login', 'add_family', 'family', 'sos', 'sos_history', 'resolve']
+# Every synthetic pilgrim registers and logs in with the same password
+PASSWORD = 'load-test-password'
+
+
+class CountingStorage:
+    """Storage proxy that counts calls to each backend method"""
+
+    def __init__(self, storage):
+        self._storage = storage
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self._storage, name)
+        if not callable(attribute) or name.startswith('_'):
+            return attribute
+
+        def counted(*args, **kwargs):
+            with self._lock:
+                self.calls[name] += 1
+            return attribute(*args, **kwargs)
+        return counted
+
+    def total(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+
+def family_size_sampler(spec, rng):
+    """Parse a family-size distribution such as ``poisson:3`` or ``choice:0=0.2,4=0.8``"""
+    kind, _, params = spec.partition(':')
+    if kind == 'fixed':
+        size = int(params)
+        return lambda: size
+    if kind == 'uniform':
+        low, high = (int(value) for value in params.split('-'))
+        return lambda: rng.randint(low, high)
+    if kind == 'poisson':
+        mean = float(params)
+
+        def poisson():
+            # Knuth's method; fine for the small means used here
+            limit, k, p = math.exp(-mean), 0, 1.0
+            while True:
+                p *= rng.random()
+                if p <= limit:
+                    return k
+                k += 1
+        return poisson
+    if kind == 'choice':
+        pairs = [item.split('=') for item in params.split(',')]
+        sizes = [int(size) for size, _ in pairs]
+        weights = [float(weight) for _, weight in pairs]
+        return lambda: rng.choices(sizes, weights)[0]
+    raise ValueError(f'Unknown family size distribution: {spec}')
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(p * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.results = {}
+        self.tokens = {}
+        self._client_local = threading.local()
+
+    def setup(self):
+        logging.disable(logging.CRITICAL)
+        from api.storage import set_storage
+        if self.args.backend == 'fake':
+            self.fake = install(FakeFirestore(latency=self.args.latency, jitter=self.args.jitter, seed=self.args.seed))
+            from api.storage.firestore_backend import FirestoreStorage
+            backend = FirestoreStorage(self.fake)
+        else:
+            self.fake = None
+            self._tmpdir = tempfile.TemporaryDirectory()
+            from api.storage.sqlite_backend import SQLiteStorage
+            backend = SQLiteStorage(os.path.join(self._tmpdir.name, 'loadtest.db'))
+        from config import Config
+        if Config.METRICS_ENABLED:
+            from api.metrics import instrument_storage
+            backend = instrument_storage(backend)
+        self.storage = set_storage(CountingStorage(backend))
+
+        from app import app
+        from api.journal import journal
+        self.app = app
+        # Keep the SOS journal out of the working directory
+        journal.directory = tempfile.mkdtemp()
+
+    @property
+    def client(self):
+        if not hasattr(self._client_local, 'client'):
+            self._client_local.client = self.app.test_client()
+        return self._client_local.client
+
+    def auth_headers(self, url):
+        """Bearer header for a /api/@<user_id>/ request, with the token the user registered with"""
+        if not url.startswith('/api/@'):
+            return None
+        return {'Authorization': f"Bearer {self.tokens[url.split('/')[2][1:]]}"}
+
+    def run_phase(self, name, requests):
+        """Run (method, url, json) requests concurrently and record stats"""
+        from api.notifications import dispatcher
+        from api.users import profile_cache, member_cache
+        if self.args.cold_cache:
+            profile_cache.clear()
+            member_cache.clear()
+
+        def call(request):
+            method, url, body = request
+            start = time.perf_counter()
+            response = self.client.open(url, method=method, json=body, headers=self.auth_headers(url))
+            elapsed = time.perf_counter() - start
+            return elapsed, response.status_code, response.get_json(silent=True)
+
+        calls_before = self.storage.total()
+        rpcs_before = self.fake.calls['rpc'] if self.fake else 0
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            with ThreadPoolExecutor(self.args.concurrency) as pool:
+                outcomes = list(pool.map(call, requests))
+            dispatcher.wait_idle(60)
+        wall = time.perf_counter() - start
+
+        latencies = sorted(elapsed for elapsed, _, _ in outcomes)
+        errors = sum(1 for _, status, _ in outcomes if status >= 400)
+        count = len(outcomes) or 1
+        stats = {
+            'requests': len(outcomes),
+            'errors': errors,
+            'throughput_rps': len(outcomes) / wall if wall else 0.0,
+            'mean_ms': sum(latencies) / count * 1000,
+            'p50_ms': (percentile(latencies, 0.50) or 0) * 1000,
+            'p95_ms': (percentile(latencies, 0.95) or 0) * 1000,
+            'p99_ms': (percentile(latencies, 0.99) or 0) * 1000,
+            'backend_calls_per_request': (self.storage.total() - calls_before) / count
+        }
+        if self.fake:
+            stats['rpcs_per_request'] = (self.fake.calls['rpc'] - rpcs_before) / count
+        self.results[name] = stats
+        print(f"{name:>12} | {stats['requests']:>6} {errors:>5} | {stats['throughput_rps']:>9.1f} | "
+              f"{stats['p50_ms']:>7.2f} {stats['p95_ms']:>7.2f} {stats['p99_ms']:>7.2f} | "
+              f"{stats['backend_calls_per_request']:>6.2f}")
+        return [body for _, _, body in outcomes]
+
+    def run(self):
+        args = self.args
+        print(f"{'endpoint':>12} | {'reqs':>6} {'errs':>5} | {'req/s':>9} | "
+              f"{'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} | {'calls':>6}")
+
+        bodies = self.run_phase('register', [
+            ('POST', '/api/register', {
+                'username': f'pilgrim{i}',
+                'email': f'pilgrim{i}.{args.seed}@example.com',
+                'mobile_number': f'+91{9000000000 + i}',
+                'password': PASSWORD
+            })
+            for i in range(args.users)
+        ])
+        user_ids = [body['user_id'] for body in bodies if body and body.get('success')]
+        self.tokens = {body['user_id']: body['token'] for body in bodies if body and body.get('success')}
+        if len(user_ids) < 2:
+            sys.exit('Registration failed; nothing to load test')
+
+        self.run_phase('login', [
+            ('POST', '/api/login', {'user_id': self.rng.choice(user_ids), 'password': PASSWORD})
+            for _ in range(args.requests)
+        ])
+
+        sample_size = family_size_sampler(args.family_sizes, self.rng)
+        links = []
+        for user_id in user_ids:
+            others = [other for other in self.rng.sample(user_ids, min(len(user_ids), 64)) if other != user_id]
+            for member_id in others[:sample_size()]:
+                links.append(('POST', f'/api/@{user_id}/add_family', {'family_member_id': member_id}))
+        self.run_phase('add_family', links)
+
+        self.run_phase('family', [
+            ('GET', f'/api/@{self.rng.choice(user_ids)}/family', None) for _ in range(args.requests)
+        ])
+
+        bodies = self.run_phase('sos', [
+            ('POST', f'/api/@{self.rng.choice(user_ids)}/sos', {'location': 'Ram Ghat', 'message': 'Load test'})
+            for _ in range(args.requests)
+        ])
+        alerts = [(body['user_id'], body['alert_id']) for body in bodies if body and body.get('success')]
+
+        self.run_phase('sos_history', [
+            ('GET', f'/api/@{user_id}/sos/history?limit=20', None)
+            for user_id, _ in (self.rng.choice(alerts) for _ in range(args.requests))
+        ])
+
+        self.run_phase('resolve', [
+            ('POST', f'/api/@{user_id}/sos/{alert_id}/resolve', None) for user_id, alert_id in alerts
+        ])
+
+        from api.notifications import dispatcher
+        from api.journal import journal
+        dispatcher.shutdown()
+        # Replicate what the journal still holds while the backend is up
+        journal.shutdown()
+
+    def report(self):
+        return {
+            'created_at': datetime.utcnow().isoformat(),
+            'git_commit': git_commit(),
+            'config': vars(self.args),
+            'endpoints': self.results
+        }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline, threshold):
+    """Print per-endpoint changes and return the endpoints that regressed"""
+    regressions = []
+    print(f"\n{'endpoint':>12} | {'p95 ms':>17} | {'req/s':>19}")
+    for name, stats in report['endpoints'].items():
+        before = baseline['endpoints'].get(name)
+        if not before:
+            continue
+        p95_change = (stats['p95_ms'] - before['p95_ms']) / before['p95_ms'] if before['p95_ms'] else 0.0
+        rps_change = ((stats['throughput_rps'] - before['throughput_rps']) / before['throughput_rps']
+                      if before['throughput_rps'] else 0.0)
+        regressed = p95_change > threshold or rps_change < -threshold
+        print(f"{name:>12} | {before['p95_ms']:>7.2f} -> {stats['p95_ms']:>7.2f} | "
+              f"{before['throughput_rps']:>8.1f} -> {stats['throughput_rps']:>8.1f}"
+              f"{'  REGRESSION' if regressed else ''}")
+        if regressed:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=['fake', 'sqlite'], default='fake')
+    parser.add_argument('--latency', type=float, default=0.005, help='fake Firestore seconds per round trip')
+    parser.add_argument('--jitter', type=float, default=0.002, help='fake Firestore extra random latency')
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--family-sizes', default='poisson:3',
+                        help='fixed:N, uniform:A-B, poisson:MEAN or choice:SIZE=WEIGHT,...')
+    parser.add_argument('--requests', type=int, default=500, help='requests per read/SOS endpoint')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--cold-cache', action='store_true', help='clear profile caches before each phase')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--compare', help='baseline JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help='allowed relative p95/throughput change before failing')
+    args = parser.parse_args()
+
+    load_test = LoadTest(args)
+    load_test.setup()
+    load_test.run()
+    report = load_test.report()
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f'\nResults written to {args.output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            sys.exit(f"Regressions: {', '.join(regressions)}")
+
+
+if __name__ == '__main__':
+    main()
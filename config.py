@@ -5,13 +5,165 @@ from firebase_admin import credentials
 class Config:
     """Configuration class for the S.A.N.G.A.M. application"""
     
-    # Flask configuration
-    SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
+    # Flask configuration. Session tokens are signed with SECRET_KEY, so a
+    # worker refuses to start with the public default unless DEBUG is set
+    DEFAULT_SECRET_KEY = 'dev-secret-key-change-in-production'
+    SECRET_KEY = os.environ.get('SECRET_KEY') or DEFAULT_SECRET_KEY
     DEBUG = os.environ.get('FLASK_DEBUG', 'False').lower() == 'true'
     
+    # Storage backend: 'firestore' or 'sqlite'
+    STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'firestore').lower()
+    SQLITE_PATH = os.environ.get('SQLITE_PATH', 'sangam.db')
+    SQLITE_POOL_SIZE = int(os.environ.get('SQLITE_POOL_SIZE', 8))
+    SQLITE_TIMEOUT = float(os.environ.get('SQLITE_TIMEOUT', 5))
+    
+    # Prometheus metrics at /metrics
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    
+    # User profile cache (per worker process)
+    PROFILE_CACHE_MAX_SIZE = int(os.environ.get('PROFILE_CACHE_MAX_SIZE', 10000))
+    PROFILE_CACHE_TTL = int(os.environ.get('PROFILE_CACHE_TTL', 300))
+    
+    # SOS notification fan-out
+    NOTIFY_CHANNELS = [name.strip() for name in os.environ.get('NOTIFY_CHANNELS', 'sms,email,push').split(',') if name.strip()]
+    NOTIFY_WORKERS = int(os.environ.get('NOTIFY_WORKERS', 8))
+    NOTIFY_CHANNEL_CONCURRENCY = int(os.environ.get('NOTIFY_CHANNEL_CONCURRENCY', 4))
+    NOTIFY_MAX_ATTEMPTS = int(os.environ.get('NOTIFY_MAX_ATTEMPTS', 5))
+    NOTIFY_BACKOFF_BASE = float(os.environ.get('NOTIFY_BACKOFF_BASE', 0.5))
+    NOTIFY_BACKOFF_MAX = float(os.environ.get('NOTIFY_BACKOFF_MAX', 30))
+    # Deliveries still pending this many seconds after they were queued are
+    # taken to be lost with the worker that queued them and are sent again;
+    # every worker looks for them each interval (0 turns recovery off)
+    NOTIFY_RECOVERY_AFTER = float(os.environ.get('NOTIFY_RECOVERY_AFTER', 600))
+    NOTIFY_RECOVERY_INTERVAL = float(os.environ.get('NOTIFY_RECOVERY_INTERVAL', 60))
+    
+    # Server-Sent Events alert stream
+    SSE_MAX_CONNECTIONS = int(os.environ.get('SSE_MAX_CONNECTIONS', 500))
+    SSE_HEARTBEAT_SECONDS = float(os.environ.get('SSE_HEARTBEAT_SECONDS', 15))
+    SSE_HISTORY_SIZE = int(os.environ.get('SSE_HISTORY_SIZE', 1000))
+    SSE_RETRY_MS = int(os.environ.get('SSE_RETRY_MS', 3000))
+    
+    # SOS idempotency keys and coalescing: repeated triggers within the window
+    # of a user's last one join their active alert (0 turns coalescing off).
+    # The sqlite store is shared by every worker on the host.
+    SOS_COALESCE_WINDOW = float(os.environ.get('SOS_COALESCE_WINDOW', 120))
+    SOS_IDEMPOTENCY_TTL = float(os.environ.get('SOS_IDEMPOTENCY_TTL', 86400))
+    SOS_CLAIM_TIMEOUT = float(os.environ.get('SOS_CLAIM_TIMEOUT', 30))
+    SOS_COALESCE_WAIT = float(os.environ.get('SOS_COALESCE_WAIT', 5))
+    SOS_COALESCE_STORE = os.environ.get('SOS_COALESCE_STORE', 'sqlite').lower()
+    SOS_COALESCE_PATH = os.environ.get('SOS_COALESCE_PATH', 'sos_coalesce.db')
+    
+    # Responder dashboard: resolved alerts stay in active_alerts this long,
+    # and the sqlite backend checks for changes this often. Only the users in
+    # SOS_RESPONDERS (comma-separated user IDs) and BROADCAST_AUTHORITIES
+    # can read other pilgrims' alerts
+    SOS_RESPONDERS = [user_id.strip() for user_id in os.environ.get('SOS_RESPONDERS', '').split(',') if user_id.strip()]
+    ACTIVE_ALERTS_RETENTION = int(os.environ.get('ACTIVE_ALERTS_RETENTION', 3600))
+    ACTIVE_ALERTS_POLL_SECONDS = float(os.environ.get('ACTIVE_ALERTS_POLL_SECONDS', 1))
+    
+    # Write-behind buffer for non-critical profile fields (last_login): flush
+    # every interval or once max_batch users are waiting; beyond max_pending
+    # buffered users new updates are dropped
+    WRITE_BEHIND_INTERVAL = float(os.environ.get('WRITE_BEHIND_INTERVAL', 2))
+    WRITE_BEHIND_MAX_BATCH = int(os.environ.get('WRITE_BEHIND_MAX_BATCH', 400))
+    WRITE_BEHIND_MAX_PENDING = int(os.environ.get('WRITE_BEHIND_MAX_PENDING', 50000))
+    
+    # Signed session tokens: lifetime, and how often each worker picks up
+    # revocations (logouts) made by other workers
+    SESSION_TOKEN_TTL = int(os.environ.get('SESSION_TOKEN_TTL', 12 * 3600))
+    SESSION_REVOCATION_POLL_SECONDS = float(os.environ.get('SESSION_REVOCATION_POLL_SECONDS', 5))
+    
+    # Login checks the password given at registration, at least
+    # PASSWORD_MIN_LENGTH characters and stored as a salted PBKDF2-SHA256
+    # hash of PASSWORD_HASH_ITERATIONS rounds
+    PASSWORD_MIN_LENGTH = int(os.environ.get('PASSWORD_MIN_LENGTH', 8))
+    PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', 260000))
+    # Accounts from before passwords have none: their first login sets one,
+    # given the account's registered email and mobile number. Turn it off
+    # once every account has a password
+    PASSWORD_SETUP_ON_LOGIN = os.environ.get('PASSWORD_SETUP_ON_LOGIN', 'true').lower() == 'true'
+    
+    # SOS write-ahead journal: alert writes are fsynced to a per-worker file
+    # here and acknowledged, then replicated to storage in batches of up to
+    # max_batch, retrying with backoff from retry_min to retry_max seconds
+    SOS_JOURNAL_ENABLED = os.environ.get('SOS_JOURNAL_ENABLED', 'true').lower() == 'true'
+    SOS_JOURNAL_DIR = os.environ.get('SOS_JOURNAL_DIR', 'sos_journal')
+    SOS_JOURNAL_MAX_BATCH = int(os.environ.get('SOS_JOURNAL_MAX_BATCH', 100))
+    SOS_JOURNAL_RETRY_MIN = float(os.environ.get('SOS_JOURNAL_RETRY_MIN', 0.2))
+    SOS_JOURNAL_RETRY_MAX = float(os.environ.get('SOS_JOURNAL_RETRY_MAX', 30))
+    
+    # Circuit breaker around storage calls on the SOS path: each call waits
+    # at most BACKEND_TIMEOUT seconds, and after the threshold of consecutive
+    # failures calls fail fast for BREAKER_RESET_SECONDS
+    BACKEND_TIMEOUT = float(os.environ.get('BACKEND_TIMEOUT', 2))
+    BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', 5))
+    BREAKER_RESET_SECONDS = float(os.environ.get('BREAKER_RESET_SECONDS', 10))
+    
+    # Alert archive: alerts resolved more than ALERT_ARCHIVE_AGE seconds ago
+    # move out of sos_alerts into per-user monthly rollups, in batches of
+    # ALERT_ARCHIVE_BATCH_SIZE (at most 160 on Firestore, whose write
+    # batches hold 500 writes) and at most ALERT_ARCHIVE_MAX_BATCHES batches
+    # every ALERT_ARCHIVE_INTERVAL seconds. Enable it on one process only;
+    # python -m scripts.archive_alerts runs the same batches by hand.
+    ALERT_ARCHIVE_ENABLED = os.environ.get('ALERT_ARCHIVE_ENABLED', 'false').lower() == 'true'
+    ALERT_ARCHIVE_AGE = int(os.environ.get('ALERT_ARCHIVE_AGE', 7 * 86400))
+    ALERT_ARCHIVE_BATCH_SIZE = int(os.environ.get('ALERT_ARCHIVE_BATCH_SIZE', 100))
+    ALERT_ARCHIVE_MAX_BATCHES = int(os.environ.get('ALERT_ARCHIVE_MAX_BATCHES', 50))
+    ALERT_ARCHIVE_INTERVAL = float(os.environ.get('ALERT_ARCHIVE_INTERVAL', 60))
+    
+    # Zone broadcasts: the users in BROADCAST_AUTHORITIES (comma-separated
+    # user IDs) can send an alert to everyone registered in a zone. It is
+    # split into BROADCAST_SHARDS shards that worker processes lease for
+    # BROADCAST_LEASE_SECONDS, writing BROADCAST_BATCH_SIZE inbox entries per
+    # commit (at most 499 on Firestore) and at most BROADCAST_RATE entries a
+    # second per process. A process pauses while more than
+    # BROADCAST_YIELD_QUEUE_DEPTH SOS notifications wait, looks for shards
+    # every BROADCAST_POLL_INTERVAL seconds when idle, and only delivers with
+    # BROADCAST_FANOUT_ENABLED (set it on the processes meant to deliver).
+    # Inbox entries are kept for BROADCAST_INBOX_RETENTION seconds.
+    BROADCAST_AUTHORITIES = [user_id.strip() for user_id in os.environ.get('BROADCAST_AUTHORITIES', '').split(',') if user_id.strip()]
+    BROADCAST_FANOUT_ENABLED = os.environ.get('BROADCAST_FANOUT_ENABLED', 'false').lower() == 'true'
+    BROADCAST_SHARDS = int(os.environ.get('BROADCAST_SHARDS', 16))
+    BROADCAST_BATCH_SIZE = int(os.environ.get('BROADCAST_BATCH_SIZE', 400))
+    BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', 2000))
+    BROADCAST_LEASE_SECONDS = float(os.environ.get('BROADCAST_LEASE_SECONDS', 30))
+    BROADCAST_POLL_INTERVAL = float(os.environ.get('BROADCAST_POLL_INTERVAL', 5))
+    BROADCAST_YIELD_QUEUE_DEPTH = int(os.environ.get('BROADCAST_YIELD_QUEUE_DEPTH', 100))
+    BROADCAST_INBOX_RETENTION = int(os.environ.get('BROADCAST_INBOX_RETENTION', 3 * 86400))
+    
+    # Request profiling: with PROFILING_ENABLED, a request carrying a signed
+    # X-Profile header (python -m scripts.sign_profile_header), or a
+    # PROFILE_SAMPLE_RATE share of all requests, has its thread's stack
+    # sampled every PROFILE_INTERVAL seconds for at most PROFILE_MAX_SECONDS.
+    # Profiles are written to PROFILE_DIR as speedscope JSON or collapsed
+    # stacks (PROFILE_FORMAT=speedscope|collapsed), keeping the newest
+    # PROFILE_MAX_FILES. When disabled no profiling hook is installed.
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', 'false').lower() == 'true'
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.002))
+    PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 30))
+    PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+    PROFILE_FORMAT = os.environ.get('PROFILE_FORMAT', 'speedscope').lower()
+    PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 50))
+    
+    # ASGI mode (uvicorn asgi:app): threads for the routes served by Flask
+    ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', 16))
+    
+    # Static assets: max-age for fingerprinted (?v=) URLs, and the largest
+    # file kept in memory with precompressed variants
+    STATIC_MAX_AGE = int(os.environ.get('STATIC_MAX_AGE', 31536000))
+    STATIC_CACHE_MAX_FILE_SIZE = int(os.environ.get('STATIC_CACHE_MAX_FILE_SIZE', 1024 * 1024))
+    
     # Firebase configuration - using service account JSON file
     FIREBASE_SERVICE_ACCOUNT_PATH = 'firebase_service_account.json'
     
+    # Firestore gRPC channel settings
+    FIRESTORE_GRPC_KEEPALIVE_MS = int(os.environ.get('FIRESTORE_GRPC_KEEPALIVE_MS', 30000))
+    FIRESTORE_GRPC_KEEPALIVE_TIMEOUT_MS = int(os.environ.get('FIRESTORE_GRPC_KEEPALIVE_TIMEOUT_MS', 10000))
+    FIRESTORE_GRPC_MAX_CONCURRENT_STREAMS = int(os.environ.get('FIRESTORE_GRPC_MAX_CONCURRENT_STREAMS', 100))
+    FIRESTORE_GRPC_LOCAL_SUBCHANNEL_POOL = os.environ.get('FIRESTORE_GRPC_LOCAL_SUBCHANNEL_POOL', 'true').lower() == 'true'
+    FIRESTORE_WARMUP_TIMEOUT = float(os.environ.get('FIRESTORE_WARMUP_TIMEOUT', 5))
+    
     @classmethod
     def get_firebase_credentials(cls):
         """Get Firebase credentials from JSON file"""
@@ -27,3 +179,16 @@ class Config:
     def get_firebase_credentials_path(cls):
         """Get Firebase credentials file path"""
         return cls.FIREBASE_SERVICE_ACCOUNT_PATH
+    
+    @classmethod
+    def get_firestore_channel_options(cls):
+        """Get gRPC channel options for the Firestore client"""
+        return [
+            ('grpc.max_send_message_length', -1),
+            ('grpc.max_receive_message_length', -1),
+            ('grpc.keepalive_time_ms', cls.FIRESTORE_GRPC_KEEPALIVE_MS),
+            ('grpc.keepalive_timeout_ms', cls.FIRESTORE_GRPC_KEEPALIVE_TIMEOUT_MS),
+            ('grpc.max_concurrent_streams', cls.FIRESTORE_GRPC_MAX_CONCURRENT_STREAMS),
+            # A per-channel subchannel pool keeps workers from sharing connections
+            ('grpc.use_local_subchannel_pool', int(cls.FIRESTORE_GRPC_LOCAL_SUBCHANNEL_POOL))
+        ]
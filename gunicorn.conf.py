@@ -0,0 +1,42 @@
+"""Gunicorn settings for S.A.N.G.A.M.
+
+Run with: gunicorn -c gunicorn.conf.py app:app
+"""
+import os
+import shutil
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+# SSE alert streams hold a connection open, so use threaded workers
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+# Safe to preload: the app opens no connections until warm_up() runs in each worker
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+# Shared directory for merging Prometheus metrics across workers
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', os.path.join(os.getcwd(), '.prometheus'))
+
+
+def on_starting(server):
+    """Start every run with an empty metrics directory"""
+    metrics_dir = os.environ['PROMETHEUS_MULTIPROC_DIR']
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def post_worker_init(worker):
+    """Warm backend connections in each worker before it accepts requests"""
+    from app import warm_up
+    warm_up(worker.wsgi)
+
+
+def worker_exit(server, worker):
+    """Flush buffered profile updates before the worker exits"""
+    from app import shut_down
+    shut_down()
+
+
+def child_exit(server, worker):
+    """Drop live gauges of a worker that has exited"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
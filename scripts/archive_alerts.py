@@ -0,0 +1,36 @@
+"""Move resolved SOS alerts older than the archive age into monthly rollups.
+
+Runs the same batches as the archiver thread (see api.archive), from a
+cron job or by hand after a festival: each batch lists the oldest
+resolved alerts past the cutoff and archives them in one commit. Archived
+alerts leave ``sos_alerts``, so stopping and running it again resumes
+where it stopped. Prints throughput after every batch. With
+STORAGE_BACKEND=sqlite it archives ``SQLITE_PATH``.
+
+Usage: python -m scripts.archive_alerts [--max-age SECONDS] [--batch-size 100] [--max-batches 0]
+"""
+import argparse
+
+from api.archive import AlertArchiver
+from config import Config
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--max-age', type=int, default=Config.ALERT_ARCHIVE_AGE,
+                        help='archive alerts resolved more than this many seconds ago')
+    parser.add_argument('--batch-size', type=int, default=Config.ALERT_ARCHIVE_BATCH_SIZE)
+    parser.add_argument('--max-batches', type=int, default=0, help='stop after this many batches (0 for all)')
+    args = parser.parse_args()
+
+    archiver = AlertArchiver(max_age=args.max_age, batch_size=args.batch_size)
+
+    def on_batch(counts):
+        print(f"{counts['alerts']} alerts archived in {counts['batches']} batches, "
+              f"{counts['seconds']:.1f}s ({counts['alerts_per_second']:.0f}/s)", flush=True)
+
+    print(archiver.run_once(max_batches=args.max_batches, on_batch=on_batch))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Build active_alerts entries for alerts raised before the collection existed.
+
+The responder dashboard only reads ``active_alerts``, so run this once
+against each project after deploying the code that maintains it. Alerts
+that already have an entry are left alone. The SQLite backend backfills
+itself when it opens the database.
+
+Usage: python -m scripts.backfill_active_alerts [--batch-size 400] [--dry-run]
+"""
+import argparse
+
+from api.storage.base import active_entry
+from api.storage.firestore_backend import get_client
+
+
+def backfill(db, batch_size=400, dry_run=False):
+    """Add an entry for every active alert without one and return counters"""
+    counts = {'alerts': 0, 'added': 0, 'already_present': 0}
+    active_ref = db.collection('active_alerts')
+    pending = []
+
+    def flush():
+        refs = [active_ref.document(alert_id) for alert_id, _ in pending]
+        present = {doc.id for doc in db.get_all(refs, field_paths=['status']) if doc.exists}
+        batch = db.batch()
+        for (alert_id, alert), ref in zip(pending, refs):
+            if alert_id in present:
+                counts['already_present'] += 1
+                continue
+            batch.set(ref, active_entry(alert))
+            counts['added'] += 1
+        if len(batch) and not dry_run:
+            batch.commit()
+        pending.clear()
+
+    for alert_doc in db.collection('sos_alerts').where('status', '==', 'active').stream():
+        counts['alerts'] += 1
+        pending.append((alert_doc.id, alert_doc.to_dict()))
+        if len(pending) >= batch_size:
+            flush()
+    if pending:
+        flush()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=400)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    db = get_client()
+    print(backfill(db, args.batch_size, args.dry_run))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""Build email_index entries for users registered before the index existed.
+
+Registration only checks ``email_index``, so run this once against each
+project before deploying the indexed registration path.
+
+Usage: python -m scripts.backfill_email_index [--batch-size 400] [--dry-run]
+"""
+import argparse
+
+from api.storage import email_index_id, normalize_email
+from api.storage.firestore_backend import get_client
+
+
+def backfill(db, batch_size=400, dry_run=False):
+    """Index every user's email, skipping emails that are already indexed
+
+    Returns counters, including emails shared by more than one legacy user
+    (the first user seen keeps the email).
+    """
+    counts = {'users': 0, 'indexed': 0, 'already_indexed': 0, 'duplicates': 0}
+    index_ref = db.collection('email_index')
+    pending = []
+
+    def flush():
+        refs = [index_ref.document(email_index_id(email)) for _, email, _ in pending]
+        claimed = {doc.id: doc.to_dict() for doc in db.get_all(refs) if doc.exists}
+        batch = db.batch()
+        seen = {}
+        for (user_id, email, created_at), ref in zip(pending, refs):
+            owner = claimed.get(ref.id, {}).get('user_id') or seen.get(ref.id)
+            if owner == user_id:
+                counts['already_indexed'] += 1
+            elif owner:
+                counts['duplicates'] += 1
+                print(f'Duplicate email {email}: {user_id} (kept {owner})')
+            else:
+                seen[ref.id] = user_id
+                batch.set(ref, {'email': email, 'user_id': user_id, 'created_at': created_at})
+                counts['indexed'] += 1
+        if seen and not dry_run:
+            batch.commit()
+        pending.clear()
+
+    for user_doc in db.collection('users').select(['email', 'created_at']).stream():
+        user_data = user_doc.to_dict()
+        counts['users'] += 1
+        if not user_data.get('email'):
+            continue
+        pending.append((user_doc.id, normalize_email(user_data['email']), user_data.get('created_at')))
+        if len(pending) >= batch_size:
+            flush()
+    if pending:
+        flush()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=400)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    db = get_client()
+    print(backfill(db, args.batch_size, args.dry_run))
+
+
+if __name__ == '__main__':
+    main()
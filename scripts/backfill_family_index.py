@@ -0,0 +1,60 @@
+"""Build family_index entries from the family lists of existing users.
+
+``family_index/<member>`` lists the users who have the member in their
+family. Adding and removing family members keeps it current, so run this
+once against each project after deploying that code. Entries are merged
+with ArrayUnion, so re-running is safe. The SQLite backend needs no
+backfill: it answers from its family_links table.
+
+Usage: python -m scripts.backfill_family_index [--batch-size 400] [--dry-run]
+"""
+import argparse
+from collections import defaultdict
+from datetime import datetime
+
+from firebase_admin import firestore
+
+from api.storage.firestore_backend import get_client
+
+
+def backfill(db, batch_size=400, dry_run=False):
+    """Index every family link and return counters"""
+    counts = {'users': 0, 'links': 0, 'members': 0}
+    listed_by = defaultdict(list)
+    for user_doc in db.collection('users').select(['family_members']).stream():
+        counts['users'] += 1
+        for member_id in user_doc.to_dict().get('family_members') or []:
+            listed_by[member_id].append(user_doc.id)
+            counts['links'] += 1
+    counts['members'] = len(listed_by)
+    if dry_run:
+        return counts
+
+    index_ref = db.collection('family_index')
+    updated_at = datetime.utcnow().isoformat()
+    batch = db.batch()
+    for member_id, owners in listed_by.items():
+        batch.set(index_ref.document(member_id), {
+            'listed_by': firestore.ArrayUnion(owners),
+            'updated_at': updated_at
+        }, merge=True)
+        if len(batch) >= batch_size:
+            batch.commit()
+            batch = db.batch()
+    if len(batch):
+        batch.commit()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=400)
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    db = get_client()
+    print(backfill(db, args.batch_size, args.dry_run))
+
+
+if __name__ == '__main__':
+    main()
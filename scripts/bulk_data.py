@@ -0,0 +1,231 @@
+"""Export users and SOS alerts as NDJSON, or import them in parallel batches.
+
+``export`` streams ``users`` then ``sos_alerts`` in document ID order, one
+page at a time, so memory stays flat however large the collections are.
+Each line is ``{"kind": "user" | "alert", "id": ..., "data": {...}}``.
+Archived alerts (api.archive) are not exported.
+
+``import`` reads such a file, or a group organizer's pre-registration list
+with one ``{"username", "email", "mobile_number"}`` object per line, in
+chunks of ``--batch-size`` lines that ``--workers`` threads write in
+parallel. The emails of a chunk are checked in one read; users and alerts
+are created in batches, and ones that already exist (by ID or email) are
+skipped, so an import can be run again. Pre-registered users get a fresh
+user ID, appended to ``--ids-output`` with their email so organizers can
+hand them out; a line may carry a ``password``, and users without one
+set it at their first login or through scripts.set_password.
+``--checkpoint`` records the lines done and resumes after them. Both
+commands print records per second as they go; with
+STORAGE_BACKEND=sqlite they use ``SQLITE_PATH``.
+
+Usage: python -m scripts.bulk_data export [--output FILE] [--page-size 500] | import FILE [--batch-size 200] [--workers 4] [--checkpoint FILE] [--ids-output FILE]
+"""
+import argparse
+import json
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from itertools import islice
+
+from api.auth import new_user, registration_error
+from api.storage import get_storage
+from api.storage.base import normalize_email
+from scripts.compact_alerts import read_checkpoint, write_checkpoint
+
+
+def _encode(value):
+    # Firestore returns timestamps as datetimes
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'Cannot export {type(value).__name__}')
+
+
+def export_lines(storage, page_size=500):
+    """Yield every user and alert as an NDJSON line, reading one page at a time"""
+    cursor = None
+    while True:
+        users = storage.scan_users(page_size, start_after=cursor)
+        for user_data in users:
+            yield json.dumps({'kind': 'user', 'id': user_data['user_id'], 'data': user_data}, default=_encode)
+        if len(users) < page_size:
+            break
+        cursor = users[-1]['user_id']
+
+    cursor = None
+    while True:
+        alerts = storage.scan_alerts(page_size, start_after=cursor)
+        for alert_id, alert in alerts:
+            yield json.dumps({'kind': 'alert', 'id': alert_id, 'data': alert}, default=_encode)
+        if len(alerts) < page_size:
+            break
+        cursor = alerts[-1][0]
+
+
+def parse_line(line):
+    """Turn an NDJSON line into ('user', user_data, registered) or ('alert', alert_id, alert)
+
+    Raises ValueError for a line that is not a valid record.
+    """
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError('not a JSON object')
+    kind = record.get('kind')
+    if kind == 'alert':
+        return 'alert', record['id'], record['data']
+    if kind == 'user':
+        user_data = dict(record['data'], user_id=record['id'])
+        if not user_data.get('email'):
+            raise ValueError('user without email')
+        return 'user', user_data, False
+    # A pre-registration: a new user, as /api/register would create it
+    error = registration_error(record, password_required=False)
+    if error:
+        raise ValueError(error)
+    return 'user', new_user(record), True
+
+
+def import_chunk(storage, lines, on_registered=None):
+    """Write one chunk of (line number, line) pairs and return its counters"""
+    counts = {'records': 0, 'users': 0, 'registered': 0, 'skipped': 0, 'alerts': 0, 'invalid': 0}
+    users, registered, alerts = [], set(), {}
+    for number, line in lines:
+        if not line.strip():
+            continue
+        counts['records'] += 1
+        try:
+            kind, key, value = parse_line(line)
+        except (ValueError, KeyError, TypeError) as e:
+            counts['invalid'] += 1
+            print(f'line {number}: skipped, {e}', file=sys.stderr)
+            continue
+        if kind == 'alert':
+            alerts[key] = value
+        else:
+            users.append(key)
+            if value:
+                registered.add(key['user_id'])
+
+    # One read for the whole chunk's emails, and each email once per chunk
+    taken = storage.find_emails([user_data['email'] for user_data in users]) if users else set()
+    new_users = []
+    for user_data in users:
+        email = normalize_email(user_data['email'])
+        if email in taken:
+            counts['skipped'] += 1
+            continue
+        taken.add(email)
+        new_users.append(user_data)
+
+    skipped = set(storage.create_users(new_users)) if new_users else set()
+    counts['skipped'] += len(skipped)
+    for user_data in new_users:
+        if user_data['user_id'] in skipped:
+            continue
+        counts['users'] += 1
+        if user_data['user_id'] in registered:
+            counts['registered'] += 1
+            if on_registered:
+                on_registered(user_data)
+
+    if alerts:
+        storage.import_alerts(alerts)
+        counts['alerts'] += len(alerts)
+    return counts
+
+
+def import_lines(storage, lines, batch_size=200, workers=4, start_after=0, on_chunk=None, on_registered=None):
+    """Import numbered NDJSON lines after line ``start_after`` and return counters
+
+    Chunks are written by ``workers`` threads, with at most two chunks per
+    worker read ahead. ``on_chunk(counts, line)`` is called in file order
+    once every line up to ``line`` is written, which is what a checkpoint
+    may record.
+    """
+    totals = {'records': 0, 'users': 0, 'registered': 0, 'skipped': 0, 'alerts': 0, 'invalid': 0}
+    numbered = ((number, line) for number, line in enumerate(lines, 1) if number > start_after)
+    pending = deque()
+
+    def finish(future, last_line):
+        for key, value in future.result().items():
+            totals[key] += value
+        if on_chunk:
+            on_chunk(totals, last_line)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='import') as pool:
+        while True:
+            chunk = list(islice(numbered, batch_size))
+            if not chunk:
+                break
+            pending.append((pool.submit(import_chunk, storage, chunk, on_registered), chunk[-1][0]))
+            if len(pending) >= workers * 2:
+                finish(*pending.popleft())
+        while pending:
+            finish(*pending.popleft())
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help='write users and alerts as NDJSON')
+    export_parser.add_argument('--output', help='file to write (default stdout)')
+    export_parser.add_argument('--page-size', type=int, default=500)
+    import_parser = commands.add_parser('import', help='read users and alerts from NDJSON')
+    import_parser.add_argument('file')
+    import_parser.add_argument('--batch-size', type=int, default=200, help='lines per chunk')
+    import_parser.add_argument('--workers', type=int, default=4, help='chunks written in parallel')
+    import_parser.add_argument('--checkpoint', help='file keeping the last line done, read on start')
+    import_parser.add_argument('--ids-output', help='append the user IDs given to pre-registered users here')
+    args = parser.parse_args()
+
+    storage = get_storage()
+    start = time.perf_counter()
+
+    if args.command == 'export':
+        out = open(args.output, 'w') if args.output else sys.stdout
+        try:
+            count = 0
+            for count, line in enumerate(export_lines(storage, args.page_size), 1):
+                out.write(line + '\n')
+                if count % 10000 == 0:
+                    print(f'{count} records ({count / (time.perf_counter() - start):.0f}/s)', file=sys.stderr, flush=True)
+        finally:
+            if out is not sys.stdout:
+                out.close()
+        print(f'{count} records exported in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+        return
+
+    start_after = read_checkpoint(args.checkpoint) or 0
+    ids_file = open(args.ids_output, 'a') if args.ids_output else None
+    ids_lock = threading.Lock()
+
+    def on_registered(user_data):
+        if ids_file:
+            with ids_lock:
+                ids_file.write(json.dumps({'email': user_data['email'], 'user_id': user_data['user_id']}) + '\n')
+
+    def on_chunk(counts, line):
+        if ids_file:
+            with ids_lock:
+                ids_file.flush()
+        if args.checkpoint:
+            write_checkpoint(args.checkpoint, line)
+        rate = counts['records'] / max(time.perf_counter() - start, 1e-9)
+        print(f"line {line}: {counts['users']} users ({counts['registered']} pre-registered), "
+              f"{counts['alerts']} alerts, {counts['skipped']} skipped, {counts['invalid']} invalid "
+              f"({rate:.0f} records/s)", flush=True)
+
+    try:
+        with open(args.file) as f:
+            counts = import_lines(storage, f, args.batch_size, args.workers, start_after, on_chunk, on_registered)
+    finally:
+        if ids_file:
+            ids_file.close()
+    print(counts)
+
+
+if __name__ == '__main__':
+    main()
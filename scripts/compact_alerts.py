@@ -0,0 +1,157 @@
+"""Rewrite SOS alerts stored before the compact alert schema.
+
+Older alerts embed the caller's and every family member's name, email and
+mobile number. This streams ``sos_alerts`` in document ID order, one page
+at a time, and drops those copies with one write batch per page, keeping
+the member IDs in ``family_notified``. Alerts already compact are skipped,
+so the migration can be stopped and run again; each page prints its
+cursor, and ``--start-after`` (or the last cursor saved in
+``--checkpoint``) resumes after it. The API reads old and new alerts alike
+while it runs. With STORAGE_BACKEND=sqlite it rewrites ``SQLITE_PATH``.
+
+Usage: python -m scripts.compact_alerts [--batch-size 400] [--start-after ALERT_ID] [--checkpoint FILE] [--dry-run]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+from firebase_admin import firestore
+
+from api.storage.base import ALERT_DETAIL_FIELDS, ALERT_SCHEMA_VERSION, compact_alert
+from api.storage.firestore_backend import get_client
+from config import Config
+
+
+def compaction_update(alert):
+    """Field updates that bring a stored alert to the compact schema, or None if it is already
+
+    Only the changed fields are written, so delivery statuses and location
+    updates recorded while the migration runs are kept.
+    """
+    compact = compact_alert(alert)
+    if compact is None:
+        return None
+    update = {field: firestore.DELETE_FIELD for field in ALERT_DETAIL_FIELDS}
+    update['schema_version'] = compact['schema_version']
+    if 'family_notified' not in alert:
+        update['family_notified'] = compact['family_notified']
+    return update
+
+
+def compact_firestore(db, batch_size=400, start_after=None, dry_run=False, on_page=None):
+    """Compact every alert after ``start_after`` and return counters
+
+    ``on_page(counts, cursor)`` is called once each page is written.
+    """
+    counts = {'alerts': 0, 'compacted': 0, 'already_compact': 0}
+    alerts_ref = db.collection('sos_alerts')
+    # Only the fields that tell whether and how an alert needs rewriting
+    fields = ['schema_version', 'family_notified', 'family_members']
+    cursor = start_after
+    while True:
+        query = alerts_ref.order_by('__name__').select(fields).limit(batch_size)
+        if cursor:
+            query = query.start_after({'__name__': cursor})
+        page = query.get()
+        if not page:
+            return counts
+
+        batch = db.batch()
+        for alert_doc in page:
+            counts['alerts'] += 1
+            update = compaction_update(alert_doc.to_dict())
+            if update is None:
+                counts['already_compact'] += 1
+                continue
+            batch.update(alert_doc.reference, update)
+            counts['compacted'] += 1
+        if len(batch) and not dry_run:
+            batch.commit()
+        cursor = page[-1].id
+        if on_page:
+            on_page(counts, cursor)
+
+
+def compact_sqlite(path, batch_size=400, start_after=None, dry_run=False, on_page=None):
+    """Compact every alert after ``start_after`` in a SQLite database and return counters
+
+    Member IDs are already in the ``family_notified`` column, so only the
+    copies in ``extra`` are removed, in one transaction per page.
+    """
+    counts = {'alerts': 0, 'compacted': 0, 'already_compact': 0}
+    conn = sqlite3.connect(path, timeout=Config.SQLITE_TIMEOUT)
+    removed = ', '.join(f"'$.{field}'" for field in ALERT_DETAIL_FIELDS)
+    cursor = start_after or ''
+    try:
+        while True:
+            rows = conn.execute(
+                "SELECT alert_id, json_extract(extra, '$.schema_version') FROM sos_alerts "
+                "WHERE alert_id > ? ORDER BY alert_id LIMIT ?",
+                (cursor, batch_size)
+            ).fetchall()
+            if not rows:
+                return counts
+
+            stale = [alert_id for alert_id, version in rows if (version or 1) < ALERT_SCHEMA_VERSION]
+            counts['alerts'] += len(rows)
+            counts['compacted'] += len(stale)
+            counts['already_compact'] += len(rows) - len(stale)
+            if stale and not dry_run:
+                with conn:
+                    conn.executemany(
+                        f"UPDATE sos_alerts SET extra = json_set(json_remove(extra, {removed}), "
+                        "'$.schema_version', ?) WHERE alert_id = ?",
+                        [(ALERT_SCHEMA_VERSION, alert_id) for alert_id in stale]
+                    )
+            cursor = rows[-1][0]
+            if on_page:
+                on_page(counts, cursor)
+    finally:
+        conn.close()
+
+
+def read_checkpoint(path):
+    """Last cursor saved in the checkpoint file, or None"""
+    if not path or not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f).get('cursor')
+
+
+def write_checkpoint(path, cursor):
+    """Save the cursor, replacing the file so a crash never leaves half of it"""
+    temporary = f'{path}.tmp'
+    with open(temporary, 'w') as f:
+        json.dump({'cursor': cursor}, f)
+    os.replace(temporary, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--batch-size', type=int, default=400)
+    parser.add_argument('--start-after', help='resume after this alert ID')
+    parser.add_argument('--checkpoint', help='file keeping the last cursor, read on start')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+
+    start_after = args.start_after or read_checkpoint(args.checkpoint)
+    start = time.perf_counter()
+
+    def on_page(counts, cursor):
+        if args.checkpoint and not args.dry_run:
+            write_checkpoint(args.checkpoint, cursor)
+        rate = counts['alerts'] / max(time.perf_counter() - start, 1e-9)
+        print(f"{counts['alerts']} alerts, {counts['compacted']} compacted, "
+              f"{counts['already_compact']} already compact ({rate:.0f}/s), cursor {cursor}", flush=True)
+
+    if Config.STORAGE_BACKEND == 'sqlite':
+        counts = compact_sqlite(Config.SQLITE_PATH, args.batch_size, start_after, args.dry_run, on_page)
+    else:
+        counts = compact_firestore(get_client(), args.batch_size, start_after, args.dry_run, on_page)
+    print(counts)
+
+
+if __name__ == '__main__':
+    main()
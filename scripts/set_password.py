@@ -0,0 +1,40 @@
+"""Set a user's login password, for users registered without one.
+
+Users registered before logins checked a password, and pre-registrations
+imported without one, set it on their first login while
+PASSWORD_SETUP_ON_LOGIN is on, and through this script otherwise. Reads
+the password from the terminal without echoing it. Workers may accept
+the old password for up to PROFILE_CACHE_TTL seconds from their profile
+cache.
+
+Usage: python -m scripts.set_password USER_ID
+"""
+import argparse
+import getpass
+import sys
+
+from api.auth import hash_password
+from api.storage import get_storage
+from config import Config
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('user_id')
+    args = parser.parse_args()
+
+    storage = get_storage()
+    if storage.get_user(args.user_id) is None:
+        sys.exit(f'No user {args.user_id}')
+    password = getpass.getpass('New password: ')
+    if len(password) < Config.PASSWORD_MIN_LENGTH:
+        sys.exit(f'Password must be at least {Config.PASSWORD_MIN_LENGTH} characters')
+    if getpass.getpass('Repeat it: ') != password:
+        sys.exit('Passwords do not match')
+
+    storage.update_user(args.user_id, {'password_hash': hash_password(password)})
+    print(f'Password set for {args.user_id}')
+
+
+if __name__ == '__main__':
+    main()
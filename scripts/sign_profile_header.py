@@ -0,0 +1,27 @@
+"""Print a signed X-Profile header value that asks for one request's profile.
+
+Signed with a key derived from SECRET_KEY, so run it with the same
+SECRET_KEY as the server, which must have PROFILING_ENABLED set. The value
+is accepted until it expires; every request sending it is profiled, one at
+a time per worker, and the response's ``X-Profile-File`` header names the
+file written to PROFILE_DIR. For example:
+
+    curl -H "X-Profile: $(python -m scripts.sign_profile_header)" ...
+
+Usage: python -m scripts.sign_profile_header [--ttl 300]
+"""
+import argparse
+
+from api.profiling import sign_profile_header
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ttl', type=int, default=300, help='seconds the header stays valid')
+    args = parser.parse_args()
+
+    print(sign_profile_header(args.ttl))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+import os
+import tempfile
+
+import pytest
+
+# Config reads the environment on import: point every store the app keeps
+# on disk at a scratch directory before any test imports it
+_data = tempfile.mkdtemp(prefix='sangam-tests-')
+os.environ.setdefault('STORAGE_BACKEND', 'sqlite')
+os.environ.setdefault('SQLITE_PATH', os.path.join(_data, 'sangam.db'))
+os.environ.setdefault('SOS_JOURNAL_DIR', os.path.join(_data, 'sos_journal'))
+os.environ.setdefault('SOS_COALESCE_PATH', os.path.join(_data, 'sos_coalesce.db'))
+os.environ.setdefault('PROFILE_DIR', os.path.join(_data, 'profiles'))
+os.environ.setdefault('SECRET_KEY', 'test-secret-key')
+# Full-strength password hashing only slows the tests down
+os.environ.setdefault('PASSWORD_HASH_ITERATIONS', '1000')
+
+
+@pytest.fixture
+def client():
+    from app import create_app
+    return create_app().test_client()
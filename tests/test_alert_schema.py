@@ -0,0 +1,55 @@
+from api.journal import journal
+from api.storage import get_storage
+from api.storage.base import ALERT_SCHEMA_VERSION, compact_alert
+
+
+def register(client, name):
+    response = client.post('/api/register', json={
+        'username': name,
+        'email': f'{name}@example.com',
+        'mobile_number': '9876543210',
+        'password': 'ganga-aarti'
+    })
+    body = response.get_json()
+    return body['user_id'], {'Authorization': f"Bearer {body['token']}"}
+
+
+def test_legacy_alerts_are_compacted_to_member_ids():
+    legacy = {
+        'user_id': 'SANGAM_CALLER01',
+        'triggered_at': '2025-01-14T06:00:00',
+        'status': 'resolved',
+        'user_details': {'user_id': 'SANGAM_CALLER01', 'username': 'caller'},
+        'family_members': [{'user_id': 'SANGAM_MEMBER01', 'username': 'member'}]
+    }
+    compact = compact_alert(legacy)
+    assert compact == {
+        'user_id': 'SANGAM_CALLER01',
+        'triggered_at': '2025-01-14T06:00:00',
+        'status': 'resolved',
+        'family_notified': ['SANGAM_MEMBER01'],
+        'schema_version': ALERT_SCHEMA_VERSION
+    }
+    assert compact_alert(compact) is None
+
+
+def test_alerts_store_member_ids_and_expand_their_details(client):
+    caller, headers = register(client, 'compactcaller')
+    member, _ = register(client, 'compactmember')
+    response = client.post(f'/api/@{caller}/add_family', json={'family_member_id': member}, headers=headers)
+    headers = {'Authorization': f"Bearer {response.get_json()['token']}"}
+
+    alert_id = client.post(f'/api/@{caller}/sos', json={'location': 'Ghat 3'}, headers=headers).get_json()['alert_id']
+    assert journal.flush()
+    stored = get_storage().get_alert(alert_id)
+    assert stored['family_notified'] == [member]
+    assert stored['profile_version'] == 1
+    assert 'user_details' not in stored and 'family_members' not in stored
+
+    history = client.get(f'/api/@{caller}/sos/history?expand=family', headers=headers).get_json()
+    assert history['alerts'][0]['family_members'] == [{
+        'user_id': member,
+        'username': 'compactmember',
+        'email': 'compactmember@example.com',
+        'mobile_number': '9876543210'
+    }]
@@ -0,0 +1,53 @@
+from api.archive import AlertArchiver
+from api.storage import get_storage
+from api.storage.sqlite_backend import SQLiteStorage
+
+
+def alert(user_id, triggered_at, status='resolved'):
+    return {
+        'user_id': user_id,
+        'triggered_at': triggered_at,
+        'status': status,
+        'resolved_at': triggered_at if status == 'resolved' else None,
+        'location': 'Ghat 3',
+        'message': 'Emergency SOS triggered',
+        'family_notified': [],
+        'delivery': {}
+    }
+
+
+def test_archiving_runs_in_bounded_batches_and_resumes(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'sangam.db'))
+    for day in range(1, 6):
+        storage.create_alert(alert('SANGAM_PILGRIM1', f'2025-01-{day:02d}T06:00:00'))
+    active = storage.create_alert(alert('SANGAM_PILGRIM1', '2025-01-06T06:00:00', status='active'))
+
+    archiver = AlertArchiver(max_age=86400, batch_size=2, max_batches=2, storage=storage)
+    assert archiver.run_once()['alerts'] == 4
+    assert archiver.run_once()['alerts'] == 1
+    assert archiver.run_once()['alerts'] == 0
+
+    assert [alert_id for alert_id, _ in storage.list_alerts('SANGAM_PILGRIM1')] == [active]
+    archived = storage.list_archived_alerts('SANGAM_PILGRIM1')
+    assert [alert_data['triggered_at'][:10] for _, alert_data in archived] == [
+        f'2025-01-{day:02d}' for day in range(5, 0, -1)
+    ]
+
+
+def test_history_reads_recent_and_archived_alerts_in_time_order(client):
+    response = client.post('/api/register', json={
+        'username': 'archivist', 'email': 'archivist@example.com',
+        'mobile_number': '9876543210', 'password': 'ganga-aarti'
+    })
+    user_id, token = response.get_json()['user_id'], response.get_json()['token']
+    storage = get_storage()
+    for triggered_at in ('2025-01-01T06:00:00', '2025-02-01T06:00:00'):
+        storage.create_alert(alert(user_id, triggered_at))
+    AlertArchiver(max_age=86400, storage=storage).run_once(max_batches=0)
+    storage.create_alert(alert(user_id, '2099-01-01T06:00:00', status='active'))
+
+    headers = {'Authorization': f'Bearer {token}'}
+    history = client.get(f'/api/@{user_id}/sos/history?limit=2', headers=headers).get_json()
+    assert [alert_data['triggered_at'][:7] for alert_data in history['alerts']] == ['2099-01', '2025-02']
+    history = client.get(f"/api/@{user_id}/sos/history?start_after={history['next_cursor']}", headers=headers).get_json()
+    assert [alert_data['triggered_at'][:7] for alert_data in history['alerts']] == ['2025-01']
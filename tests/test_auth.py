@@ -0,0 +1,134 @@
+import threading
+
+import pytest
+
+from api.auth import hash_password, password_matches
+from api.storage import EmailAlreadyRegistered, UserIdCollision
+from api.storage.sqlite_backend import SQLiteStorage
+
+
+def register(client, **fields):
+    body = dict({'username': 'Asha', 'email': 'asha@example.com', 'mobile_number': '9876543210',
+                 'password': 'ganga-aarti'}, **fields)
+    return client.post('/api/register', json=body)
+
+
+def test_password_hashes_are_salted():
+    first, second = hash_password('ganga-aarti'), hash_password('ganga-aarti')
+    assert first != second
+    assert password_matches('ganga-aarti', first)
+    assert not password_matches('ganga-aart', first)
+    assert not password_matches('ganga-aarti', None)
+
+
+def test_register_requires_a_password(client):
+    response = register(client, email='nopassword@example.com', password=None)
+    assert response.status_code == 400
+    response = register(client, email='short@example.com', password='short')
+    assert response.status_code == 400
+    assert 'at least 8' in response.get_json()['error']
+
+
+def test_emails_are_unique_whatever_their_case(client):
+    assert register(client, email='unique@example.com').status_code == 201
+    response = register(client, email=' Unique@Example.com ')
+    assert response.status_code == 409
+    assert 'token' not in response.get_json()
+
+
+def test_concurrent_registrations_claim_an_email_once(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'sangam.db'))
+    barrier = threading.Barrier(20)
+    created, refused = [], []
+
+    def create(i):
+        barrier.wait()
+        try:
+            storage.create_user({'user_id': f'SANGAM_RACE{i:04d}', 'username': 'racer',
+                                 'email': 'race@example.com', 'mobile_number': '9876543210'})
+            created.append(i)
+        except EmailAlreadyRegistered:
+            refused.append(i)
+
+    threads = [threading.Thread(target=create, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(created) == 1 and len(refused) == 19
+
+    with pytest.raises(UserIdCollision):
+        storage.create_user({'user_id': f'SANGAM_RACE{created[0]:04d}', 'username': 'racer',
+                             'email': 'other@example.com', 'mobile_number': '9876543210'})
+
+
+def test_login_checks_the_password(client):
+    response = register(client, email='login@example.com')
+    assert response.status_code == 201
+    user_id = response.get_json()['user_id']
+
+    response = client.post('/api/login', json={'user_id': user_id})
+    assert response.status_code == 400
+
+    wrong = client.post('/api/login', json={'user_id': user_id, 'password': 'not-the-password'})
+    unknown = client.post('/api/login', json={'user_id': 'SANGAM_NOBODY00', 'password': 'ganga-aarti'})
+    assert wrong.status_code == unknown.status_code == 401
+    assert wrong.get_json() == unknown.get_json()
+    assert 'token' not in wrong.get_json()
+
+    response = client.post('/api/login', json={'user_id': user_id, 'password': 'ganga-aarti'})
+    assert response.status_code == 200
+    assert response.get_json()['token']
+
+
+def test_per_user_endpoints_check_the_session_token(client):
+    from api.sessions import issue_token
+    first = register(client, email='token@example.com').get_json()
+    second = register(client, email='token2@example.com').get_json()
+    history = f"/api/@{first['user_id']}/sos/history"
+
+    assert client.get(history, headers={'Authorization': f"Bearer {first['token']}"}).status_code == 200
+    forged = first['token'][:-2] + ('AA' if not first['token'].endswith('AA') else 'BB')
+    assert client.get(history, headers={'Authorization': f'Bearer {forged}'}).status_code == 401
+    assert client.get(history, headers={'Authorization': f"Bearer {second['token']}"}).status_code == 403
+    expired = issue_token(first['user_id'], now=0)
+    assert client.get(history, headers={'Authorization': f'Bearer {expired}'}).status_code == 401
+
+
+def test_workers_refuse_the_default_secret_key(monkeypatch):
+    from app import check_secret_key, create_app
+    from config import Config
+    app = create_app()
+    monkeypatch.setattr(Config, 'SECRET_KEY', Config.DEFAULT_SECRET_KEY)
+    with pytest.raises(RuntimeError):
+        check_secret_key(app)
+    app.debug = True
+    check_secret_key(app)
+
+
+def test_first_login_sets_a_password_for_accounts_without_one(client):
+    from api.storage import get_storage
+    user_id = 'SANGAM_LEGACY01'
+    get_storage().create_users([{
+        'user_id': user_id, 'username': 'legacy', 'email': 'legacy@example.com',
+        'mobile_number': '+91 98765 43210', 'family_members': [],
+        'created_at': '2025-12-01T00:00:00', 'is_active': True
+    }])
+
+    response = client.post('/api/login', json={'user_id': user_id, 'password': 'ganga-aarti'})
+    assert response.status_code == 403
+    assert response.get_json()['password_setup_required']
+    response = client.post('/api/login', json={'user_id': user_id, 'password': 'ganga-aarti',
+                                                'email': 'legacy@example.com', 'mobile_number': '9876543210'})
+    assert response.status_code == 403
+
+    response = client.post('/api/login', json={'user_id': user_id, 'password': 'ganga-aarti',
+                                                'email': 'Legacy@Example.com', 'mobile_number': '+919876543210'})
+    assert response.status_code == 200
+    assert response.get_json()['token']
+
+    # From then on the password is checked like any other
+    wrong = client.post('/api/login', json={'user_id': user_id, 'password': 'another-password',
+                                             'email': 'legacy@example.com', 'mobile_number': '+919876543210'})
+    assert wrong.status_code == 401
+    assert client.post('/api/login', json={'user_id': user_id, 'password': 'ganga-aarti'}).status_code == 200
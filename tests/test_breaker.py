@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+from api.breaker import CircuitBreaker, CircuitOpen
+from api.journal import AlertJournal
+from api.storage.sqlite_backend import SQLiteStorage
+
+
+def test_not_found_errors_do_not_open_the_breaker():
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=60)
+
+    def missing():
+        raise KeyError('alert-1')
+
+    for _ in range(5):
+        with pytest.raises(KeyError):
+            breaker.call(missing)
+    assert breaker.state == 'closed'
+    assert breaker.stats()['failures'] == 0
+
+
+def test_backend_errors_open_the_breaker():
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=60)
+
+    def down():
+        raise ConnectionError('backend down')
+
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            breaker.call(down)
+    assert breaker.state == 'open'
+    with pytest.raises(CircuitOpen):
+        breaker.call(lambda: 1)
+
+
+def test_replaying_writes_to_a_missing_alert_keeps_the_breaker_closed(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'sangam.db'))
+    breaker = CircuitBreaker('test', failure_threshold=3, reset_timeout=60)
+    journal = AlertJournal(directory=str(tmp_path / 'journal'), enabled=True, retry_min=0.001,
+                           retry_max=0.001, storage=storage, breaker=breaker)
+    try:
+        journal.append_alert_update('missing-alert', {'location': 'Ghat 3'})
+        for _ in range(breaker.failure_threshold * 2):
+            time.sleep(0.01)
+            journal.replicate(force=True)
+
+        assert journal.is_pending('missing-alert')
+        assert breaker.state == 'closed'
+        # Reads the SOS handlers make through the same breaker still go through
+        assert breaker.call(storage.get_user, 'nobody') is None
+    finally:
+        journal.shutdown()
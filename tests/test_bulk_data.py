@@ -0,0 +1,59 @@
+import json
+
+from api.storage.sqlite_backend import SQLiteStorage
+from scripts.bulk_data import export_lines, import_lines
+
+
+def user(i, family_members=()):
+    return {
+        'user_id': f'SANGAM_BULK{i:04d}',
+        'username': f'bulk{i}',
+        'email': f'bulk{i}@example.com',
+        'mobile_number': f'+91{9000000000 + i}',
+        'family_members': list(family_members),
+        'created_at': '2025-01-14T05:00:00',
+        'is_active': True
+    }
+
+
+def test_an_export_imports_into_an_empty_store_and_again_without_duplicates(tmp_path):
+    source = SQLiteStorage(str(tmp_path / 'source.db'))
+    source.create_users([user(0, ['SANGAM_BULK0001'])] + [user(i) for i in range(1, 5)])
+    source.create_alert({
+        'user_id': 'SANGAM_BULK0000',
+        'triggered_at': '2025-01-14T06:00:00',
+        'status': 'resolved',
+        'location': 'Ghat 3',
+        'message': 'Emergency SOS triggered',
+        'family_notified': ['SANGAM_BULK0001'],
+        'delivery': {'SANGAM_BULK0001': {'sms': {'status': 'sent', 'attempts': 1}}}
+    })
+    lines = list(export_lines(source, page_size=2))
+    assert [json.loads(line)['kind'] for line in lines] == ['user'] * 5 + ['alert']
+
+    target = SQLiteStorage(str(tmp_path / 'target.db'))
+    totals = import_lines(target, lines, batch_size=2, workers=2)
+    assert (totals['users'], totals['alerts'], totals['skipped']) == (5, 1, 0)
+    assert target.scan_users(10) == source.scan_users(10)
+    assert target.scan_alerts(10) == source.scan_alerts(10)
+
+    totals = import_lines(target, lines, batch_size=2, workers=2)
+    assert (totals['users'], totals['skipped']) == (0, 5)
+    assert len(target.scan_users(10)) == 5
+
+
+def test_pre_registrations_get_new_ids_and_skip_taken_emails(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'sangam.db'))
+    storage.create_users([user(0)])
+    lines = [
+        json.dumps({'username': 'Asha', 'email': 'asha@example.com', 'mobile_number': '9876543210'}),
+        json.dumps({'username': 'Asha again', 'email': 'ASHA@example.com', 'mobile_number': '9876543210'}),
+        json.dumps({'username': 'Bulk', 'email': 'bulk0@example.com', 'mobile_number': '9876543210'}),
+        '{not json'
+    ]
+    registered = []
+    totals = import_lines(storage, lines, batch_size=10, workers=1, on_registered=registered.append)
+
+    assert (totals['registered'], totals['skipped'], totals['invalid']) == (1, 2, 1)
+    assert [user_data['email'] for user_data in registered] == ['asha@example.com']
+    assert storage.get_user(registered[0]['user_id'])['username'] == 'Asha'
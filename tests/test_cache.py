@@ -0,0 +1,63 @@
+from api.cache import ProfileCache
+from api.users import get_user, invalidate_user
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_least_recently_used_entries_are_evicted():
+    cache = ProfileCache(max_size=2, ttl=60)
+    cache.set('a', {'n': 1})
+    cache.set('b', {'n': 2})
+    assert cache.get('a') == {'n': 1}
+    cache.set('c', {'n': 3})
+
+    assert cache.get('b') is None
+    assert cache.get('a') == {'n': 1} and cache.get('c') == {'n': 3}
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_expire_and_are_copies():
+    clock = Clock()
+    cache = ProfileCache(max_size=10, ttl=60, clock=clock)
+    value = {'family_members': ['m1']}
+    cache.set('a', value)
+    value['family_members'].append('m2')
+    cache.get('a')['family_members'].append('m3')
+    assert cache.get('a') == {'family_members': ['m1']}
+
+    clock.now = 60
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+
+
+class Storage:
+    def __init__(self):
+        self.user = {'user_id': 'SANGAM_CACHED01', 'username': 'cached', 'family_version': 1}
+        self.reads = 0
+
+    def get_user(self, user_id):
+        self.reads += 1
+        return dict(self.user)
+
+
+def test_profiles_are_read_once_until_invalidated_or_behind_the_token():
+    storage = Storage()
+    invalidate_user('SANGAM_CACHED01')
+    get_user('SANGAM_CACHED01', storage=storage)
+    get_user('SANGAM_CACHED01', storage=storage, family_version=1)
+    assert storage.reads == 1
+
+    # A token that has seen a newer family list re-reads the profile
+    storage.user['family_version'] = 2
+    assert get_user('SANGAM_CACHED01', storage=storage, family_version=2)['family_version'] == 2
+    assert storage.reads == 2
+
+    invalidate_user('SANGAM_CACHED01')
+    get_user('SANGAM_CACHED01', storage=storage)
+    assert storage.reads == 3
@@ -0,0 +1,48 @@
+import json
+
+from api.dashboard import ActiveAlertsMirror
+
+
+class WatchedStorage:
+    """Storage whose active_alerts watch the test drives by hand"""
+
+    def watch_active_alerts(self, on_change):
+        self.on_change = on_change
+        on_change([], True)
+        return self
+
+    def unsubscribe(self):
+        pass
+
+
+def entry(status='active', triggered_at='2026-01-14T06:00:00', resolved_at=None):
+    return {'user_id': 'SANGAM_PILGRIM1', 'status': status, 'location': 'Ghat 3',
+            'triggered_at': triggered_at, 'resolved_at': resolved_at, 'family_notified': ['SANGAM_MEMBER01']}
+
+
+def test_feed_follows_the_watch_and_keeps_its_etag_until_a_change():
+    storage = WatchedStorage()
+    mirror = ActiveAlertsMirror(storage=storage).start()
+    empty_etag, _ = mirror.feed()
+
+    storage.on_change([('alert-2', entry(triggered_at='2026-01-14T06:05:00')), ('alert-1', entry())], False)
+    etag, body = mirror.feed()
+    feed = json.loads(body)
+    assert etag != empty_etag
+    assert [alert['alert_id'] for alert in feed['alerts']] == ['alert-1', 'alert-2']
+    assert 'family_notified' not in feed['alerts'][0]
+
+    # A reload that finds nothing new keeps the ETag
+    storage.on_change([('alert-1', entry()), ('alert-2', entry(triggered_at='2026-01-14T06:05:00'))], True)
+    assert mirror.feed()[0] == etag
+
+    storage.on_change([('alert-1', entry('resolved', resolved_at='2999-01-01T00:00:00'))], False)
+    assert [alert['alert_id'] for alert in json.loads(mirror.feed()[1])['alerts']] == ['alert-2']
+    assert json.loads(mirror.feed('resolved')[1])['counts'] == {'active': 1, 'resolved': 1}
+
+
+def test_resolved_alerts_leave_the_feed_after_the_retention():
+    storage = WatchedStorage()
+    mirror = ActiveAlertsMirror(retention=60, storage=storage).start()
+    storage.on_change([('alert-1', entry('resolved', resolved_at='2026-01-14T06:10:00'))], False)
+    assert json.loads(mirror.feed('all')[1])['alerts'] == []
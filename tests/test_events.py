@@ -0,0 +1,80 @@
+import queue
+
+from api.events import AlertHub
+
+CALLER = 'SANGAM_CALLER01'
+MEMBER = 'SANGAM_MEMBER01'
+
+
+def alert(user_id, family_notified):
+    return {
+        'user_id': user_id,
+        'status': 'active',
+        'location': 'Ghat 3',
+        'geo': {'lat': 25.43, 'lon': 81.88},
+        'family_notified': family_notified
+    }
+
+
+def received(subscription):
+    events = []
+    while True:
+        try:
+            events.append(subscription.queue.get_nowait())
+        except queue.Empty:
+            return events
+
+
+def test_alerts_stream_to_the_family_members_they_notify():
+    # The caller lists the member; the member does not list the caller
+    hub = AlertHub()
+    caller = hub.subscribe(CALLER)
+    member = hub.subscribe(MEMBER)
+
+    hub.publish('sos_triggered', 'alert-1', alert(CALLER, [MEMBER]))
+    hub.publish('sos_triggered', 'alert-2', alert(MEMBER, []))
+
+    assert [event['data']['alert_id'] for event in received(caller)] == ['alert-1']
+    assert [event['data']['alert_id'] for event in received(member)] == ['alert-1', 'alert-2']
+
+
+def test_replay_only_resumes_events_for_the_subscriber():
+    hub = AlertHub()
+    first = hub.publish('sos_triggered', 'alert-1', alert(MEMBER, []))
+    hub.publish('sos_triggered', 'alert-2', alert(MEMBER, []))
+    hub.publish('sos_triggered', 'alert-3', alert(CALLER, [MEMBER]))
+
+    caller = hub.subscribe(CALLER, last_event_id=first['id'])
+    assert [event['data']['alert_id'] for event in received(caller)] == ['alert-3']
+
+
+def entry(user_id, family_notified, status='active', location='Ghat 3'):
+    return {'user_id': user_id, 'status': status, 'location': location, 'family_notified': family_notified}
+
+
+def test_alerts_from_other_workers_arrive_through_the_watch():
+    hub = AlertHub()
+    member = hub.subscribe(MEMBER)
+    # Alerts already open when the watch starts are not replayed
+    hub.apply_changes([('alert-0', entry(CALLER, [MEMBER]))], True)
+    assert received(member) == []
+
+    hub.apply_changes([('alert-0', entry(CALLER, [MEMBER])), ('alert-1', entry(CALLER, [MEMBER]))], True)
+    hub.apply_changes([('alert-1', entry(CALLER, [MEMBER], location='Ghat 5'))], False)
+    hub.apply_changes([('alert-1', entry(CALLER, [MEMBER], status='resolved', location='Ghat 5'))], False)
+
+    assert [(event['event'], event['data']['alert_id']) for event in received(member)] == [
+        ('sos_triggered', 'alert-1'), ('sos_updated', 'alert-1'), ('sos_resolved', 'alert-1')
+    ]
+    assert hub.stats()['mirrored'] == 3
+
+
+def test_alerts_published_in_this_worker_are_not_mirrored_again():
+    hub = AlertHub()
+    hub.apply_changes([], True)
+    member = hub.subscribe(MEMBER)
+
+    hub.publish('sos_triggered', 'alert-1', entry(CALLER, [MEMBER]))
+    hub.apply_changes([('alert-1', entry(CALLER, [MEMBER]))], True)
+
+    assert [event['event'] for event in received(member)] == ['sos_triggered']
@@ -0,0 +1,55 @@
+from api import family
+from api.journal import journal
+from api.sessions import verify_token
+from api.storage import get_storage
+
+
+def register(client, name):
+    response = client.post('/api/register', json={
+        'username': name,
+        'email': f'{name}@example.com',
+        'mobile_number': '9876543210',
+        'password': 'ganga-aarti'
+    })
+    body = response.get_json()
+    return body['user_id'], {'Authorization': f"Bearer {body['token']}"}
+
+
+def test_family_edits_issue_the_stored_family_version(client, monkeypatch):
+    storage = get_storage()
+    pilgrim, headers = register(client, 'pilgrim')
+    sister, _ = register(client, 'sister')
+    cousin, _ = register(client, 'cousin')
+
+    # Another request links the cousin both ways between this one's read and its write
+    load_users = family.load_users
+
+    def load_then_link(*args, **kwargs):
+        users = load_users(*args, **kwargs)
+        monkeypatch.setattr(family, 'load_users', load_users)
+        storage.add_family_member(cousin, pilgrim, reciprocal=True)
+        return users
+
+    monkeypatch.setattr(family, 'load_users', load_then_link)
+    response = client.post(f'/api/@{pilgrim}/add_family', json={'family_member_id': sister}, headers=headers)
+    token = response.get_json()['token']
+    assert verify_token(token).family_version == storage.get_user(pilgrim)['family_version'] == 2
+
+    headers = {'Authorization': f'Bearer {token}'}
+    response = client.post(f'/api/@{pilgrim}/remove_family', json={'family_member_id': sister}, headers=headers)
+    assert verify_token(response.get_json()['token']).family_version == 3
+
+
+def test_members_see_who_lists_them_and_their_alerts(client):
+    father, headers = register(client, 'father')
+    son, son_headers = register(client, 'son')
+    response = client.post(f'/api/@{father}/add_family', json={'family_member_id': son}, headers=headers)
+    headers = {'Authorization': f"Bearer {response.get_json()['token']}"}
+
+    incoming = client.get(f'/api/@{son}/family/incoming', headers=son_headers).get_json()
+    assert [(member['user_id'], member['reciprocal']) for member in incoming['listed_by']] == [(father, False)]
+
+    alert_id = client.post(f'/api/@{father}/sos', json={'location': 'Ghat 3'}, headers=headers).get_json()['alert_id']
+    assert journal.flush()
+    alerts = client.get(f'/api/@{son}/sos/family', headers=son_headers).get_json()['alerts']
+    assert [(alert['alert_id'], alert['user_id']) for alert in alerts] == [(alert_id, father)]
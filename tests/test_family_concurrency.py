@@ -0,0 +1,89 @@
+import threading
+from datetime import datetime
+
+from api.storage.sqlite_backend import SQLiteStorage
+
+HUB = 'H000000'
+MEMBERS = 50
+
+
+def seed(storage):
+    now = datetime.utcnow().isoformat()
+    user_ids = [HUB] + [f'M{i:06d}' for i in range(MEMBERS)]
+    storage.create_users([{
+        'user_id': user_id,
+        'username': user_id.lower(),
+        'email': f'{user_id.lower()}@example.com',
+        'mobile_number': f'+91{9000000000 + i}',
+        'family_members': [],
+        'created_at': now,
+        'is_active': True
+    } for i, user_id in enumerate(user_ids)])
+    return user_ids[1:]
+
+
+def run_together(targets):
+    """Start every target at once, so their transactions contend for the database"""
+    barrier = threading.Barrier(len(targets))
+    errors = []
+
+    def run(target):
+        barrier.wait()
+        try:
+            target()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(target,)) for target in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+
+
+def test_concurrent_reciprocal_adds_lose_no_links(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'sangam.db'))
+    members = seed(storage)
+
+    run_together([
+        lambda member_id=member_id: storage.add_family_member(HUB, member_id, reciprocal=True)
+        for member_id in members
+    ])
+
+    hub = storage.get_user(HUB)
+    assert sorted(hub['family_members']) == members
+    assert hub['family_version'] == MEMBERS
+    for member_id, member in storage.get_users(members).items():
+        assert member['family_members'] == [HUB], member_id
+        assert member['family_version'] == 1
+
+
+def test_concurrent_adds_and_removes_keep_both_sides_in_step(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'sangam.db'))
+    members = seed(storage)
+    rounds = 3
+
+    def churn(member_id, keep):
+        # Add and remove the link repeatedly, leaving it in place if keep
+        for _ in range(rounds):
+            storage.add_family_member(HUB, member_id, reciprocal=True)
+            storage.remove_family_member(HUB, member_id, reciprocal=True)
+        if keep:
+            storage.add_family_member(HUB, member_id, reciprocal=True)
+
+    kept = members[::2]
+    run_together([
+        lambda member_id=member_id: churn(member_id, member_id in kept)
+        for member_id in members
+    ])
+
+    hub = storage.get_user(HUB)
+    assert sorted(hub['family_members']) == kept
+    # Every add and remove bumps the version on each side of the link
+    assert hub['family_version'] == MEMBERS * rounds * 2 + len(kept)
+    for member_id, member in storage.get_users(members).items():
+        keep = member_id in kept
+        assert member['family_members'] == ([HUB] if keep else []), member_id
+        assert member['family_version'] == rounds * 2 + keep
+    assert sorted(storage.get_listed_by(HUB)) == kept
@@ -0,0 +1,55 @@
+import time
+from datetime import datetime
+
+from api.broadcasts import new_broadcast
+from api.fanout import BroadcastFanout
+from api.storage.base import broadcast_shards, new_alert_id, zone_fields
+from api.storage.sqlite_backend import SQLiteStorage
+
+ZONE = 'sector-4'
+
+
+def seed(storage, count):
+    now = datetime.utcnow().isoformat()
+    storage.create_users([dict({
+        'user_id': f'Z{i:06d}',
+        'username': f'pilgrim{i}',
+        'email': f'z{i:06d}@example.com',
+        'mobile_number': f'+91{9000000000 + i}',
+        'family_members': [],
+        'created_at': now,
+        'is_active': True
+    }, **zone_fields(f'Z{i:06d}', ZONE)) for i in range(count)])
+    broadcast_id = new_alert_id()
+    broadcast = dict(new_broadcast({'zone': ZONE, 'message': 'Ghat 3 is closed'}, 'authority'), shards=1)
+    storage.create_broadcast(broadcast_id, broadcast, broadcast_shards(broadcast_id, broadcast, 1, time.time()))
+    return broadcast_id
+
+
+def test_a_batch_after_a_lost_lease_is_dropped(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'sangam.db'))
+    broadcast_id = seed(storage, 30)
+    stalled = BroadcastFanout(rate=0, batch_size=10, lease_seconds=30, storage=storage)
+    now = time.time()
+    shard = storage.claim_broadcast_shard(stalled.owner, now + 30, now)
+
+    # The lease runs out and another worker claims the shard
+    later = now + 31
+    assert storage.claim_broadcast_shard('other-worker', later + 30, later)['owner'] == 'other-worker'
+
+    assert stalled.deliver_shard(shard) == 0
+    assert stalled.stats()['leases_lost'] == 1
+    assert storage.list_inbox('Z000000', '') == []
+    record = storage.get_broadcast(broadcast_id)[1][0]
+    assert record['owner'] == 'other-worker' and record['delivered'] == 0
+
+
+def test_shards_are_delivered_by_their_owner(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / 'sangam.db'))
+    broadcast_id = seed(storage, 30)
+    worker = BroadcastFanout(rate=0, batch_size=10, storage=storage)
+
+    assert worker.run_once() == {'shards': 1, 'delivered': 30}
+    record = storage.get_broadcast(broadcast_id)[1][0]
+    assert record['status'] == 'done' and record['delivered'] == 30
+    assert len(storage.list_inbox('Z000029', '')) == 1
@@ -0,0 +1,25 @@
+def sample(body, name, **labels):
+    """Value of the sample whose labels include the given ones, or None"""
+    for line in body.splitlines():
+        if line.startswith(name + '{') and all(f'{key}="{value}"' in line for key, value in labels.items()):
+            return float(line.rsplit(' ', 1)[1])
+    return None
+
+
+def test_metrics_report_request_latency_by_route_and_backend_calls(client):
+    response = client.post('/api/register', json={
+        'username': 'metered', 'email': 'metered@example.com',
+        'mobile_number': '9876543210', 'password': 'ganga-aarti'
+    })
+    assert response.status_code == 201
+    user_id = response.get_json()['user_id']
+    headers = {'Authorization': f"Bearer {response.get_json()['token']}"}
+    client.get(f'/api/@{user_id}/family', headers=headers)
+
+    body = client.get('/metrics').get_data(as_text=True)
+    assert sample(body, 'sangam_request_duration_seconds_count',
+                  endpoint='/api/register', method='POST', status='201') >= 1
+    # Endpoints are labelled by route, not by the user in the URL
+    assert user_id not in body
+    assert sample(body, 'sangam_request_duration_seconds_count', endpoint='/api/@<user_id>/family') >= 1
+    assert sample(body, 'sangam_backend_calls_total', operation='create_user', kind='write') >= 1
@@ -0,0 +1,65 @@
+from datetime import datetime
+
+from api.breaker import backend_breaker
+from api.notifications import LoggingChannel, NotificationDispatcher
+from api.storage import get_storage
+
+
+def test_delivery_status_is_written_outside_the_backend_breaker():
+    storage = get_storage()
+    member = {'user_id': 'SANGAM_MEMBER01', 'username': 'member', 'mobile_number': '9876543210'}
+    alert = {
+        'user_id': 'SANGAM_CALLER01',
+        'triggered_at': '2026-01-14T06:00:00',
+        'status': 'active',
+        'location': 'Ghat 3',
+        'message': 'Emergency SOS triggered',
+        'family_notified': [member['user_id']],
+        'delivery': {}
+    }
+    alert_id = storage.create_alert(alert)
+    alert['user_details'] = {'user_id': alert['user_id'], 'username': 'caller'}
+    dispatcher = NotificationDispatcher(channels=[LoggingChannel('sms', 'mobile_number')], workers=1)
+    calls = backend_breaker.stats()['calls']
+
+    assert dispatcher.dispatch(alert_id, alert, [member]) == 1
+    dispatcher.shutdown()
+
+    assert storage.get_alert(alert_id)['delivery'][member['user_id']]['sms']['status'] == 'sent'
+    assert backend_breaker.stats()['calls'] == calls
+
+
+def stored_alert(storage, member_id, queued_at, status='active'):
+    return storage.create_alert({
+        'user_id': 'SANGAM_CALLER01',
+        'triggered_at': queued_at,
+        'status': status,
+        'location': 'Ghat 3',
+        'message': 'Emergency SOS triggered',
+        'family_notified': [member_id],
+        'delivery': {member_id: {'sms': {'status': 'pending', 'attempts': 0, 'queued_at': queued_at}}}
+    })
+
+
+def test_deliveries_left_pending_by_a_stopped_worker_are_sent_once():
+    storage = get_storage()
+    member = {'user_id': 'SANGAM_MEMBER02', 'username': 'member02', 'email': 'member02@example.com',
+              'mobile_number': '9876543211', 'family_members': [], 'created_at': '2026-01-14T05:00:00'}
+    storage.create_users([member])
+    lost = stored_alert(storage, member['user_id'], '2026-01-14T06:00:00')
+    queued = stored_alert(storage, member['user_id'], datetime.utcnow().isoformat())
+    resolved = stored_alert(storage, member['user_id'], '2026-01-14T06:00:00', status='resolved')
+
+    # Two workers come up after the one that queued the notification died
+    workers = [
+        NotificationDispatcher(channels=[LoggingChannel('sms', 'mobile_number')], workers=1,
+                               recover_after=60, recover_interval=0)
+        for _ in range(2)
+    ]
+    assert [worker.recover(storage) for worker in workers] == [1, 0]
+    for worker in workers:
+        worker.shutdown()
+
+    assert storage.get_alert(lost)['delivery'][member['user_id']]['sms']['status'] == 'sent'
+    assert storage.get_alert(queued)['delivery'][member['user_id']]['sms']['status'] == 'pending'
+    assert storage.get_alert(resolved)['delivery'][member['user_id']]['sms']['status'] == 'pending'
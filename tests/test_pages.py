@@ -0,0 +1,23 @@
+import gzip
+
+
+def test_pages_are_served_precompressed_and_revalidate_with_their_etag(client):
+    plain = client.get('/login')
+    assert plain.status_code == 200
+    assert 'Content-Encoding' not in plain.headers
+
+    compressed = client.get('/login', headers={'Accept-Encoding': 'gzip'})
+    assert compressed.headers['Content-Encoding'] == 'gzip'
+    assert compressed.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(compressed.data) == plain.data
+    # Each encoding is a different body, so it carries a different ETag
+    assert compressed.headers['ETag'] != plain.headers['ETag']
+
+    revalidated = client.get('/login', headers={
+        'Accept-Encoding': 'gzip', 'If-None-Match': compressed.headers['ETag']
+    })
+    assert revalidated.status_code == 304
+    assert revalidated.data == b''
+
+    stale = client.get('/login', headers={'Accept-Encoding': 'gzip', 'If-None-Match': plain.headers['ETag']})
+    assert stale.status_code == 200
@@ -0,0 +1,51 @@
+import json
+import os
+import time
+
+from flask import Flask
+
+from api.profiling import PROFILE_FILE_HEADER, init_profiling, profiler, sign_profile_header, verify_profile_header
+
+
+def profiled_app():
+    app = Flask(__name__)
+
+    @app.route('/slow')
+    def slow():
+        time.sleep(0.05)
+        return 'done'
+
+    init_profiling(app)
+    return app.test_client()
+
+
+def wait_for(path, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        assert time.monotonic() < deadline, f'{path} was not written'
+        time.sleep(0.01)
+
+
+def test_profile_headers_are_signed_and_expire():
+    header = sign_profile_header(ttl=60, now=1000)
+    assert verify_profile_header(header, now=1030)
+    assert not verify_profile_header(header, now=1061)
+    assert not verify_profile_header(header[:-1] + ('0' if header[-1] != '0' else '1'), now=1030)
+
+
+def test_only_signed_requests_are_profiled(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler, 'directory', str(tmp_path))
+    monkeypatch.setattr(profiler, 'sample_rate', 0)
+    monkeypatch.setattr(profiler, 'output_format', 'speedscope')
+    client = profiled_app()
+
+    assert PROFILE_FILE_HEADER not in client.get('/slow').headers
+    assert PROFILE_FILE_HEADER not in client.get('/slow', headers={'X-Profile': '1.forged'}).headers
+
+    response = client.get('/slow', headers={'X-Profile': sign_profile_header()})
+    path = os.path.join(str(tmp_path), response.headers[PROFILE_FILE_HEADER])
+    wait_for(path)
+    with open(path) as f:
+        profile = json.load(f)
+    names = [frame['name'] for frame in profile['shared']['frames']]
+    assert any(name.endswith('.slow') for name in names)
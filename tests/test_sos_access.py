@@ -0,0 +1,62 @@
+import pytest
+
+from api.journal import journal
+from api.sessions import issue_token
+from config import Config
+
+RESPONDER = 'SANGAM_RESPOND1'
+PILGRIM = 'SANGAM_PILGRIM1'
+
+
+@pytest.fixture(autouse=True)
+def responders(monkeypatch):
+    monkeypatch.setattr(Config, 'SOS_RESPONDERS', [RESPONDER])
+
+
+def bearer(user_id):
+    return {'Authorization': f'Bearer {issue_token(user_id)}'}
+
+
+def trigger(client, name, **position):
+    response = client.post('/api/register', json={
+        'username': name,
+        'email': f'{name}@example.com',
+        'mobile_number': '9876543210',
+        'password': 'ganga-aarti'
+    })
+    user_id = response.get_json()['user_id']
+    response = client.post(f'/api/@{user_id}/sos', json=position, headers=bearer(user_id))
+    return user_id, response.get_json()['alert_id']
+
+
+def test_nearby_needs_a_responder_session(client):
+    url = '/api/sos/nearby?lat=25.43&lon=81.88'
+    assert client.get(url).status_code == 401
+    assert client.get(url, headers=bearer(PILGRIM)).status_code == 403
+    response = client.get(url, headers=bearer(RESPONDER))
+    assert response.status_code == 200
+    assert response.get_json()['alerts'] == []
+
+
+def test_nearby_rejects_expand(client):
+    response = client.get('/api/sos/nearby?lat=25.43&lon=81.88&expand=user', headers=bearer(RESPONDER))
+    assert response.status_code == 400
+
+
+def test_active_feed_needs_a_responder_session(client):
+    assert client.get('/api/sos/active').status_code == 401
+    assert client.get('/api/sos/active', headers=bearer(PILGRIM)).status_code == 403
+    response = client.get('/api/sos/active', headers=bearer(RESPONDER))
+    assert response.status_code == 200
+    assert 'ETag' in response.headers
+
+
+def test_nearby_finds_active_alerts_within_the_radius(client):
+    _, near = trigger(client, 'near', lat=25.4500, lon=81.8500)
+    _, far = trigger(client, 'far', lat=25.4600, lon=81.8500)
+    assert journal.flush()
+
+    response = client.get('/api/sos/nearby?lat=25.4501&lon=81.8501&radius=500', headers=bearer(RESPONDER))
+    alerts = response.get_json()['alerts']
+    assert [alert['alert_id'] for alert in alerts] == [near]
+    assert alerts[0]['distance_m'] < 20
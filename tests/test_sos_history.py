@@ -0,0 +1,40 @@
+from api.storage import get_storage
+
+
+def alert(user_id, triggered_at, status):
+    return {
+        'user_id': user_id,
+        'triggered_at': triggered_at,
+        'status': status,
+        'location': 'Ghat 3',
+        'message': 'Emergency SOS triggered',
+        'family_notified': [],
+        'delivery': {}
+    }
+
+
+def test_history_pages_newest_first_with_a_cursor_and_a_status_filter(client):
+    response = client.post('/api/register', json={
+        'username': 'historian', 'email': 'historian@example.com',
+        'mobile_number': '9876543210', 'password': 'ganga-aarti'
+    })
+    user_id = response.get_json()['user_id']
+    headers = {'Authorization': f"Bearer {response.get_json()['token']}"}
+    storage = get_storage()
+    for hour in range(5):
+        storage.create_alert(alert(user_id, f'2026-01-14T0{hour}:00:00', 'active' if hour % 2 else 'resolved'))
+
+    url = f'/api/@{user_id}/sos/history'
+    first = client.get(f'{url}?limit=2', headers=headers).get_json()
+    assert [item['triggered_at'][11:13] for item in first['alerts']] == ['04', '03']
+    assert set(first['alerts'][0]) >= {'alert_id', 'status', 'location'}
+    assert 'delivery' not in first['alerts'][0]
+    second = client.get(f"{url}?limit=2&start_after={first['next_cursor']}", headers=headers).get_json()
+    assert [item['triggered_at'][11:13] for item in second['alerts']] == ['02', '01']
+    last = client.get(f"{url}?limit=2&start_after={second['next_cursor']}", headers=headers).get_json()
+    assert [item['triggered_at'][11:13] for item in last['alerts']] == ['00']
+    assert last['next_cursor'] is None
+
+    active = client.get(f'{url}?status=active', headers=headers).get_json()
+    assert [item['triggered_at'][11:13] for item in active['alerts']] == ['03', '01']
+    assert client.get(f'{url}?start_after=not-a-cursor', headers=headers).status_code == 400
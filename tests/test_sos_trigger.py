@@ -0,0 +1,74 @@
+import pytest
+
+from api.breaker import backend_breaker
+from api.journal import journal
+from api.storage import get_storage
+from api.users import invalidate_user
+
+
+def register(client, name):
+    response = client.post('/api/register', json={
+        'username': name,
+        'email': f'{name}@example.com',
+        'mobile_number': '9876543210',
+        'password': 'ganga-aarti'
+    })
+    body = response.get_json()
+    return body['user_id'], {'Authorization': f"Bearer {body['token']}"}
+
+
+@pytest.fixture
+def backend_down():
+    for _ in range(backend_breaker.failure_threshold):
+        backend_breaker._on_failure(False)
+    yield
+    backend_breaker._on_success()
+
+
+def test_trigger_is_journaled_while_storage_is_down(client, backend_down):
+    caller, headers = register(client, 'caller')
+    member, _ = register(client, 'member')
+    response = client.post(f'/api/@{caller}/add_family', json={'family_member_id': member}, headers=headers)
+    headers = {'Authorization': f"Bearer {response.get_json()['token']}"}
+    invalidate_user(caller)
+
+    response = client.post(f'/api/@{caller}/sos', json={'location': 'Ghat 3'}, headers=headers)
+    assert response.status_code == 200
+    body = response.get_json()
+    assert body['details_pending'] is True
+    assert body['family_members_notified'] == 0
+    alert_id = body['alert_id']
+    assert journal.pending_alert(alert_id)['details_pending']
+
+    # Storage answers again: the replay fills the alert in before storing it
+    backend_breaker._on_success()
+    assert journal.flush()
+    alert = get_storage().get_alert(alert_id)
+    assert alert['family_notified'] == [member]
+    assert alert['delivery'][member]
+    assert 'details_pending' not in alert
+
+
+def test_repeated_presses_join_the_active_alert(client):
+    caller, headers = register(client, 'presser')
+    first = client.post(f'/api/@{caller}/sos', json={'location': 'Ghat 3'}, headers=headers).get_json()
+    second = client.post(f'/api/@{caller}/sos', json={'location': 'Ghat 5'}, headers=headers).get_json()
+    assert second['coalesced'] is True
+    assert second['alert_id'] == first['alert_id']
+    assert second['notifications_queued'] == 0
+    assert journal.get_alert(first['alert_id'])['location'] == 'Ghat 5'
+
+    # Resolving closes the window: the next press raises a new alert
+    client.post(f"/api/@{caller}/sos/{first['alert_id']}/resolve", headers=headers)
+    third = client.post(f'/api/@{caller}/sos', json={'location': 'Ghat 5'}, headers=headers).get_json()
+    assert third['alert_id'] != first['alert_id']
+    assert third['coalesced'] is False
+
+
+def test_a_retried_trigger_gets_the_first_response(client):
+    caller, headers = register(client, 'retrier')
+    headers = dict(headers, **{'Idempotency-Key': 'press-1'})
+    first = client.post(f'/api/@{caller}/sos', json={'location': 'Ghat 3'}, headers=headers)
+    retry = client.post(f'/api/@{caller}/sos', json={'location': 'Ghat 3'}, headers=headers)
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json() == first.get_json()
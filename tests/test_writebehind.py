@@ -0,0 +1,47 @@
+from api.storage import get_storage
+from api.writebehind import WriteBehindBuffer, user_writes
+
+
+def test_updates_to_one_document_merge_into_one_write():
+    batches = []
+    buffer = WriteBehindBuffer(batches.append, interval=3600, max_batch=10, max_pending=10)
+    buffer.defer('user-1', {'last_login': '06:00', 'updated_at': '06:00'})
+    buffer.defer('user-1', {'last_login': '06:05'})
+    buffer.defer('user-2', {'last_login': '06:01'})
+
+    buffer.shutdown()
+    assert batches == [{'user-1': {'last_login': '06:05', 'updated_at': '06:00'}, 'user-2': {'last_login': '06:01'}}]
+    assert buffer.stats()['merged'] == 1
+
+
+def test_a_failed_batch_is_retried_under_newer_updates_then_dropped():
+    attempts = []
+
+    def write(batch):
+        attempts.append(batch)
+        raise RuntimeError('backend down')
+
+    buffer = WriteBehindBuffer(write, interval=3600, max_batch=10, max_pending=10, max_attempts=2)
+    buffer.defer('user-1', {'last_login': '06:00', 'updated_at': '06:00'})
+    assert buffer.flush() == 0
+    buffer.defer('user-1', {'last_login': '06:05'})
+    assert buffer.flush() == 0
+    assert attempts[1] == {'user-1': {'last_login': '06:05', 'updated_at': '06:00'}}
+
+    buffer.shutdown()
+    assert len(attempts) == 2
+    assert buffer.stats()['dropped'] == 1
+
+
+def test_login_defers_its_last_login_write(client):
+    response = client.post('/api/register', json={
+        'username': 'gatecrowd', 'email': 'gatecrowd@example.com',
+        'mobile_number': '9876543210', 'password': 'ganga-aarti'
+    })
+    user_id = response.get_json()['user_id']
+    deferred = user_writes.stats()['deferred']
+
+    assert client.post('/api/login', json={'user_id': user_id, 'password': 'ganga-aarti'}).status_code == 200
+    assert user_writes.stats()['deferred'] == deferred + 1
+    user_writes.flush()
+    assert get_storage().get_user(user_id)['last_login'] is not None